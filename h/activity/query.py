@@ -24,11 +24,15 @@ from h.search import (
 
 
 class ActivityResults(
-    namedtuple("ActivityResults", ["total", "aggregations", "timeframes"])
+    namedtuple("ActivityResults", ["total", "aggregations", "timeframes", "cursor"])
 ):
     pass
 
 
+# The cursor pointing to the next page of results, if there's one.
+ActivityResults.__new__.__defaults__ = (None,)
+
+
 @newrelic.agent.function_trace()
 def extract(request, parse=parser.parse):
     """
@@ -114,6 +118,7 @@ def execute(request, query, page_size):
         total=search_result.total,
         aggregations=search_result.aggregations,
         timeframes=[],
+        cursor=search_result.cursor,
     )
 
     if result.total == 0:
@@ -199,6 +204,12 @@ def _execute_search(request, query, page_size):
     query["limit"] = page_size
     query["offset"] = (page - 1) * page_size
 
+    # The links to the next page carry a cursor, which is quicker than the
+    # offset for pages deep into the results.
+    cursor = request.params.get("cursor")
+    if cursor:
+        query["cursor"] = cursor
+
     search_result = search.run(query)
     return search_result
 
@@ -65,6 +65,8 @@ celery.conf.update(
         "h.tasks.indexer.add_annotation": "indexer",
         "h.tasks.indexer.delete_annotation": "indexer",
         "h.tasks.indexer.reindex_user_annotations": "indexer",
+        "h.tasks.indexer.reindex_group_annotations": "indexer",
+        "h.tasks.indexer.sync_annotations": "indexer",
     },
     task_serializer="json",
     task_queues=[
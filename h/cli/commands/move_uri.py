@@ -3,7 +3,7 @@
 import click
 
 from h import models
-from h.models.document import merge_documents
+from h.models.document import DOCUMENT_URI_CACHE, merge_documents
 from h.search.index import BatchIndexer
 from h.util import uri
 
@@ -61,6 +61,12 @@ def move_uri(ctx, old, new):
     for docuri in docuris_uri:
         docuri.uri = new
 
+    DOCUMENT_URI_CACHE.invalidate(
+        [uri.normalize(old), uri.normalize(new)],
+        [docuri.document_id for docuri in docuris_uri],
+        session=request.db,
+    )
+
     if annotations:
         indexer = BatchIndexer(request.db, request.es, request)
         ids = [a.id for a in annotations]
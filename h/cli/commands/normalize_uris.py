@@ -6,7 +6,7 @@ from collections import namedtuple
 import click
 
 from h import models
-from h.models.document import merge_documents
+from h.models.document import DOCUMENT_URI_CACHE, merge_documents
 from h.search import index
 from h.util import uri
 
@@ -84,6 +84,12 @@ def _normalize_document_uris_window(session, window):
             models.DocumentURI.content_type == docuri.content_type,
         )
 
+        DOCUMENT_URI_CACHE.invalidate(
+            [docuri.uri_normalized, uri.normalize(docuri.uri)],
+            [docuri.document_id],
+            session=session,
+        )
+
         if existing.count() > 0:
             session.delete(docuri)
         else:
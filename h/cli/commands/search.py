@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import json
 import os
 
 import click
+from dateutil import parser as dateparser
+from webob.multidict import MultiDict
 
 from h import indexer
+from h.celery import celery
+from h.indexer import consumer
+from h.schemas import ValidationError
+from h.schemas.annotation import SearchParamsSchema
+from h.schemas.util import validate_query_params
 from h.search import config
+from h.search.index import BatchIndexer
 
 
 @click.group()
@@ -14,14 +23,31 @@ def search():
 
 
 @search.command()
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of processes to reindex with.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Resume the last reindex, which didn't finish, from its checkpoint.",
+)
 @click.pass_context
-def reindex(ctx):
+def reindex(ctx, workers, resume):
     """
     Reindex all annotations.
 
     Creates a new search index from the data in PostgreSQL and atomically
     updates the index alias. This requires that the index is aliased already,
     and will raise an error if it is not.
+
+    With --workers, the annotations are shared out between several processes,
+    each with its own database and Elasticsearch connections.
+
+    The reindex's progress is checkpointed as it goes. If it doesn't finish,
+    --resume carries on from the checkpoint, into the same new index.
     """
     os.environ["ELASTICSEARCH_CLIENT_TIMEOUT"] = "30"
 
@@ -32,7 +58,95 @@ def reindex(ctx):
     es_server_version = es_client.conn.info()["version"]["number"]
     click.echo("reindexing into Elasticsearch {} cluster".format(es_server_version))
 
-    indexer.reindex(request.db, es_client, request)
+    indexer.reindex(
+        request.db,
+        es_client,
+        request,
+        workers=workers,
+        bootstrap=ctx.obj["bootstrap"],
+        resume=resume,
+    )
+
+
+@search.command()
+@click.option(
+    "--since",
+    required=True,
+    metavar="TIME",
+    help="Reindex the annotations updated at or after this ISO 8601 time "
+    "(UTC unless it has a timezone), e.g. 2018-08-27T11:00:00.",
+)
+@click.pass_context
+def sync(ctx, since):
+    """
+    Reindex the annotations updated since a given time.
+
+    Annotations which haven't been deleted are indexed, and deleted ones are
+    marked as deleted in the index. This repairs the index after it missed
+    some writes, without reindexing all the annotations.
+    """
+    try:
+        since = dateparser.parse(since)
+    except (ValueError, OverflowError):
+        raise click.BadParameter(
+            "{} isn't an ISO 8601 time".format(since), param_hint="--since"
+        )
+
+    request = ctx.obj["bootstrap"]()
+
+    # If a reindex is running at the moment, sync the new index as well.
+    target_indexes = [None]
+    new_index = request.find_service(name="settings").get("reindex.new_index")
+    if new_index is not None:
+        target_indexes.append(new_index)
+
+    errored = set()
+    for target_index in target_indexes:
+        batch_indexer = BatchIndexer(
+            request.db, request.es, request, target_index=target_index
+        )
+        errored.update(batch_indexer.sync(since))
+    if errored:
+        raise click.ClickException(
+            "failed to index {} annotations: {}".format(
+                len(errored), ", ".join(sorted(errored))
+            )
+        )
+
+
+@search.command()
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=consumer.DEFAULT_BATCH_SIZE,
+    help="The most annotations to index with one bulk request.",
+)
+@click.option(
+    "--wait",
+    type=click.IntRange(min=1),
+    default=int(consumer.DEFAULT_WAIT * 1000),
+    metavar="MILLISECONDS",
+    help="The longest time to wait for a batch to fill up.",
+)
+@click.pass_context
+def worker(ctx, batch_size, wait):
+    """
+    Consume the indexer queue, indexing annotations in batches.
+
+    This takes the place of the Celery worker for the indexer queue. Rather
+    than indexing the annotations one at a time, it indexes up to
+    --batch-size of them with one bulk request, or those whose messages
+    arrive within --wait milliseconds of the first.
+    """
+    request = ctx.obj["bootstrap"]()
+
+    # The tasks which aren't batched use the request, as in the Celery worker.
+    celery.request = request
+
+    batch_consumer = consumer.BatchConsumer(
+        celery.connection_for_read(), celery, batch_size=batch_size, wait=wait / 1000.0
+    )
+    batch_consumer.run()
 
 
 @search.command("update-settings")
@@ -51,3 +165,38 @@ def update_settings(ctx):
         config.update_index_settings(request.es)
     except RuntimeError as e:
         raise click.ClickException(str(e))
+
+
+@search.command()
+@click.argument("params", nargs=-1, metavar="[KEY=VALUE]...")
+@click.pass_context
+def export(ctx, params):
+    """
+    Export the annotations matching a search.
+
+    Takes the same params as the search API, as KEY=VALUE arguments (for
+    example "group=__world__ uri=https://example.com/"), and writes every
+    matching annotation which anyone may read to stdout as newline-delimited
+    JSON, however many there are.
+    """
+    query = MultiDict()
+    for param in params:
+        key, sep, value = param.partition("=")
+        if not sep:
+            raise click.BadParameter(
+                "{} isn't of the form KEY=VALUE".format(param), param_hint="PARAMS"
+            )
+        query.add(key, value)
+
+    try:
+        query = validate_query_params(SearchParamsSchema(), query)
+    except ValidationError as e:
+        raise click.ClickException(str(e))
+    query.pop("_separate_replies", None)
+    query.pop("_paginate_replies", None)
+
+    request = ctx.obj["bootstrap"]()
+
+    svc = request.find_service(name="annotation_export")
+    for annotation in svc.export(query):
+        click.echo(json.dumps(annotation))
@@ -102,6 +102,9 @@ def configure(environ=None, settings=None):
     )
 
     settings_manager.set("h.db_session_checks", "DB_SESSION_CHECKS", type_=asbool)
+    # How long (in seconds) the ids of the groups each user can read are cached
+    # for. Zero disables the cache.
+    settings_manager.set("h.groupids_cache_ttl", "GROUPIDS_CACHE_TTL", type_=int)
 
     # Environment name, provided by the deployment environment. Please do
     # *not* toggle functionality based on this value. It is intended as a
@@ -115,6 +118,42 @@ def configure(environ=None, settings=None):
     settings_manager.set("h.sentry_dsn_client", "SENTRY_DSN_CLIENT")
     settings_manager.set("h.sentry_dsn_frontend", "SENTRY_DSN_FRONTEND")
     settings_manager.set("h.websocket_url", "WEBSOCKET_URL")
+    # Whether to compress websocket messages with permessage-deflate, and the
+    # zlib parameters which bound the memory used for each connection.
+    settings_manager.set("h.websocket_deflate", "WEBSOCKET_DEFLATE", type_=asbool)
+    settings_manager.set(
+        "h.websocket_deflate_window_bits", "WEBSOCKET_DEFLATE_WINDOW_BITS", type_=int
+    )
+    settings_manager.set(
+        "h.websocket_deflate_mem_level", "WEBSOCKET_DEFLATE_MEM_LEVEL", type_=int
+    )
+    settings_manager.set(
+        "h.websocket_deflate_no_context_takeover",
+        "WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER",
+        type_=asbool,
+    )
+    # The number of greenlets processing messages in each websocket worker.
+    settings_manager.set("h.streamer_consumers", "STREAMER_CONSUMERS", type_=int)
+    # The number of messages which may wait to be sent to each websocket client,
+    # and what to do when a client is too slow to keep up with them (one of
+    # "drop_oldest", "coalesce" or "disconnect").
+    settings_manager.set(
+        "h.streamer_send_queue_size", "STREAMER_SEND_QUEUE_SIZE", type_=int
+    )
+    settings_manager.set(
+        "h.streamer_slow_consumer_policy", "STREAMER_SLOW_CONSUMER_POLICY"
+    )
+    # The number of recent annotation notifications kept for websocket clients
+    # to catch up on when they reconnect.
+    settings_manager.set(
+        "h.streamer_replay_buffer_size", "STREAMER_REPLAY_BUFFER_SIZE", type_=int
+    )
+
+    # The number of shards annotation messages are routed to, so that each
+    # websocket worker only receives messages about the URIs its clients are
+    # listening to. Zero (the default) disables sharding. This must be the same
+    # for the web and websocket processes.
+    settings_manager.set("h.realtime_shards", "REALTIME_SHARDS", type_=int)
 
     # Debug/development settings
     settings_manager.set("debug_query", "DEBUG_QUERY")
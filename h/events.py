@@ -5,10 +5,11 @@ from __future__ import unicode_literals
 class AnnotationEvent(object):
     """An event representing an action on an annotation."""
 
-    def __init__(self, request, annotation_id, action):
+    def __init__(self, request, annotation_id, action, target_uri_normalized=None):
         self.request = request
         self.annotation_id = annotation_id
         self.action = action
+        self.target_uri_normalized = target_uri_normalized
 
 
 class AnnotationTransformEvent(object):
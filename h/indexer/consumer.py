@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""
+A consumer of the indexer queue which indexes annotations in batches.
+
+The Celery worker runs one ``h.tasks.indexer.add_annotation`` task at a time,
+each of which loads one annotation from the database and indexes it with a
+request of its own, so a spike in the number of annotations created builds up
+a backlog in the indexer queue. This consumer takes the place of the Celery
+worker for the indexer queue. It collects the ids of the annotations to add
+and delete from up to `batch_size` messages, or from the messages which arrive
+within `wait` seconds of the first, loads the annotations with one query and
+indexes them with one bulk request. The other tasks of the queue are run as
+the Celery worker would run them.
+
+Like the Celery worker, the consumer holds messages with an ETA (such as the
+delayed reindexes of thread roots) until they're due.
+"""
+
+from __future__ import unicode_literals
+
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime
+
+from dateutil import parser, tz
+from kombu.mixins import ConsumerMixin
+
+from h.indexer.reindexer import NEW_INDEX_SETTING
+from h.search.index import BatchIndexer, fetch_annotations
+from h.tasks import indexer as indexer_tasks
+
+log = logging.getLogger(__name__)
+
+INDEXER_QUEUE = "indexer"
+
+# The most messages to batch up, and the longest time (in seconds) to wait for
+# a batch to fill up.
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WAIT = 0.5
+
+ADD_TASK = indexer_tasks.add_annotation.name
+DELETE_TASK = indexer_tasks.delete_annotation.name
+
+EPOCH = datetime(1970, 1, 1, tzinfo=tz.tzutc())
+
+
+class BatchConsumer(ConsumerMixin):
+    """
+    A consumer of the indexer queue which indexes annotations in batches.
+
+    Conforms to the :py:class:`kombu.mixins.ConsumerMixin` interface.
+
+    A message is only acknowledged once its annotation has been indexed. The
+    messages of annotations which fail to index are requeued, once: if they
+    fail again, they're acknowledged and the failure is logged.
+
+    :param connection: a `kombu.Connection` to the Celery broker
+    :param app: the Celery application, with the bootstrapped request that
+        its tasks use as its ``request``
+    :param batch_size: the most messages to index in one batch
+    :param wait: the longest time to wait for a batch to fill up, in seconds
+    """
+
+    def __init__(
+        self, connection, app, batch_size=DEFAULT_BATCH_SIZE, wait=DEFAULT_WAIT
+    ):
+        self.connection = connection
+        self.app = app
+        self.batch_size = batch_size
+        self.wait = wait
+
+        # The (task name, annotation id, message) of each message of the batch
+        self._batch = []
+        self._batch_started = None
+
+        # The messages with an ETA which are held until they're due, as a
+        # heap of (ETA, sequence number, body, message)
+        self._delayed = []
+        self._delayed_seq = itertools.count()
+
+        self._consumers = []
+
+    def get_consumers(self, consumer_factory, channel):
+        queue = self.app.amqp.queues[INDEXER_QUEUE]
+        return [
+            consumer_factory(
+                queues=[queue],
+                callbacks=[self.handle_message],
+                accept=["json"],
+                # A batch can't fill up unless the broker sends that many
+                # messages before they're acknowledged.
+                prefetch_count=self.batch_size,
+            )
+        ]
+
+    def on_consume_ready(self, connection, channel, consumers, **kwargs):
+        # Messages received on an earlier channel can't be acknowledged on
+        # this one: the broker will deliver them again.
+        self._consumers = consumers
+        self._batch = []
+        self._delayed = []
+
+    def run(self, **kwargs):
+        # Wake up often enough to index a batch once it's waited long enough.
+        kwargs.setdefault("safety_interval", min(self.wait, 1.0))
+        super(BatchConsumer, self).run(**kwargs)
+
+    def on_iteration(self):
+        self._release_due_messages()
+        if self._batch and time.time() - self._batch_started >= self.wait:
+            self.flush()
+
+    def handle_message(self, body, message):
+        """Add an indexing message to the batch, or run any other task."""
+        task, args, kwargs, eta = _decode(body, message)
+
+        if eta is not None and eta > time.time():
+            self._delay(eta, body, message)
+            return
+
+        if task not in (ADD_TASK, DELETE_TASK):
+            self._run_task(task, args, kwargs, message)
+            return
+
+        id_ = args[0] if args else kwargs["id_"]
+        if not self._batch:
+            self._batch_started = time.time()
+        self._batch.append((task, id_, message))
+
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Index the batch, and acknowledge its messages."""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        request = self.app.request
+
+        # Reset the nipsa service's cache, as before each task.
+        request.find_service(name="nipsa").clear()
+
+        try:
+            errored = self._index(request, batch)
+        except Exception:
+            log.exception("failed to index a batch of %d annotations", len(batch))
+            request.tm.abort()
+            errored = {id_ for _, id_, _ in batch}
+        else:
+            request.tm.commit()
+
+        for _, id_, message in batch:
+            if id_ in errored:
+                _retry(id_, message)
+            else:
+                message.ack()
+
+    def _index(self, request, batch):
+        """Index the batch's annotations, return the errored ids."""
+        added_ids = {id_ for task, id_, _ in batch if task == ADD_TASK}
+        deleted_ids = {id_ for task, id_, _ in batch if task == DELETE_TASK}
+
+        annotations = fetch_annotations(request.db, added_ids)
+        log.debug(
+            "indexing %d annotations and deleting %d",
+            len(annotations),
+            len(deleted_ids),
+        )
+
+        # If a reindex is running at the moment, index into the new index as
+        # well.
+        target_indexes = [None]
+        new_index = request.find_service(name="settings").get(NEW_INDEX_SETTING)
+        if new_index is not None:
+            target_indexes.append(new_index)
+
+        errored = set()
+        for target_index in target_indexes:
+            batch_indexer = BatchIndexer(
+                request.db, request.es, request, target_index=target_index
+            )
+            errored.update(
+                batch_indexer.index_annotations(annotations, chunk_size=self.batch_size)
+            )
+            errored.update(
+                batch_indexer.delete(deleted_ids, chunk_size=self.batch_size)
+            )
+
+        # The thread roots of the batch's replies need reindexing too, once
+        # each, unless they've just been indexed along with them.
+        replies = [a for a in annotations if a.is_reply]
+        root_ids = {a.thread_root_id for a in replies} - added_ids
+        coalesced = len(replies) - len(root_ids)
+        if coalesced:
+            request.stats.incr("indexer.thread_root.coalesced", coalesced)
+        for root_id in root_ids:
+            indexer_tasks.reindex_thread_root(root_id)
+
+        return errored
+
+    def _delay(self, eta, body, message):
+        """Hold a message until its ETA."""
+        heapq.heappush(self._delayed, (eta, next(self._delayed_seq), body, message))
+        self._update_prefetch_count()
+
+    def _release_due_messages(self):
+        """Handle the held messages which are now due."""
+        now = time.time()
+        due = []
+        while self._delayed and self._delayed[0][0] <= now:
+            due.append(heapq.heappop(self._delayed))
+        if not due:
+            return
+
+        self._update_prefetch_count()
+        for _, _, body, message in due:
+            self.handle_message(body, message)
+
+    def _update_prefetch_count(self):
+        # The held messages count against the prefetch limit, so as the
+        # Celery worker does, raise it to leave room for a batch besides them.
+        for consumer in self._consumers:
+            consumer.qos(prefetch_count=self.batch_size + len(self._delayed))
+
+    def _run_task(self, name, args, kwargs, message):
+        # Keep the order of the messages with respect to the batch.
+        self.flush()
+
+        task = self.app.tasks.get(name)
+        if task is None:
+            log.error("received unregistered task %s, discarding it", name)
+        else:
+            # This runs the task as the worker would, signals included, and
+            # doesn't raise if the task does.
+            task.apply(args=args, kwargs=kwargs)
+        message.ack()
+
+
+def _decode(body, message):
+    """
+    Return the task name, args, kwargs and ETA of a Celery task message.
+
+    The ETA is a POSIX timestamp, or None if the task is due straight away.
+    """
+    if isinstance(body, dict):
+        # Version 1 of the task message protocol
+        return (
+            body["task"],
+            body.get("args", []),
+            body.get("kwargs", {}),
+            _timestamp(body.get("eta")),
+        )
+    args, kwargs = body[0], body[1]
+    return (
+        message.headers["task"],
+        args,
+        kwargs,
+        _timestamp(message.headers.get("eta")),
+    )
+
+
+def _timestamp(eta):
+    if eta is None:
+        return None
+    eta = parser.parse(eta)
+    # Celery's ETAs are in UTC unless they say otherwise.
+    if eta.tzinfo is None:
+        eta = eta.replace(tzinfo=tz.tzutc())
+    return (eta - EPOCH).total_seconds()
+
+
+def _retry(id_, message):
+    if message.delivery_info.get("redelivered"):
+        log.warning("failed to index annotation %s again, discarding it", id_)
+        message.ack()
+    else:
+        message.requeue()
@@ -2,6 +2,10 @@
 
 from __future__ import unicode_literals
 import logging
+import multiprocessing
+import time
+
+from dateutil import parser
 
 from h.search.config import (
     configure_index,
@@ -9,13 +13,45 @@ from h.search.config import (
     get_aliased_index,
     update_aliased_index,
 )
-from h.search.index import BatchIndexer
+from h.search.index import BatchIndexer, annotation_windows
 
 log = logging.getLogger(__name__)
 
+# The settings in which the progress of a reindex is kept: the index it's
+# indexing into, and the `updated` date before which all the annotations have
+# been indexed.
+NEW_INDEX_SETTING = "reindex.new_index"
+CHECKPOINT_SETTING = "reindex.checkpoint"
+
+# The state of a worker process of a parallel reindex.
+_worker = {}
+
+
+def reindex(session, es, request, workers=1, bootstrap=None, resume=False):
+    """
+    Reindex all annotations into a new index, and update the alias.
+
+    The annotations are indexed a window of the `updated` column at a time,
+    and the progress is checkpointed in the settings after each window. If the
+    reindex fails, the new index and the checkpoint are kept (and annotations
+    created or edited in the meantime are still indexed into it), and with
+    `resume` the next reindex carries on from the checkpoint rather than
+    starting again. Otherwise the unfinished reindex's index is deleted.
 
-def reindex(session, es, request):
-    """Reindex all annotations into a new index, and update the alias."""
+    With more than one worker, the windows are shared out between `workers`
+    processes. Each process has its own database session and Elasticsearch
+    client, from a request returned by `bootstrap`. Annotations which fail to
+    index are retried in this process.
+
+    :param workers: the number of processes to reindex with
+    :type workers: int
+    :param bootstrap: a function returning a new bootstrapped request, which
+        is required with more than one worker
+    :param resume: whether to resume the last, unfinished reindex
+    :type resume: bool
+    """
+    if workers > 1 and bootstrap is None:
+        raise ValueError("reindexing with several workers requires bootstrap")
 
     current_index = get_aliased_index(es)
     if current_index is None:
@@ -27,36 +63,157 @@ def reindex(session, es, request):
     nipsa_svc = request.find_service(name="nipsa")
     nipsa_svc.fetch_all_flagged_userids()
 
-    new_index = configure_index(es)
-    log.info("configured new index {}".format(new_index))
-    setting_name = "reindex.new_index"
+    unfinished_index = settings.get(NEW_INDEX_SETTING)
+    if resume:
+        if unfinished_index is None:
+            raise RuntimeError("there is no unfinished reindex to resume")
+        new_index = unfinished_index
+        checkpoint = settings.get(CHECKPOINT_SETTING)
+        if checkpoint is not None:
+            checkpoint = parser.parse(checkpoint)
+        log.info(
+            "resuming reindexing into index {} from {}".format(new_index, checkpoint)
+        )
+    else:
+        new_index = configure_index(es)
+        checkpoint = None
+        log.info("configured new index {}".format(new_index))
 
-    try:
-        settings.put(setting_name, new_index)
+    settings.put(NEW_INDEX_SETTING, new_index)
+    if checkpoint is None:
+        settings.delete(CHECKPOINT_SETTING)
+    request.tm.commit()
+
+    # Now that new annotations go to the new index, the unfinished reindex's
+    # index can go.
+    if not resume and unfinished_index not in (None, current_index):
+        log.warning("removing unfinished reindex's index {}".format(unfinished_index))
+        delete_index(es, unfinished_index)
+
+    def save_checkpoint(updated):
+        settings.put(CHECKPOINT_SETTING, updated.isoformat())
         request.tm.commit()
 
-        log.info("reindexing annotations into new index {}".format(new_index))
-        indexer = BatchIndexer(
-            session, es, request, target_index=new_index, op_type="create"
-        )
+    log.info("reindexing annotations into new index {}".format(new_index))
+    indexer = BatchIndexer(
+        session, es, request, target_index=new_index, op_type="create"
+    )
+    windows = annotation_windows(session, since=checkpoint)
 
-        errored = indexer.index()
+    if workers > 1:
+        errored = _index_in_parallel(
+            windows, new_index, workers, bootstrap, save_checkpoint
+        )
+    else:
+        errored = _index_serially(indexer, windows, save_checkpoint)
+    if errored:
+        log.debug("failed to index {} annotations, retrying...".format(len(errored)))
+        errored = indexer.index(errored)
         if errored:
-            log.debug(
-                "failed to index {} annotations, retrying...".format(len(errored))
+            log.warning(
+                "failed to index {} annotations: {!r}".format(len(errored), errored)
             )
-            errored = indexer.index(errored)
-            if errored:
-                log.warning(
-                    "failed to index {} annotations: {!r}".format(len(errored), errored)
-                )
 
-        log.info("making new index {} current".format(new_index))
-        update_aliased_index(es, new_index)
+    log.info("making new index {} current".format(new_index))
+    update_aliased_index(es, new_index)
+
+    settings.delete(NEW_INDEX_SETTING)
+    settings.delete(CHECKPOINT_SETTING)
+    request.tm.commit()
+
+    log.info("removing previous index {}".format(current_index))
+    delete_index(es, current_index)
+
 
-        log.info("removing previous index {}".format(current_index))
-        delete_index(es, current_index)
+def _index_serially(indexer, windows, save_checkpoint):
+    """Index the windows one after the other, return the errored ids."""
+    errored = set()
+    progress = _Progress(windows, save_checkpoint)
+    for window in windows:
+        errored.update(indexer.index(windows=[window]))
+        progress.done(window)
+    return errored
 
+
+def _index_in_parallel(windows, target_index, workers, bootstrap, save_checkpoint):
+    """Index the windows with a pool of processes, return the errored ids."""
+    log.info(
+        "reindexing {} windows of annotations with {} workers".format(
+            len(windows), workers
+        )
+    )
+
+    pool = multiprocessing.Pool(
+        workers, initializer=_init_worker, initargs=(bootstrap, target_index)
+    )
+    errored = set()
+    progress = _Progress(windows, save_checkpoint)
+    try:
+        # The windows are handed out one at a time, so that a worker which
+        # gets slow windows doesn't hold the others up.
+        results = pool.imap_unordered(_index_window, windows)
+        for window, window_errored in results:
+            errored.update(window_errored)
+            progress.done(window)
+        pool.close()
+    except:  # noqa: E722
+        pool.terminate()
+        raise
     finally:
-        settings.delete(setting_name)
-        request.tm.commit()
+        pool.join()
+
+    return errored
+
+
+class _Progress(object):
+    """
+    Logs the progress of a reindex and checkpoints it.
+
+    Windows may be done out of order, so the checkpoint is the end of the
+    last window before which all the windows are done.
+    """
+
+    def __init__(self, windows, save_checkpoint):
+        self.windows = windows
+        self.save_checkpoint = save_checkpoint
+        self.started = time.time()
+        self._pending = set(windows)
+        self._next = 0
+
+    def done(self, window):
+        self._pending.discard(window)
+        log.info(
+            "indexed {:d}/{:d} windows of annotations in {:.0f}s".format(
+                len(self.windows) - len(self._pending),
+                len(self.windows),
+                time.time() - self.started,
+            )
+        )
+
+        checkpoint = None
+        while (
+            self._next < len(self.windows)
+            and self.windows[self._next] not in self._pending
+        ):
+            checkpoint = self.windows[self._next].end
+            self._next += 1
+
+        # The last window has no end: once it's done, so is the reindex.
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint)
+
+
+def _init_worker(bootstrap, target_index):
+    request = bootstrap()
+
+    # Preload userids of shadowbanned users.
+    nipsa_svc = request.find_service(name="nipsa")
+    nipsa_svc.fetch_all_flagged_userids()
+
+    _worker["indexer"] = BatchIndexer(
+        request.db, request.es, request, target_index=target_index, op_type="create"
+    )
+
+
+def _index_window(window):
+    return (window, _worker["indexer"].index(windows=[window]))
@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 
 from datetime import datetime
 import logging
+import time
 
 import sqlalchemy as sa
 import transaction
@@ -13,10 +14,17 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from h._compat import urlparse
 from h.db import Base, mixins
 from h.models.annotation import Annotation
+from h.util.db import on_transaction_end
 from h.util.uri import normalize as uri_normalize
 
 log = logging.getLogger(__name__)
 
+# How long (in seconds) the URIs of the document found for a URI are cached.
+DOCUMENT_URI_CACHE_TTL = 300
+
+# The number of URIs whose documents' URIs are cached at most.
+DOCUMENT_URI_CACHE_SIZE = 10000
+
 
 class ConcurrentUpdateError(transaction.interfaces.TransientError):
     """Raised when concurrent updates to document data conflict."""
@@ -123,6 +131,9 @@ class Document(Base, mixins.Timestamps):
                 updated=updated,
             )
             session.add(doc)
+            DOCUMENT_URI_CACHE.invalidate(
+                [uri_normalize(claimant_uri)], session=session
+            )
 
         try:
             session.flush()
@@ -228,6 +239,131 @@ class DocumentMeta(Base, mixins.Timestamps):
         return "<DocumentMeta %s>" % self.id
 
 
+class DocumentURICache(object):
+    """
+    A cache, shared by everything in a process, of the URIs of documents.
+
+    Caches the URIs (and their types) of the document which
+    :py:meth:`Document.find_by_uris` finds for a single URI, keyed by the
+    normalized URI, so that :py:func:`h.storage.expand_uri` needn't query the
+    database each time a page's annotations are searched for or listened to.
+
+    The functions below which change a document's URIs invalidate the cache,
+    but only in their own process: other processes see the change once their
+    entries have expired, after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=DOCUMENT_URI_CACHE_TTL, maxsize=DOCUMENT_URI_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        # Normalized URI -> (expiry time, document id, ((uri, type), ...))
+        self._entries = {}
+        # Document id -> the normalized URIs whose entries are for it
+        self._keys_by_document = {}
+
+    def find(self, session, uri):
+        """
+        Return the URIs of the document for `uri`, and their types.
+
+        :returns: a list of ``(uri, type)`` tuples, which is empty if there is
+            no document for `uri`
+        """
+        key = uri_normalize(uri)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return list(entry[2])
+
+        doc = Document.find_by_uris(session, [uri]).one_or_none()
+        if doc is None:
+            document_id, docuris = None, ()
+        else:
+            document_id = doc.id
+            docuris = tuple((docuri.uri, docuri.type) for docuri in doc.document_uris)
+
+        if self.ttl > 0:
+            self._make_room(now)
+            self._remove(key)
+            self._entries[key] = (now + self.ttl, document_id, docuris)
+            self._keys_by_document.setdefault(document_id, set()).add(key)
+
+        return list(docuris)
+
+    def invalidate(self, uris_normalized=(), document_ids=(), session=None):
+        """
+        Forget the cached entries for some URIs and for some documents' URIs.
+
+        A URI gaining a document changes the entry for that URI, and a document
+        gaining or losing a URI changes the entries for all its URIs.
+
+        The entries may be cached again before the change has been committed,
+        so if `session` is given they are forgotten again once its transaction
+        has ended.
+        """
+        uris_normalized = set(uris_normalized)
+        # New documents have no id yet, nor any cached entries.
+        document_ids = set(id_ for id_ in document_ids if id_ is not None)
+        self._invalidate(uris_normalized, document_ids)
+
+        if session is None:
+            return
+
+        pending = session.info.get("document_uri_cache.pending")
+        if pending is None:
+            pending = session.info["document_uri_cache.pending"] = (set(), set())
+
+            @on_transaction_end(session)
+            def invalidate_after_transaction():
+                self._invalidate(*pending)
+                pending[0].clear()
+                pending[1].clear()
+
+        pending[0].update(uris_normalized)
+        pending[1].update(document_ids)
+
+    def clear(self):
+        """Forget all the cached entries."""
+        self._entries.clear()
+        self._keys_by_document.clear()
+
+    def _invalidate(self, uris_normalized, document_ids):
+        keys = set(uris_normalized)
+        for document_id in document_ids:
+            keys.update(self._keys_by_document.get(document_id, ()))
+
+        for key in keys:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        keys = self._keys_by_document.get(entry[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_document[entry[1]]
+
+    def _make_room(self, now):
+        if len(self._entries) < self.maxsize:
+            return
+
+        for key, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                self._remove(key)
+
+        # If none of them had expired, start afresh rather than keeping track
+        # of which entry is the oldest.
+        if len(self._entries) >= self.maxsize:
+            self.clear()
+
+
+DOCUMENT_URI_CACHE = DocumentURICache()
+
+
 def create_or_update_document_uri(
     session, claimant, uri, type, content_type, document, created, updated
 ):
@@ -295,6 +431,9 @@ def create_or_update_document_uri(
             updated=updated,
         )
         session.add(docuri)
+        DOCUMENT_URI_CACHE.invalidate(
+            [docuri.uri_normalized], [document.id], session=session
+        )
     elif not docuri.document == document:
         log.warning(
             "Found DocumentURI (id: %d)'s document_id (%d) doesn't match "
@@ -433,6 +572,10 @@ def merge_documents(session, documents, updated=None):
     except sa.exc.IntegrityError:
         raise ConcurrentUpdateError("concurrent document merges")
 
+    DOCUMENT_URI_CACHE.invalidate(
+        document_ids=[master.id] + duplicate_ids, session=session
+    )
+
     return master
 
 
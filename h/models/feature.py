@@ -20,6 +20,13 @@ FEATURES = {
     ),
     "overlay_highlighter": "Use the new overlay highlighter?",
     "client_display_names": "Render display names instead of user names in the client",
+    "search_group_readable_by_world": (
+        "Find annotations in world-readable groups with the search index's "
+        "group_readable_by_world field? (Only once all annotations are reindexed)"
+    ),
+    "search_query_templates": (
+        "Run common searches with query bodies compiled once per shape of search?"
+    ),
 }
 
 # Once a feature has been fully deployed, we remove the flag from the codebase.
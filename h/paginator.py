@@ -9,7 +9,13 @@ import math
 PAGE_SIZE = 20
 
 
-def paginate(request, total, page_size=PAGE_SIZE):
+def paginate(request, total, page_size=PAGE_SIZE, cursor=None):
+    """
+    Return the page metadata for a paginated view.
+
+    If given, `cursor` points to the results after the current page, and is
+    added to the link to the next page.
+    """
     first = 1
     page_max = int(math.ceil(total / page_size))
     page_max = max(1, page_max)  # There's always at least one page.
@@ -74,6 +80,9 @@ def paginate(request, total, page_size=PAGE_SIZE):
     def url_for(page):
         query = request.params.dict_of_lists()
         query["page"] = page
+        query.pop("cursor", None)
+        if cursor is not None and page == next_:
+            query["cursor"] = cursor
         return request.current_route_path(_query=query)
 
     return {
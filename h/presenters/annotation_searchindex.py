@@ -2,6 +2,8 @@
 
 from __future__ import unicode_literals
 
+from h.interfaces import IGroupService
+from h.models.group import ReadableBy
 from h.presenters.annotation_base import AnnotationBasePresenter
 from h.presenters.document_searchindex import DocumentSearchIndexPresenter
 from h.util.user import split_user
@@ -31,6 +33,7 @@ class AnnotationSearchIndexPresenter(AnnotationBasePresenter):
             "tags": self.tags,
             "tags_raw": self.tags,
             "group": self.annotation.groupid,
+            "group_readable_by_world": self.group_readable_by_world,
             "shared": self.annotation.shared,
             "target": self.target,
             "document": docpresenter.asdict(),
@@ -53,6 +56,12 @@ class AnnotationSearchIndexPresenter(AnnotationBasePresenter):
 
         return result
 
+    @property
+    def group_readable_by_world(self):
+        group_service = self.request.find_service(IGroupService)
+        group = group_service.find(self.annotation.groupid)
+        return group is not None and group.readable_by == ReadableBy.world
+
     @property
     def links(self):
         # The search index presenter has no need to generate links, and so the
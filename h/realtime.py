@@ -2,14 +2,26 @@
 
 from __future__ import unicode_literals
 import base64
+import hashlib
 import random
 import struct
+import time
 from datetime import datetime
 
 import kombu
 from kombu.mixins import ConsumerMixin
 from kombu.pools import producers as producer_pool
 
+from h._compat import text_type
+
+# The routing key for annotation messages when sharded routing is disabled,
+# and for those which can't be routed to a shard.
+ANNOTATION_ROUTING_KEY = "annotation"
+
+# How often (in seconds) a consumer with dynamic bindings checks whether they
+# need updating.
+BINDINGS_INTERVAL = 1.0
+
 
 class Consumer(ConsumerMixin):
     """
@@ -22,10 +34,19 @@ class Consumer(ConsumerMixin):
     :param routing_key: listen to messages with this routing key
     :param handler: the function which gets called when a messages arrives
     :param sentry_client: an optional Sentry client for error reporting
+    :param bindings: an optional function returning the set of additional
+        routing keys to listen to, which is called periodically so that the
+        consumer's bindings follow changes in what its handler is interested in
     """
 
     def __init__(
-        self, connection, routing_key, handler, sentry_client=None, statsd_client=None
+        self,
+        connection,
+        routing_key,
+        handler,
+        sentry_client=None,
+        statsd_client=None,
+        bindings=None,
     ):
         self.connection = connection
         self.routing_key = routing_key
@@ -33,6 +54,12 @@ class Consumer(ConsumerMixin):
         self.exchange = get_exchange()
         self.sentry_client = sentry_client
         self.statsd_client = statsd_client
+        self.bindings = bindings
+
+        # The declared queue and the routing keys it is currently bound to
+        self._queue = None
+        self._bound = set()
+        self._bindings_checked = 0
 
     def get_consumers(self, consumer_factory, channel):
         name = self.generate_queue_name()
@@ -45,6 +72,36 @@ class Consumer(ConsumerMixin):
         )
         return [consumer_factory(queues=[queue], callbacks=[self.handle_message])]
 
+    def on_consume_ready(self, connection, channel, consumers, **kwargs):
+        if self.bindings is None:
+            return
+
+        # The queue is declared afresh each time we (re)connect, bound only to
+        # `routing_key`, so the other bindings must be added again.
+        self._queue = consumers[0].queues[0]
+        self._bound = {self.routing_key}
+        self.update_bindings()
+
+    def on_iteration(self):
+        if self._queue is None:
+            return
+        if time.time() - self._bindings_checked >= BINDINGS_INTERVAL:
+            self.update_bindings()
+
+    def update_bindings(self):
+        """Bind and unbind the queue so that it matches `bindings`."""
+        self._bindings_checked = time.time()
+
+        wanted = set(self.bindings())
+        wanted.add(self.routing_key)
+
+        for routing_key in wanted - self._bound:
+            self._queue.bind_to(self.exchange, routing_key=routing_key)
+        for routing_key in self._bound - wanted:
+            self._queue.unbind_from(self.exchange, routing_key=routing_key)
+
+        self._bound = wanted
+
     def generate_queue_name(self):
         return "realtime-{}-{}".format(self.routing_key, self._random_id())
 
@@ -109,12 +166,21 @@ class Publisher(object):
     """
 
     def __init__(self, request):
-        self.connection = get_connection(request.registry.settings)
+        settings = request.registry.settings
+        self.connection = get_connection(settings)
         self.exchange = get_exchange()
+        self.shards = get_shards(settings)
+
+    def publish_annotation(self, payload, target_uri_normalized=None):
+        """
+        Publish an annotation message.
 
-    def publish_annotation(self, payload):
-        """Publish an annotation message with the routing key 'annotation'."""
-        self._publish("annotation", payload)
+        The routing key is 'annotation', unless sharded routing is enabled and
+        the annotation's normalized target URI is given, in which case it is
+        the routing key of the URI's shard (see :py:func:`annotation_routing_key`).
+        """
+        routing_key = annotation_routing_key(target_uri_normalized, self.shards)
+        self._publish(routing_key, payload)
 
     def publish_user(self, payload):
         """Publish a user message with the routing key 'user'."""
@@ -144,6 +210,44 @@ def get_exchange():
     )
 
 
+def get_shards(settings):
+    """
+    Return the number of shards annotation messages are routed to.
+
+    Zero, the default, disables sharded routing. The setting must be the same
+    for the web app and all the websocket workers.
+    """
+    return int(settings.get("h.realtime_shards") or 0)
+
+
+def annotation_routing_key(target_uri_normalized=None, shards=0):
+    """
+    Return the routing key for a message about an annotation on a URI.
+
+    With sharded routing, messages about annotations on each URI go to one of
+    `shards` routing keys, so that websocket workers need only receive the
+    messages about the URIs their clients are listening to. Messages about an
+    unknown URI use the unsharded routing key, which every worker listens to.
+    """
+    if not shards or target_uri_normalized is None:
+        return ANNOTATION_ROUTING_KEY
+    return shard_routing_key(uri_shard(target_uri_normalized, shards))
+
+
+def uri_shard(target_uri_normalized, shards):
+    """Return the shard, from 0 to `shards - 1`, for a normalized URI."""
+    # Python's `hash` varies between processes, so use a stable hash instead.
+    uri = target_uri_normalized
+    if not isinstance(uri, bytes):
+        uri = text_type(uri).encode("utf-8")
+    return int(hashlib.sha1(uri).hexdigest()[:8], 16) % shards
+
+
+def shard_routing_key(shard):
+    """Return the routing key for annotation messages in `shard`."""
+    return "{}.{}".format(ANNOTATION_ROUTING_KEY, shard)
+
+
 def get_connection(settings):
     """Returns a `kombu.Connection` based on the application's settings."""
 
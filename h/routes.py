@@ -148,6 +148,7 @@ def includeme(config):
         traverse="/{pubid}",
     )
     config.add_route("api.search", "/api/search")
+    config.add_route("api.search_export", "/api/search/export")
     config.add_route("api.users", "/api/users", factory="h.traversal.UserRoot")
     config.add_route(
         "api.user",
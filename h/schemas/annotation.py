@@ -8,7 +8,7 @@ from dateutil.parser import parse
 from pyramid import i18n
 
 from h.schemas.base import JSONSchema, ValidationError
-from h.search.query import LIMIT_DEFAULT, LIMIT_MAX, OFFSET_MAX
+from h.search.query import LIMIT_DEFAULT, LIMIT_MAX, OFFSET_MAX, decode_cursor
 from h.search.util import wildcard_uri_is_valid
 from h.util import document_claims
 
@@ -26,6 +26,12 @@ def _validate_wildcard_uri(node, value):
             )
 
 
+def _validate_cursor(node, value):
+    """Raise if the cursor isn't one returned by a search."""
+    if decode_cursor(value) is None:
+        raise colander.Invalid(node, "Invalid cursor")
+
+
 class AnnotationSchema(JSONSchema):
 
     """Validate an annotation object."""
@@ -296,6 +302,12 @@ class SearchParamsSchema(colander.Schema):
         missing=False,
         description="Return a separate set of annotations and their replies.",
     )
+    _paginate_replies = colander.SchemaNode(
+        colander.Boolean(),
+        missing=False,
+        description="With _separate_replies, return all the replies to the "
+        "annotations rather than only the first page of them.",
+    )
     sort = colander.SchemaNode(
         colander.String(),
         validator=colander.OneOf(["created", "updated", "group", "id", "user"]),
@@ -311,6 +323,17 @@ class SearchParamsSchema(colander.Schema):
                     epoch. This is used for iteration through large collections
                     of results.""",
     )
+    cursor = colander.SchemaNode(
+        colander.String(),
+        validator=_validate_cursor,
+        missing=colander.drop,
+        description="""Returns the results after the last annotation of a
+                    previous search, given the cursor that search returned.
+                    The results are sorted the same way as that search's, and
+                    sort, order, search_after and offset are ignored. This is
+                    the fastest way to page through large collections of
+                    results.""",
+    )
     limit = colander.SchemaNode(
         colander.Integer(),
         validator=colander.Range(min=0, max=LIMIT_MAX),
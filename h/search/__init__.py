@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from h.search.client import get_client
 from h.search.config import init
 from h.search.core import Search
+from h.search.templates import QUERY_TEMPLATES_KEY, QueryTemplates
 from h.search.query import (
     TopLevelAnnotationsFilter,
     DeletedFilter,
@@ -45,4 +46,5 @@ def includeme(config):
     # client. This can be used for direct or bulk access without having to
     # reread the settings.
     config.registry["es.client"] = get_client(settings)
+    config.registry[QUERY_TEMPLATES_KEY] = QueryTemplates()
     config.add_request_method(lambda r: r.registry["es.client"], name="es", reify=True)
@@ -32,6 +32,9 @@ ANNOTATION_MAPPING = {
         "deleted": {"type": "boolean"},
         "document": {"enabled": False},  # not indexed
         "group": {"type": "keyword"},
+        # Whether the annotation's group is readable by everyone, so that
+        # searches needn't list all the world-readable groups.
+        "group_readable_by_world": {"type": "boolean"},
         "id": {"type": "keyword"},
         "nipsa": {"type": "boolean"},
         "quote": {"type": "text", "analyzer": "uni_normalizer"},
@@ -3,17 +3,43 @@ from __future__ import unicode_literals
 import logging
 from collections import namedtuple
 from contextlib import contextmanager
+from elasticsearch import helpers as es_helpers
 from elasticsearch.exceptions import ConnectionTimeout
 import elasticsearch_dsl
 from webob.multidict import MultiDict
 
 from h.search import query
+from h.search import templates
 
 log = logging.getLogger(__name__)
 
 SearchResult = namedtuple(
-    "SearchResult", ["total", "annotation_ids", "reply_ids", "aggregations"]
+    "SearchResult", ["total", "annotation_ids", "reply_ids", "aggregations", "cursor"]
 )
+# The cursor pointing to the next page of results, if there's one.
+SearchResult.__new__.__defaults__ = (None,)
+
+
+def default_modifiers(request, separate_wildcard_uri_keys=True):
+    """Return the modifiers a search applies by default, in order."""
+    # Order matters! The KeyValueMatcher must be run last,
+    # after all other modifiers have popped off the params.
+    return [
+        query.Sorter(),
+        query.Limiter(),
+        query.DeletedFilter(),
+        query.AuthFilter(request),
+        query.GroupFilter(),
+        query.GroupAuthFilter(request),
+        query.UserFilter(),
+        query.HiddenFilter(request),
+        query.AnyMatcher(),
+        query.TagsMatcher(),
+        query.UriCombinedWildcardFilter(
+            request, separate_keys=separate_wildcard_uri_keys
+        ),
+        query.KeyValueMatcher(),
+    ]
 
 
 class Search(object):
@@ -37,6 +63,17 @@ class Search(object):
     :param stats: An optional statsd client to which some metrics will be
         published.
     :type stats: statsd.client.StatsClient
+
+    :param paginate_replies: If True (and separate_replies is True) then
+        replies beyond the first page of `_replies_limit` replies are fetched
+        too, all the remaining pages in a single multi-search request, rather
+        than being left out.
+    :type paginate_replies: bool
+
+    With the ``search_query_templates`` feature, the common shapes of search
+    (see :py:mod:`h.search.templates`) are run with a query body compiled once
+    for their shape, rather than one built through the modifiers each time.
+    Adding modifiers or aggregations to a search opts it out of this.
     """
 
     def __init__(
@@ -45,32 +82,22 @@ class Search(object):
         separate_replies=False,
         separate_wildcard_uri_keys=True,
         stats=None,
+        paginate_replies=False,
         _replies_limit=200,
     ):
         self.es = request.es
         self.separate_replies = separate_replies
         self.stats = stats
+        self.paginate_replies = paginate_replies
         self._replies_limit = _replies_limit
-        # Order matters! The KeyValueMatcher must be run last,
-        # after all other modifiers have popped off the params.
-        self._modifiers = [
-            query.Sorter(),
-            query.Limiter(),
-            query.DeletedFilter(),
-            query.AuthFilter(request),
-            query.GroupFilter(),
-            query.GroupAuthFilter(request),
-            query.UserFilter(),
-            query.HiddenFilter(request),
-            query.AnyMatcher(),
-            query.TagsMatcher(),
-            query.UriCombinedWildcardFilter(
-                request, separate_keys=separate_wildcard_uri_keys
-            ),
-            query.KeyValueMatcher(),
-        ]
+        self._modifiers = default_modifiers(request, separate_wildcard_uri_keys)
         self._aggregations = []
 
+        self._request = request
+        self._templates = None
+        if separate_wildcard_uri_keys and request.feature("search_query_templates"):
+            self._templates = templates.get_templates(request)
+
     def run(self, params):
         """
         Execute the search query
@@ -81,15 +108,95 @@ class Search(object):
         :returns: The search results
         :rtype: SearchResult
         """
-        total, annotation_ids, aggregations = self._search_annotations(params)
+        total, annotation_ids, aggregations, cursor = self._search_annotations(params)
+
+        # The replies are searched for with a request of their own, as the
+        # query for them depends on the annotations found by the first one.
+        # The annotations' documents do have the ids of their threads
+        # (`thread_ids`), but only as of the last time they were indexed, and
+        # the replies still have to be filtered for the request (deleted,
+        # hidden, private and other groups' replies) and sorted, which takes a
+        # query over the replies' own documents.
         reply_ids = self._search_replies(annotation_ids)
 
-        return SearchResult(total, annotation_ids, reply_ids, aggregations)
+        return SearchResult(total, annotation_ids, reply_ids, aggregations, cursor)
+
+    def count(self, params):
+        """
+        Return the number of annotations matching the search query.
+
+        This is the `total` that :py:meth:`run` would return, but it's counted
+        with Elasticsearch's `_count` API: no annotations are returned or
+        sorted, no aggregations are computed and no replies are searched for.
+
+        :param params: the search parameters that will be popped by each of the filters.
+        :type params: webob.multidict.MultiDict
+
+        :rtype: int
+        """
+        search = self._build_search(self._annotation_modifiers(), [], params)
+
+        with self._instrument():
+            return search.count()
+
+    def count_many(self, params_list):
+        """
+        Return the numbers of annotations matching several search queries.
+
+        The searches are counted like :py:meth:`count` does, but with a single
+        multi-search request for all of them.
+
+        :param params_list: the search parameters of each query
+        :type params_list: list of webob.multidict.MultiDict
+
+        :returns: the count for each of the queries, in order
+        :rtype: list of int
+        """
+        if not params_list:
+            return []
+
+        msearch = elasticsearch_dsl.MultiSearch(using=self.es.conn, index=self.es.index)
+        for params in params_list:
+            search = self._build_search(self._annotation_modifiers(), [], params)
+            msearch = msearch.add(search.sort()[0:0])
+
+        with self._instrument():
+            responses = msearch.execute()
+
+        return [response["hits"]["total"] for response in responses]
+
+    def scan(self, params, size=query.LIMIT_MAX):
+        """
+        Generate the ids of all the annotations matching the search query.
+
+        Rather than a page of them, every matching annotation is returned,
+        scrolled through `size` at a time with Elasticsearch's scroll API. The
+        annotations are in no particular order: the limit, offset, sort,
+        order, search_after and cursor params are ignored.
+
+        :param params: the search parameters that will be popped by each of the filters.
+        :type params: webob.multidict.MultiDict
+
+        :param size: the number of annotations to fetch with each request
+        :type size: int
+        """
+        search = self._build_search(self._annotation_modifiers(), [], params)
+
+        # Scrolling in index order is the cheapest, and the paging is done by
+        # the scroll.
+        body = search.to_dict()
+        for key in ("from", "size", "sort", "search_after"):
+            body.pop(key, None)
+
+        hits = es_helpers.scan(self.es.conn, query=body, index=self.es.index, size=size)
+        for hit in hits:
+            yield hit["_id"]
 
     def clear(self):
         """Clear search modifiers, aggregators, and matchers."""
         self._modifiers = [query.Sorter()]
         self._aggregations = []
+        self._templates = None
 
     def append_modifier(self, modifier):
         """Append a search modifier, matcher, etc to the search query."""
@@ -97,14 +204,16 @@ class Search(object):
         # since the KeyValueFilter must always be run after all the other
         # modifiers.
         self._modifiers.insert(0, modifier)
+        self._templates = None
 
     def append_aggregation(self, aggregation):
         """Append an aggregation to the search query."""
         self._aggregations.append(aggregation)
+        self._templates = None
 
-    def _search(self, modifiers, aggregations, params):
+    def _build_search(self, modifiers, aggregations, params):
         """
-        Applies the modifiers, aggregations, and executes the search.
+        Applies the modifiers and aggregations to a new search.
         """
         # Don't return any fields, just the metadata so set _source=False.
         search = elasticsearch_dsl.Search(
@@ -116,24 +225,60 @@ class Search(object):
         for qual in modifiers:
             search = qual(search, params)
 
+        return search
+
+    def _search(self, modifiers, aggregations, params):
+        """
+        Applies the modifiers, aggregations, and executes the search.
+        """
+        search = self._build_search(modifiers, aggregations, params)
+
         response = None
         with self._instrument():
             response = search.execute()
 
         return response
 
-    def _search_annotations(self, params):
+    def _annotation_modifiers(self):
         # If separate_replies is True, don't return any replies to annotations.
-        modifiers = self._modifiers
         if self.separate_replies:
-            modifiers = [query.TopLevelAnnotationsFilter()] + modifiers
+            return [query.TopLevelAnnotationsFilter()] + self._modifiers
+        return self._modifiers
 
-        response = self._search(modifiers, self._aggregations, params)
+    def _search_annotations(self, params):
+        # The modifiers pop the params, so see how the search is sorted first.
+        cursor_sort = query.Sorter.cursor_sort(params)
+
+        body = None
+        if self._templates is not None:
+            body = self._templates.body(
+                self._request,
+                params,
+                default_modifiers,
+                top_level_only=self.separate_replies,
+                stats=self.stats,
+            )
 
+        if body is not None:
+            with self._instrument():
+                response = self.es.conn.search(index=self.es.index, body=body)
+            aggregations = {}
+        else:
+            response = self._search(
+                self._annotation_modifiers(), self._aggregations, params
+            )
+            aggregations = self._parse_aggregation_results(response.aggregations)
+
+        hits = response["hits"]["hits"]
         total = response["hits"]["total"]
-        annotation_ids = [hit["_id"] for hit in response["hits"]["hits"]]
-        aggregations = self._parse_aggregation_results(response.aggregations)
-        return (total, annotation_ids, aggregations)
+        annotation_ids = [hit["_id"] for hit in hits]
+
+        cursor = None
+        if cursor_sort is not None and hits:
+            sort_by, order = cursor_sort
+            cursor = query.encode_cursor(sort_by, order, hits[-1]["sort"])
+
+        return (total, annotation_ids, aggregations, cursor)
 
     def _search_replies(self, annotation_ids):
         if not self.separate_replies:
@@ -142,21 +287,61 @@ class Search(object):
         # The only difference between a search for annotations and a search for
         # replies to annotations is the RepliesMatcher and the params passed to
         # the modifiers.
+        modifiers = [query.RepliesMatcher(annotation_ids)] + self._modifiers
         response = self._search(
-            [query.RepliesMatcher(annotation_ids)] + self._modifiers,
+            modifiers,
             [],  # Aggregations aren't used in replies.
             MultiDict({"limit": self._replies_limit}),
         )
 
-        if len(response["hits"]["hits"]) < response["hits"]["total"]:
-            log.warning(
-                "The number of reply annotations exceeded the page size "
-                "of the Elasticsearch query. We currently don't handle "
-                "this, our search API doesn't support pagination of the "
-                "reply set."
+        reply_ids = [hit["_id"] for hit in response["hits"]["hits"]]
+        total = response["hits"]["total"]
+
+        if len(reply_ids) < total and self.paginate_replies:
+            reply_ids.extend(
+                self._search_more_replies(modifiers, len(reply_ids), total)
             )
 
-        return [hit["_id"] for hit in response["hits"]["hits"]]
+        if len(reply_ids) < total:
+            if self.paginate_replies:
+                log.warning(
+                    "The number of reply annotations exceeded Elasticsearch's "
+                    "max result window, so some of them were left out."
+                )
+            else:
+                log.warning(
+                    "The number of reply annotations exceeded the page size "
+                    "of the Elasticsearch query, so some of them were left "
+                    "out. Search with paginate_replies to fetch them all."
+                )
+
+        return reply_ids
+
+    def _search_more_replies(self, modifiers, page_size, total):
+        """
+        Return the ids of the replies after the first page of them.
+
+        The pages don't depend on each other, so they are all fetched with a
+        single multi-search request. Elasticsearch won't page beyond its max
+        result window, so replies past `query.OFFSET_MAX` are still left out.
+        """
+        if not page_size:
+            return []
+
+        msearch = elasticsearch_dsl.MultiSearch(using=self.es.conn, index=self.es.index)
+        for offset in range(page_size, min(total, query.OFFSET_MAX + 1), page_size):
+            msearch = msearch.add(
+                self._build_search(
+                    modifiers, [], MultiDict({"offset": offset, "limit": page_size})
+                )
+            )
+
+        with self._instrument():
+            responses = msearch.execute()
+
+        return [
+            hit["_id"] for response in responses for hit in response["hits"]["hits"]
+        ]
 
     def _parse_aggregation_results(self, aggregations):
         if not aggregations:
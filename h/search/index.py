@@ -8,13 +8,14 @@ import time
 from collections import namedtuple
 
 import sqlalchemy as sa
+from dateutil import tz
 from elasticsearch import helpers as es_helpers
 from sqlalchemy.orm import subqueryload
 
 from h import models
 from h import presenters
 from h.events import AnnotationTransformEvent
-from h.util.query import column_windows
+from h.util.query import column_window, column_window_bounds, column_windows
 
 log = logging.getLogger(__name__)
 
@@ -114,7 +115,11 @@ class BatchIndexer(object):
             self._target_index = target_index
 
     def index(
-        self, annotation_ids=None, windowsize=PG_WINDOW_SIZE, chunk_size=ES_CHUNK_SIZE
+        self,
+        annotation_ids=None,
+        windowsize=PG_WINDOW_SIZE,
+        chunk_size=ES_CHUNK_SIZE,
+        windows=None,
     ):
         """
         Reindex annotations.
@@ -125,26 +130,106 @@ class BatchIndexer(object):
         :type windowsize: integer
         :param chunk_size: the number of docs in one chunk sent to ES
         :type chunk_size: integer
+        :param windows: windows (see :py:func:`annotation_windows`) of the
+            annotations to reindex, rather than all of them. Progress isn't
+            logged, it's up to the caller to report it.
+        :type windows: list of Window
 
         :returns: a set of errored ids
         :rtype: set
         """
-        if not annotation_ids:
-            annotations = _all_annotations(session=self.session, windowsize=windowsize)
+        if windows is not None:
+            annotations = _windowed_annotations(session=self.session, windows=windows)
         else:
-            annotations = _filtered_annotations(
-                session=self.session, ids=annotation_ids
-            )
+            if not annotation_ids:
+                annotations = _all_annotations(
+                    session=self.session, windowsize=windowsize
+                )
+            else:
+                annotations = _filtered_annotations(
+                    session=self.session, ids=annotation_ids
+                )
+
+            # Report indexing status as we go
+            annotations = _log_status(annotations, log_every=windowsize)
+
+        return self._bulk(annotations, chunk_size)
+
+    def sync(self, since, windowsize=PG_WINDOW_SIZE, chunk_size=ES_CHUNK_SIZE):
+        """
+        Reindex the annotations updated since a date, deleted ones included.
+
+        Annotations which haven't been deleted are indexed, and deleted ones
+        are marked as deleted in the index (see :py:func:`delete`). This
+        repairs the index after it missed some writes, without reindexing
+        all the annotations.
+
+        :param since: the date from which to reindex the annotations, in UTC
+            if it's naive
+        :type since: datetime.datetime
+        :param windowsize: the number of annotations to index in between progress log statements
+        :type windowsize: integer
+        :param chunk_size: the number of docs in one chunk sent to ES
+        :type chunk_size: integer
+
+        :returns: a set of errored ids
+        :rtype: set
+        """
+        # The database's dates are naive UTC ones.
+        if since.tzinfo is not None:
+            since = since.astimezone(tz.tzutc()).replace(tzinfo=None)
+
+        annotations = _annotations_since(
+            session=self.session, since=since, windowsize=windowsize
+        )
 
         # Report indexing status as we go
         annotations = _log_status(annotations, log_every=windowsize)
 
+        return self._bulk(annotations, chunk_size)
+
+    def index_annotations(self, annotations, chunk_size=ES_CHUNK_SIZE):
+        """
+        Index annotations which have already been loaded from the database.
+
+        Deleted annotations are marked as deleted in the index.
+
+        :param annotations: the annotations, loaded with their documents, as
+            by :py:func:`fetch_annotations`
+        :type annotations: iterable of h.models.Annotation
+        :param chunk_size: the number of docs in one chunk sent to ES
+        :type chunk_size: integer
+
+        :returns: a set of errored ids
+        :rtype: set
+        """
+        return self._bulk(annotations, chunk_size)
+
+    def delete(self, annotation_ids, chunk_size=ES_CHUNK_SIZE):
+        """
+        Mark annotations as deleted in the index (see :py:func:`delete`).
+
+        :param annotation_ids: the ids of the annotations
+        :type annotation_ids: collection
+        :param chunk_size: the number of docs in one chunk sent to ES
+        :type chunk_size: integer
+
+        :returns: a set of errored ids
+        :rtype: set
+        """
+        return self._bulk(annotation_ids, chunk_size, prepare=self._prepare_deletion)
+
+    def _bulk(self, items, chunk_size, prepare=None):
+        """Index the items with bulk requests, return the errored ids."""
+        if prepare is None:
+            prepare = self._prepare
+
         indexing = es_helpers.streaming_bulk(
             self.es_client.conn,
-            annotations,
+            items,
             chunk_size=chunk_size,
             raise_on_error=False,
-            expand_action_callback=self._prepare,
+            expand_action_callback=prepare,
         )
         errored = set()
         for ok, item in indexing:
@@ -166,6 +251,10 @@ class BatchIndexer(object):
                 "_id": annotation.id,
             }
         }
+
+        if annotation.deleted:
+            return (action, {"deleted": True})
+
         data = presenters.AnnotationSearchIndexPresenter(
             annotation, self.request
         ).asdict()
@@ -175,6 +264,64 @@ class BatchIndexer(object):
 
         return (action, data)
 
+    def _prepare_deletion(self, annotation_id):
+        action = {
+            self.op_type: {
+                "_index": self._target_index,
+                "_type": self.es_client.mapping_type,
+                "_id": annotation_id,
+            }
+        }
+        return (action, {"deleted": True})
+
+
+def fetch_annotations(session, ids):
+    """
+    Return the annotations with the given ids, ready to be indexed.
+
+    The annotations' documents and the other things their index documents
+    are made from are loaded along with them. Deleted annotations are
+    included, and ids which aren't found are left out.
+
+    :param ids: the ids of the annotations
+    :type ids: collection
+
+    :rtype: list of h.models.Annotation
+    """
+    if not ids:
+        return []
+    return (
+        _eager_loaded_annotations(session)
+        .filter(models.Annotation.id.in_(list(ids)))
+        .all()
+    )
+
+
+def annotation_windows(session, windowsize=PG_WINDOW_SIZE, since=None):
+    """
+    Return windows of `windowsize` annotations, covering all of them.
+
+    The windows are ranges of the annotations' `updated` column, in order.
+    They can be pickled, to share the annotations out between processes.
+
+    :param since: if given, only cover the annotations updated at or after
+        this date
+    :type since: datetime.datetime
+
+    :rtype: list of Window
+    """
+    where = _annotation_filter()
+    if since is not None:
+        where = sa.and_(where, models.Annotation.updated >= since)
+
+    bounds = column_window_bounds(
+        session=session,
+        column=models.Annotation.updated,
+        windowsize=windowsize,
+        where=where,
+    )
+    return [Window(start, end) for start, end in bounds]
+
 
 def _all_annotations(session, windowsize=2000):
     # This is using a windowed query for loading all annotations in batches.
@@ -194,6 +341,31 @@ def _all_annotations(session, windowsize=2000):
             yield a
 
 
+def _windowed_annotations(session, windows):
+    query = _eager_loaded_annotations(session).filter(_annotation_filter())
+
+    for window in windows:
+        clause = column_window(models.Annotation.updated, window.start, window.end)
+        for a in query.filter(clause):
+            yield a
+
+
+def _annotations_since(session, since, windowsize=2000):
+    # Unlike the other queries, this includes deleted annotations.
+    where = models.Annotation.updated >= since
+    windows = column_windows(
+        session=session,
+        column=models.Annotation.updated,
+        windowsize=windowsize,
+        where=where,
+    )
+    query = _eager_loaded_annotations(session).filter(where)
+
+    for window in windows:
+        for a in query.filter(window):
+            yield a
+
+
 def _filtered_annotations(session, ids):
     annotations = (
         _eager_loaded_annotations(session)
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import base64
+import binascii
+import json
+
 from dateutil.parser import parse
 from dateutil import tz
 from datetime import datetime as dt
 
 from h import storage
+from h._compat import string_types
 from h.util import uri
 from elasticsearch_dsl import Q
 from elasticsearch_dsl.query import SimpleQueryString
@@ -17,6 +22,10 @@ LIMIT_MAX = 200
 OFFSET_MAX = 9800
 DEFAULT_DATE = dt(1970, 1, 1, 0, 0, 0, 0).replace(tzinfo=tz.tzutc())
 
+# The field which breaks ties between annotations with the same value of the
+# field they're sorted by, so that cursors point to a single annotation.
+CURSOR_TIEBREAKER = "id"
+
 
 def popall(multidict, key):
     """ Pops and returns all values of the key in multidict"""
@@ -79,16 +88,29 @@ class Limiter(object):
 
 class Sorter(object):
     """
-    Sorts and returns annotations after search_after.
+    Sorts and returns annotations after search_after or a cursor.
 
     Sorts annotations by sort (the key to sort by)
     and the order (the order in which to sort by).
 
     Returns annotations after search_after. search_after
     must be the value of the annotation's sort field.
+
+    Unless search_after is given, ties are broken by the annotations' ids so
+    that the results can be paged through with cursors (see
+    :py:func:`encode_cursor`). A valid cursor overrides the sort, order,
+    search_after and offset params.
     """
 
     def __call__(self, search, params):
+        cursor = decode_cursor(params.pop("cursor", None))
+        if cursor is not None:
+            for key in ("sort", "order", "search_after", "offset"):
+                popall(params, key)
+            sort_by, order, values = cursor
+            search = search.extra(search_after=values)
+            return search.sort(*self._sort(sort_by, order, tiebreaker=True))
+
         sort_by = params.pop("sort", "updated")
         # Sorting must be done on non-analyzed fields.
         if sort_by == "user":
@@ -104,10 +126,34 @@ class Sorter(object):
         if search_after:
             search = search.extra(search_after=[search_after])
 
-        return search.sort(
+        order = params.pop("order", "desc")
+        return search.sort(*self._sort(sort_by, order, tiebreaker=not search_after))
+
+    @staticmethod
+    def cursor_sort(params):
+        """
+        Return the field and order which the cursors of a search are for.
+
+        Returns None if the search's results can't be paged through with
+        cursors, because they're after a search_after value. Doesn't modify
+        `params`.
+        """
+        cursor = decode_cursor(params.get("cursor"))
+        if cursor is not None:
+            return cursor[:2]
+        if params.get("search_after"):
+            return None
+
+        sort_by = params.get("sort", "updated")
+        if sort_by == "user":
+            sort_by = "user_raw"
+        return (sort_by, params.get("order", "desc"))
+
+    def _sort(self, sort_by, order, tiebreaker):
+        sort = [
             {
                 sort_by: {
-                    "order": params.pop("order", "desc"),
+                    "order": order,
                     # `unmapped_type` causes unknown fields specified as arguments to
                     # `sort` behave as if all documents contained empty values of the
                     # given type. Without this, specifying eg. `sort=foobar` throws
@@ -118,7 +164,10 @@ class Sorter(object):
                     "unmapped_type": "boolean",
                 }
             }
-        )
+        ]
+        if tiebreaker and sort_by != CURSOR_TIEBREAKER:
+            sort.append({CURSOR_TIEBREAKER: {"order": order}})
+        return sort
 
     def _parse_date(self, str_value):
         """
@@ -147,6 +196,45 @@ class Sorter(object):
                 pass
 
 
+def encode_cursor(sort_by, order, values):
+    """
+    Return an opaque cursor pointing to the results after an annotation.
+
+    :param sort_by: the field the search is sorted by
+    :param order: the order of the search, "asc" or "desc"
+    :param values: the sort values of the last annotation before the cursor
+    :rtype: unicode
+    """
+    data = json.dumps([sort_by, order, list(values)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Return the sort field, order and sort values of a cursor.
+
+    Returns None if `cursor` is missing or isn't a valid cursor.
+    """
+    if not cursor:
+        return None
+
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        data = base64.urlsafe_b64decode((cursor + padding).encode("ascii"))
+        sort_by, order, values = json.loads(data.decode("utf-8"))
+    except (binascii.Error, TypeError, UnicodeError, ValueError):
+        return None
+
+    if not isinstance(sort_by, string_types) or order not in ("asc", "desc"):
+        return None
+    if not isinstance(values, list) or not 1 <= len(values) <= 2:
+        return None
+    if not all(isinstance(v, string_types + (int, float)) for v in values):
+        return None
+
+    return (sort_by, order, values)
+
+
 class TopLevelAnnotationsFilter(object):
 
     """Matches top-level annotations only, filters out replies."""
@@ -211,15 +299,32 @@ class GroupFilter(object):
 
 
 class GroupAuthFilter(object):
-    """Filter out groups that the request isn't authorized to read."""
+    """
+    Filter out groups that the request isn't authorized to read.
+
+    With the ``search_group_readable_by_world`` feature, annotations in
+    world-readable groups are matched by the ``group_readable_by_world`` field
+    of the index, rather than by listing every world-readable group, so that
+    only the members-only groups the user belongs to need to be listed.
+    """
 
     def __init__(self, request):
         self.user = request.user
         self.group_service = request.find_service(name="group")
+        self.readable_by_world_field = request.feature("search_group_readable_by_world")
 
     def __call__(self, search, _):
-        groups = self.group_service.groupids_readable_by(self.user)
-        return search.filter("terms", group=groups)
+        if not self.readable_by_world_field:
+            groups = self.group_service.groupids_readable_by(self.user)
+            return search.filter("terms", group=groups)
+
+        should_clauses = [Q("term", group_readable_by_world=True)]
+
+        groups = self.group_service.groupids_readable_by_members(self.user)
+        if groups:
+            should_clauses.append(Q("terms", group=groups))
+
+        return search.filter(Q("bool", should=should_clauses))
 
 
 class UriCombinedWildcardFilter(object):
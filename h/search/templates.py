@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""
+Search query bodies compiled once for each of the common shapes of search.
+
+Building a search through the chain of modifiers of
+:py:class:`h.search.core.Search` and serializing it costs a fair amount of CPU
+on every search. The shapes of search which make up most of the traffic (the
+annotations on a URI, optionally in a group, and the annotations of a user or
+of a group) only differ in their parameters, so for these the query body is
+built once through the same modifiers, with placeholders standing in for the
+parameters, and each search of the same shape substitutes its own parameters
+into a copy of it.
+"""
+
+from __future__ import unicode_literals
+
+from collections import Counter
+
+import elasticsearch_dsl
+from webob.multidict import MultiDict
+
+from h.search import query
+from h.search.util import add_default_scheme
+
+QUERY_TEMPLATES_KEY = "h.search.query_templates"
+
+# The maximum number of compiled templates to keep.
+DEFAULT_QUERY_TEMPLATES_SIZE = 1000
+
+# The parameters searches of the compiled shapes may have. Searches with any
+# other parameters are built through the modifiers as usual.
+TEMPLATE_PARAMS = frozenset(
+    ["uri", "url", "group", "user", "limit", "offset", "sort", "order"]
+)
+
+# The parameters which can't have more than one value in a compiled search.
+SINGLE_VALUED_PARAMS = ("group", "limit", "offset", "sort", "order")
+
+# The placeholders in the compiled bodies. Those which stand for lists appear
+# in the bodies as the only item of a list.
+USERID = "\x00userid\x00"
+USER = "\x00user\x00"
+GROUP = "\x00group\x00"
+USER_PARAM = "\x00user.{}\x00"
+READABLE_GROUPS = "\x00readable_groups\x00"
+CREATED_GROUPS = "\x00created_groups\x00"
+URIS = "\x00uris\x00"
+
+
+class QueryTemplates(object):
+    """
+    A cache of the query bodies compiled for each shape of search.
+
+    The number of searches which used a template, which compiled one and which
+    couldn't use one are counted in :py:attr:`counts` and, if a statsd client
+    is given, reported as ``search.query.template.{hit,compile,fallback}``.
+
+    :param maxsize: the maximum number of templates to keep, beyond which they
+        are all discarded
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUERY_TEMPLATES_SIZE):
+        self.maxsize = maxsize
+        self.counts = Counter()
+        self._templates = {}
+
+    def body(self, request, params, modifiers, top_level_only=False, stats=None):
+        """
+        Return the query body of a search, or None if it has no template.
+
+        :param request: the request of the search
+        :param params: the search parameters, which are left untouched
+        :type params: webob.multidict.MultiDict
+        :param modifiers: a function returning the search's modifiers, in
+            order, for a given request
+        :param top_level_only: whether replies are left out of the search
+        :param stats: an optional statsd client
+        """
+        shape = _shape(request, params, top_level_only)
+        if shape is None:
+            self._record("fallback", stats)
+            return None
+
+        template = self._templates.get(shape)
+        if template is None:
+            template = _compile(request, params, modifiers, shape)
+            if template is None:
+                self._record("fallback", stats)
+                return None
+            if len(self._templates) >= self.maxsize:
+                self._templates.clear()
+            self._templates[shape] = template
+            self._record("compile", stats)
+        else:
+            self._record("hit", stats)
+
+        return _render(request, params, shape, template)
+
+    def clear(self):
+        self._templates.clear()
+
+    def _record(self, outcome, stats):
+        self.counts[outcome] += 1
+        if stats is not None:
+            stats.incr("search.query.template.{}".format(outcome))
+
+
+def get_templates(request):
+    """Return the application's query templates, if there are any."""
+    return request.registry.get(QUERY_TEMPLATES_KEY)
+
+
+class _Shape(object):
+    """
+    The shape of a search: what its query body depends on, other than its
+    parameters and the lists of groups the user may read.
+
+    Searches of the same shape compare equal. The shape also holds the search's
+    lists of groups, so that they're only looked up once.
+    """
+
+    def __init__(self, request, params, top_level_only):
+        group_service = request.find_service(name="group")
+        user = request.user
+
+        self.top_level_only = top_level_only
+        self.uris = "uri" in params or "url" in params
+        self.authenticated = request.authenticated_userid is not None
+        self.user = user is not None
+        self.readable_by_world_field = request.feature("search_group_readable_by_world")
+
+        if self.readable_by_world_field:
+            self.readable_groups = group_service.groupids_readable_by_members(user)
+        else:
+            self.readable_groups = group_service.groupids_readable_by(user)
+        self.created_groups = []
+        if self.user:
+            self.created_groups = group_service.groupids_created_by(user)
+
+        self.key = (
+            top_level_only,
+            self.uris,
+            "group" in params,
+            len(params.getall("user")),
+            params.get("sort"),
+            params.get("order"),
+            self.authenticated,
+            self.user,
+            self.readable_by_world_field,
+            # Whether these lists are empty changes the query's structure.
+            bool(self.readable_groups),
+            bool(self.created_groups),
+        )
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+def _shape(request, params, top_level_only):
+    """Return the shape of a search, or None if it has no template."""
+    if not TEMPLATE_PARAMS.issuperset(params.keys()):
+        return None
+    for key in SINGLE_VALUED_PARAMS:
+        if len(params.getall(key)) > 1:
+            return None
+    if params.get("order", "desc") not in ("asc", "desc"):
+        return None
+    return _Shape(request, params, top_level_only)
+
+
+def _compile(request, params, modifiers, shape):
+    """Build the query body of a shape of search, with placeholders."""
+    template_request = _TemplateRequest(request, shape)
+
+    template_params = MultiDict()
+    for i, _ in enumerate(params.getall("user")):
+        template_params.add("user", USER_PARAM.format(i))
+    if "group" in params:
+        template_params.add("group", GROUP)
+    if "uri" in params or "url" in params:
+        template_params.add("uri", URIS)
+    for key in ("sort", "order"):
+        if key in params:
+            template_params.add(key, params[key])
+
+    template_modifiers = [
+        _TemplateUriFilter(template_request, separate_keys=True)
+        if isinstance(modifier, query.UriCombinedWildcardFilter)
+        else modifier
+        for modifier in modifiers(template_request)
+    ]
+    if shape.top_level_only:
+        template_modifiers.insert(0, query.TopLevelAnnotationsFilter())
+
+    search = elasticsearch_dsl.Search().source(False)
+    for modifier in template_modifiers:
+        search = modifier(search, template_params)
+
+    # Parameters left over would have been matched by the KeyValueMatcher,
+    # which means the modifiers didn't expect them.
+    if template_params:
+        return None
+
+    return search.to_dict()
+
+
+def _render(request, params, shape, template):
+    """Return a copy of a template with the search's parameters in it."""
+    values = {USERID: request.authenticated_userid, GROUP: params.get("group")}
+    for i, userid in enumerate(params.getall("user")):
+        values[USER_PARAM.format(i)] = userid.lower()
+    if shape.user:
+        values[USER] = request.user.userid.lower()
+
+    list_values = {
+        READABLE_GROUPS: shape.readable_groups,
+        CREATED_GROUPS: shape.created_groups,
+    }
+    if shape.uris:
+        uri_filter = query.UriCombinedWildcardFilter(request, separate_keys=True)
+        list_values[URIS] = uri_filter._normalize_uris(
+            [add_default_scheme(u) for u in params.getall("uri") + params.getall("url")]
+        )
+
+    body = _substitute(template, values, list_values)
+
+    limiter = query.Limiter()
+    page = MultiDict((key, params[key]) for key in ("limit", "offset") if key in params)
+    body["from"] = limiter._extract_offset(page)
+    body["size"] = limiter._extract_limit(page)
+    return body
+
+
+def _substitute(node, values, list_values):
+    if isinstance(node, dict):
+        return {
+            key: _substitute(value, values, list_values) for key, value in node.items()
+        }
+    if isinstance(node, list):
+        if len(node) == 1 and _is_placeholder(node[0], list_values):
+            return list(list_values[node[0]])
+        return [_substitute(item, values, list_values) for item in node]
+    if _is_placeholder(node, values):
+        return values[node]
+    return node
+
+
+def _is_placeholder(node, values):
+    try:
+        return node in values
+    except TypeError:
+        # Unhashable values can't be placeholders.
+        return False
+
+
+class _TemplateRequest(object):
+    """
+    A stand-in for the request of a search, for compiling its template.
+
+    It gives the modifiers placeholders rather than the user and the groups
+    they may read.
+    """
+
+    def __init__(self, request, shape):
+        self._request = request
+        self.authenticated_userid = USERID if shape.authenticated else None
+        self.user = _TemplateUser() if shape.user else None
+        self._group_service = _TemplateGroupService(shape)
+
+    def feature(self, name):
+        return self._request.feature(name)
+
+    def find_service(self, *args, **kwargs):
+        return self._group_service
+
+
+class _TemplateUser(object):
+    userid = USER
+
+
+class _TemplateGroupService(object):
+    def __init__(self, shape):
+        self.shape = shape
+
+    def groupids_readable_by(self, user):
+        return [READABLE_GROUPS]
+
+    def groupids_readable_by_members(self, user):
+        return [READABLE_GROUPS] if self.shape.readable_groups else []
+
+    def groupids_created_by(self, user):
+        return [CREATED_GROUPS] if self.shape.created_groups else []
+
+
+class _TemplateUriFilter(query.UriCombinedWildcardFilter):
+    """Matches the placeholder for the expanded URIs of the search."""
+
+    def _normalize_uris(self, query_uris, normalize_method=None):
+        return [URIS] if query_uris else []
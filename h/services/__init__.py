@@ -4,8 +4,17 @@
 
 from __future__ import unicode_literals
 
+from h.services.group import (
+    DEFAULT_GROUPIDS_CACHE_TTL,
+    GROUPIDS_CACHE_KEY,
+    GroupidsCache,
+)
+
 
 def includeme(config):
+    config.register_service_factory(
+        ".annotation_export.annotation_export_factory", name="annotation_export"
+    )
     config.register_service_factory(
         ".annotation_json_presentation.annotation_json_presentation_service_factory",
         name="annotation_json_presentation",
@@ -89,6 +98,13 @@ def includeme(config):
         ".user_update.user_update_factory", name="user_update"
     )
 
+    # The group ids readable by and created by users are cached across
+    # requests, as every search needs them.
+    ttl = int(
+        config.registry.settings.get("h.groupids_cache_ttl", DEFAULT_GROUPIDS_CACHE_TTL)
+    )
+    config.registry[GROUPIDS_CACHE_KEY] = GroupidsCache(ttl=ttl)
+
     config.add_directive(
         "add_annotation_link_generator", ".links.add_annotation_link_generator"
     )
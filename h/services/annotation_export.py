@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from h.search import Search
+from h.services.annotation_json_presentation import (
+    annotation_json_presentation_service_factory,
+)
+
+# The number of annotations fetched from the index, loaded from the database
+# and presented at a time.
+DEFAULT_WINDOW_SIZE = 500
+
+
+class AnnotationExportService(object):
+    """
+    A service for exporting all the annotations matching a search.
+
+    Unlike a search, which returns a page of annotations, an export returns
+    every matching annotation, however many there are. They're scrolled
+    through in the search index, and loaded from the database and presented
+    a window at a time, so that memory use doesn't grow with the size of the
+    export.
+    """
+
+    def __init__(self, request, window_size=DEFAULT_WINDOW_SIZE):
+        self.request = request
+        self.window_size = window_size
+
+    def export(self, params):
+        """
+        Generate the presented annotations matching a search.
+
+        The annotations are in no particular order. The params which only
+        select a page of results (limit, offset, sort, order, search_after
+        and cursor) are ignored.
+
+        :param params: the search parameters
+        :type params: webob.multidict.MultiDict
+        """
+        search = Search(self.request, stats=getattr(self.request, "stats", None))
+        annotation_ids = search.scan(params, size=self.window_size)
+
+        for window in _windows(annotation_ids, self.window_size):
+            # The presentation service's formatters keep what they preload
+            # for as long as they live, so use a new one for each window.
+            presentation_svc = annotation_json_presentation_service_factory(
+                None, self.request
+            )
+            for annotation in presentation_svc.present_all(window):
+                yield annotation
+
+
+def _windows(iterable, size):
+    """Generate lists of up to `size` consecutive items of `iterable`."""
+    window = []
+    for item in iterable:
+        window.append(item)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def annotation_export_factory(context, request):
+    """Return an AnnotationExportService instance for the passed request."""
+    return AnnotationExportService(request)
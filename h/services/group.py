@@ -2,24 +2,144 @@
 
 from __future__ import unicode_literals
 
+import time
+
 import sqlalchemy as sa
 
 from h.models import Group, User
 from h.models.group import ReadableBy
 from h.util import group as group_util
+from h.util.db import on_transaction_end
+
+# The registry key of the process-wide :py:class:`GroupidsCache`.
+GROUPIDS_CACHE_KEY = "h.groupids_cache"
+
+# How long (in seconds) the lists of a user's group ids are cached for by
+# default. This can be changed with the `h.groupids_cache_ttl` setting.
+DEFAULT_GROUPIDS_CACHE_TTL = 60
+
+# The number of users whose group ids are cached at most.
+DEFAULT_GROUPIDS_CACHE_SIZE = 10000
+
+
+class GroupidsCache(object):
+    """
+    A cache, shared by all the requests in a process, of users' group ids.
+
+    Caches the results of :py:meth:`GroupService.groupids_readable_by`,
+    :py:meth:`GroupService.groupids_readable_by_members` and
+    :py:meth:`GroupService.groupids_created_by`, which are needed by every
+    search request, for each user. Anonymous users all share one entry.
+
+    The services which change the groups a user can read or has created
+    invalidate the cache, but only in their own process: other processes see
+    the change once their entries have expired, after `ttl` seconds.
+    """
+
+    def __init__(
+        self, ttl=DEFAULT_GROUPIDS_CACHE_TTL, maxsize=DEFAULT_GROUPIDS_CACHE_SIZE
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+
+    def get(self, kind, userid, fetch):
+        """
+        Return the cached group ids of `kind` for `userid`.
+
+        If there are none, or they have expired, they are fetched with
+        `fetch()` and cached.
+
+        :param kind: the kind of group ids, ``"readable"``,
+            ``"readable_by_members"`` or ``"created"``
+        :param userid: the user's userid, or ``None`` for anonymous users
+        :param fetch: a callable returning the list of group ids
+        """
+        key = (kind, userid)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return list(entry[1])
+
+        groupids = fetch()
+        if self.ttl > 0:
+            self._make_room(now)
+            self._entries[key] = (now + self.ttl, tuple(groupids))
+        return groupids
+
+    def invalidate(self, userids=None, session=None):
+        """
+        Forget the cached group ids of `userids`, or of everyone if ``None``.
+
+        The group ids may be fetched again before the change which made them
+        stale has been committed, so if `session` is given they are forgotten
+        again once its transaction has ended.
+        """
+        self._invalidate(userids)
+
+        if session is None:
+            return
+
+        # One listener per session forgets all the group ids which have been
+        # invalidated during its transaction.
+        pending = session.info.get("groupids_cache.pending")
+        if pending is None:
+            pending = session.info["groupids_cache.pending"] = {
+                "everyone": False,
+                "userids": set(),
+            }
+
+            @on_transaction_end(session)
+            def invalidate_after_transaction():
+                if pending["everyone"]:
+                    self._invalidate(None)
+                elif pending["userids"]:
+                    self._invalidate(pending["userids"])
+                pending["everyone"] = False
+                pending["userids"] = set()
+
+        if userids is None:
+            pending["everyone"] = True
+        else:
+            pending["userids"].update(userids)
+
+    def _invalidate(self, userids):
+        if userids is None:
+            self._entries.clear()
+            return
+
+        for key in list(self._entries):
+            if key[1] in userids:
+                self._entries.pop(key, None)
+
+    def _make_room(self, now):
+        if len(self._entries) < self.maxsize:
+            return
+
+        for key, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                self._entries.pop(key, None)
+
+        # If none of them had expired, start afresh rather than keeping track
+        # of which entry is the oldest.
+        if len(self._entries) >= self.maxsize:
+            self._entries.clear()
 
 
 class GroupService(object):
-    def __init__(self, session, user_fetcher):
+    def __init__(self, session, user_fetcher, groupids_cache=None):
         """
         Create a new groups service.
 
         :param session: the SQLAlchemy session object
         :param user_fetcher: a callable for fetching users by userid
-        :param publish: a callable for publishing events
+        :param groupids_cache: an optional :py:class:`GroupidsCache` of the
+            group ids readable by and created by users
         """
         self.session = session
         self.user_fetcher = user_fetcher
+        self.groupids_cache = groupids_cache
 
     def fetch(self, pubid_or_groupid):
         """
@@ -67,6 +187,14 @@ class GroupService(object):
 
         :type user: `h.models.user.User`
         """
+        if self.groupids_cache is None:
+            return self._groupids_readable_by(user)
+
+        return self.groupids_cache.get(
+            "readable", _userid(user), lambda: self._groupids_readable_by(user)
+        )
+
+    def _groupids_readable_by(self, user):
         readable = Group.readable_by == ReadableBy.world
 
         if user is not None:
@@ -80,6 +208,37 @@ class GroupService(object):
             record.pubid for record in self.session.query(Group.pubid).filter(readable)
         ]
 
+    def groupids_readable_by_members(self, user):
+        """
+        Return a list of pubids of the members-only groups the user can read.
+
+        These are the groups which the user is a member of, excluding the
+        world-readable ones. If the passed-in user is ``None``, this returns an
+        empty list.
+
+        :type user: `h.models.user.User` or None
+        """
+        if user is None:
+            return []
+
+        if self.groupids_cache is None:
+            return self._groupids_readable_by_members(user)
+
+        return self.groupids_cache.get(
+            "readable_by_members",
+            user.userid,
+            lambda: self._groupids_readable_by_members(user),
+        )
+
+    def _groupids_readable_by_members(self, user):
+        readable = sa.and_(
+            Group.readable_by == ReadableBy.members,
+            Group.members.any(User.id == user.id),
+        )
+        return [
+            record.pubid for record in self.session.query(Group.pubid).filter(readable)
+        ]
+
     def groupids_created_by(self, user):
         """
         Return a list of pubids which the user created.
@@ -91,6 +250,14 @@ class GroupService(object):
         if user is None:
             return []
 
+        if self.groupids_cache is None:
+            return self._groupids_created_by(user)
+
+        return self.groupids_cache.get(
+            "created", user.userid, lambda: self._groupids_created_by(user)
+        )
+
+    def _groupids_created_by(self, user):
         return [
             g.pubid for g in self.session.query(Group.pubid).filter_by(creator=user)
         ]
@@ -99,4 +266,19 @@ class GroupService(object):
 def groups_factory(context, request):
     """Return a GroupService instance for the passed context and request."""
     user_service = request.find_service(name="user")
-    return GroupService(session=request.db, user_fetcher=user_service.fetch)
+    return GroupService(
+        session=request.db,
+        user_fetcher=user_service.fetch,
+        groupids_cache=groupids_cache(request),
+    )
+
+
+def groupids_cache(request):
+    """Return the process's :py:class:`GroupidsCache`, if there is one."""
+    return request.registry.get(GROUPIDS_CACHE_KEY)
+
+
+def _userid(user):
+    if user is None:
+        return None
+    return user.userid
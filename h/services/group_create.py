@@ -10,21 +10,27 @@ from h.models.group import (
     OPEN_GROUP_TYPE_FLAGS,
     PRIVATE_GROUP_TYPE_FLAGS,
     RESTRICTED_GROUP_TYPE_FLAGS,
+    ReadableBy,
 )
+from h.services.group import groupids_cache
 
 
 class GroupCreateService(object):
-    def __init__(self, session, user_fetcher, publish):
+    def __init__(self, session, user_fetcher, publish, groupids_cache=None):
         """
         Create a new GroupCreateService.
 
         :param session: the SQLAlchemy session object
         :param user_fetcher: a callable for fetching users by userid
         :param publish: a callable for publishing events
+        :param groupids_cache: an optional
+            :py:class:`h.services.group.GroupidsCache` to invalidate when a
+            group is created
         """
         self.session = session
         self.user_fetcher = user_fetcher
         self.publish = publish
+        self.groupids_cache = groupids_cache
 
     def create_private_group(self, name, userid, **kwargs):
         """
@@ -133,6 +139,14 @@ class GroupCreateService(object):
         )
         self.session.add(group)
 
+        if self.groupids_cache is not None:
+            # Everyone can read a world-readable group, but otherwise only the
+            # creator's group ids have changed.
+            userids = [creator.userid]
+            if group.readable_by == ReadableBy.world:
+                userids = None
+            self.groupids_cache.invalidate(userids, session=self.session)
+
         if add_creator_as_member:
             group.members.append(group.creator)
 
@@ -159,6 +173,7 @@ def group_create_factory(context, request):
         session=request.db,
         user_fetcher=user_service.fetch,
         publish=partial(_publish, request),
+        groupids_cache=groupids_cache(request),
     )
 
 
@@ -4,23 +4,28 @@ from __future__ import unicode_literals
 from functools import partial
 
 from h import session
+from h.services.group import groupids_cache
 
 
 class GroupMembersService(object):
 
     """A service for manipulating group membership."""
 
-    def __init__(self, session, user_fetcher, publish):
+    def __init__(self, session, user_fetcher, publish, groupids_cache=None):
         """
         Create a new GroupMembersService
 
         :param session: the SQLAlchemy session object
         :param user_fetcher: a callable for fetching users by userid
         :param publish: a callable for publishing events
+        :param groupids_cache: an optional
+            :py:class:`h.services.group.GroupidsCache` to invalidate when a
+            user's memberships change
         """
         self.session = session
         self.user_fetcher = user_fetcher
         self.publish = publish
+        self.groupids_cache = groupids_cache
 
     def add_members(self, group, userids):
         """
@@ -66,6 +71,7 @@ class GroupMembersService(object):
             return
 
         group.members.append(user)
+        self._invalidate(userid)
 
         self.publish("group-join", group.pubid, userid)
 
@@ -77,9 +83,14 @@ class GroupMembersService(object):
             return
 
         group.members.remove(user)
+        self._invalidate(userid)
 
         self.publish("group-leave", group.pubid, userid)
 
+    def _invalidate(self, userid):
+        if self.groupids_cache is not None:
+            self.groupids_cache.invalidate([userid], session=self.session)
+
 
 def group_members_factory(context, request):
     """Return a GroupMembersService instance for the passed context and request."""
@@ -88,6 +99,7 @@ def group_members_factory(context, request):
         session=request.db,
         user_fetcher=user_service.fetch,
         publish=partial(_publish, request),
+        groupids_cache=groupids_cache(request),
     )
 
 
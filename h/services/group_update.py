@@ -5,16 +5,29 @@ from __future__ import unicode_literals
 from sqlalchemy.exc import SQLAlchemyError
 
 from h.services.exceptions import ValidationError, ConflictError
+from h.services.group import groupids_cache
+from h.tasks.indexer import reindex_group_annotations
+
+# The group attributes which affect who can read it or who created it.
+GROUPIDS_ATTRIBUTES = ("creator", "readable_by")
 
 
 class GroupUpdateService(object):
-    def __init__(self, session):
+    def __init__(self, session, transaction_manager, groupids_cache=None):
         """
         Create a new GroupUpdateService
 
         :param session: the SQLAlchemy session object
+        :param transaction_manager: the transaction manager of the session's
+            transaction, which the group's annotations are reindexed after
+            when its readability changes
+        :param groupids_cache: an optional
+            :py:class:`h.services.group.GroupidsCache` to invalidate when a
+            group's readability or creator change
         """
         self.session = session
+        self.transaction_manager = transaction_manager
+        self.groupids_cache = groupids_cache
 
     def update(self, group, **kwargs):
         """
@@ -29,12 +42,18 @@ class GroupUpdateService(object):
         :rtype: ~h.models.Group
         """
 
+        readable_by = group.readable_by
+
         for key, value in kwargs.items():
             try:
                 setattr(group, key, value)
             except ValueError as err:
                 raise ValidationError(err)
 
+        if self.groupids_cache is not None:
+            if any(key in kwargs for key in GROUPIDS_ATTRIBUTES):
+                self.groupids_cache.invalidate(session=self.session)
+
         try:
             self.session.flush()
 
@@ -53,9 +72,27 @@ class GroupUpdateService(object):
                 # Re-raise as this is an unexpected problem
                 raise
 
+        # The search index records whether each annotation's group is
+        # world-readable.
+        if group.readable_by != readable_by:
+            self._reindex_annotations_after_commit(group.pubid)
+
         return group
 
+    def _reindex_annotations_after_commit(self, groupid):
+        # The task mustn't run before the transaction commits, or it would
+        # index the annotations with the group's old readability.
+        def reindex(committed):
+            if committed:
+                reindex_group_annotations.delay(groupid)
+
+        self.transaction_manager.get().addAfterCommitHook(reindex)
+
 
 def group_update_factory(context, request):
     """Return a GroupUpdateService instance for the passed context and request."""
-    return GroupUpdateService(session=request.db)
+    return GroupUpdateService(
+        session=request.db,
+        transaction_manager=request.tm,
+        groupids_cache=groupids_cache(request),
+    )
@@ -49,6 +49,29 @@ class NipsaService(object):
         user = self.session.query(User).filter_by(userid=userid).one_or_none()
         return user and user.nipsa
 
+    def flagged_userids(self, userids):
+        """
+        Return the subset of the given userids which are flagged as "NIPSA".
+
+        This looks up the status of all of the given users in a single query,
+        unless the cache is populated.
+
+        :rtype: set of unicode strings
+        """
+        userids = set(userids)
+
+        # Use the cache if populated.
+        if self._flagged_userids is not None:
+            return userids & self._flagged_userids
+
+        if not userids:
+            return set()
+
+        query = self.session.query(User).filter(
+            User.userid.in_(userids), User.nipsa.is_(True)
+        )
+        return set([u.userid for u in query])
+
     def flag(self, user):
         """
         Add a NIPSA flag for a user.
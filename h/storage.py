@@ -25,7 +25,7 @@ from pyramid import i18n
 from h import models, schemas
 from h.db import types
 from h.util.group_scope import match as group_scope_match
-from h.models.document import update_document_metadata
+from h.models.document import DOCUMENT_URI_CACHE, update_document_metadata
 
 _ = i18n.TranslationStringFactory(__package__)
 
@@ -244,20 +244,21 @@ def expand_uri(session, uri):
     :returns: a list of equivalent URIs
     :rtype: list
     """
-    doc = models.Document.find_by_uris(session, [uri]).one_or_none()
+    # The document's URIs are cached, see
+    # :py:class:`h.models.document.DocumentURICache`.
+    docuris = DOCUMENT_URI_CACHE.find(session, uri)
 
-    if doc is None:
+    if not docuris:
         return [uri]
 
     # We check if the match was a "canonical" link. If so, all annotations
     # created on that page are guaranteed to have that as their target.source
     # field, so we don't need to expand to other URIs and risk false positives.
-    docuris = doc.document_uris
-    for docuri in docuris:
-        if docuri.uri == uri and docuri.type == "rel-canonical":
+    for docuri, type_ in docuris:
+        if docuri == uri and type_ == "rel-canonical":
             return [uri]
 
-    return [docuri.uri for docuri in docuris]
+    return [docuri for docuri, _ in docuris]
 
 
 def _validate_group_scope(group, target_uri):
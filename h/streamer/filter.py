@@ -4,9 +4,9 @@ from __future__ import unicode_literals
 
 import unicodedata
 
-from jsonpointer import resolve_pointer
+from jsonpointer import JsonPointer
 from h.util.uri import normalize as normalize_uri
-from h._compat import text_type
+from h._compat import string_types, text_type
 
 SCHEMA = {
     "type": "object",
@@ -33,59 +33,276 @@ SCHEMA = {
 
 
 class FilterHandler(object):
+    """
+    A websocket client's filter, compiled for matching against annotations.
+
+    The filter's clauses are compiled once, when the filter is received, so
+    that matching an annotation doesn't need to re-normalize the filter terms
+    or re-parse the JSON pointers to the annotation fields each time.
+    """
+
     def __init__(self, filter_json):
         self.filter = filter_json
+        self.clauses = [
+            Clause(clause["field"], clause["operator"], clause["value"])
+            for clause in filter_json["clauses"]
+        ]
 
-    def evaluate_clause(self, clause, target):
-        field_value = resolve_pointer(target, clause["field"], None)
-        if field_value is None:
-            return False
+    def include_any(self, target):
+        for clause in self.clauses:
+            if clause.evaluate(target):
+                return True
+        return False
 
-        filter_term = clause["value"]
+    def match(self, target, action=None):
+        """
+        Return True if the annotation `target` matches this filter.
 
-        def normalize(term):
-            # Apply generic normalization.
-            normalized = uni_fold(term)
+        `target` may be a presented annotation or, when matching the same
+        annotation against many filters, a :py:class:`NormalizedTarget`
+        wrapping it so that its fields are only normalized once.
+        """
+        if self.clauses:
+            if not isinstance(target, NormalizedTarget):
+                target = NormalizedTarget(target)
+            return self.include_any(target)
+        else:
+            return True
 
-            # Apply field-specific normalization.
-            if clause["field"] == "/uri":
-                normalized = normalize_uri(term)
+    def index_keys(self):
+        """
+        Return the ``(field, normalized term)`` pairs this filter can match on.
 
-            return normalized
+        An annotation can only match this filter if, for one of the returned
+        pairs, the normalized value of ``field`` in the annotation (or one of
+        its items, for list fields) is equal to ``term``.
 
-        if isinstance(filter_term, list):
-            filter_term = [normalize(t) for t in filter_term]
-        else:
-            filter_term = normalize(filter_term)
+        Returns ``None`` if the filter can't be described this way, for example
+        because it has no clauses (and so matches everything) or because it
+        uses a ``one_of`` clause with a single string value, which does a
+        substring match against scalar fields.
+        """
+        if not self.clauses:
+            return None
+
+        keys = []
+        for clause in self.clauses:
+            terms = clause.terms
+            if not isinstance(terms, list):
+                if clause.operator == "one_of" and isinstance(terms, string_types):
+                    return None
+                terms = [terms]
+            if not terms:
+                return None
+            for term in terms:
+                if not _is_hashable(term):
+                    return None
+                keys.append((clause.field, term))
+        return keys
+
+
+class Clause(object):
+    """A single compiled clause of a :py:class:`FilterHandler`."""
+
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.pointer = JsonPointer(field)
+        self.operator = operator
 
-        if isinstance(field_value, list):
-            field_value = [normalize(v) for v in field_value]
+        if isinstance(value, list):
+            self.terms = [normalize_term(field, term) for term in value]
         else:
-            field_value = normalize(field_value)
+            self.terms = normalize_term(field, value)
 
-        if clause["operator"] == "one_of":
+        # Use a set for `one_of` membership tests where the terms allow it.
+        self.term_set = None
+        if isinstance(self.terms, list) and all(
+            _is_hashable(term) for term in self.terms
+        ):
+            self.term_set = frozenset(self.terms)
+
+    def evaluate(self, target):
+        """Return True if the :py:class:`NormalizedTarget` matches."""
+        field_value = target.get(self.field, self.pointer)
+        if field_value is None:
+            return False
+
+        if self.operator == "one_of":
             # The `one_of` operator behaves differently depending on whether
             # the annotation's field value is a list (eg. tags) or atom (eg. id).
             #
             # This is not ideal but the client currently relies on it.
             if isinstance(field_value, list):
-                return filter_term in field_value
+                return self.terms in field_value
+            elif self.term_set is not None and _is_hashable(field_value):
+                return field_value in self.term_set
             else:
-                return field_value in filter_term
+                return field_value in self.terms
         else:
-            return field_value == filter_term
+            return field_value == self.terms
 
-    def include_any(self, target):
-        for clause in self.filter["clauses"]:
-            if self.evaluate_clause(clause, target):
-                return True
-        return False
 
-    def match(self, target, action=None):
-        if len(self.filter["clauses"]) > 0:
-            return self.include_any(target)
-        else:
-            return True
+class NormalizedTarget(object):
+    """
+    An annotation whose field values are normalized for matching.
+
+    Each field is resolved and normalized the first time it is needed and
+    then cached, so an annotation can be matched against many filters while
+    normalizing each of its fields only once.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._values = {}
+
+    def get(self, field, pointer=None):
+        """
+        Return the normalized value of `field`, or None if it's missing.
+
+        :param field: the JSON pointer to the field, as a string
+        :param pointer: an optional pre-parsed :py:class:`jsonpointer.JsonPointer`
+            for `field`
+        """
+        try:
+            return self._values[field]
+        except KeyError:
+            pass
+
+        if pointer is None:
+            pointer = JsonPointer(field)
+        value = pointer.resolve(self.target, None)
+
+        if value is not None:
+            if isinstance(value, list):
+                value = [normalize_term(field, v) for v in value]
+            else:
+                value = normalize_term(field, value)
+
+        self._values[field] = value
+        return value
+
+
+class SubscriptionIndex(object):
+    """
+    An index of websockets by the filter terms they are subscribed to.
+
+    Most sockets are filtered on the URI of the page they are open on, so
+    checking every socket's filter against every annotation event is wasted
+    work. This index maps ``(field, normalized term)`` pairs to the sockets
+    whose filters contain them, so that :py:meth:`candidates` can return only
+    the sockets which could possibly match an annotation.
+
+    The candidates are a superset of the matching sockets, so callers must
+    still check each socket's filter against the annotation.
+    """
+
+    def __init__(self):
+        # Mapping of field -> normalized term -> set of sockets
+        self._index = {}
+
+        # Mapping of socket -> the keys it is indexed under
+        self._keys = {}
+
+        # Sockets whose filters can't be indexed and must always be checked
+        self._unindexed = set()
+
+        # Sockets whose filters match on fields other than the URI
+        self._unrestricted = set()
+
+        # Incremented whenever the index changes
+        self.version = 0
+
+    def __len__(self):
+        return len(self._keys) + len(self._unindexed)
+
+    def update(self, socket):
+        """Index (or re-index) `socket` according to its current filter."""
+        self.remove(socket)
+
+        if socket.filter is None:
+            return
+
+        keys = socket.filter.index_keys()
+        if keys is None:
+            self._unindexed.add(socket)
+            return
+
+        for field, term in keys:
+            self._index.setdefault(field, {}).setdefault(term, set()).add(socket)
+            if field != "/uri":
+                self._unrestricted.add(socket)
+        self._keys[socket] = keys
+
+    def remove(self, socket):
+        """Remove `socket` from the index, if present."""
+        self.version += 1
+        self._unindexed.discard(socket)
+        self._unrestricted.discard(socket)
+
+        for field, term in self._keys.pop(socket, []):
+            terms = self._index[field]
+            sockets = terms.get(term)
+            if sockets is None:
+                continue
+            sockets.discard(socket)
+            if not sockets:
+                del terms[term]
+                if not terms:
+                    del self._index[field]
+
+    def uris(self):
+        """
+        Return the set of normalized URIs the indexed sockets are filtering on.
+
+        Returns ``None`` if some socket's filter could also match annotations
+        on other URIs.
+        """
+        if self._unindexed or self._unrestricted:
+            return None
+        return set(self._index.get("/uri", ()))
+
+    def candidates(self, target):
+        """
+        Return the set of sockets whose filters might match `target`.
+
+        Like :py:meth:`FilterHandler.match`, `target` may be a presented
+        annotation or a :py:class:`NormalizedTarget` wrapping one.
+        """
+        if not isinstance(target, NormalizedTarget):
+            target = NormalizedTarget(target)
+
+        result = set(self._unindexed)
+
+        for field, terms in self._index.items():
+            value = target.get(field)
+            if value is None:
+                continue
+
+            if not isinstance(value, list):
+                value = [value]
+
+            for item in value:
+                if not _is_hashable(item):
+                    # A list term can only be matched by a list item, so be
+                    # conservative and include everyone filtering on the field.
+                    for sockets in terms.values():
+                        result.update(sockets)
+                    break
+                sockets = terms.get(item)
+                if sockets:
+                    result.update(sockets)
+
+        return result
+
+
+def normalize_term(field, term):
+    """Return `term` normalized for comparison against values of `field`."""
+    # Apply field-specific normalization.
+    if field == "/uri":
+        return normalize_uri(term)
+
+    # Apply generic normalization.
+    return uni_fold(term)
 
 
 def uni_fold(text):
@@ -106,3 +323,7 @@ def uni_fold(text):
     text = text.lower()
     text = unicodedata.normalize("NFKD", text)
     return "".join([c for c in text if not unicodedata.combining(c)])
+
+
+def _is_hashable(value):
+    return not isinstance(value, (list, dict))
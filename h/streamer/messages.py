@@ -2,19 +2,24 @@
 
 from __future__ import unicode_literals
 from collections import namedtuple
+import json
 import logging
 
 from gevent.queue import Full
+from sqlalchemy.orm import subqueryload
 
+from h import models
 from h import presenters
 from h import realtime
 from h import storage
 from h.realtime import Consumer
 from h.traversal import AnnotationContext
 from h.auth.util import translate_annotation_principals
+from h.db.types import InvalidUUID
 from h.services.links import LinksService
 from h.services.nipsa import NipsaService
 from h.services.groupfinder import GroupfinderService
+from h.streamer import filter
 from h.streamer import websocket
 import h.sentry
 import h.stats
@@ -36,6 +41,10 @@ def process_messages(settings, routing_key, work_queue, raise_error=True):
     This sets up a :py:class:`h.realtime.Consumer` to route messages from
     `routing_key` to the passed `work_queue`, and starts it. The consumer
     should never return. If it does, this function will raise an exception.
+
+    If sharded routing is enabled with `h.realtime_shards`, the consumer of
+    annotation messages is also bound to the shards of the URIs that this
+    worker's websockets are listening to.
     """
 
     def _handler(payload):
@@ -51,12 +60,19 @@ def process_messages(settings, routing_key, work_queue, raise_error=True):
     conn = realtime.get_connection(settings)
     sentry_client = h.sentry.get_client(settings)
     statsd_client = h.stats.get_client(settings)
+
+    bindings = None
+    shards = realtime.get_shards(settings)
+    if shards and routing_key == realtime.ANNOTATION_ROUTING_KEY:
+        bindings = ShardBindings(shards, websocket.WebSocket.subscriptions)
+
     consumer = Consumer(
         connection=conn,
         routing_key=routing_key,
         handler=_handler,
         sentry_client=sentry_client,
         statsd_client=statsd_client,
+        bindings=bindings,
     )
     consumer.run()
 
@@ -64,16 +80,49 @@ def process_messages(settings, routing_key, work_queue, raise_error=True):
         raise RuntimeError("Realtime consumer quit unexpectedly!")
 
 
-def handle_message(message, settings, session, topic_handlers):
+class ShardBindings(object):
+    """
+    The routing keys of the annotation shards a streamer worker must receive.
+
+    Called by the :py:class:`h.realtime.Consumer` of annotation messages to
+    find out which shards it should be bound to. These are the shards of the
+    URIs in the sockets' filters or, if some socket's filter isn't restricted
+    to particular URIs, all of them.
+
+    :param shards: the number of shards
+    :param subscriptions: the :py:class:`h.streamer.filter.SubscriptionIndex`
+        of the worker's sockets
+    """
+
+    def __init__(self, shards, subscriptions):
+        self.shards = shards
+        self.subscriptions = subscriptions
+        self._version = None
+        self._routing_keys = None
+
+    def __call__(self):
+        # Only recompute the routing keys if the subscriptions have changed.
+        version = self.subscriptions.version
+        if version != self._version:
+            self._routing_keys = self.routing_keys()
+            self._version = version
+        return self._routing_keys
+
+    def routing_keys(self):
+        uris = self.subscriptions.uris()
+        if uris is None:
+            return set(realtime.shard_routing_key(s) for s in range(self.shards))
+        return set(realtime.annotation_routing_key(uri, self.shards) for uri in uris)
+
+
+def handle_message(message, registry, session, topic_handlers):
     """
     Deserialize and process a message from the reader.
 
-    For each message, `handler` is called with the deserialized message and a
-    single :py:class:`h.streamer.WebSocket` instance, and should return the
-    message to be sent to the client on that socket. The handler can return
-    `None`, to signify that no message should be sent, or a JSON-serializable
-    object. It is assumed that there is a 1:1 request-reply mapping between
-    incoming messages and messages to be sent out over the websockets.
+    For each message, the handler for the message's topic is called with the
+    deserialized message, the application registry and the database session,
+    and is responsible for finding the :py:class:`h.streamer.WebSocket`
+    instances which should be notified and sending them a message.
     """
     try:
         handler = topic_handlers[message.topic]
@@ -82,89 +131,197 @@ def handle_message(message, settings, session, topic_handlers):
             "Don't know how to handle message from topic: " "{}".format(message.topic)
         )
 
-    # N.B. We iterate over a non-weak list of instances because there's nothing
-    # to stop connections being added or dropped during iteration, and if that
-    # happens Python will throw a "Set changed size during iteration" error.
-    sockets = list(websocket.WebSocket.instances)
-    handler(message.payload, sockets, settings, session)
+    handler(message.payload, registry, session)
+
+
+def handle_annotation_event(message, registry, session):
+    """Notify the interested websockets about an annotation event."""
+    handle_annotation_events([message], registry, session)
 
 
-def handle_annotation_event(message, sockets, settings, session):
-    id_ = message["annotation_id"]
-    annotation = storage.fetch_annotation(session, id_)
+def handle_annotation_events(events, registry, session):
+    """
+    Notify the interested websockets about a batch of annotation events.
+
+    The annotations, their documents and the NIPSA status of their authors are
+    loaded for the whole batch at once, rather than with several queries per
+    event.
 
-    if annotation is None:
-        log.warning("received annotation event for missing annotation: %s", id_)
+    Everything which doesn't depend on the recipient (the presented
+    annotation, its read principals and the encoded notification) is computed
+    once per event, and the sockets which may read it are looked up by its
+    read principals, leaving only the filter checks to be done for each socket.
+    """
+    events = [event for event in events if event["action"] != "read"]
+    if not events:
         return
 
+    annotations = _fetch_annotations(
+        session, [event["annotation_id"] for event in events]
+    )
+
     nipsa_service = NipsaService(session)
-    user_nipsad = nipsa_service.is_flagged(annotation.userid)
+    flagged_userids = nipsa_service.flagged_userids(
+        set(annotation.userid for annotation in annotations.values())
+    )
 
+    settings = registry.settings
     authority = text_type(settings.get("h.authority", "localhost"))
     group_service = GroupfinderService(session, authority)
+    base_url = settings.get("h.app_url", "http://localhost:5000")
+    links_service = LinksService(base_url, registry)
 
-    for socket in sockets:
-        reply = _generate_annotation_event(
-            message, socket, annotation, user_nipsad, group_service
+    for event in events:
+        id_ = event["annotation_id"]
+        annotation = annotations.get(id_)
+
+        if annotation is None:
+            log.warning("received annotation event for missing annotation: %s", id_)
+            continue
+
+        user_nipsad = annotation.userid in flagged_userids
+        resource = AnnotationContext(annotation, group_service, links_service)
+        serialized = presenters.AnnotationJSONPresenter(resource).asdict()
+
+        _notify_sockets(event, annotation, serialized, user_nipsad)
+
+
+def _fetch_annotations(session, ids):
+    """Return a dict of the annotations with the given ids, keyed by id."""
+
+    def eager_load_documents(query):
+        return query.options(
+            subqueryload(models.Annotation.document).subqueryload(
+                models.Document.document_uris
+            )
         )
-        if reply is None:
+
+    try:
+        annotations = storage.fetch_ordered_annotations(
+            session, ids, query_processor=eager_load_documents
+        )
+    except InvalidUUID:
+        # One of the ids is malformed, which would make the whole query fail,
+        # so fall back to fetching the annotations one at a time.
+        annotations = [storage.fetch_annotation(session, id_) for id_ in ids]
+
+    return {a.id: a for a in annotations if a is not None}
+
+
+def _notify_sockets(event, annotation, serialized, user_nipsad):
+    """
+    Send the notification about an annotation event to the right sockets.
+
+    The notification is also kept in the replay buffer, for clients which
+    reconnect having missed it.
+    """
+    replay = websocket.WebSocket.replay
+    seq = replay.next_seq()
+
+    read_principals = _read_principals(serialized.get("permissions"))
+    notification = _annotation_notification(
+        event["action"], annotation, serialized, seq=seq, stream=replay.stream
+    )
+    broadcast = websocket.Broadcast(json.dumps(notification))
+
+    # Normalize the annotation's fields once for all the sockets' filters.
+    target = filter.NormalizedTarget(serialized)
+
+    # The annotation itself is expired when the session is committed, so only
+    # hold on to its userid.
+    userid = annotation.userid
+
+    def recipient(socket):
+        if not _authorized_to_read(socket.effective_principals, read_principals):
+            return False
+        return _should_notify(event, socket, userid, user_nipsad, target)
+
+    replay.append(seq, broadcast, annotation.id, recipient)
+
+    # Only the sockets whose filters could match this annotation need to be
+    # considered, rather than every open socket...
+    sockets = websocket.WebSocket.subscriptions.candidates(target)
+
+    # ...and of those, only the ones which may read it.
+    readers = websocket.WebSocket.principals.readers(read_principals)
+    if readers is not None:
+        sockets = readers.intersection(sockets)
+
+    for socket in sockets:
+        if not _should_notify(event, socket, userid, user_nipsad, target):
             continue
-        socket.send_json(reply)
+        socket.send_broadcast(broadcast, key=annotation.id)
 
 
-def handle_user_event(message, sockets, settings, session):
+def handle_user_event(message, registry, session):
+    """
+    Notify the user's websockets about a user event.
+
+    When the user joins or leaves a group, their sockets gain or lose the
+    group's principal so that they are sent the group's annotations (or not).
+    """
+    sockets = websocket.WebSocket.principals.user_sockets(message["userid"])
+
     for socket in sockets:
+        _update_principals(message, socket)
         reply = _generate_user_event(message, socket)
         if reply is None:
             continue
         socket.send_json(reply)
 
 
-def _generate_annotation_event(message, socket, annotation, user_nipsad, group_service):
-    """
-    Get message about annotation event `message` to be sent to `socket`.
+def _update_principals(message, socket):
+    """Update the socket's principals for a group join or leave event."""
+    if "group" not in message:
+        return
 
-    Inspects the embedded annotation event and decides whether or not the
-    passed socket should receive notification of the event.
+    principal = "group:{}".format(message["group"])
+    if message["type"] == "group-join":
+        socket.add_principal(principal)
+    elif message["type"] == "group-leave":
+        socket.remove_principal(principal)
 
-    Returns None if the socket should not receive any message about this
-    annotation event, otherwise a dict containing information about the event.
+
+def _annotation_notification(action, annotation, serialized, seq=None, stream=None):
     """
-    action = message["action"]
+    Return the notification to send to clients about an annotation event.
 
-    if action == "read":
-        return None
+    The notification's sequence number and the stream it belongs to (see
+    :py:class:`h.streamer.websocket.ReplayBuffer`) are sent in its options.
+    """
+    payload = [serialized]
+    if action == "delete":
+        payload = [{"id": annotation.id}]
+
+    options = {"action": action}
+    if seq is not None:
+        options["seq"] = seq
+        options["stream"] = stream
 
+    return {"type": "annotation-notification", "options": options, "payload": payload}
+
+
+def _should_notify(message, socket, userid, user_nipsad, target):
+    """
+    Return True if `socket` should be notified about annotation event `message`.
+
+    Inspects the embedded annotation event and decides whether or not the
+    passed socket, which is authorized to read the annotation, should receive
+    notification of the event.
+    """
     if message["src_client_id"] == socket.client_id:
-        return None
+        return False
 
     # We don't send anything until we have received a filter from the client
     if socket.filter is None:
-        return None
+        return False
 
     # Don't sent annotations from NIPSA'd users to anyone other than that
     # user.
-    if user_nipsad and socket.authenticated_userid != annotation.userid:
-        return None
-
-    notification = {"type": "annotation-notification", "options": {"action": action}}
+    if user_nipsad and socket.authenticated_userid != userid:
+        return False
 
-    base_url = socket.registry.settings.get("h.app_url", "http://localhost:5000")
-    links_service = LinksService(base_url, socket.registry)
-    resource = AnnotationContext(annotation, group_service, links_service)
-    serialized = presenters.AnnotationJSONPresenter(resource).asdict()
-
-    permissions = serialized.get("permissions")
-    if not _authorized_to_read(socket.effective_principals, permissions):
-        return None
-
-    if not socket.filter.match(serialized, action):
-        return None
-
-    notification["payload"] = [serialized]
-    if action == "delete":
-        notification["payload"] = [{"id": annotation.id}]
-    return notification
+    return socket.filter.match(target, message["action"])
 
 
 def _generate_user_event(message, socket):
@@ -190,14 +347,16 @@ def _generate_user_event(message, socket):
     }
 
 
-def _authorized_to_read(effective_principals, permissions):
+def _read_principals(permissions):
+    """Return the set of principals which may read an annotation."""
+    read_permissions = permissions.get("read", [])
+    return set(translate_annotation_principals(read_permissions))
+
+
+def _authorized_to_read(effective_principals, read_principals):
     """Return True if the passed request is authorized to read the annotation.
 
     If the annotation belongs to a private group, this will return False if the
     authenticated user isn't a member of that group.
     """
-    read_permissions = permissions.get("read", [])
-    read_principals = translate_annotation_principals(read_permissions)
-    if set(read_principals).intersection(effective_principals):
-        return True
-    return False
+    return not read_principals.isdisjoint(effective_principals)
@@ -3,8 +3,10 @@
 from __future__ import unicode_literals
 import logging
 import sys
+import time
 
 import gevent
+from gevent.queue import Empty, Full
 
 from h import db
 from h import stats
@@ -25,6 +27,17 @@ WORK_QUEUE = gevent.queue.Queue(maxsize=4096)
 ANNOTATION_TOPIC = "annotation"
 USER_TOPIC = "user"
 
+# The default number of greenlets consuming messages from the work queue. This
+# can be changed with the `h.streamer_consumers` setting.
+DEFAULT_CONSUMERS = 4
+
+# Consecutive annotation events in a consumer's queue are handled together, in
+# batches of up to this many events...
+ANNOTATION_BATCH_SIZE = 100
+
+# ...waiting at most this long (in seconds) for more events to join a batch.
+ANNOTATION_BATCH_WAIT = 0.005
+
 
 class UnknownMessageType(Exception):
     """Raised if a message in the work queue if of an unknown type."""
@@ -38,23 +51,151 @@ def start(event):
     greenlets running `process_queue` for each message queue we subscribe to.
     The function does not block.
     """
-    settings = event.app.registry.settings
+    registry = event.app.registry
+    settings = registry.settings
+    consumers = int(settings.get("h.streamer_consumers", DEFAULT_CONSUMERS))
+
+    policy = settings.get(
+        "h.streamer_slow_consumer_policy", websocket.DEFAULT_SLOW_CONSUMER_POLICY
+    )
+    if policy not in websocket.SLOW_CONSUMER_POLICIES:
+        raise ValueError(
+            "Unknown h.streamer_slow_consumer_policy {!r}, expected one of "
+            "{}".format(policy, ", ".join(websocket.SLOW_CONSUMER_POLICIES))
+        )
+
+    # Each worker process numbers its annotation notifications afresh, in a
+    # stream of its own.
+    replay_buffer_size = int(
+        settings.get(
+            "h.streamer_replay_buffer_size", websocket.DEFAULT_REPLAY_BUFFER_SIZE
+        )
+    )
+    websocket.WebSocket.replay = websocket.ReplayBuffer(replay_buffer_size)
+
+    # Each consumer of the work queue gets its own queue of messages, and
+    # messages are distributed between them so that messages from the same
+    # socket are always processed by the same consumer, in order.
+    consumer_queues = [
+        gevent.queue.Queue(maxsize=max(WORK_QUEUE.maxsize // consumers, 1))
+        for _ in range(consumers)
+    ]
+
     greenlets = [
         # Start greenlets to process messages from RabbitMQ
         gevent.spawn(messages.process_messages, settings, ANNOTATION_TOPIC, WORK_QUEUE),
         gevent.spawn(messages.process_messages, settings, USER_TOPIC, WORK_QUEUE),
         # A greenlet to periodically report to statsd
         gevent.spawn(report_stats, settings),
-        # And one to process the queued work
-        gevent.spawn(process_work_queue, settings, WORK_QUEUE),
+        # One to hand out the queued work to the consumers
+        gevent.spawn(distribute_work, WORK_QUEUE, consumer_queues),
     ]
 
+    # And a pool of greenlets to process the queued work
+    for consumer_id, consumer_queue in enumerate(consumer_queues):
+        greenlets.append(
+            gevent.spawn(
+                process_work_queue, registry, consumer_queue, consumer_id=consumer_id
+            )
+        )
+
     # Start a "greenlet of last resort" to monitor the worker greenlets and
     # bail if any unexpected errors occur.
     gevent.spawn(supervise, greenlets)
 
 
-def process_work_queue(settings, queue, session_factory=None):
+def distribute_work(queue, consumer_queues):
+    """
+    Hand out each message from `queue` to one of the `consumer_queues`.
+
+    Messages are partitioned between the consumers by
+    :py:func:`partition_key`, so that messages which must be processed in
+    order always go to the same consumer.
+
+    A consumer which falls behind mustn't hold up the others for long, so if
+    its queue stays full for 0.1s a realtime message is dropped, and counted in
+    ``streamer.consumer.<n>.dropped``. Messages from websocket clients (such
+    as their filters) are never dropped, as the client wouldn't know that its
+    message had been lost.
+    """
+    for msg in queue:
+        index = hash(partition_key(msg)) % len(consumer_queues)
+        if isinstance(msg, websocket.Message):
+            consumer_queues[index].put(msg)
+            continue
+        try:
+            consumer_queues[index].put(msg, timeout=0.1)
+        except Full:
+            log.warning(
+                "Streamer consumer %d's queue full! Unable to queue message "
+                "having waited 0.1s: giving up.",
+                index,
+            )
+            websocket.SEND_STATS["streamer.consumer.{}.dropped".format(index)] += 1
+
+
+def batch_annotation_messages(
+    queue, max_size=ANNOTATION_BATCH_SIZE, max_wait=ANNOTATION_BATCH_WAIT
+):
+    """
+    Yield the messages from `queue`, batching up annotation events.
+
+    Each run of consecutive annotation messages is yielded as a list of up to
+    `max_size` messages, waiting at most `max_wait` seconds for more of them
+    to arrive. Other messages are yielded on their own, in order. Like
+    iterating over a gevent queue, this stops when `StopIteration` is taken
+    from the queue.
+    """
+    msg = queue.get()
+    while msg is not StopIteration:
+        if not _is_annotation_message(msg):
+            yield msg
+            msg = queue.get()
+            continue
+
+        batch = [msg]
+        msg = None
+        deadline = time.time() + max_wait
+        while len(batch) < max_size:
+            try:
+                msg = queue.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                msg = None
+                break
+            if not _is_annotation_message(msg):
+                break
+            batch.append(msg)
+            msg = None
+
+        yield batch
+
+        if msg is None:
+            msg = queue.get()
+
+
+def _is_annotation_message(msg):
+    return isinstance(msg, messages.Message) and msg.topic == ANNOTATION_TOPIC
+
+
+def partition_key(msg):
+    """
+    Return the key used to pick the consumer which processes `msg`.
+
+    Messages from a websocket are keyed on the socket, so that (for example) a
+    client's filter is always updated in the order it was sent. Realtime
+    messages are keyed on the annotation or user they concern.
+    """
+    if isinstance(msg, websocket.Message):
+        return id(msg.socket)
+    if isinstance(msg, messages.Message) and isinstance(msg.payload, dict):
+        if msg.topic == ANNOTATION_TOPIC:
+            return msg.payload.get("annotation_id")
+        if msg.topic == USER_TOPIC:
+            return msg.payload.get("userid")
+    return None
+
+
+def process_work_queue(registry, queue, session_factory=None, consumer_id=0):
     """
     Process each message from the queue in turn, handling exceptions.
 
@@ -62,7 +203,16 @@ def process_work_queue(settings, queue, session_factory=None):
     dispatching them as appropriate. The handling of each message is wrapped in
     code that ensures the database session is appropriately committed and
     closed between messages.
+
+    Consecutive annotation events are handled in batches (see
+    :py:func:`batch_annotation_messages`), so that the database is queried
+    once per batch rather than once per event.
+
+    Several of these may run at once, each with its own database session. The
+    time each one spends handling messages is reported to statsd, tagged with
+    `consumer_id`.
     """
+    settings = registry.settings
     if session_factory is None:
         session_factory = _get_session
     s = stats.get_client(settings).pipeline()
@@ -71,8 +221,9 @@ def process_work_queue(settings, queue, session_factory=None):
         ANNOTATION_TOPIC: messages.handle_annotation_event,
         USER_TOPIC: messages.handle_user_event,
     }
+    busy_stat = "streamer.consumer.{}.busy".format(consumer_id)
 
-    for msg in queue:
+    for msg in batch_annotation_messages(queue):
         t_total = s.timer("streamer.msg.handler_total")
         t_total.start()
         try:
@@ -85,9 +236,14 @@ def process_work_queue(settings, queue, session_factory=None):
                 "DEFERRABLE"
             )
 
-            if isinstance(msg, messages.Message):
+            if isinstance(msg, list):
+                with s.timer("streamer.msg.handler_annotation_batch"):
+                    messages.handle_annotation_events(
+                        [m.payload for m in msg], registry, session
+                    )
+            elif isinstance(msg, messages.Message):
                 with s.timer("streamer.msg.handler_message"):
-                    messages.handle_message(msg, settings, session, topic_handlers)
+                    messages.handle_message(msg, registry, session, topic_handlers)
             elif isinstance(msg, websocket.Message):
                 with s.timer("streamer.msg.handler_websocket"):
                     websocket.handle_message(msg, session)
@@ -105,6 +261,7 @@ def process_work_queue(settings, queue, session_factory=None):
         finally:
             session.close()
         t_total.stop()
+        s.timing(busy_stat, t_total.ms)
         s.send()
 
 
@@ -113,9 +270,28 @@ def report_stats(settings):
     while True:
         client.gauge("streamer.connected_clients", len(websocket.WebSocket.instances))
         client.gauge("streamer.queue_length", WORK_QUEUE.qsize())
+        client.gauge("streamer.deflate_memory", deflate_memory_usage())
+        report_send_stats(client)
         gevent.sleep(10)
 
 
+def deflate_memory_usage():
+    """Return the memory used to compress messages to all the clients."""
+    return sum(
+        socket.deflate.memory_usage
+        for socket in list(websocket.WebSocket.instances)
+        if socket.deflate is not None
+    )
+
+
+def report_send_stats(client):
+    """Report and reset the counts of messages dropped because of slowness."""
+    send_stats = websocket.SEND_STATS.copy()
+    websocket.SEND_STATS.clear()
+    for stat, count in send_stats.items():
+        client.incr(stat, count)
+
+
 def supervise(greenlets):
     try:
         gevent.joinall(greenlets, raise_error=True)
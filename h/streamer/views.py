@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+from pyramid.settings import asbool
 from pyramid.view import forbidden_view_config
 from pyramid.view import notfound_view_config
 from pyramid.view import view_config
 from ws4py.exc import HandshakeError
-from ws4py.server.wsgiutils import WebSocketWSGIApplication
 
 from h.streamer import streamer, websocket
+from h.websocket import (
+    DEFAULT_DEFLATE_MEM_LEVEL,
+    DEFAULT_DEFLATE_WINDOW_BITS,
+    WebSocketWSGIApplication,
+)
 
 
 @view_config(route_name="ws")
@@ -26,10 +31,30 @@ def websocket_view(request):
     # WebSocket connection are closed.
     request.db.close()
 
-    app = WebSocketWSGIApplication(handler_cls=websocket.WebSocket)
+    app = WebSocketWSGIApplication(
+        handler_cls=websocket.WebSocket,
+        deflate=_deflate_options(request.registry.settings),
+    )
     return request.get_response(app)
 
 
+def _deflate_options(settings):
+    """Return the permessage-deflate options, or None if it's disabled."""
+    if not asbool(settings.get("h.websocket_deflate", False)):
+        return None
+    return {
+        "window_bits": int(
+            settings.get("h.websocket_deflate_window_bits", DEFAULT_DEFLATE_WINDOW_BITS)
+        ),
+        "mem_level": int(
+            settings.get("h.websocket_deflate_mem_level", DEFAULT_DEFLATE_MEM_LEVEL)
+        ),
+        "no_context_takeover": asbool(
+            settings.get("h.websocket_deflate_no_context_takeover", False)
+        ),
+    }
+
+
 @notfound_view_config(renderer="json")
 def notfound(exc, request):
     request.response.status_code = 404
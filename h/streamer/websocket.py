@@ -1,17 +1,26 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-from collections import namedtuple
+import binascii
+from collections import Counter, deque, namedtuple
 import copy
 import json
 import logging
+import os
 import weakref
 
+import gevent
+from gevent.event import Event
+from gevent.lock import Semaphore
 from gevent.queue import Full
 import jsonschema
+from pyramid import security
+from ws4py.framing import Frame, OPCODE_BINARY, OPCODE_TEXT
 from ws4py.websocket import WebSocket as _WebSocket
 
 from h import storage
+from h._compat import text_type
+from h.websocket import parsing_with
 from h.streamer import filter
 
 log = logging.getLogger(__name__)
@@ -20,6 +29,34 @@ log = logging.getLogger(__name__)
 # below.
 MESSAGE_HANDLERS = {}
 
+# The default maximum number of messages waiting to be sent to each client.
+# This can be changed with the `h.streamer_send_queue_size` setting.
+DEFAULT_SEND_QUEUE_SIZE = 100
+
+# What to do when a client isn't reading its messages quickly enough and its
+# send queue is full, set with the `h.streamer_slow_consumer_policy` setting:
+#
+# - "drop_oldest": discard the oldest queued message
+# - "coalesce": discard a queued message about the same annotation, which the
+#   new message supersedes, or otherwise the oldest queued message
+# - "disconnect": close the connection with `SLOW_CONSUMER_CLOSE_CODE`
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+DEFAULT_SLOW_CONSUMER_POLICY = "drop_oldest"
+
+# The close code sent to clients disconnected for being too slow (RFC 6455
+# "policy violation").
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+# The default number of recent annotation notifications kept for clients which
+# reconnect to catch up on. This can be changed with the
+# `h.streamer_replay_buffer_size` setting.
+DEFAULT_REPLAY_BUFFER_SIZE = 1000
+
+# Counts of messages dropped and clients disconnected because of slow clients
+# or slow work queue consumers, which are periodically reported to statsd and
+# reset by the streamer.
+SEND_STATS = Counter()
+
 
 # An incoming message from a WebSocket client.
 class Message(namedtuple("Message", ["socket", "payload"])):
@@ -40,15 +77,175 @@ class Message(namedtuple("Message", ["socket", "payload"])):
         self.socket.send_json(data)
 
 
+class PrincipalIndex(object):
+    """
+    An index of websockets by their principals and authenticated users.
+
+    This allows finding the sockets which may read an annotation by looking
+    up each of its read principals, and the sockets of a user by looking up
+    their userid, rather than checking every socket.
+
+    Every socket has the `Everyone` principal, so sockets aren't indexed by it
+    and :py:meth:`readers` returns None for annotations everyone can read.
+    """
+
+    def __init__(self):
+        # Mapping of principal -> set of sockets
+        self._principals = {}
+
+        # Mapping of authenticated userid -> set of sockets
+        self._users = {}
+
+    def add(self, socket):
+        """Index `socket` by its current principals and userid."""
+        for principal in socket.effective_principals:
+            self.add_principal(socket, principal)
+        if socket.authenticated_userid is not None:
+            _add_to_index(self._users, socket.authenticated_userid, socket)
+
+    def remove(self, socket):
+        """Remove `socket` from the index."""
+        for principal in socket.effective_principals:
+            self.remove_principal(socket, principal)
+        if socket.authenticated_userid is not None:
+            _remove_from_index(self._users, socket.authenticated_userid, socket)
+
+    def add_principal(self, socket, principal):
+        """Index `socket` by a principal it has gained."""
+        if principal != security.Everyone:
+            _add_to_index(self._principals, principal, socket)
+
+    def remove_principal(self, socket, principal):
+        """Stop indexing `socket` by a principal it has lost."""
+        _remove_from_index(self._principals, principal, socket)
+
+    def readers(self, read_principals):
+        """
+        Return the set of sockets having any of the given principals.
+
+        Returns None if `read_principals` includes `Everyone`, meaning every
+        socket.
+        """
+        if security.Everyone in read_principals:
+            return None
+
+        result = set()
+        for principal in read_principals:
+            result.update(self._principals.get(principal, ()))
+        return result
+
+    def user_sockets(self, userid):
+        """Return the set of sockets authenticated as `userid`."""
+        return set(self._users.get(userid, ()))
+
+
+def _add_to_index(index, key, socket):
+    index.setdefault(key, set()).add(socket)
+
+
+def _remove_from_index(index, key, socket):
+    sockets = index.get(key)
+    if sockets is None:
+        return
+    sockets.discard(socket)
+    if not sockets:
+        del index[key]
+
+
+# A notification kept in a :py:class:`ReplayBuffer`
+ReplayEntry = namedtuple("ReplayEntry", ["seq", "broadcast", "key", "recipient"])
+
+
+class ReplayBuffer(object):
+    """
+    A bounded buffer of recent annotation notifications.
+
+    Each notification is numbered from a sequence which increases for the
+    lifetime of the worker process, and the number is sent to clients with
+    the notification. A client which reconnects can send the last number it
+    saw to be sent the notifications it missed instead of fetching everything
+    again, as long as they are still in the buffer.
+
+    Sequence numbers from different processes can't be compared, so each
+    buffer has a random ``stream`` id which is sent along with them.
+    """
+
+    def __init__(self, size=DEFAULT_REPLAY_BUFFER_SIZE):
+        self.stream = binascii.hexlify(os.urandom(8)).decode("ascii")
+        self.last_seq = 0
+        self._entries = deque(maxlen=size)
+
+        # The sequence number of the newest notification dropped from the
+        # buffer to make room for others
+        self._discarded_seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def next_seq(self):
+        """Return the sequence number for a new notification."""
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, seq, broadcast, key, recipient):
+        """
+        Keep a notification for replaying to reconnecting clients.
+
+        :param seq: the notification's number, from :py:meth:`next_seq`
+        :param broadcast: the notification
+        :type broadcast: :py:class:`Broadcast`
+        :param key: the key to send the notification with (see
+            :py:meth:`WebSocket.send_broadcast`)
+        :param recipient: a function returning True if the notification
+            should be sent to the socket it is passed
+        """
+        if not self._entries.maxlen:
+            self._discarded_seq = seq
+            return
+        if len(self._entries) == self._entries.maxlen:
+            self._discarded_seq = self._entries[0].seq
+        self._entries.append(ReplayEntry(seq, broadcast, key, recipient))
+
+    def since(self, seq, until=None):
+        """
+        Return the notifications numbered after `seq`, oldest first.
+
+        :param until: if given, leave out the notifications numbered after this
+        :returns: a list of :py:class:`ReplayEntry`, or None if any of the
+            notifications are no longer in the buffer
+        """
+        if seq < self._discarded_seq or seq > self.last_seq:
+            return None
+        if until is None:
+            until = self.last_seq
+        return [entry for entry in self._entries if seq < entry.seq <= until]
+
+
 class WebSocket(_WebSocket):
     # All instances of WebSocket, allowing us to iterate over open websockets
     instances = weakref.WeakSet()
 
+    # Index of open websockets by their filters, allowing us to find the
+    # websockets which might be interested in an annotation
+    subscriptions = filter.SubscriptionIndex()
+
+    # Index of open websockets by their principals and users, allowing us to
+    # find the websockets which may read an annotation or belong to a user
+    principals = PrincipalIndex()
+
+    # Recent annotation notifications, for clients catching up after
+    # reconnecting
+    replay = ReplayBuffer()
+
     # Instance attributes
     client_id = None
     filter = None
     query = None
 
+    # The sequence number of the last annotation notification before the
+    # client first sent a filter, after which notifications were sent live
+    subscribed_seq = None
+
     def __init__(self, sock, protocols=None, extensions=None, environ=None):
         super(WebSocket, self).__init__(
             sock,
@@ -59,11 +256,31 @@ class WebSocket(_WebSocket):
         )
 
         self.authenticated_userid = environ["h.ws.authenticated_userid"]
-        self.effective_principals = environ["h.ws.effective_principals"]
+        self.effective_principals = list(environ["h.ws.effective_principals"])
         self.registry = environ["h.ws.registry"]
 
         self._work_queue = environ["h.ws.streamer_work_queue"]
 
+        # The negotiated permessage-deflate extension, if any
+        self.deflate = environ.get("h.ws.deflate")
+
+        # Messages are sent to the client by a greenlet of its own, so that a
+        # client which is slow to read them doesn't hold up the streamer.
+        settings = self.registry.settings
+        self._send_queue = deque()
+        self._send_queue_size = int(
+            settings.get("h.streamer_send_queue_size", DEFAULT_SEND_QUEUE_SIZE)
+        )
+        self._slow_consumer_policy = settings.get(
+            "h.streamer_slow_consumer_policy", DEFAULT_SLOW_CONSUMER_POLICY
+        )
+        self._send_ready = Event()
+        self._sender = None
+        self._write_lock = Semaphore()
+        self._too_slow = False
+
+        self.principals.add(self)
+
     def __new__(cls, *args, **kwargs):
         instance = super(WebSocket, cls).__new__(cls)
         cls.instances.add(instance)
@@ -83,15 +300,204 @@ class WebSocket(_WebSocket):
                 "WebSocket client having waited 0.1s: giving up."
             )
 
+    def process(self, bytes):
+        with parsing_with(self.deflate):
+            return super(WebSocket, self).process(bytes)
+
+    def send(self, payload, binary=False):
+        # ws4py sends its own messages through here too, such as the pongs of
+        # its heartbeat. Those are control messages, which mustn't be
+        # compressed (RFC 7692 section 6.1).
+        if self.deflate is None or not isinstance(payload, (bytes, text_type)):
+            return super(WebSocket, self).send(payload, binary=binary)
+
+        if self.terminated or self.sock is None:
+            raise RuntimeError("Cannot send on a terminated websocket")
+
+        # Compressed messages go through the send queue, so that they're
+        # compressed with the socket's deflate context in the order they're
+        # written in.
+        self._enqueue(Broadcast(payload, binary=binary))
+
+    def _write(self, b):
+        # ws4py writes frames (eg. closes and pongs) with this, so they mustn't
+        # land in the middle of a frame written by the sender greenlet.
+        with self._write_lock:
+            super(WebSocket, self)._write(b)
+
     def closed(self, code, reason=None):
         try:
             self.instances.remove(self)
         except KeyError:
             pass
+        self.subscriptions.remove(self)
+        self.principals.remove(self)
+
+        self._send_queue.clear()
+        if self._sender is not None:
+            self._sender.kill(block=False)
+
+    def add_principal(self, principal):
+        """Give the client a new principal, eg. when its user joins a group."""
+        if principal not in self.effective_principals:
+            self.effective_principals.append(principal)
+            self.principals.add_principal(self, principal)
+
+    def remove_principal(self, principal):
+        """Take a principal away from the client."""
+        if principal in self.effective_principals:
+            self.effective_principals.remove(principal)
+            self.principals.remove_principal(self, principal)
 
     def send_json(self, payload):
         if not self.terminated:
-            self.send(json.dumps(payload))
+            self._enqueue(Broadcast(json.dumps(payload)))
+
+    def send_broadcast(self, broadcast, key=None):
+        """
+        Send a message which may also be sent to other clients.
+
+        :param broadcast: the message
+        :type broadcast: :py:class:`Broadcast`
+        :param key: an optional key (eg. an annotation ID) identifying what the
+            message is about, allowing a newer message with the same key to
+            replace this one if the client's send queue is full
+        """
+        if not self.terminated:
+            self._enqueue(broadcast, key)
+
+    def _enqueue(self, broadcast, key=None):
+        """Queue a message to be sent to the client by its sender greenlet."""
+        if self._too_slow:
+            return
+
+        if len(self._send_queue) >= self._send_queue_size:
+            if self._slow_consumer_policy == "disconnect":
+                self._disconnect_slow_consumer()
+                return
+            self._drop_queued_message(key)
+
+        self._send_queue.append((key, broadcast))
+        self._wake_sender()
+
+    def _drop_queued_message(self, key):
+        """Make room in the full send queue for a new message with `key`."""
+        index = 0
+        if self._slow_consumer_policy == "coalesce" and key is not None:
+            for i, (queued_key, _) in enumerate(self._send_queue):
+                if queued_key == key:
+                    index = i
+                    break
+        del self._send_queue[index]
+        SEND_STATS["streamer.send_queue.dropped"] += 1
+
+    def _disconnect_slow_consumer(self):
+        """Discard the queued messages and have the sender close the socket."""
+        self._too_slow = True
+        self._send_queue.clear()
+        SEND_STATS["streamer.send_queue.slow_consumer_disconnected"] += 1
+        self._wake_sender()
+
+    def _wake_sender(self):
+        """Let the sender greenlet know it has work to do, starting it if needed."""
+        self._send_ready.set()
+        if self._sender is None:
+            self._sender = gevent.spawn(self._send_queued_messages)
+
+    def _send_queued_messages(self):
+        """Send the queued messages to the client until it goes away."""
+        while not self.terminated:
+            self._send_ready.wait()
+            self._send_ready.clear()
+
+            if self._too_slow:
+                self.close(SLOW_CONSUMER_CLOSE_CODE, "client too slow")
+                return
+
+            while self._send_queue and not self.terminated:
+                _, broadcast = self._send_queue.popleft()
+                try:
+                    self._write_frame(broadcast.frame(self.deflate))
+                except Exception:
+                    log.debug("failed to send message to websocket", exc_info=True)
+                    return
+
+    def _write_frame(self, frame):
+        """
+        Write the bytes of a frame to the socket.
+
+        The frame's bytes may be shared with other sockets, so they're written
+        through a memoryview to avoid copying what's left after a partial
+        write.
+        """
+        if self.terminated or self.sock is None:
+            raise RuntimeError("Cannot send on a terminated websocket")
+
+        with self._write_lock:
+            view = memoryview(frame)
+            while len(view):
+                view = view[self.sock.send(view) :]
+
+
+class Broadcast(object):
+    """
+    A JSON message to be sent to one or more websockets.
+
+    The websocket frame for the message is built the first time it's needed
+    and the same bytes are then written to every socket the message is sent
+    to. Sockets which compress messages with their own deflate context need a
+    frame of their own, but sockets compressing without context takeover share
+    a compressed frame.
+    """
+
+    def __init__(self, data, binary=False):
+        """
+        :param data: the JSON text of the message
+        :type data: bytes or unicode
+        :param binary: whether to send the message as binary rather than text
+        """
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.data = data
+        self.binary = binary
+        self._frames = {}
+
+    def frame(self, deflate=None):
+        """
+        Return the bytes of the frame to send to a socket.
+
+        :param deflate: the socket's negotiated
+            :py:class:`h.websocket.PerMessageDeflate`, if any
+        """
+        if deflate is not None and not deflate.no_context_takeover:
+            return build_frame(self.data, deflate, binary=self.binary)
+
+        key = None
+        if deflate is not None:
+            key = (deflate.window_bits, deflate.mem_level)
+
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = build_frame(
+                self.data, deflate, binary=self.binary
+            )
+        return frame
+
+
+def build_frame(payload, deflate=None, binary=False):
+    """
+    Return the bytes of an unfragmented frame for a message from the server.
+
+    :param deflate: the :py:class:`h.websocket.PerMessageDeflate` to compress
+        the message with, if any
+    """
+    if not isinstance(payload, bytes):
+        payload = payload.encode("utf-8")
+
+    opcode = OPCODE_BINARY if binary else OPCODE_TEXT
+    if deflate is None:
+        return Frame(opcode=opcode, body=payload, fin=1).build()
+    return Frame(opcode=opcode, body=deflate.compress(payload), fin=1, rsv1=1).build()
 
 
 def handle_message(message, session=None):
@@ -170,7 +576,12 @@ def handle_filter_message(message, session=None):
     if session is not None:
         # Add backend expands for clauses
         _expand_clauses(session, filter_)
+    if message.socket.filter is None:
+        # Annotation notifications are sent to the client from now on, so
+        # only earlier ones need replaying.
+        message.socket.subscribed_seq = WebSocket.replay.last_seq
     message.socket.filter = filter.FilterHandler(filter_)
+    WebSocket.subscriptions.update(message.socket)
 
 
 MESSAGE_HANDLERS["filter"] = handle_filter_message  # noqa: E305
@@ -192,6 +603,64 @@ def handle_whoami_message(message, session=None):
 MESSAGE_HANDLERS["whoami"] = handle_whoami_message  # noqa: E305
 
 
+def handle_replay_message(message, session=None):
+    """
+    A client asking for the annotation notifications it missed.
+
+    The client sends the ``stream`` and ``seq`` of the last notification it
+    received before reconnecting, after sending its filter. If the
+    notifications since then are still available they are sent, followed by a
+    reply. Otherwise an error is returned, and the client should fetch the
+    annotations again.
+    """
+    socket = message.socket
+    stream = message.payload.get("stream")
+    seq = message.payload.get("seq")
+
+    if not isinstance(seq, int) or isinstance(seq, bool):
+        message.reply(
+            {
+                "type": "error",
+                "error": {
+                    "type": "invalid_data",
+                    "description": '"seq" is missing or invalid',
+                },
+            },
+            ok=False,
+        )
+        return
+
+    replay = WebSocket.replay
+    entries = None
+    if socket.filter is not None and stream == replay.stream:
+        entries = replay.since(seq, until=socket.subscribed_seq)
+
+    if entries is None:
+        message.reply(
+            {
+                "type": "error",
+                "error": {
+                    "type": "replay_unavailable",
+                    "description": "missed notifications are not available",
+                },
+            },
+            ok=False,
+        )
+        return
+
+    for entry in entries:
+        if entry.recipient(socket):
+            socket.send_broadcast(entry.broadcast, key=entry.key)
+
+    # Replaying again must not resend the same notifications.
+    socket.subscribed_seq = seq
+
+    message.reply({"type": "replay", "stream": replay.stream})
+
+
+MESSAGE_HANDLERS["replay"] = handle_replay_message  # noqa: E305
+
+
 def handle_unknown_message(message, session=None):
     """Message type missing or not recognised."""
     type_ = json.dumps(message.payload.get("type"))
@@ -37,7 +37,9 @@ def publish_annotation_event(event):
         "annotation_id": event.annotation_id,
         "src_client_id": event.request.headers.get("X-Client-Id"),
     }
-    event.request.realtime.publish_annotation(data)
+    event.request.realtime.publish_annotation(
+        data, target_uri_normalized=event.target_uri_normalized
+    )
 
 
 def send_reply_notifications(
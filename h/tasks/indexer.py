@@ -1,12 +1,29 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import time
+
+from dateutil import parser
+
 from h import models, storage
 from h.celery import celery, get_task_logger
 from h.search.index import BatchIndexer, delete, index
 
 log = get_task_logger(__name__)
 
+# How long (in seconds) to wait before reindexing the root annotation of a
+# thread that's been replied to. The reindexes for further replies to the
+# thread in the meantime are coalesced into the one which is pending.
+THREAD_ROOT_DELAY = 2
+
+# The thread roots whose reindex this process has scheduled, and when each of
+# them is due to run.
+_pending_thread_roots = {}
+
+# The number of a group's annotation ids to load at a time when reindexing
+# the group's annotations.
+GROUP_REINDEX_PAGE_SIZE = 2000
+
 
 @celery.task
 def add_annotation(id_):
@@ -23,7 +40,7 @@ def add_annotation(id_):
             )
 
         if annotation.is_reply:
-            add_annotation.delay(annotation.thread_root_id)
+            reindex_thread_root(annotation.thread_root_id)
 
 
 @celery.task
@@ -50,6 +67,99 @@ def reindex_user_annotations(userid):
         log.warning("Failed to re-index annotations into ES6 %s", errored)
 
 
+@celery.task
+def reindex_group_annotations(groupid):
+    query = (
+        celery.request.db.query(models.Annotation.id)
+        .filter_by(groupid=groupid)
+        .order_by(models.Annotation.id)
+    )
+
+    indexer = BatchIndexer(celery.request.db, celery.request.es, celery.request)
+    errored = set()
+
+    # Load the ids a page at a time, as an open group may have a great many
+    # annotations.
+    last_id = None
+    while True:
+        page = query
+        if last_id is not None:
+            page = page.filter(models.Annotation.id > last_id)
+        ids = [a.id for a in page.limit(GROUP_REINDEX_PAGE_SIZE)]
+        if not ids:
+            break
+        errored.update(indexer.index(ids))
+        last_id = ids[-1]
+
+    if errored:
+        log.warning("Failed to re-index annotations into ES6 %s", errored)
+
+
+@celery.task
+def sync_annotations(since):
+    """
+    Reindex the annotations updated since a date, deleted ones included.
+
+    :param since: the date, as an ISO 8601 string
+    """
+    since = parser.parse(since)
+
+    indexer = BatchIndexer(celery.request.db, celery.request.es, celery.request)
+    errored = indexer.sync(since)
+    if errored:
+        log.warning("Failed to sync annotations into ES6 %s", errored)
+
+    # If a reindex is running at the moment, sync the new index as well.
+    future_index = _current_reindex_new_name(celery.request, "reindex.new_index")
+    if future_index is not None:
+        indexer = BatchIndexer(
+            celery.request.db,
+            celery.request.es,
+            celery.request,
+            target_index=future_index,
+        )
+        errored = indexer.sync(since)
+        if errored:
+            log.warning("Failed to sync annotations into new index %s", errored)
+
+
+def reindex_thread_root(root_id):
+    """
+    Schedule a reindex of the root annotation of a thread.
+
+    The reindex runs after :py:data:`THREAD_ROOT_DELAY` seconds, unless one
+    which this process has scheduled is pending already: it hasn't run yet,
+    so it will pick up the latest replies. A pending reindex is only relied on
+    until it's due, so one which gets lost holds up no others for longer than
+    that. Both the Celery worker and
+    :py:class:`h.indexer.consumer.BatchConsumer` hold the reindex's message
+    until it's due. The number of reindexes scheduled
+    and coalesced are reported to statsd as
+    ``indexer.thread_root.{scheduled,coalesced}``.
+
+    :param root_id: the id of the thread's root annotation
+    :returns: whether a reindex was scheduled
+    :rtype: bool
+    """
+    stats = celery.request.stats
+    now = time.time()
+
+    if _pending_thread_roots.get(root_id, 0) > now:
+        stats.incr("indexer.thread_root.coalesced")
+        return False
+
+    # Forget the reindexes which have run.
+    for id_, due in list(_pending_thread_roots.items()):
+        if due <= now:
+            del _pending_thread_roots[id_]
+
+    # Only count the reindex as pending once it's been scheduled.
+    add_annotation.apply_async((root_id,), countdown=THREAD_ROOT_DELAY)
+    _pending_thread_roots[root_id] = now + THREAD_ROOT_DELAY
+    stats.incr("indexer.thread_root.scheduled")
+    return True
+
+
 def _current_reindex_new_name(request, new_index_setting_name):
     settings = celery.request.find_service(name="settings")
     new_index = settings.get(new_index_setting_name)
@@ -19,6 +19,20 @@ def column_windows(session, column, windowsize=2000, where=None):
     Returns an iterable of SQLAlchemy expressions which can be used in a
     .filter(...) clause.
     """
+    for start, end in column_window_bounds(session, column, windowsize, where):
+        yield column_window(column, start, end)
+
+
+def column_window_bounds(session, column, windowsize=2000, where=None):
+    """
+    Return the bounds of the windows which break a given column up.
+
+    Takes the same arguments as :py:func:`column_windows`, and returns a list
+    of ``(start, end)`` tuples of values of the column. Unlike the clauses
+    returned by :py:func:`column_windows`, they can be pickled, for instance to
+    share the windows out between processes. Pass them to
+    :py:func:`column_window` to get the clause for a window.
+    """
 
     # This function is adapted from a recipe supplied by the SQLAlchemy
     # maintainers:
@@ -29,14 +43,8 @@ def column_windows(session, column, windowsize=2000, where=None):
     # on the server, and then turn that list into a subquery with
     # Query#from_self(). We then use the row number of the inner query to
     # select every `windowsize`'th row. The resulting values are then
-    # translated into an iterable of SQLAlchemy expressions suitable for use
-    # in Query#filter(...).
-
-    def interval_for_range(start_id, end_id):
-        if end_id:
-            return sa.and_(column >= start_id, column < end_id)
-        else:
-            return column >= start_id
+    # translated into the bounds of the windows, each window ending where the
+    # next one starts.
 
     q = session.query(
         column, sa.func.row_number().over(order_by=column).label("rownum")
@@ -53,10 +61,18 @@ def column_windows(session, column, windowsize=2000, where=None):
 
     intervals = [id for id, in q]
 
-    while intervals:
-        start = intervals.pop(0)
-        if intervals:
-            end = intervals[0]
-        else:
-            end = None
-        yield interval_for_range(start, end)
+    return list(zip(intervals, intervals[1:] + [None]))
+
+
+def column_window(column, start, end):
+    """
+    Return the WHERE clause for a window of a column.
+
+    :param column: the SQLAlchemy column object the window is of
+    :param start: the first value in the window
+    :param end: the value after the last one in the window, or None for the
+        last window
+    """
+    if end is not None:
+        return sa.and_(column >= start, column < end)
+    return column >= start
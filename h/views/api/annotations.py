@@ -17,6 +17,8 @@ authorization system. You can find the mapping between annotation "permissions"
 objects and Pyramid ACLs in :mod:`h.traversal`.
 """
 from __future__ import unicode_literals
+import json
+
 from pyramid import i18n
 import newrelic.agent
 
@@ -49,22 +51,57 @@ def search(request):
     _record_search_api_usage_metrics(params)
 
     separate_replies = params.pop("_separate_replies", False)
+    paginate_replies = params.pop("_paginate_replies", False)
 
     stats = getattr(request, "stats", None)
 
-    search = search_lib.Search(request, separate_replies=separate_replies, stats=stats)
+    search = search_lib.Search(
+        request,
+        separate_replies=separate_replies,
+        stats=stats,
+        paginate_replies=paginate_replies,
+    )
     result = search.run(params)
 
     svc = request.find_service(name="annotation_json_presentation")
 
     out = {"total": result.total, "rows": svc.present_all(result.annotation_ids)}
 
+    if result.cursor is not None:
+        out["cursor"] = result.cursor
+
     if separate_replies:
         out["replies"] = svc.present_all(result.reply_ids)
 
     return out
 
 
+@api_config(
+    route_name="api.search_export",
+    link_name="search_export",
+    description="Export all the annotations matching a search",
+)
+def search_export(request):
+    """
+    Stream all the annotations matching a search, as newline-delimited JSON.
+
+    The search takes the same params as :py:func:`search`, except for those
+    which select a page of results, and every matching annotation is returned
+    however many there are, one JSON object per line.
+    """
+    schema = SearchParamsSchema()
+    params = validate_query_params(schema, request.params)
+    params.pop("_separate_replies", None)
+    params.pop("_paginate_replies", None)
+
+    svc = request.find_service(name="annotation_export")
+    annotations = svc.export(params)
+
+    request.response.content_type = "application/x-ndjson"
+    request.response.app_iter = _ndjson(request, annotations)
+    return request.response
+
+
 @api_config(
     route_name="api.annotations",
     request_method="POST",
@@ -175,10 +212,22 @@ def _json_payload(request):
 
 def _publish_annotation_event(request, annotation, action):
     """Publish an event to the annotations queue for this annotation action."""
-    event = AnnotationEvent(request, annotation.id, action)
+    event = AnnotationEvent(
+        request, annotation.id, action, annotation.target_uri_normalized
+    )
     request.notify_after_commit(event)
 
 
+def _ndjson(request, annotations):
+    try:
+        for annotation in annotations:
+            yield json.dumps(annotation).encode("utf-8") + b"\n"
+    finally:
+        # The response is streamed after the request's database session has
+        # been closed, so close the session again once the export is done.
+        request.db.close()
+
+
 def _annotation_resource(request, annotation):
     group_service = request.find_service(IGroupService)
     links_service = request.find_service(name="links")
@@ -193,6 +242,7 @@ def _record_search_api_usage_metrics(
         # Record usage of inefficient offset and it's alternative search_after.
         "offset",
         "search_after",
+        "cursor",
         "sort",
         # Record usage of url/uri (url is an alias of uri).
         "url",
@@ -20,7 +20,12 @@ def create(context, request):
     svc = request.find_service(name="annotation_moderation")
     svc.hide(context.annotation)
 
-    event = events.AnnotationEvent(request, context.annotation.id, "update")
+    event = events.AnnotationEvent(
+        request,
+        context.annotation.id,
+        "update",
+        context.annotation.target_uri_normalized,
+    )
     request.notify_after_commit(event)
 
     return HTTPNoContent()
@@ -38,7 +43,12 @@ def delete(context, request):
     svc = request.find_service(name="annotation_moderation")
     svc.unhide(context.annotation)
 
-    event = events.AnnotationEvent(request, context.annotation.id, "update")
+    event = events.AnnotationEvent(
+        request,
+        context.annotation.id,
+        "update",
+        context.annotation.target_uri_normalized,
+    )
     request.notify_after_commit(event)
 
     return HTTPNoContent()
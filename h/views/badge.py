@@ -48,9 +48,8 @@ def badge(request):
     elif models.Blocklist.is_blocked(request.db, uri):
         count = 0
     else:
-        query = MultiDict({"uri": uri, "limit": 0})
+        query = MultiDict({"uri": uri})
         s = search.Search(request, stats=request.stats)
-        result = s.run(query)
-        count = result.total
+        count = s.count(query)
 
     return {"total": count}
@@ -31,22 +31,335 @@ the (apparently unmaintained) ws4py code, and these are documented below:
 
    - https://github.com/Lawouach/WebSocket-for-Python/issues/132
 
+3. Add support for the permessage-deflate extension (RFC 7692), which ws4py
+   doesn't implement. The extension is negotiated by
+   WebSocketWSGIApplication, outgoing messages are compressed by the
+   websocket handler using PerMessageDeflate, and ws4py's frame parser is
+   replaced with DeflateFrame so that compressed incoming messages are
+   inflated before ws4py sees them.
+
 N.B. Portions of the ws4py code are used here under the terms of the MIT
 license distributed with the ws4py project. Such code remains copyright (c)
 2011-2015, Sylvain Hellegouarch.
 """
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
 import logging
+import zlib
 
+from gevent.local import local
 from gevent.pool import Pool
 from gunicorn.workers.ggevent import GeventPyWSGIWorker, PyWSGIHandler, PyWSGIServer
 from ws4py import format_addresses
+from ws4py import streaming
+from ws4py.exc import FrameTooLargeException, ProtocolException
+from ws4py.framing import Frame, OPCODE_CONTINUATION
+from ws4py.server.wsgiutils import WebSocketWSGIApplication as _WebSocketWSGIApplication
 
 from h.config import configure
 
 log = logging.getLogger(__name__)
 
+# The trailer which permessage-deflate strips from, and adds back to, each
+# compressed message (RFC 7692, section 7.2.1).
+DEFLATE_TRAILER = b"\x00\x00\xff\xff"
+
+# The default deflate parameters for permessage-deflate. These bound the memory
+# used to compress each connection's messages to about 32KB (see
+# PerMessageDeflate.memory_usage).
+DEFAULT_DEFLATE_WINDOW_BITS = 12
+DEFAULT_DEFLATE_MEM_LEVEL = 5
+
+# The largest incoming message we're prepared to inflate, in bytes.
+MAX_INFLATED_MESSAGE_SIZE = 1024 * 1024
+
+# The permessage-deflate state of the websocket whose incoming bytes are being
+# parsed, if any. See DeflateFrame.
+_parse_state = local()
+
+
+class PerMessageDeflate(object):
+
+    """
+    The state of a websocket connection's permessage-deflate extension.
+
+    Messages sent to the client are compressed with a raw deflate stream
+    which, unless `no_context_takeover` is set, is kept for the lifetime of the
+    connection so that repeated content (such as the keys of annotation
+    notifications) compresses well across messages. The memory that stream
+    uses is bounded by `window_bits` and `mem_level`, and reported by
+    :py:attr:`memory_usage`.
+
+    Messages from the client are always compressed without context takeover,
+    so no inflate state is kept between them.
+    """
+
+    name = "permessage-deflate"
+
+    # Whether the client asked us to limit our window size, in which case the
+    # response must say which size we're using.
+    offered_window_bits = False
+
+    def __init__(
+        self,
+        window_bits=DEFAULT_DEFLATE_WINDOW_BITS,
+        mem_level=DEFAULT_DEFLATE_MEM_LEVEL,
+        no_context_takeover=False,
+    ):
+        self.window_bits = window_bits
+        self.mem_level = mem_level
+        self.no_context_takeover = no_context_takeover
+
+        self._compressor = None
+        self._decompressor = None
+
+    @classmethod
+    def negotiate(
+        cls,
+        header,
+        window_bits=DEFAULT_DEFLATE_WINDOW_BITS,
+        mem_level=DEFAULT_DEFLATE_MEM_LEVEL,
+        no_context_takeover=False,
+    ):
+        """
+        Accept the first acceptable permessage-deflate offer in `header`.
+
+        :param header: the value of the request's Sec-WebSocket-Extensions
+            header, or None
+        :returns: a :py:class:`PerMessageDeflate` configured according to the
+            offer, or None if there was no acceptable offer
+        """
+        if not header:
+            return None
+
+        for offer in header.split(","):
+            params = [param.strip() for param in offer.split(";")]
+            if params[0] != cls.name:
+                continue
+            deflate = cls._accept(
+                params[1:], window_bits, mem_level, no_context_takeover
+            )
+            if deflate is not None:
+                return deflate
+
+        return None
+
+    @classmethod
+    def _accept(cls, params, window_bits, mem_level, no_context_takeover):
+        """Return a PerMessageDeflate for an offer's params, or None."""
+        offered = {}
+        for param in params:
+            name, _, value = param.partition("=")
+            name = name.strip()
+            value = value.strip().strip('"')
+            if name in offered:
+                return None
+            offered[name] = value
+
+        for name in offered:
+            if name not in (
+                "server_no_context_takeover",
+                "client_no_context_takeover",
+                "server_max_window_bits",
+                "client_max_window_bits",
+            ):
+                return None
+
+        deflate = cls(
+            window_bits=window_bits,
+            mem_level=mem_level,
+            no_context_takeover=no_context_takeover,
+        )
+
+        if "server_no_context_takeover" in offered:
+            deflate.no_context_takeover = True
+
+        if "server_max_window_bits" in offered:
+            try:
+                max_window_bits = int(offered["server_max_window_bits"])
+            except ValueError:
+                return None
+            # zlib can't produce raw deflate streams with an 8 bit window.
+            if not 9 <= max_window_bits <= 15:
+                return None
+            deflate.window_bits = min(deflate.window_bits, max_window_bits)
+            deflate.offered_window_bits = True
+
+        return deflate
+
+    @property
+    def response_header(self):
+        """The Sec-WebSocket-Extensions value accepting this extension."""
+        params = [self.name, "client_no_context_takeover"]
+        if self.no_context_takeover:
+            params.append("server_no_context_takeover")
+        if self.offered_window_bits:
+            params.append("server_max_window_bits={}".format(self.window_bits))
+        return "; ".join(params)
+
+    @property
+    def memory_usage(self):
+        """
+        The approximate number of bytes used by the connection's deflate state.
+
+        This is zlib's documented memory use for a deflate stream, which is
+        only kept between messages when context takeover is allowed.
+        """
+        if self._compressor is None:
+            return 0
+        return (1 << (self.window_bits + 2)) + (1 << (self.mem_level + 9))
+
+    def compress(self, data):
+        """Return the compressed payload of a message with payload `data`."""
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                -self.window_bits,
+                self.mem_level,
+            )
+
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if not self.no_context_takeover:
+            self._compressor = compressor
+
+        if compressed.endswith(DEFLATE_TRAILER):
+            compressed = compressed[: -len(DEFLATE_TRAILER)]
+        return compressed
+
+    def decompress(self, data, start=False, end=False):
+        """
+        Return the inflated payload of a frame of a compressed message.
+
+        :param start: whether this is the first frame of the message
+        :param end: whether this is the last frame of the message
+        """
+        if start:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        if self._decompressor is None:
+            raise ProtocolException()
+
+        if end:
+            data += DEFLATE_TRAILER
+
+        try:
+            inflated = self._decompressor.decompress(data, MAX_INFLATED_MESSAGE_SIZE)
+        except zlib.error:
+            raise ProtocolException()
+        if self._decompressor.unconsumed_tail:
+            raise FrameTooLargeException()
+
+        if end:
+            self._decompressor = None
+        return inflated
+
+    @property
+    def decompressing(self):
+        """Whether a compressed message from the client is being received."""
+        return self._decompressor is not None
+
+
+class DeflateFrame(Frame):
+
+    """
+    A ws4py frame which understands permessage-deflate compression.
+
+    ws4py rejects frames with the RSV1 bit set, which marks the first frame of
+    a compressed message. When the websocket whose bytes are being parsed has
+    negotiated permessage-deflate, this clears the bit before ws4py's parser
+    sees it and, once the frame has been parsed, replaces its payload with the
+    inflated one.
+    """
+
+    def _parsing(self):
+        deflate = getattr(_parse_state, "deflate", None)
+        parser = super(DeflateFrame, self)._parsing()
+        compressed = False
+        header_seen = False
+
+        size = next(parser)
+        while True:
+            some_bytes = yield size
+            if some_bytes and not header_seen:
+                header_seen = True
+                first_byte = bytearray(some_bytes[:1])[0]
+                if deflate is not None and first_byte & 0x40:
+                    compressed = True
+                    some_bytes = bytes(bytearray([first_byte & ~0x40])) + some_bytes[1:]
+            try:
+                size = parser.send(some_bytes)
+            except StopIteration:
+                break
+
+        if deflate is None:
+            return
+
+        if compressed and self.opcode > 0x7:
+            # Control frames can't be compressed.
+            raise ProtocolException()
+
+        if self.opcode == OPCODE_CONTINUATION:
+            inflate = deflate.decompressing
+        else:
+            inflate = compressed
+
+        if inflate:
+            body = self.body
+            if self.masking_key:
+                body = bytes(self.unmask(body))
+            body = deflate.decompress(body, start=compressed, end=self.fin == 1)
+            if self.masking_key:
+                body = bytes(self.mask(body))
+            self.body = body
+            self.payload_length = len(body)
+
+
+# ws4py's stream parser creates its frames from this module attribute.
+streaming.Frame = DeflateFrame
+
+
+@contextmanager
+def parsing_with(deflate):
+    """Parse incoming bytes with the given :py:class:`PerMessageDeflate`."""
+    _parse_state.deflate = deflate
+    try:
+        yield
+    finally:
+        _parse_state.deflate = None
+
+
+class WebSocketWSGIApplication(_WebSocketWSGIApplication):
+
+    """
+    ws4py's WSGI application, with permessage-deflate negotiation.
+
+    If `deflate` options are given and the client offers permessage-deflate
+    then the negotiated :py:class:`PerMessageDeflate` is passed to the
+    websocket handler in the `h.ws.deflate` environ key.
+    """
+
+    def __init__(self, deflate=None, **kwargs):
+        super(WebSocketWSGIApplication, self).__init__(**kwargs)
+        self.deflate = deflate
+
+    def __call__(self, environ, start_response):
+        deflate = None
+        if self.deflate is not None:
+            deflate = PerMessageDeflate.negotiate(
+                environ.get("HTTP_SEC_WEBSOCKET_EXTENSIONS"), **self.deflate
+            )
+        environ["h.ws.deflate"] = deflate
+
+        def _start_response(status, headers, exc_info=None):
+            if deflate is not None:
+                headers.append(("Sec-WebSocket-Extensions", deflate.response_header))
+            return start_response(status, headers, exc_info)
+
+        return super(WebSocketWSGIApplication, self).__call__(environ, _start_response)
+
 
 class WebSocketWSGIHandler(PyWSGIHandler):
 
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load-test the streamer with simulated websocket clients.
+
+This runs the streamer's realtime consumer and work queue consumers
+(:py:func:`h.streamer.streamer.process_work_queue`) against kombu's in-memory
+transport, with thousands of :py:class:`h.streamer.websocket.WebSocket`
+instances connected to fake sockets. The clients watch pages chosen with a
+skewed popularity, as sidebars do, and annotation events are published for
+those pages at a steady rate.
+
+It reports the rate at which events were handled and delivered, the latency
+from publishing an event to writing it to a client's socket, the depth of the
+streamer's queues and the memory used by each connection.
+
+The database and annotation presentation are replaced with in-memory stand-ins,
+so the numbers measure the streamer's routing, matching and sending rather
+than Postgres. No RabbitMQ or browsers are needed. Run it from the root of the
+repository:
+
+    python scripts/benchmark_streamer.py --clients 5000 --rate 200 --duration 10
+"""
+from __future__ import division, print_function, unicode_literals
+
+from gevent import monkey
+
+monkey.patch_all()  # noqa: E402
+
+import argparse  # noqa: E402
+import bisect  # noqa: E402
+import gc  # noqa: E402
+import os  # noqa: E402
+import random  # noqa: E402
+import resource  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+import gevent.queue  # noqa: E402
+import kombu  # noqa: E402
+from pyramid import security  # noqa: E402
+from pyramid.registry import Registry  # noqa: E402
+from sqlalchemy import orm  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from h import realtime  # noqa: E402
+from h.streamer import messages, streamer, websocket  # noqa: E402
+from h.util.uri import normalize as normalize_uri  # noqa: E402
+
+# Annotation ids are of this form, so that they can be found cheaply in the
+# frames written to the fake sockets.
+ID_PREFIX = b"bench-"
+ID_FORMAT = "bench-{:010d}"
+ID_LENGTH = len(ID_FORMAT.format(0))
+
+
+class Annotation(object):
+    """An in-memory annotation, standing in for the database model."""
+
+    def __init__(self, id_, userid, uri, groupid):
+        self.id = id_
+        self.userid = userid
+        self.serialized = {
+            "id": id_,
+            "user": userid,
+            "uri": uri,
+            "group": groupid,
+            "text": "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
+            "tags": ["benchmark"],
+            "permissions": {"read": ["group:{}".format(groupid)]},
+            "target": [{"source": uri, "selector": []}],
+            "document": {"title": ["A page"]},
+            "links": {},
+        }
+
+
+class Presenter(object):
+    """Stands in for :py:class:`h.presenters.AnnotationJSONPresenter`."""
+
+    def __init__(self, annotation):
+        self.annotation = annotation
+
+    def asdict(self):
+        return dict(self.annotation.serialized)
+
+
+class Presenters(object):
+    AnnotationJSONPresenter = Presenter
+
+
+class NipsaService(object):
+    def __init__(self, session):
+        pass
+
+    def flagged_userids(self, userids):
+        return set()
+
+
+class Session(orm.Session):
+    """
+    A database session which isn't connected to a database.
+
+    It's a real SQLAlchemy session, as the services the streamer creates
+    listen to its events, but it has no bind and its statements do nothing.
+    """
+
+    def __init__(self, settings=None):
+        super(Session, self).__init__()
+
+    def execute(self, *args, **kwargs):
+        pass
+
+
+class Request(object):
+    def __init__(self, registry):
+        self.registry = registry
+
+
+class FakeSocket(object):
+    """
+    The network socket of a simulated client.
+
+    Records the latency of each annotation notification written to it, from
+    when the event was published.
+    """
+
+    def __init__(self, published, latencies):
+        self.published = published
+        self.latencies = latencies
+
+    def send(self, data):
+        now = time.time()
+        head = data[:256].tobytes() if isinstance(data, memoryview) else data[:256]
+        start = head.find(ID_PREFIX)
+        if start != -1:
+            id_ = head[start : start + ID_LENGTH].decode("ascii")
+            published_at = self.published.get(id_)
+            if published_at is not None:
+                self.latencies.append(now - published_at)
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+
+class Pages(object):
+    """A set of pages whose popularity follows a Zipf-like distribution."""
+
+    def __init__(self, count, skew):
+        self.uris = ["https://example.com/articles/{}".format(i) for i in range(count)]
+        total = 0.0
+        self._cumulative = []
+        for rank in range(count):
+            total += 1.0 / (rank + 1) ** skew
+            self._cumulative.append(total)
+
+    def choose(self):
+        point = random.random() * self._cumulative[-1]
+        return self.uris[bisect.bisect(self._cumulative, point)]
+
+
+def rss():
+    """Return the resident memory of this process, in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # Elsewhere, make do with the peak resident memory (in KB on Linux,
+        # bytes on macOS).
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def install_stand_ins(annotations, broker_url, polling_interval):
+    """Replace the streamer's database and broker access for the benchmark."""
+
+    def fetch_annotations(session, ids):
+        return {id_: annotations[id_] for id_ in ids if id_ in annotations}
+
+    def get_connection(settings):
+        return kombu.Connection(
+            broker_url, transport_options={"polling_interval": polling_interval}
+        )
+
+    messages._fetch_annotations = fetch_annotations
+    messages.NipsaService = NipsaService
+    messages.AnnotationContext = lambda annotation, *args: annotation
+    messages.presenters = Presenters
+    realtime.get_connection = get_connection
+
+
+def count_handled_events(counter):
+    """Count the annotation events handled by the streamer."""
+    handle_annotation_events = messages.handle_annotation_events
+
+    def counting_handler(events, registry, session):
+        handle_annotation_events(events, registry, session)
+        counter[0] += len(events)
+
+    messages.handle_annotation_events = counting_handler
+
+
+def connect_clients(args, registry, work_queue, pages, published, latencies):
+    clients = []
+    for i in range(args.clients):
+        principals = [security.Everyone, "group:__world__"]
+        userid = None
+        if random.random() < args.authenticated:
+            userid = "acct:user{}@example.com".format(i)
+            principals += [security.Authenticated, userid]
+            principals.append("group:group{}".format(random.randrange(args.groups)))
+
+        environ = {
+            "h.ws.authenticated_userid": userid,
+            "h.ws.effective_principals": principals,
+            "h.ws.registry": registry,
+            "h.ws.streamer_work_queue": work_queue,
+        }
+        client = websocket.WebSocket(
+            FakeSocket(published, latencies), environ=environ
+        )
+        client.client_id = "client-{}".format(i)
+
+        # The client's filter, as sent by the Hypothesis client in a sidebar
+        uri = pages.choose()
+        filter_ = {
+            "match_policy": "include_any",
+            "actions": {"create": True, "update": True, "delete": True},
+            "clauses": [
+                {"field": "/uri", "operator": "one_of", "value": [uri, uri + "/"]}
+            ],
+        }
+        websocket.handle_filter_message(
+            websocket.Message(socket=client, payload={"filter": filter_})
+        )
+        clients.append(client)
+    return clients
+
+
+def start_streamer(args, registry, work_queue):
+    settings = registry.settings
+    consumer_queues = [
+        gevent.queue.Queue(maxsize=max(work_queue.maxsize // args.consumers, 1))
+        for _ in range(args.consumers)
+    ]
+    greenlets = [
+        gevent.spawn(
+            messages.process_messages,
+            settings,
+            streamer.ANNOTATION_TOPIC,
+            work_queue,
+        ),
+        gevent.spawn(streamer.distribute_work, work_queue, consumer_queues),
+    ]
+    for consumer_id, consumer_queue in enumerate(consumer_queues):
+        greenlets.append(
+            gevent.spawn(
+                streamer.process_work_queue,
+                registry,
+                consumer_queue,
+                session_factory=Session,
+                consumer_id=consumer_id,
+            )
+        )
+    return greenlets, consumer_queues
+
+
+def publish_events(args, registry, pages, annotations, published):
+    publisher = realtime.Publisher(Request(registry))
+    interval = 1.0 / args.rate
+    total = int(args.rate * args.duration)
+    started = time.time()
+
+    for i in range(total):
+        uri = pages.choose()
+        groupid = "__world__"
+        if random.random() < args.private:
+            groupid = "group{}".format(random.randrange(args.groups))
+        id_ = ID_FORMAT.format(i)
+        userid = "acct:author{}@example.com".format(random.randrange(1000))
+        annotations[id_] = Annotation(id_, userid, uri, groupid)
+
+        published[id_] = time.time()
+        publisher.publish_annotation(
+            {"action": "create", "annotation_id": id_, "src_client_id": None},
+            target_uri_normalized=normalize_uri(uri),
+        )
+
+        delay = started + (i + 1) * interval - time.time()
+        if delay > 0:
+            gevent.sleep(delay)
+        else:
+            gevent.sleep(0)
+
+    return total
+
+
+def sample_queues(work_queue, consumer_queues, clients, samples, stop):
+    while not stop:
+        depth = work_queue.qsize() + sum(q.qsize() for q in consumer_queues)
+        send_depth = max(len(c._send_queue) for c in clients) if clients else 0
+        samples.append((depth, send_depth))
+        gevent.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the streamer with simulated websocket clients"
+    )
+    parser.add_argument(
+        "--clients", type=int, default=2000, help="number of websocket clients"
+    )
+    parser.add_argument(
+        "--pages", type=int, default=500, help="number of pages clients watch"
+    )
+    parser.add_argument(
+        "--skew",
+        type=float,
+        default=1.0,
+        help="Zipf exponent of page popularity (0 for uniform)",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=100, help="annotation events per second"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds to publish events for"
+    )
+    parser.add_argument(
+        "--consumers", type=int, default=4, help="work queue consumer greenlets"
+    )
+    parser.add_argument(
+        "--authenticated",
+        type=float,
+        default=0.3,
+        help="fraction of clients which are logged in",
+    )
+    parser.add_argument(
+        "--private",
+        type=float,
+        default=0.1,
+        help="fraction of annotations in private groups",
+    )
+    parser.add_argument(
+        "--groups", type=int, default=50, help="number of private groups"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=0, help="realtime shards (0 to disable)"
+    )
+    parser.add_argument(
+        "--send-queue-size",
+        type=int,
+        default=websocket.DEFAULT_SEND_QUEUE_SIZE,
+        help="maximum messages waiting to be sent to each client",
+    )
+    parser.add_argument(
+        "--polling-interval",
+        type=float,
+        default=0.001,
+        help="how often the in-memory broker is polled when idle, in seconds",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30,
+        help="seconds to wait for queued events to be handled after publishing",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    registry = Registry("benchmark_streamer")
+    registry.settings = {
+        "h.app_url": "http://localhost:5000",
+        "h.authority": "example.com",
+        "h.realtime_shards": args.shards,
+        "h.streamer_send_queue_size": args.send_queue_size,
+    }
+
+    annotations = {}
+    published = {}
+    latencies = []
+    handled = [0]
+
+    install_stand_ins(annotations, "memory://", args.polling_interval)
+    count_handled_events(handled)
+
+    pages = Pages(args.pages, args.skew)
+    work_queue = gevent.queue.Queue(maxsize=4096)
+
+    gc.collect()
+    rss_before = rss()
+    clients = connect_clients(args, registry, work_queue, pages, published, latencies)
+    gc.collect()
+    rss_connected = rss()
+
+    greenlets, consumer_queues = start_streamer(args, registry, work_queue)
+    # Give the realtime consumer time to declare and bind its queue.
+    gevent.sleep(1)
+
+    samples = []
+    stop = []
+    sampler = gevent.spawn(
+        sample_queues, work_queue, consumer_queues, clients, samples, stop
+    )
+
+    started = time.time()
+    total = publish_events(args, registry, pages, annotations, published)
+    published_in = time.time() - started
+
+    deadline = time.time() + args.drain_timeout
+    while handled[0] < total and time.time() < deadline:
+        gevent.sleep(0.01)
+    handled_in = time.time() - started
+
+    # Let the clients' sender greenlets write what's left in their queues.
+    while any(c._send_queue for c in clients) and time.time() < deadline:
+        gevent.sleep(0.01)
+    delivered_in = time.time() - started
+
+    stop.append(True)
+    sampler.join()
+    gevent.killall(greenlets)
+
+    # Leave out the benchmark's own record of the events.
+    annotations.clear()
+    published.clear()
+    gc.collect()
+    rss_after = rss()
+
+    latencies.sort()
+    depths = [depth for depth, _ in samples] or [0]
+    send_depths = [send_depth for _, send_depth in samples] or [0]
+    dropped = websocket.SEND_STATS.get("streamer.send_queue.dropped", 0)
+
+    print("clients                      {:>12,}".format(len(clients)))
+    print(
+        "events published             {:>12,} in {:.2f}s".format(total, published_in)
+    )
+    print("events handled               {:>12,}".format(handled[0]))
+    print(
+        "events/s                     {:>12,.0f}".format(handled[0] / handled_in)
+    )
+    print("notifications delivered      {:>12,}".format(len(latencies)))
+    print(
+        "notifications/s              {:>12,.0f}".format(len(latencies) / delivered_in)
+    )
+    print("notifications dropped        {:>12,}".format(dropped))
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1)):
+        print(
+            "fan-out latency {:<12} {:>12.1f} ms".format(
+                name, percentile(latencies, fraction) * 1000
+            )
+        )
+    print(
+        "work queue depth mean/max    {:>12.1f} / {}".format(
+            sum(depths) / len(depths), max(depths)
+        )
+    )
+    print("send queue depth max         {:>12,}".format(max(send_depths)))
+    print(
+        "memory/connection idle       {:>12,.0f} bytes".format(
+            (rss_connected - rss_before) / max(len(clients), 1)
+        )
+    )
+    print(
+        "memory/connection after run  {:>12,.0f} bytes".format(
+            (rss_after - rss_before) / max(len(clients), 1)
+        )
+    )
+
+    # The numbers above mean nothing if the streamer failed to handle the
+    # events.
+    if not handled[0]:
+        sys.exit("error: no events were handled, see the errors logged above")
+
+
+if __name__ == "__main__":
+    main()
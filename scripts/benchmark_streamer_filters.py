@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure how fast streamer filters can be evaluated against an annotation.
+
+This simulates the streamer checking one annotation event against the filters
+of many connected clients, each of which is watching a page with a few
+equivalent URIs, and prints the number of filter evaluations per second.
+
+Run it from the root of the repository:
+
+    python scripts/benchmark_streamer_filters.py --filters 5000
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from h.streamer import filter as streamer_filter  # noqa: E402
+
+
+def make_filter(i):
+    uris = [
+        "https://example.com/articles/{}".format(i),
+        "http://example.com/articles/{}/".format(i),
+        "urn:x-pdf:{:032x}".format(i),
+    ]
+    return {
+        "match_policy": "include_any",
+        "actions": {"create": True, "update": True, "delete": True},
+        "clauses": [
+            {"field": "/uri", "operator": "one_of", "value": uris},
+            {
+                "field": "/references",
+                "operator": "one_of",
+                "value": ["ref{}".format(i)],
+            },
+        ],
+    }
+
+
+def make_annotation():
+    return {
+        "id": "AVLlVTs1f9G3pW-EYc6q",
+        "uri": "HTTPS://Example.com/articles/42?",
+        "references": ["AVLlVTs1f9G3pW-EYc6a", "AVLlVTs1f9G3pW-EYc6b"],
+        "tags": ["Foo", "Bär"],
+        "user": "acct:someone@example.com",
+        "group": "__world__",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark matching annotations against streamer filters"
+    )
+    parser.add_argument(
+        "--filters", type=int, default=2000, help="number of client filters"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of times to time each case"
+    )
+    args = parser.parse_args()
+
+    handlers = [
+        streamer_filter.FilterHandler(make_filter(i)) for i in range(args.filters)
+    ]
+    annotation = make_annotation()
+
+    def per_socket():
+        # The annotation is normalized again for every filter.
+        for handler in handlers:
+            handler.match(annotation)
+
+    cases = [("annotation normalized per filter", per_socket)]
+
+    normalized_target = getattr(streamer_filter, "NormalizedTarget", None)
+    if normalized_target is not None:
+
+        def per_event():
+            # The annotation is normalized once and shared by every filter.
+            target = normalized_target(annotation)
+            for handler in handlers:
+                handler.match(target)
+
+        cases.append(("annotation normalized per event", per_event))
+
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print("{:<36} {:>12,.0f} evaluations/s".format(name, len(handlers) / best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import re
+import subprocess
+import sys
+
+SCRIPT = os.path.join(
+    os.path.dirname(__file__), "..", "..", "scripts", "benchmark_streamer.py"
+)
+
+
+class TestBenchmarkStreamer(object):
+    def test_the_streamer_handles_the_events(self):
+        # The benchmark monkey-patches the standard library with gevent, so
+        # it's run in a process of its own.
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                SCRIPT,
+                "--clients",
+                "100",
+                "--rate",
+                "50",
+                "--duration",
+                "1",
+            ],
+            stderr=subprocess.STDOUT,
+        ).decode("utf-8")
+
+        assert "Traceback" not in output
+        handled = re.search(r"events handled\s+([\d,]+)", output)
+        assert handled is not None, output
+        assert int(handled.group(1).replace(",", "")) > 0
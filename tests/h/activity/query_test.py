@@ -362,6 +362,21 @@ class TestExecute(object):
 
         assert search.run.call_args[0][0]["foo"] == "bar"
 
+    def test_it_passes_the_cursor_to_the_search(self, pyramid_request, search):
+        pyramid_request.params["page"] = "2"
+        pyramid_request.params["cursor"] = "abc123"
+
+        execute(pyramid_request, MultiDict(), self.PAGE_SIZE)
+
+        assert search.run.call_args[0][0]["cursor"] == "abc123"
+
+    def test_it_returns_the_cursor_to_the_next_page(self, pyramid_request, search):
+        search.run.return_value.cursor = "abc123"
+
+        result = execute(pyramid_request, MultiDict(), self.PAGE_SIZE)
+
+        assert result.cursor == "abc123"
+
     def test_it_returns_the_search_result_if_there_are_no_matches(
         self, pyramid_request, search
     ):
@@ -603,8 +618,9 @@ class TestExecute(object):
     def search(self, annotations):
         search = mock.Mock(spec_set=["append_modifier", "append_aggregation", "run"])
         search.run.return_value = mock.Mock(
-            spec_set=["total", "aggregations", "annotation_ids"]
+            spec_set=["total", "aggregations", "annotation_ids", "cursor"]
         )
+        search.run.return_value.cursor = None
         search.run.return_value.total = 20
         search.run.return_value.aggregations = mock.sentinel.aggregations
         search.run.return_value.annotation_ids = [
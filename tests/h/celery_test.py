@@ -20,6 +20,19 @@ class TestCelery(object):
     def register_logger_signal(self, request):
         return _patch("h.celery.register_logger_signal", request)
 
+    @pytest.mark.parametrize(
+        "task",
+        [
+            "h.tasks.indexer.add_annotation",
+            "h.tasks.indexer.delete_annotation",
+            "h.tasks.indexer.reindex_user_annotations",
+            "h.tasks.indexer.reindex_group_annotations",
+            "h.tasks.indexer.sync_annotations",
+        ],
+    )
+    def test_indexer_tasks_are_routed_to_the_indexer_queue(self, task):
+        assert celery.celery.conf.task_routes[task] == "indexer"
+
     def test_bootstrap_worker_bootstraps_application(self):
         sender = mock.Mock(spec=["app"])
 
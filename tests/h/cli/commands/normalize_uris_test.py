@@ -34,6 +34,27 @@ def test_it_normalizes_document_uris_uri(req):
     assert docuri_2.uri_normalized == "httpx://example.org"
 
 
+def test_it_invalidates_the_cached_document_uris(req, patch):
+    cache = patch("h.cli.commands.normalize_uris.DOCUMENT_URI_CACHE")
+    docuri = models.DocumentURI(
+        _claimant="http://example.org/",
+        _claimant_normalized="http://example.org",
+        _uri="http://example.org/",
+        _uri_normalized="http://example.org",
+        type="self-claim",
+    )
+    req.db.add(models.Document(document_uris=[docuri]))
+    req.db.flush()
+
+    normalize_uris.normalize_document_uris(req)
+
+    cache.invalidate.assert_called_once_with(
+        ["http://example.org", "httpx://example.org"],
+        [docuri.document_id],
+        session=req.db,
+    )
+
+
 def test_it_normalizes_document_uris_claimant(req):
     docuri_1 = models.DocumentURI(
         _claimant="http://example.org/",
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import datetime
 import mock
 import os
 import pytest
@@ -19,15 +20,132 @@ class TestReindexCommand(object):
 
         assert result.exit_code == 0
         reindex.assert_called_once_with(
-            pyramid_request.db, pyramid_request.es, pyramid_request
+            pyramid_request.db,
+            pyramid_request.es,
+            pyramid_request,
+            workers=1,
+            bootstrap=cliconfig["bootstrap"],
+            resume=False,
         )
 
+    def test_passes_resume(self, cli, cliconfig, reindex):
+        result = cli.invoke(search.reindex, ["--resume"], obj=cliconfig)
+
+        assert result.exit_code == 0
+        assert reindex.call_args[1]["resume"] is True
+
+    def test_passes_the_number_of_workers(self, cli, cliconfig, reindex):
+        result = cli.invoke(search.reindex, ["--workers", "4"], obj=cliconfig)
+
+        assert result.exit_code == 0
+        assert reindex.call_args[1]["workers"] == 4
+
+    def test_rejects_less_than_one_worker(self, cli, cliconfig, reindex):
+        result = cli.invoke(search.reindex, ["--workers", "0"], obj=cliconfig)
+
+        assert result.exit_code == 2
+        assert not reindex.called
+
     @pytest.fixture
     def reindex(self, patch):
         index = patch("h.cli.commands.search.indexer")
         return index.reindex
 
 
+@pytest.mark.usefixtures("settings_service")
+class TestSyncCommand(object):
+    def test_it_syncs_the_annotations_updated_since_the_time(
+        self, cli, cliconfig, pyramid_request, BatchIndexer
+    ):
+        result = cli.invoke(
+            search.sync, ["--since", "2018-08-27T11:02:15"], obj=cliconfig
+        )
+
+        assert result.exit_code == 0
+        BatchIndexer.assert_called_once_with(
+            pyramid_request.db, pyramid_request.es, pyramid_request, target_index=None
+        )
+        BatchIndexer.return_value.sync.assert_called_once_with(
+            datetime.datetime(2018, 8, 27, 11, 2, 15)
+        )
+
+    def test_during_reindex_it_syncs_the_new_index(
+        self, cli, cliconfig, pyramid_request, BatchIndexer, settings_service
+    ):
+        settings_service.get.return_value = "hypothesis-xyz123"
+
+        cli.invoke(search.sync, ["--since", "2018-08-27"], obj=cliconfig)
+
+        BatchIndexer.assert_called_with(
+            pyramid_request.db,
+            pyramid_request.es,
+            pyramid_request,
+            target_index="hypothesis-xyz123",
+        )
+        assert BatchIndexer.return_value.sync.call_count == 2
+
+    def test_it_fails_if_annotations_fail_to_index(self, cli, cliconfig, BatchIndexer):
+        BatchIndexer.return_value.sync.return_value = {"abc123"}
+
+        result = cli.invoke(search.sync, ["--since", "2018-08-27"], obj=cliconfig)
+
+        assert result.exit_code == 1
+        assert "abc123" in result.output
+
+    def test_it_rejects_invalid_times(self, cli, cliconfig, BatchIndexer):
+        result = cli.invoke(search.sync, ["--since", "yesterday-ish"], obj=cliconfig)
+
+        assert result.exit_code == 2
+        assert not BatchIndexer.called
+
+    @pytest.fixture
+    def BatchIndexer(self, patch):
+        BatchIndexer = patch("h.cli.commands.search.BatchIndexer")
+        BatchIndexer.return_value.sync.return_value = set()
+        return BatchIndexer
+
+    @pytest.fixture
+    def settings_service(self, pyramid_config):
+        service = mock.Mock(spec_set=["get"])
+        service.get.return_value = None
+        pyramid_config.register_service(service, name="settings")
+        return service
+
+
+class TestWorkerCommand(object):
+    def test_it_runs_a_batch_consumer(self, cli, cliconfig, celery, BatchConsumer):
+        result = cli.invoke(
+            search.worker, ["--batch-size", "50", "--wait", "250"], obj=cliconfig
+        )
+
+        assert result.exit_code == 0
+        BatchConsumer.assert_called_once_with(
+            celery.connection_for_read.return_value, celery, batch_size=50, wait=0.25
+        )
+        BatchConsumer.return_value.run.assert_called_once_with()
+
+    def test_it_gives_the_tasks_the_request(
+        self, cli, cliconfig, celery, pyramid_request, BatchConsumer
+    ):
+        cli.invoke(search.worker, [], obj=cliconfig)
+
+        assert celery.request == pyramid_request
+
+    def test_it_defaults_the_batch_size_and_wait(self, cli, cliconfig, BatchConsumer):
+        cli.invoke(search.worker, [], obj=cliconfig)
+
+        _, kwargs = BatchConsumer.call_args
+        assert kwargs == {"batch_size": 100, "wait": 0.5}
+
+    @pytest.fixture
+    def celery(self, patch):
+        return patch("h.cli.commands.search.celery")
+
+    @pytest.fixture
+    def BatchConsumer(self, patch):
+        return patch("h.cli.commands.search.consumer.BatchConsumer")
+
+
 class TestUpdateSettingsCommand(object):
     def test_calls_update_index_settings(
         self, cli, cliconfig, pyramid_request, update_index_settings
@@ -50,6 +168,58 @@ class TestUpdateSettingsCommand(object):
         return patch("h.cli.commands.search.config.update_index_settings")
 
 
+class TestExportCommand(object):
+    def test_it_exports_the_annotations_matching_the_search(
+        self, cli, cliconfig, export_service
+    ):
+        result = cli.invoke(
+            search.export, ["group=abc123", "user=acct:foo@example.com"], obj=cliconfig
+        )
+
+        assert result.exit_code == 0
+        params = export_service.export.call_args[0][0]
+        assert params["group"] == "abc123"
+        assert params["user"] == "acct:foo@example.com"
+
+    def test_it_leaves_out_the_params_about_replies(
+        self, cli, cliconfig, export_service
+    ):
+        result = cli.invoke(
+            search.export, ["_separate_replies=1", "_paginate_replies=1"], obj=cliconfig
+        )
+
+        assert result.exit_code == 0
+        params = export_service.export.call_args[0][0]
+        assert "_separate_replies" not in params
+        assert "_paginate_replies" not in params
+
+    def test_it_writes_newline_delimited_json(self, cli, cliconfig, export_service):
+        export_service.export.return_value = iter([{"id": "foo"}, {"id": "bar"}])
+
+        result = cli.invoke(search.export, [], obj=cliconfig)
+
+        assert result.output == '{"id": "foo"}\n{"id": "bar"}\n'
+
+    def test_it_fails_if_a_param_isnt_a_key_and_value(self, cli, cliconfig):
+        result = cli.invoke(search.export, ["group"], obj=cliconfig)
+
+        assert result.exit_code == 2
+        assert "KEY=VALUE" in result.output
+
+    def test_it_fails_if_the_params_are_invalid(self, cli, cliconfig):
+        result = cli.invoke(search.export, ["sort=sideways"], obj=cliconfig)
+
+        assert result.exit_code == 1
+        assert "sort" in result.output
+
+    @pytest.fixture
+    def export_service(self, pyramid_config):
+        svc = mock.Mock(spec_set=["export"])
+        svc.export.return_value = iter([])
+        pyramid_config.register_service(svc, name="annotation_export")
+        return svc
+
+
 @pytest.fixture
 def cliconfig(pyramid_request):
     pyramid_request.es = mock.create_autospec(Client, spec_set=True, instance=True)
@@ -11,8 +11,21 @@ from h.config import configure
     [
         (None, None, "h.db_session_checks", True),
         ("DB_SESSION_CHECKS", "False", "h.db_session_checks", False),
+        ("GROUPIDS_CACHE_TTL", "30", "h.groupids_cache_ttl", 30),
         ("SECRET_KEY", "dont_tell_anyone", "secret_key", b"dont_tell_anyone"),
         ("SECRET_SALT", "best_with_pepper", "secret_salt", b"best_with_pepper"),
+        ("STREAMER_CONSUMERS", "8", "h.streamer_consumers", 8),
+        ("WEBSOCKET_DEFLATE", "true", "h.websocket_deflate", True),
+        ("WEBSOCKET_DEFLATE_WINDOW_BITS", "10", "h.websocket_deflate_window_bits", 10),
+        ("STREAMER_SEND_QUEUE_SIZE", "10", "h.streamer_send_queue_size", 10),
+        ("REALTIME_SHARDS", "16", "h.realtime_shards", 16),
+        ("STREAMER_REPLAY_BUFFER_SIZE", "50", "h.streamer_replay_buffer_size", 50),
+        (
+            "STREAMER_SLOW_CONSUMER_POLICY",
+            "disconnect",
+            "h.streamer_slow_consumer_policy",
+            "disconnect",
+        ),
         # There are many other settings that can be updated from env vars.
         # These are not currently tested.
     ],
@@ -153,6 +153,9 @@ def db_session(db_engine):
         trans.rollback()
         conn.close()
 
+        # Forget the documents' URIs cached from the rolled back transaction.
+        models.document.DOCUMENT_URI_CACHE.clear()
+
 
 @pytest.fixture
 def factories(db_session):
@@ -15,6 +15,13 @@ def test_annotation_event():
     assert evt.request == s.request
     assert evt.annotation_id == s.annotation_id
     assert evt.action == s.action
+    assert evt.target_uri_normalized is None
+
+
+def test_annotation_event_with_target_uri():
+    evt = AnnotationEvent(s.request, s.annotation_id, s.action, s.target_uri)
+
+    assert evt.target_uri_normalized == s.target_uri
 
 
 def test_annotation_transform_event():
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h.indexer.consumer import BatchConsumer
+from h.tasks import indexer as indexer_tasks
+from h.services.nipsa import NipsaService
+from h.services.settings import SettingsService
+
+ADD = "h.tasks.indexer.add_annotation"
+DELETE = "h.tasks.indexer.delete_annotation"
+
+
+@pytest.mark.usefixtures(
+    "BatchIndexer", "fetch_annotations", "nipsa_service", "settings_service"
+)
+class TestBatchConsumer(object):
+    def test_it_consumes_the_indexer_queue(self, batch_consumer, app):
+        consumer_factory = mock.Mock()
+
+        consumers = batch_consumer.get_consumers(consumer_factory, mock.Mock())
+
+        assert consumers == [consumer_factory.return_value]
+        consumer_factory.assert_called_once_with(
+            queues=[app.amqp.queues["indexer"]],
+            callbacks=[batch_consumer.handle_message],
+            accept=["json"],
+            prefetch_count=3,
+        )
+
+    def test_it_batches_messages_until_the_batch_is_full(
+        self, batch_consumer, batch_indexer
+    ):
+        messages = [message(ADD, "id-1"), message(ADD, "id-2")]
+        for body, msg in messages:
+            batch_consumer.handle_message(body, msg)
+
+        assert not batch_indexer.index_annotations.called
+        for _, msg in messages:
+            assert not msg.ack.called
+
+    def test_it_indexes_a_full_batch_with_one_request(
+        self, batch_consumer, batch_indexer, fetch_annotations, pyramid_request
+    ):
+        for id_ in ["id-1", "id-2", "id-3"]:
+            batch_consumer.handle_message(*message(ADD, id_))
+
+        fetch_annotations.assert_called_once_with(
+            pyramid_request.db, {"id-1", "id-2", "id-3"}
+        )
+        batch_indexer.index_annotations.assert_called_once_with(
+            fetch_annotations.return_value, chunk_size=3
+        )
+
+    def test_it_marks_deleted_annotations_as_deleted(
+        self, batch_consumer, batch_indexer
+    ):
+        batch_consumer.handle_message(*message(DELETE, "id-1"))
+        batch_consumer.handle_message(*message(ADD, "id-2"))
+        batch_consumer.handle_message(*message(DELETE, "id-3"))
+
+        batch_indexer.delete.assert_called_once_with({"id-1", "id-3"}, chunk_size=3)
+
+    def test_it_reads_the_id_from_the_kwargs(self, batch_consumer, fetch_annotations):
+        _, msg = message(ADD, "id-1")
+
+        batch_consumer.handle_message([[], {"id_": "id-1"}, {}], msg)
+        batch_consumer.flush()
+
+        assert fetch_annotations.call_args[0][1] == {"id-1"}
+
+    def test_it_reads_version_1_messages(self, batch_consumer, fetch_annotations):
+        msg = mock.Mock(headers={}, delivery_info={})
+        body = {"task": ADD, "args": ["id-1"], "kwargs": {}}
+
+        batch_consumer.handle_message(body, msg)
+        batch_consumer.flush()
+
+        assert fetch_annotations.call_args[0][1] == {"id-1"}
+
+    def test_it_acks_the_indexed_messages(self, batch_consumer):
+        messages = [message(ADD, "id-1"), message(DELETE, "id-2")]
+        for body, msg in messages:
+            batch_consumer.handle_message(body, msg)
+
+        batch_consumer.flush()
+
+        for _, msg in messages:
+            msg.ack.assert_called_once_with()
+
+    def test_it_requeues_the_messages_of_errored_annotations(
+        self, batch_consumer, batch_indexer
+    ):
+        batch_indexer.index_annotations.return_value = {"id-2"}
+        messages = [message(ADD, "id-1"), message(ADD, "id-2")]
+        for body, msg in messages:
+            batch_consumer.handle_message(body, msg)
+
+        batch_consumer.flush()
+
+        messages[0][1].ack.assert_called_once_with()
+        messages[1][1].requeue.assert_called_once_with()
+        assert not messages[1][1].ack.called
+
+    def test_it_acks_redelivered_messages_of_errored_annotations(
+        self, batch_consumer, batch_indexer
+    ):
+        batch_indexer.index_annotations.return_value = {"id-1"}
+        body, msg = message(ADD, "id-1", redelivered=True)
+        batch_consumer.handle_message(body, msg)
+
+        batch_consumer.flush()
+
+        msg.ack.assert_called_once_with()
+        assert not msg.requeue.called
+
+    def test_it_requeues_the_batch_if_indexing_raises(
+        self, batch_consumer, batch_indexer, pyramid_request
+    ):
+        batch_indexer.index_annotations.side_effect = RuntimeError("boom")
+        messages = [message(ADD, "id-1"), message(ADD, "id-2")]
+        for body, msg in messages:
+            batch_consumer.handle_message(body, msg)
+
+        batch_consumer.flush()
+
+        pyramid_request.tm.abort.assert_called_once_with()
+        for _, msg in messages:
+            msg.requeue.assert_called_once_with()
+
+    def test_it_commits_the_transaction(self, batch_consumer, pyramid_request):
+        batch_consumer.handle_message(*message(ADD, "id-1"))
+
+        batch_consumer.flush()
+
+        pyramid_request.tm.commit.assert_called_once_with()
+
+    def test_it_resets_the_nipsa_cache(self, batch_consumer, nipsa_service):
+        batch_consumer.handle_message(*message(ADD, "id-1"))
+
+        batch_consumer.flush()
+
+        nipsa_service.clear.assert_called_once_with()
+
+    def test_it_indexes_into_the_new_index_during_a_reindex(
+        self, batch_consumer, BatchIndexer, settings_service, pyramid_request
+    ):
+        settings_service.get.return_value = "hypothesis-xyz123"
+        batch_consumer.handle_message(*message(ADD, "id-1"))
+
+        batch_consumer.flush()
+
+        settings_service.get.assert_called_once_with("reindex.new_index")
+        assert BatchIndexer.call_args_list == [
+            mock.call(
+                pyramid_request.db,
+                pyramid_request.es,
+                pyramid_request,
+                target_index=None,
+            ),
+            mock.call(
+                pyramid_request.db,
+                pyramid_request.es,
+                pyramid_request,
+                target_index="hypothesis-xyz123",
+            ),
+        ]
+
+    def test_it_indexes_the_thread_roots_of_replies(
+        self, batch_consumer, fetch_annotations, reindex_thread_root
+    ):
+        fetch_annotations.return_value = [
+            mock.Mock(is_reply=False),
+            mock.Mock(is_reply=True, thread_root_id="root-id"),
+        ]
+        batch_consumer.handle_message(*message(ADD, "id-1"))
+
+        batch_consumer.flush()
+
+        reindex_thread_root.assert_called_once_with("root-id")
+
+    def test_it_coalesces_the_thread_roots_of_replies(
+        self, batch_consumer, fetch_annotations, reindex_thread_root, pyramid_request
+    ):
+        fetch_annotations.return_value = [
+            mock.Mock(is_reply=True, thread_root_id="root-id"),
+            mock.Mock(is_reply=True, thread_root_id="root-id"),
+            mock.Mock(is_reply=True, thread_root_id="id-3"),
+        ]
+        for id_ in ["id-1", "id-2", "id-3"]:
+            batch_consumer.handle_message(*message(ADD, id_))
+
+        reindex_thread_root.assert_called_once_with("root-id")
+        pyramid_request.stats.incr.assert_called_once_with(
+            "indexer.thread_root.coalesced", 2
+        )
+
+    def test_it_indexes_the_batch_once_it_has_waited(
+        self, batch_consumer, batch_indexer, time
+    ):
+        time.time.return_value = 100
+        batch_consumer.handle_message(*message(ADD, "id-1"))
+
+        time.time.return_value = 100.4
+        batch_consumer.on_iteration()
+        assert not batch_indexer.index_annotations.called
+
+        time.time.return_value = 100.5
+        batch_consumer.on_iteration()
+        assert batch_indexer.index_annotations.called
+
+    def test_it_does_nothing_when_there_is_no_batch(
+        self, batch_consumer, fetch_annotations
+    ):
+        batch_consumer.on_iteration()
+        batch_consumer.flush()
+
+        assert not fetch_annotations.called
+
+    def test_it_runs_other_tasks(self, batch_consumer, app):
+        body, msg = message("h.tasks.indexer.reindex_user_annotations", "acct:a@b")
+
+        batch_consumer.handle_message(body, msg)
+
+        task = app.tasks["h.tasks.indexer.reindex_user_annotations"]
+        task.apply.assert_called_once_with(args=["acct:a@b"], kwargs={})
+        msg.ack.assert_called_once_with()
+
+    def test_it_indexes_the_batch_before_running_other_tasks(
+        self, batch_consumer, batch_indexer
+    ):
+        batch_consumer.handle_message(*message(ADD, "id-1"))
+
+        batch_consumer.handle_message(
+            *message("h.tasks.indexer.reindex_user_annotations", "acct:a@b")
+        )
+
+        assert batch_indexer.index_annotations.called
+
+    def test_it_discards_unregistered_tasks(self, batch_consumer):
+        body, msg = message("h.tasks.unknown", "foo")
+
+        batch_consumer.handle_message(body, msg)
+
+        msg.ack.assert_called_once_with()
+
+    def test_it_holds_messages_until_their_eta(
+        self, batch_consumer, fetch_annotations, time
+    ):
+        time.time.return_value = 100
+        body, msg = message(ADD, "id-1", eta="1970-01-01T00:01:50+00:00")
+
+        batch_consumer.handle_message(body, msg)
+        batch_consumer.on_iteration()
+        batch_consumer.flush()
+        assert not fetch_annotations.called
+
+        time.time.return_value = 110
+        batch_consumer.on_iteration()
+        batch_consumer.flush()
+        assert fetch_annotations.call_args[0][1] == {"id-1"}
+        msg.ack.assert_called_once_with()
+
+    def test_it_takes_naive_etas_to_be_utc(
+        self, batch_consumer, fetch_annotations, time
+    ):
+        time.time.return_value = 100
+        body, msg = message(ADD, "id-1", eta="1970-01-01T00:01:50")
+
+        batch_consumer.handle_message(body, msg)
+        batch_consumer.flush()
+        assert not fetch_annotations.called
+
+        time.time.return_value = 110
+        batch_consumer.on_iteration()
+        batch_consumer.flush()
+        assert fetch_annotations.called
+
+    def test_it_reads_the_eta_of_version_1_messages(
+        self, batch_consumer, fetch_annotations, time
+    ):
+        time.time.return_value = 100
+        msg = mock.Mock(headers={}, delivery_info={})
+        body = {
+            "task": ADD,
+            "args": ["id-1"],
+            "kwargs": {},
+            "eta": "1970-01-01T00:01:50+00:00",
+        }
+
+        batch_consumer.handle_message(body, msg)
+        batch_consumer.flush()
+
+        assert not fetch_annotations.called
+
+    def test_it_handles_messages_whose_eta_has_passed(
+        self, batch_consumer, fetch_annotations, time
+    ):
+        time.time.return_value = 200
+        body, msg = message(ADD, "id-1", eta="1970-01-01T00:01:50+00:00")
+
+        batch_consumer.handle_message(body, msg)
+        batch_consumer.flush()
+
+        assert fetch_annotations.called
+
+    def test_it_makes_room_for_a_batch_besides_the_held_messages(
+        self, batch_consumer, time
+    ):
+        time.time.return_value = 100
+        consumer = mock.Mock(spec_set=["qos"])
+        batch_consumer.on_consume_ready(mock.Mock(), mock.Mock(), [consumer])
+
+        batch_consumer.handle_message(
+            *message(ADD, "id-1", eta="1970-01-01T00:01:50+00:00")
+        )
+        time.time.return_value = 110
+        batch_consumer.on_iteration()
+
+        assert consumer.qos.call_args_list == [
+            mock.call(prefetch_count=4),
+            mock.call(prefetch_count=3),
+        ]
+
+    def test_it_forgets_the_messages_of_an_earlier_channel(
+        self, batch_consumer, fetch_annotations, time
+    ):
+        time.time.return_value = 100
+        batch_consumer.handle_message(
+            *message(ADD, "id-1", eta="1970-01-01T00:01:50+00:00")
+        )
+        batch_consumer.handle_message(*message(ADD, "id-2"))
+
+        batch_consumer.on_consume_ready(mock.Mock(), mock.Mock(), [])
+        time.time.return_value = 110
+        batch_consumer.on_iteration()
+        batch_consumer.flush()
+
+        assert not fetch_annotations.called
+
+    def test_it_reindexes_a_thread_root_once_for_replies_in_several_batches(
+        self, batch_consumer, fetch_annotations, time, patch, pyramid_request
+    ):
+        # Run the thread root debounce for real, with the same clock.
+        tasks_time = patch("h.tasks.indexer.time")
+        tasks_time.time = time.time
+        patch("h.tasks.indexer.celery").request = pyramid_request
+        apply_async = patch("h.tasks.indexer.add_annotation.apply_async")
+        annotations = {
+            "reply-1": mock.Mock(is_reply=True, thread_root_id="root-id"),
+            "reply-2": mock.Mock(is_reply=True, thread_root_id="root-id"),
+            "root-id": mock.Mock(is_reply=False),
+        }
+        fetch_annotations.side_effect = lambda _, ids: [annotations[i] for i in ids]
+
+        time.time.return_value = 100
+        batch_consumer.handle_message(*message(ADD, "reply-1"))
+        batch_consumer.flush()
+        time.time.return_value = 101
+        batch_consumer.handle_message(*message(ADD, "reply-2"))
+        batch_consumer.flush()
+
+        # The one reindex of the root is held until it's due.
+        apply_async.assert_called_once_with(("root-id",), countdown=2)
+        batch_consumer.handle_message(
+            *message(ADD, "root-id", eta="1970-01-01T00:01:42+00:00")
+        )
+        batch_consumer.flush()
+        assert fetch_annotations.call_count == 2
+
+        time.time.return_value = 102
+        batch_consumer.on_iteration()
+        batch_consumer.flush()
+        assert fetch_annotations.call_args[0][1] == {"root-id"}
+        assert pyramid_request.stats.incr.call_args_list == [
+            mock.call("indexer.thread_root.scheduled"),
+            mock.call("indexer.thread_root.coalesced"),
+        ]
+
+    def test_run_wakes_up_in_time_to_index_the_batch(self, batch_consumer):
+        with mock.patch("kombu.mixins.ConsumerMixin.run") as run:
+            batch_consumer.run()
+
+        run.assert_called_once_with(safety_interval=0.5)
+
+    @pytest.fixture
+    def app(self, pyramid_request):
+        app = mock.Mock(spec_set=["amqp", "request", "tasks"])
+        app.amqp.queues = {"indexer": mock.sentinel.indexer_queue}
+        app.request = pyramid_request
+        app.tasks = {"h.tasks.indexer.reindex_user_annotations": mock.Mock()}
+        return app
+
+    @pytest.fixture
+    def batch_consumer(self, app):
+        return BatchConsumer(mock.sentinel.connection, app, batch_size=3, wait=0.5)
+
+    @pytest.fixture
+    def BatchIndexer(self, patch):
+        BatchIndexer = patch("h.indexer.consumer.BatchIndexer")
+        BatchIndexer.return_value.index_annotations.return_value = set()
+        BatchIndexer.return_value.delete.return_value = set()
+        return BatchIndexer
+
+    @pytest.fixture
+    def batch_indexer(self, BatchIndexer):
+        return BatchIndexer.return_value
+
+    @pytest.fixture
+    def fetch_annotations(self, patch):
+        return patch("h.indexer.consumer.fetch_annotations", return_value=[])
+
+    @pytest.fixture
+    def reindex_thread_root(self, patch):
+        return patch("h.indexer.consumer.indexer_tasks.reindex_thread_root")
+
+    @pytest.fixture
+    def time(self, patch):
+        return patch("h.indexer.consumer.time")
+
+    @pytest.fixture(autouse=True)
+    def pending_thread_roots(self):
+        with mock.patch.dict(indexer_tasks._pending_thread_roots, clear=True):
+            yield
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.es = mock.Mock()
+        pyramid_request.tm = mock.Mock(spec_set=["commit", "abort"])
+        pyramid_request.stats = mock.Mock(spec_set=["incr"])
+        return pyramid_request
+
+
+def message(task, id_, redelivered=False, eta=None):
+    """Return the body and message of a Celery task message."""
+    msg = mock.Mock(
+        headers={"task": task, "eta": eta}, delivery_info={"redelivered": redelivered}
+    )
+    return ([[id_], {}, {}], msg)
+
+
+@pytest.fixture
+def nipsa_service(pyramid_config):
+    service = mock.create_autospec(NipsaService, spec_set=True, instance=True)
+    pyramid_config.register_service(service, name="nipsa")
+    return service
+
+
+@pytest.fixture
+def settings_service(pyramid_config):
+    service = mock.create_autospec(SettingsService, spec_set=True, instance=True)
+    service.get.return_value = None
+    pyramid_config.register_service(service, name="settings")
+    return service
@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import datetime
+
 import mock
 import pytest
 
+from h.indexer import reindexer
 from h.indexer.reindexer import reindex
+from h.search.index import Window
 from h.search import client
 from h.services.nipsa import NipsaService
+from h.services.settings import SettingsService
+
+CHECKPOINT = "reindex.checkpoint"
 
 
 @pytest.mark.usefixtures(
@@ -17,6 +24,7 @@ from h.services.nipsa import NipsaService
     "get_aliased_index",
     "update_aliased_index",
     "settings_service",
+    "annotation_windows",
 )
 class TestReindex(object):
     def test_sets_op_type_to_create(self, pyramid_request, es, BatchIndexer):
@@ -25,22 +33,44 @@ class TestReindex(object):
         _, kwargs = BatchIndexer.call_args
         assert kwargs["op_type"] == "create"
 
-    def test_indexes_annotations(self, pyramid_request, es, batchindexer):
-        """Should call .index() on the batch indexer instance."""
+    def test_indexes_annotations(self, pyramid_request, es, batchindexer, windows):
+        """Should call .index() on the batch indexer instance for each window."""
         reindex(mock.sentinel.session, es, pyramid_request)
 
-        batchindexer.index.assert_called_once_with()
+        assert batchindexer.index.mock_calls == [
+            mock.call(windows=[window]) for window in windows
+        ]
+
+    def test_gets_the_windows_of_all_the_annotations(
+        self, pyramid_request, es, annotation_windows
+    ):
+        reindex(mock.sentinel.session, es, pyramid_request)
+
+        annotation_windows.assert_called_once_with(mock.sentinel.session, since=None)
 
     def test_retries_failed_annotations(self, pyramid_request, es, batchindexer):
         """Should call .index() a second time with any failed annotation IDs."""
-        batchindexer.index.return_value = ["abc123", "def456"]
+        batchindexer.index.side_effect = [{"abc123"}, set(), {"def456"}, set()]
 
         reindex(mock.sentinel.session, es, pyramid_request)
 
-        assert batchindexer.index.mock_calls == [
-            mock.call(),
-            mock.call(["abc123", "def456"]),
+        assert batchindexer.index.mock_calls[-1] == mock.call({"abc123", "def456"})
+
+    def test_checkpoints_after_each_window(
+        self, pyramid_request, es, settings_service, windows
+    ):
+        reindex(mock.sentinel.session, es, pyramid_request)
+
+        # The last window has no end, and the reindex is done after it.
+        checkpoints = [
+            c[1] for c, _ in settings_service.put.call_args_list if c[0] == CHECKPOINT
         ]
+        assert checkpoints == [windows[0].end.isoformat(), windows[1].end.isoformat()]
+
+    def test_deletes_the_checkpoint(self, pyramid_request, es, settings_service):
+        reindex(mock.sentinel.session, es, pyramid_request)
+
+        assert settings_service.delete.call_args_list[-1] == mock.call(CHECKPOINT)
 
     def test_creates_new_index(self, pyramid_request, es, configure_index, matchers):
         """Creates a new target index."""
@@ -95,16 +125,27 @@ class TestReindex(object):
 
         reindex(mock.sentinel.session, es, pyramid_request)
 
-        settings_service.put.assert_called_once_with(
-            "reindex.new_index", "hypothesis-abcd1234"
-        )
+        # The other settings put are the checkpoints.
+        new_index_puts = [
+            c
+            for c in settings_service.put.call_args_list
+            if c != mock.call(CHECKPOINT, mock.ANY)
+        ]
+        assert new_index_puts == [mock.call("reindex.new_index", "hypothesis-abcd1234")]
 
     def test_deletes_index_name_setting(self, pyramid_request, es, settings_service):
         reindex(mock.sentinel.session, es, pyramid_request)
 
-        settings_service.delete.assert_called_once_with("reindex.new_index")
+        settings_service.delete.assert_any_call("reindex.new_index")
+        # The checkpoint is cleared when the reindex starts, and when it's done.
+        checkpoint_deletes = [
+            c
+            for c in settings_service.delete.call_args_list
+            if c == mock.call(CHECKPOINT)
+        ]
+        assert len(checkpoint_deletes) == 2
 
-    def test_deletes_index_name_setting_when_exception_raised(
+    def test_keeps_index_name_setting_when_exception_raised(
         self, pyramid_request, es, settings_service, batchindexer
     ):
         batchindexer.index.side_effect = RuntimeError("boom!")
@@ -112,7 +153,65 @@ class TestReindex(object):
         with pytest.raises(RuntimeError):
             reindex(mock.sentinel.session, es, pyramid_request)
 
-        settings_service.delete.assert_called_once_with("reindex.new_index")
+        assert mock.call("reindex.new_index") not in (
+            settings_service.delete.call_args_list
+        )
+
+    def test_deletes_an_unfinished_reindexs_index(
+        self, pyramid_request, es, settings_service, delete_index, get_aliased_index
+    ):
+        get_aliased_index.return_value = "original_index"
+        settings_service.get.side_effect = {"reindex.new_index": "unfinished"}.get
+
+        reindex(mock.sentinel.session, es, pyramid_request)
+
+        assert delete_index.call_args_list == [
+            mock.call(es, "unfinished"),
+            mock.call(es, "original_index"),
+        ]
+
+    def test_resumes_an_unfinished_reindex(
+        self,
+        pyramid_request,
+        es,
+        settings_service,
+        configure_index,
+        delete_index,
+        update_aliased_index,
+        annotation_windows,
+        BatchIndexer,
+    ):
+        settings_service.get.side_effect = {
+            "reindex.new_index": "unfinished",
+            CHECKPOINT: "2018-02-01T00:00:00",
+        }.get
+
+        reindex(mock.sentinel.session, es, pyramid_request, resume=True)
+
+        assert not configure_index.called
+        assert BatchIndexer.call_args[1]["target_index"] == "unfinished"
+        annotation_windows.assert_called_once_with(
+            mock.sentinel.session, since=datetime.datetime(2018, 2, 1)
+        )
+        update_aliased_index.assert_called_once_with(es, "unfinished")
+        delete_index.assert_called_once_with(es, "foobar")
+
+    def test_resumes_from_the_start_without_a_checkpoint(
+        self, pyramid_request, es, settings_service, annotation_windows
+    ):
+        settings_service.get.side_effect = {"reindex.new_index": "unfinished"}.get
+
+        reindex(mock.sentinel.session, es, pyramid_request, resume=True)
+
+        annotation_windows.assert_called_once_with(mock.sentinel.session, since=None)
+
+    def test_raises_if_there_is_no_reindex_to_resume(
+        self, pyramid_request, es, configure_index
+    ):
+        with pytest.raises(RuntimeError):
+            reindex(mock.sentinel.session, es, pyramid_request, resume=True)
+
+        assert not configure_index.called
 
     def test_deletes_old_index(
         self, pyramid_request, es, delete_index, get_aliased_index
@@ -127,10 +226,75 @@ class TestReindex(object):
         reindex(mock.sentinel.session, es, pyramid_request)
         nipsa_service.fetch_all_flagged_userids.assert_called_once_with()
 
+    def test_it_indexes_the_windows_with_a_pool_of_workers(
+        self, pyramid_request, es, configure_index, batchindexer, Pool, windows
+    ):
+        configure_index.return_value = "hypothesis-abcd1234"
+        bootstrap = mock.Mock()
+
+        reindex(
+            mock.sentinel.session, es, pyramid_request, workers=3, bootstrap=bootstrap
+        )
+
+        Pool.assert_called_once_with(
+            3,
+            initializer=reindexer._init_worker,
+            initargs=(bootstrap, "hypothesis-abcd1234"),
+        )
+        Pool.return_value.imap_unordered.assert_called_once_with(
+            reindexer._index_window, windows
+        )
+        assert not batchindexer.index.called
+
+    def test_it_retries_the_annotations_the_workers_failed_to_index(
+        self, pyramid_request, es, batchindexer, Pool, windows
+    ):
+        Pool.return_value.imap_unordered.return_value = iter(
+            [(windows[1], {"abc123"}), (windows[0], set()), (windows[2], {"def456"})]
+        )
+
+        reindex(
+            mock.sentinel.session, es, pyramid_request, workers=3, bootstrap=mock.Mock()
+        )
+
+        batchindexer.index.assert_called_once_with({"abc123", "def456"})
+
+    def test_it_stops_the_workers_if_indexing_fails(
+        self, pyramid_request, es, update_aliased_index, Pool
+    ):
+        Pool.return_value.imap_unordered.side_effect = RuntimeError("boom!")
+
+        with pytest.raises(RuntimeError):
+            reindex(
+                mock.sentinel.session,
+                es,
+                pyramid_request,
+                workers=3,
+                bootstrap=mock.Mock(),
+            )
+
+        Pool.return_value.terminate.assert_called_once_with()
+        Pool.return_value.join.assert_called_once_with()
+        assert not update_aliased_index.called
+
+    def test_it_requires_bootstrap_with_several_workers(self, pyramid_request, es):
+        with pytest.raises(ValueError):
+            reindex(mock.sentinel.session, es, pyramid_request, workers=3)
+
     @pytest.fixture
     def BatchIndexer(self, patch):
         return patch("h.indexer.reindexer.BatchIndexer")
 
+    @pytest.fixture
+    def Pool(self, patch):
+        Pool = patch("h.indexer.reindexer.multiprocessing.Pool")
+        Pool.return_value.imap_unordered.return_value = iter([])
+        return Pool
+
+    @pytest.fixture
+    def annotation_windows(self, patch, windows):
+        return patch("h.indexer.reindexer.annotation_windows", return_value=windows)
+
     @pytest.fixture
     def configure_index(self, patch):
         return patch("h.indexer.reindexer.configure_index")
@@ -152,7 +316,7 @@ class TestReindex(object):
     @pytest.fixture
     def batchindexer(self, BatchIndexer):
         indexer = BatchIndexer.return_value
-        indexer.index.return_value = []
+        indexer.index.return_value = set()
         return indexer
 
     @pytest.fixture
@@ -169,7 +333,8 @@ class TestReindex(object):
 
     @pytest.fixture
     def settings_service(self, pyramid_config):
-        service = mock.Mock()
+        service = mock.create_autospec(SettingsService, instance=True, spec_set=True)
+        service.get.return_value = None
         pyramid_config.register_service(service, name="settings")
         return service
 
@@ -183,3 +348,87 @@ class TestReindex(object):
     def pyramid_request(self, pyramid_request):
         pyramid_request.tm = mock.Mock()
         return pyramid_request
+
+
+class TestProgress(object):
+    def test_it_checkpoints_the_end_of_each_window(self, windows, save_checkpoint):
+        progress = reindexer._Progress(windows, save_checkpoint)
+
+        for window in windows:
+            progress.done(window)
+
+        assert save_checkpoint.call_args_list == [
+            mock.call(windows[0].end),
+            mock.call(windows[1].end),
+        ]
+
+    def test_it_only_checkpoints_when_the_windows_before_are_done(
+        self, windows, save_checkpoint
+    ):
+        progress = reindexer._Progress(windows, save_checkpoint)
+
+        progress.done(windows[1])
+        assert not save_checkpoint.called
+
+        progress.done(windows[0])
+        save_checkpoint.assert_called_once_with(windows[1].end)
+
+    @pytest.fixture
+    def save_checkpoint(self):
+        return mock.Mock(spec_set=[])
+
+
+@pytest.mark.usefixtures("BatchIndexer")
+class TestWorker(object):
+    def test_it_indexes_into_the_target_index_with_its_own_request(
+        self, pyramid_request, BatchIndexer, nipsa_service
+    ):
+        reindexer._init_worker(
+            mock.Mock(return_value=pyramid_request), "hypothesis-abcd1234"
+        )
+
+        BatchIndexer.assert_called_once_with(
+            pyramid_request.db,
+            pyramid_request.es,
+            pyramid_request,
+            target_index="hypothesis-abcd1234",
+            op_type="create",
+        )
+        nipsa_service.fetch_all_flagged_userids.assert_called_once_with()
+
+    def test_it_indexes_a_window(self, pyramid_request, BatchIndexer):
+        BatchIndexer.return_value.index.return_value = {"abc123"}
+        window = Window(datetime.datetime(2018, 1, 1), None)
+        reindexer._init_worker(
+            mock.Mock(return_value=pyramid_request), "hypothesis-abcd1234"
+        )
+
+        result = reindexer._index_window(window)
+
+        BatchIndexer.return_value.index.assert_called_once_with(windows=[window])
+        assert result == (window, {"abc123"})
+
+    @pytest.fixture
+    def BatchIndexer(self, patch):
+        return patch("h.indexer.reindexer.BatchIndexer")
+
+    @pytest.fixture
+    def nipsa_service(self, pyramid_config):
+        service = mock.create_autospec(NipsaService, spec_set=True, instance=True)
+        pyramid_config.register_service(service, name="nipsa")
+        return service
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request, nipsa_service):
+        pyramid_request.es = mock.sentinel.es
+        return pyramid_request
+
+
+@pytest.fixture
+def windows():
+    dt = datetime.datetime
+    return [
+        Window(dt(2018, 1, 1), dt(2018, 2, 1)),
+        Window(dt(2018, 2, 1), dt(2018, 3, 1)),
+        Window(dt(2018, 3, 1), None),
+    ]
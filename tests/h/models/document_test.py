@@ -140,6 +140,192 @@ class TestDocumentFindOrCreateByURIs(object):
                 )
 
 
+class TestDocumentFindOrCreateByURIsCacheInvalidation(object):
+    def test_it_invalidates_the_cached_document_for_the_claimant(
+        self, db_session, cache
+    ):
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Pluto")
+
+        document.Document.find_or_create_by_uris(
+            db_session, "https://en.wikipedia.org/wiki/Pluto", []
+        )
+
+        assert cache.find(db_session, "https://en.wikipedia.org/wiki/Pluto") == [
+            ("https://en.wikipedia.org/wiki/Pluto", "self-claim")
+        ]
+
+
+class TestDocumentURICache(object):
+    def test_find_returns_the_documents_uris(self, db_session, cache, wikipedia):
+        assert sorted(
+            cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+        ) == [
+            ("https://en.wikipedia.org/wiki/Main_Page", "self-claim"),
+            ("https://m.en.wikipedia.org/wiki/Main_Page", "rel-alternate"),
+        ]
+
+    def test_find_returns_empty_list_if_there_is_no_document(self, db_session, cache):
+        assert cache.find(db_session, "https://example.com/") == []
+
+    def test_find_caches_the_documents_uris(self, db_session, cache, wikipedia):
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+
+        db_session.delete(wikipedia.document_uris[1])
+        db_session.flush()
+        db_session.expire(wikipedia)
+
+        assert (
+            len(cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")) == 2
+        )
+
+    def test_find_caches_by_normalized_uri(self, db_session, cache, wikipedia):
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+
+        db_session.delete(wikipedia.document_uris[1])
+        db_session.flush()
+        db_session.expire(wikipedia)
+
+        assert (
+            len(cache.find(db_session, "http://en.wikipedia.org/wiki/Main_Page")) == 2
+        )
+
+    def test_find_caches_missing_documents(self, db_session, cache, wikipedia):
+        cache.find(db_session, "https://example.com/")
+
+        wikipedia.document_uris.append(
+            document.DocumentURI(
+                claimant="https://example.com/", uri="https://example.com/"
+            )
+        )
+        db_session.flush()
+
+        assert cache.find(db_session, "https://example.com/") == []
+
+    def test_find_refetches_expired_entries(self, db_session, cache, wikipedia, time):
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+        db_session.delete(wikipedia.document_uris[1])
+        db_session.flush()
+        db_session.expire(wikipedia)
+
+        time.time.return_value += document.DOCUMENT_URI_CACHE_TTL
+
+        assert (
+            len(cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")) == 1
+        )
+
+    def test_find_starts_afresh_when_full(self, db_session, wikipedia):
+        cache = document.DocumentURICache(maxsize=1)
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+        db_session.delete(wikipedia.document_uris[1])
+        db_session.flush()
+        db_session.expire(wikipedia)
+
+        cache.find(db_session, "https://example.com/")
+
+        assert (
+            len(cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")) == 1
+        )
+
+    def test_invalidate_forgets_the_entries_for_uris(self, db_session, cache):
+        cache.find(db_session, "https://example.com/")
+        db_session.add(
+            document.Document(
+                document_uris=[
+                    document.DocumentURI(
+                        claimant="https://example.com/", uri="https://example.com/"
+                    )
+                ]
+            )
+        )
+        db_session.flush()
+
+        cache.invalidate(uris_normalized=["httpx://example.com"])
+
+        assert cache.find(db_session, "https://example.com/") == [
+            ("https://example.com/", "")
+        ]
+
+    def test_invalidate_forgets_the_entries_for_documents(
+        self, db_session, cache, wikipedia
+    ):
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+        cache.find(db_session, "https://m.en.wikipedia.org/wiki/Main_Page")
+        db_session.delete(wikipedia.document_uris[1])
+        db_session.flush()
+        db_session.expire(wikipedia)
+
+        cache.invalidate(document_ids=[wikipedia.id])
+
+        assert (
+            len(cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")) == 1
+        )
+        assert cache.find(db_session, "https://m.en.wikipedia.org/wiki/Main_Page") == []
+
+    def test_invalidate_ignores_new_documents(self, db_session, cache):
+        cache.find(db_session, "https://example.com/")
+        db_session.add(
+            document.Document(
+                document_uris=[
+                    document.DocumentURI(
+                        claimant="https://example.com/", uri="https://example.com/"
+                    )
+                ]
+            )
+        )
+        db_session.flush()
+
+        cache.invalidate(document_ids=[None])
+
+        assert cache.find(db_session, "https://example.com/") == []
+
+    def test_invalidate_forgets_the_entries_again_after_the_transaction(
+        self, db_session, cache, wikipedia
+    ):
+        cache.invalidate(document_ids=[wikipedia.id], session=db_session)
+        cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")
+        db_session.delete(wikipedia.document_uris[1])
+        db_session.flush()
+        db_session.expire(wikipedia)
+
+        transaction = mock.Mock()
+        transaction.parent = None
+        db_session.dispatch.after_transaction_end(db_session, transaction)
+
+        assert (
+            len(cache.find(db_session, "https://en.wikipedia.org/wiki/Main_Page")) == 1
+        )
+
+    @pytest.fixture
+    def cache(self):
+        return document.DocumentURICache()
+
+    @pytest.fixture
+    def time(self, patch):
+        time = patch("h.models.document.time")
+        time.time.return_value = 1000.0
+        return time
+
+    @pytest.fixture
+    def wikipedia(self, db_session):
+        document_ = document.Document(
+            document_uris=[
+                document.DocumentURI(
+                    claimant="https://en.wikipedia.org/wiki/Main_Page",
+                    uri="https://en.wikipedia.org/wiki/Main_Page",
+                    type="self-claim",
+                ),
+                document.DocumentURI(
+                    claimant="https://en.wikipedia.org/wiki/Main_Page",
+                    uri="https://m.en.wikipedia.org/wiki/Main_Page",
+                    type="rel-alternate",
+                ),
+            ]
+        )
+        db_session.add(document_)
+        db_session.flush()
+        return document_
+
+
 class TestDocumentWebURI(object):
     """Unit tests for Document.web_uri and Document.update_web_uri()."""
 
@@ -422,6 +608,33 @@ class TestCreateOrUpdateDocumentURI(object):
         document_ = db_session.query(document.Document).get(document_.id)
         assert document_.web_uri == "http://example.com/first_uri.html"
 
+    def test_it_invalidates_the_cached_documents_uris(self, db_session, cache):
+        document_ = document.Document(
+            document_uris=[
+                document.DocumentURI(
+                    claimant="http://example.com/", uri="http://example.com/"
+                )
+            ]
+        )
+        db_session.add(document_)
+        db_session.flush()
+        cache.find(db_session, "http://example.com/")
+        cache.find(db_session, "http://example.org/")
+
+        document.create_or_update_document_uri(
+            session=db_session,
+            claimant="http://example.com/",
+            uri="http://example.org/",
+            type="rel-alternate",
+            content_type="",
+            document=document_,
+            created=now(),
+            updated=now(),
+        )
+
+        assert len(cache.find(db_session, "http://example.com/")) == 2
+        assert len(cache.find(db_session, "http://example.org/")) == 2
+
     def test_it_logs_a_warning_if_document_ids_differ(self, log):
         """
         It should log a warning on Document objects mismatch.
@@ -737,6 +950,18 @@ class TestMergeDocuments(object):
             .count()
         )
 
+    def test_merge_documents_invalidates_the_cached_documents_uris(
+        self, db_session, merge_data, patch
+    ):
+        cache = patch("h.models.document.DOCUMENT_URI_CACHE")
+        master, duplicate_1, duplicate_2 = merge_data
+
+        document.merge_documents(db_session, merge_data)
+
+        cache.invalidate.assert_called_once_with(
+            document_ids=[master.id, duplicate_1.id, duplicate_2.id], session=db_session
+        )
+
     def test_raises_retryable_error_when_flush_fails(
         self, db_session, merge_data, monkeypatch
     ):
@@ -1119,3 +1344,8 @@ def mock_document_meta(document=None):
 @pytest.fixture
 def log(patch):
     return patch("h.models.document.log")
+
+
+@pytest.fixture
+def cache():
+    return document.DOCUMENT_URI_CACHE
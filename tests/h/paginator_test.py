@@ -153,6 +153,29 @@ class TestPaginate(object):
         pyramid_request.current_route_path.assert_called_once_with(_query=expected)
         assert url == pyramid_request.current_route_path.return_value
 
+    def test_url_for_adds_the_cursor_to_the_next_page(self, pyramid_request):
+        pyramid_request.params = NestedMultiDict({"page": "3", "cursor": "old"})
+        pyramid_request.current_route_path = mock.Mock(spec_set=["__call__"])
+        url_for = paginate(pyramid_request, 600, 10, cursor="new")["url_for"]
+
+        url_for(page=4)
+
+        pyramid_request.current_route_path.assert_called_once_with(
+            _query={"page": 4, "cursor": "new"}
+        )
+
+    @pytest.mark.parametrize("page", (1, 2, 5))
+    def test_url_for_drops_the_cursor_from_other_pages(self, pyramid_request, page):
+        pyramid_request.params = NestedMultiDict({"page": "3", "cursor": "old"})
+        pyramid_request.current_route_path = mock.Mock(spec_set=["__call__"])
+        url_for = paginate(pyramid_request, 600, 10, cursor="new")["url_for"]
+
+        url_for(page=page)
+
+        pyramid_request.current_route_path.assert_called_once_with(
+            _query={"page": page}
+        )
+
 
 @pytest.mark.usefixtures("paginate")
 class TestPaginateQuery(object):
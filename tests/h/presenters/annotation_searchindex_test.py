@@ -7,12 +7,15 @@ import datetime
 import mock
 import pytest
 
+from h.interfaces import IGroupService
+from h.models.group import ReadableBy
 from h.presenters.annotation_searchindex import AnnotationSearchIndexPresenter
 from h.services.annotation_moderation import AnnotationModerationService
+from h.services.groupfinder import GroupfinderService
 
 
 @pytest.mark.usefixtures(
-    "DocumentSearchIndexPresenter", "moderation_service", "thread_ids"
+    "DocumentSearchIndexPresenter", "group_service", "moderation_service", "thread_ids"
 )
 class TestAnnotationSearchIndexPresenter(object):
     def test_asdict(self, DocumentSearchIndexPresenter, pyramid_request, thread_ids):
@@ -51,6 +54,7 @@ class TestAnnotationSearchIndexPresenter(object):
             "tags": ["magic"],
             "tags_raw": ["magic"],
             "group": "__world__",
+            "group_readable_by_world": True,
             "shared": True,
             "target": [
                 {
@@ -80,6 +84,34 @@ class TestAnnotationSearchIndexPresenter(object):
             "http://example.com/normalized"
         ]
 
+    @pytest.mark.parametrize(
+        "readable_by,expected", [(ReadableBy.world, True), (ReadableBy.members, False)]
+    )
+    def test_it_marks_whether_the_group_is_readable_by_world(
+        self, pyramid_request, group_service, factories, readable_by, expected
+    ):
+        annotation = mock.MagicMock(userid="acct:luke@hypothes.is", groupid="abc123")
+        group_service.find.return_value = factories.Group.build(readable_by=readable_by)
+
+        annotation_dict = AnnotationSearchIndexPresenter(
+            annotation, pyramid_request
+        ).asdict()
+
+        group_service.find.assert_called_once_with("abc123")
+        assert annotation_dict["group_readable_by_world"] is expected
+
+    def test_it_marks_the_group_not_readable_by_world_if_it_is_missing(
+        self, pyramid_request, group_service
+    ):
+        annotation = mock.MagicMock(userid="acct:luke@hypothes.is")
+        group_service.find.return_value = None
+
+        annotation_dict = AnnotationSearchIndexPresenter(
+            annotation, pyramid_request
+        ).asdict()
+
+        assert annotation_dict["group_readable_by_world"] is False
+
     def test_it_marks_annotation_hidden_when_it_and_all_children_are_moderated(
         self, pyramid_request, moderation_service, thread_ids
     ):
@@ -164,6 +196,14 @@ class TestAnnotationSearchIndexPresenter(object):
         return class_
 
 
+@pytest.fixture
+def group_service(pyramid_config, factories):
+    svc = mock.create_autospec(GroupfinderService, spec_set=True, instance=True)
+    svc.find.return_value = factories.Group.build(readable_by=ReadableBy.world)
+    pyramid_config.register_service(svc, iface=IGroupService)
+    return svc
+
+
 @pytest.fixture
 def moderation_service(pyramid_config):
     svc = mock.create_autospec(
@@ -83,6 +83,87 @@ class TestConsumer(object):
 
         consumer.handle_message({}, message)
 
+    def test_on_consume_ready_binds_the_queue_to_the_extra_routing_keys(
+        self, handler, exchange
+    ):
+        consumer = realtime.Consumer(
+            mock.sentinel.connection,
+            "annotation",
+            handler,
+            bindings=lambda: {"annotation.1"},
+        )
+        kombu_consumer = mock.Mock(queues=[mock.Mock()])
+
+        consumer.on_consume_ready(mock.Mock(), mock.Mock(), [kombu_consumer])
+
+        queue = kombu_consumer.queues[0]
+        queue.bind_to.assert_called_once_with(exchange, routing_key="annotation.1")
+
+    def test_on_consume_ready_does_nothing_without_bindings(self, consumer):
+        kombu_consumer = mock.Mock(queues=[mock.Mock()])
+
+        consumer.on_consume_ready(mock.Mock(), mock.Mock(), [kombu_consumer])
+
+        assert not kombu_consumer.queues[0].bind_to.called
+
+    def test_on_iteration_updates_the_bindings(self, handler, exchange, time):
+        bindings = mock.Mock(return_value={"annotation.1", "annotation.2"})
+        consumer = realtime.Consumer(
+            mock.sentinel.connection, "annotation", handler, bindings=bindings
+        )
+        queue = mock.Mock()
+        time.time.return_value = 100
+        consumer.on_consume_ready(mock.Mock(), mock.Mock(), [mock.Mock(queues=[queue])])
+        queue.reset_mock()
+        bindings.return_value = {"annotation.2", "annotation.3"}
+        time.time.return_value = 100 + realtime.BINDINGS_INTERVAL
+
+        consumer.on_iteration()
+
+        queue.bind_to.assert_called_once_with(exchange, routing_key="annotation.3")
+        queue.unbind_from.assert_called_once_with(exchange, routing_key="annotation.1")
+
+    def test_on_iteration_checks_the_bindings_at_most_once_per_interval(
+        self, handler, time
+    ):
+        bindings = mock.Mock(return_value=set())
+        consumer = realtime.Consumer(
+            mock.sentinel.connection, "annotation", handler, bindings=bindings
+        )
+        time.time.return_value = 100
+        consumer.on_consume_ready(
+            mock.Mock(), mock.Mock(), [mock.Mock(queues=[mock.Mock()])]
+        )
+        bindings.reset_mock()
+
+        consumer.on_iteration()
+
+        assert not bindings.called
+
+    def test_on_iteration_never_unbinds_the_routing_key(self, handler, time):
+        bindings = mock.Mock(return_value={"annotation.1"})
+        consumer = realtime.Consumer(
+            mock.sentinel.connection, "annotation", handler, bindings=bindings
+        )
+        queue = mock.Mock()
+        time.time.return_value = 100
+        consumer.on_consume_ready(mock.Mock(), mock.Mock(), [mock.Mock(queues=[queue])])
+        bindings.return_value = set()
+        time.time.return_value = 200
+
+        consumer.on_iteration()
+
+        unbound = [c[1]["routing_key"] for c in queue.unbind_from.call_args_list]
+        assert unbound == ["annotation.1"]
+
+    @pytest.fixture
+    def exchange(self):
+        return realtime.get_exchange()
+
+    @pytest.fixture
+    def time(self, patch):
+        return patch("h.realtime.time")
+
     @pytest.fixture
     def Queue(self, patch):
         return patch("h.realtime.kombu.Queue")
@@ -126,6 +207,28 @@ class TestPublisher(object):
             retry_policy=retry_policy,
         )
 
+    def test_publish_annotation_routes_to_the_uri_shard(
+        self, producer_pool, pyramid_request
+    ):
+        pyramid_request.registry.settings["h.realtime_shards"] = 16
+        producer = producer_pool["foobar"].acquire().__enter__()
+
+        publisher = realtime.Publisher(pyramid_request)
+        publisher.publish_annotation({}, target_uri_normalized="httpx://example.com")
+
+        expected_key = realtime.annotation_routing_key("httpx://example.com", 16)
+        assert producer.publish.call_args[1]["routing_key"] == expected_key
+
+    def test_publish_annotation_ignores_the_uri_if_not_sharded(
+        self, producer_pool, pyramid_request
+    ):
+        producer = producer_pool["foobar"].acquire().__enter__()
+
+        publisher = realtime.Publisher(pyramid_request)
+        publisher.publish_annotation({}, target_uri_normalized="httpx://example.com")
+
+        assert producer.publish.call_args[1]["routing_key"] == "annotation"
+
     def test_publish_user(self, matchers, producer_pool, pyramid_request, retry_policy):
         payload = {"action": "create", "user": {"id": "foobar"}}
         producer = producer_pool["foobar"].acquire().__enter__()
@@ -175,6 +278,46 @@ class TestGetExchange(object):
         assert exchange.delivery_mode == 1
 
 
+class TestGetShards(object):
+    def test_defaults_to_no_sharding(self):
+        assert realtime.get_shards({}) == 0
+
+    def test_returns_the_number_of_shards(self):
+        assert realtime.get_shards({"h.realtime_shards": "8"}) == 8
+
+
+class TestAnnotationRoutingKey(object):
+    def test_returns_annotation_if_not_sharded(self):
+        assert realtime.annotation_routing_key("httpx://example.com") == "annotation"
+
+    def test_returns_annotation_if_uri_unknown(self):
+        assert realtime.annotation_routing_key(None, 8) == "annotation"
+
+    def test_returns_the_shard_routing_key(self):
+        shard = realtime.uri_shard("httpx://example.com", 8)
+
+        routing_key = realtime.annotation_routing_key("httpx://example.com", 8)
+
+        assert routing_key == "annotation.{}".format(shard)
+
+
+class TestURIShard(object):
+    def test_is_stable(self):
+        # The shard must be the same in every process, whatever the hash seed.
+        assert realtime.uri_shard("httpx://example.com", 1000) == 821
+
+    def test_is_in_range(self):
+        shards = set(
+            realtime.uri_shard("httpx://example.com/{}".format(i), 4)
+            for i in range(100)
+        )
+        assert shards == {0, 1, 2, 3}
+
+    def test_accepts_bytes(self):
+        shard = realtime.uri_shard(b"httpx://example.com", 1000)
+        assert shard == realtime.uri_shard("httpx://example.com", 1000)
+
+
 class TestGetConnection(object):
     def test_defaults(self, Connection):
         realtime.get_connection({})
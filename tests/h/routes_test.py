@@ -143,6 +143,7 @@ def test_includeme():
             traverse="/{pubid}",
         ),
         call("api.search", "/api/search"),
+        call("api.search_export", "/api/search/export"),
         call("api.users", "/api/users", factory="h.traversal.UserRoot"),
         call(
             "api.user",
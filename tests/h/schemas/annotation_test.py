@@ -7,7 +7,7 @@ import pytest
 import re
 from webob.multidict import NestedMultiDict, MultiDict
 
-from h.search.query import LIMIT_DEFAULT, LIMIT_MAX, OFFSET_MAX
+from h.search.query import LIMIT_DEFAULT, LIMIT_MAX, OFFSET_MAX, encode_cursor
 from h.schemas import ValidationError
 from h.schemas.annotation import (
     CreateAnnotationSchema,
@@ -583,6 +583,7 @@ class TestSearchParamsSchema(object):
         expected_params = MultiDict(
             {
                 "_separate_replies": True,
+                "_paginate_replies": True,
                 "group": "group1",
                 "quote": "quote me",
                 "references": "3456TA12",
@@ -606,6 +607,7 @@ class TestSearchParamsSchema(object):
             MultiDict(
                 {
                     "_separate_replies": "1",
+                    "_paginate_replies": "1",
                     "group": "group1",
                     "quote": "quote me",
                     "references": "3456TA12",
@@ -732,6 +734,29 @@ class TestSearchParamsSchema(object):
         assert params["offset"] == 0
         assert params["search_after"] == "2009-02-16"
 
+    def test_passes_validation_if_valid_cursor(self, schema):
+        cursor = encode_cursor("updated", "desc", [1514764800000, "abc123"])
+        input_params = NestedMultiDict(MultiDict({"cursor": cursor}))
+
+        params = validate_query_params(schema, input_params)
+
+        assert params["cursor"] == cursor
+
+    @pytest.mark.parametrize(
+        "cursor",
+        (
+            "not a cursor",
+            encode_cursor("updated", "sideways", [1]),
+            encode_cursor("updated", "desc", []),
+            encode_cursor("updated", "desc", [{"foo": "bar"}]),
+        ),
+    )
+    def test_raises_if_invalid_cursor(self, schema, cursor):
+        input_params = NestedMultiDict(MultiDict({"cursor": cursor}))
+
+        with pytest.raises(ValidationError):
+            validate_query_params(schema, input_params)
+
     @pytest.mark.parametrize(
         "wildcard_uri", ("https://localhost:3000*", "file://localhost*/foo.pdf")
     )
@@ -5,7 +5,10 @@ import mock
 import pytest
 
 import h.search.index
+from h.interfaces import IGroupService
+from h.models.group import ReadableBy
 from h.services.group import GroupService
+from h.services.groupfinder import GroupfinderService
 from h.services.annotation_moderation import AnnotationModerationService
 
 
@@ -13,10 +16,20 @@ from h.services.annotation_moderation import AnnotationModerationService
 def group_service(pyramid_config):
     group_service = mock.create_autospec(GroupService, instance=True, spec_set=True)
     group_service.groupids_readable_by.return_value = ["__world__"]
+    group_service.groupids_readable_by_members.return_value = []
     pyramid_config.register_service(group_service, name="group")
     return group_service
 
 
+@pytest.fixture(autouse=True)
+def groupfinder_service(pyramid_config, factories):
+    """Make the groups of indexed annotations world-readable, by default."""
+    svc = mock.create_autospec(GroupfinderService, spec_set=True, instance=True)
+    svc.find.return_value = factories.Group.build(readable_by=ReadableBy.world)
+    pyramid_config.register_service(svc, iface=IGroupService)
+    return svc
+
+
 @pytest.fixture(autouse=True)
 def moderation_service(pyramid_config):
     svc = mock.create_autospec(
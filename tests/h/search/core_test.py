@@ -14,6 +14,7 @@ import pytest
 from webob.multidict import MultiDict
 
 from h import search
+from h.search.templates import QUERY_TEMPLATES_KEY, QueryTemplates
 
 
 class TestSearch(object):
@@ -158,6 +159,95 @@ class TestSearch(object):
 
         assert result.reply_ids == []
 
+    def test_it_returns_a_cursor_to_the_next_page(self, pyramid_request, Annotation):
+        # All the annotations were updated at once, so they're ordered by id.
+        now = datetime.datetime.now()
+        annotations = [Annotation(updated=now, shared=True) for _ in range(3)]
+        expected = sorted(annotations, key=lambda a: a.id, reverse=True)
+
+        first = search.Search(pyramid_request).run(MultiDict({"limit": 2}))
+        second = search.Search(pyramid_request).run(
+            MultiDict({"limit": 2, "cursor": first.cursor})
+        )
+
+        assert first.annotation_ids + second.annotation_ids == [a.id for a in expected]
+
+    def test_it_doesnt_return_a_cursor_if_there_are_no_results(self, pyramid_request):
+        result = search.Search(pyramid_request).run(MultiDict({}))
+
+        assert result.cursor is None
+
+    def test_it_doesnt_return_a_cursor_after_search_after(
+        self, pyramid_request, Annotation
+    ):
+        Annotation(shared=True)
+
+        result = search.Search(pyramid_request).run(
+            MultiDict({"search_after": "2000-01-01", "order": "asc"})
+        )
+
+        assert result.cursor is None
+
+    def test_count_returns_the_total(self, factories, pyramid_request, Annotation):
+        user = factories.User()
+        for _ in range(3):
+            Annotation(userid=user.userid, shared=True)
+        Annotation(shared=True)
+
+        count = search.Search(pyramid_request).count(
+            MultiDict({"user": user.userid, "limit": 1})
+        )
+
+        assert count == 3
+
+    def test_count_many_returns_each_querys_total(
+        self, factories, pyramid_request, Annotation
+    ):
+        users = [factories.User() for _ in range(3)]
+        for i, user in enumerate(users):
+            for _ in range(i):
+                Annotation(userid=user.userid, shared=True)
+
+        counts = search.Search(pyramid_request).count_many(
+            [MultiDict({"user": user.userid}) for user in users]
+        )
+
+        assert counts == [0, 1, 2]
+
+    def test_count_many_returns_an_empty_list_if_there_are_no_queries(
+        self, pyramid_request
+    ):
+        assert search.Search(pyramid_request).count_many([]) == []
+
+    def test_scan_returns_all_the_matching_annotations(
+        self, factories, pyramid_request, Annotation
+    ):
+        user = factories.User()
+        annotations = [Annotation(userid=user.userid, shared=True) for _ in range(5)]
+        Annotation(shared=True)
+
+        annotation_ids = search.Search(pyramid_request).scan(
+            MultiDict({"user": user.userid}), size=2
+        )
+
+        assert sorted(annotation_ids) == sorted(a.id for a in annotations)
+
+    def test_scan_ignores_the_paging_params(self, pyramid_request, Annotation):
+        annotations = [Annotation(shared=True) for _ in range(3)]
+        params = MultiDict(
+            {
+                "limit": 1,
+                "offset": 1,
+                "sort": "created",
+                "order": "asc",
+                "search_after": "2000-01-01",
+            }
+        )
+
+        annotation_ids = search.Search(pyramid_request).scan(params)
+
+        assert sorted(annotation_ids) == sorted(a.id for a in annotations)
+
     @pytest.fixture
     def UriCombinedWildcardFilter(self, patch):
         return patch("h.search.core.query.UriCombinedWildcardFilter")
@@ -181,6 +271,16 @@ class TestSearchWithSeparateReplies(object):
         assert result.annotation_ids == [annotation.id]
         assert result.reply_ids == matchers.UnorderedList([reply_1.id, reply_2.id])
 
+    def test_count_doesnt_count_replies(self, pyramid_request, Annotation):
+        annotation = Annotation(shared=True)
+        Annotation(references=[annotation.id], shared=True)
+
+        count = search.Search(pyramid_request, separate_replies=True).count(
+            MultiDict({})
+        )
+
+        assert count == 1
+
     def test_replies_are_ordered_most_recently_updated_first(
         self, Annotation, pyramid_request
     ):
@@ -295,3 +395,161 @@ class TestSearchWithSeparateReplies(object):
 
         assert len(result.reply_ids) == 3
         assert oldest_reply.id not in result.reply_ids
+
+    def test_replies_beyond_the_limit_are_included_if_paginate_replies(
+        self, pyramid_request, Annotation
+    ):
+        annotation = Annotation(shared=True)
+        now = datetime.datetime.now()
+        five_mins = datetime.timedelta(minutes=5)
+        replies = [
+            Annotation(
+                updated=now - (five_mins * i), references=[annotation.id], shared=True
+            )
+            for i in range(7)
+        ]
+
+        result = search.Search(
+            pyramid_request,
+            separate_replies=True,
+            paginate_replies=True,
+            _replies_limit=3,
+        ).run(MultiDict({}))
+
+        assert result.reply_ids == [reply.id for reply in replies]
+
+    def test_it_warns_that_replies_beyond_the_limit_were_left_out(
+        self, pyramid_request, Annotation, caplog
+    ):
+        annotation = Annotation(shared=True)
+        for _ in range(4):
+            Annotation(references=[annotation.id], shared=True)
+
+        search.Search(pyramid_request, separate_replies=True, _replies_limit=3).run(
+            MultiDict({})
+        )
+
+        assert "Search with paginate_replies" in caplog.text
+
+    def test_it_doesnt_warn_if_paginate_replies_fetched_them_all(
+        self, pyramid_request, Annotation, caplog
+    ):
+        annotation = Annotation(shared=True)
+        for _ in range(4):
+            Annotation(references=[annotation.id], shared=True)
+
+        search.Search(
+            pyramid_request,
+            separate_replies=True,
+            paginate_replies=True,
+            _replies_limit=3,
+        ).run(MultiDict({}))
+
+        assert "reply annotations exceeded" not in caplog.text
+
+    def test_paginate_replies_doesnt_change_the_replies_within_the_limit(
+        self, pyramid_request, Annotation
+    ):
+        annotation = Annotation(shared=True)
+        reply = Annotation(references=[annotation.id], shared=True)
+
+        result = search.Search(
+            pyramid_request, separate_replies=True, paginate_replies=True
+        ).run(MultiDict({}))
+
+        assert result.annotation_ids == [annotation.id]
+        assert result.reply_ids == [reply.id]
+
+
+class TestSearchWithQueryTemplates(object):
+    """Unit tests for search.Search with the search_query_templates feature."""
+
+    def test_it_finds_the_annotations_with_a_compiled_query(
+        self, factories, pyramid_request, Annotation, templates
+    ):
+        user = factories.User()
+        now = datetime.datetime.now()
+        five_mins = datetime.timedelta(minutes=5)
+        annotation_1 = Annotation(userid=user.userid, updated=now, shared=True)
+        annotation_2 = Annotation(
+            userid=user.userid, updated=now + five_mins, shared=True
+        )
+        Annotation(shared=True)
+
+        result = search.Search(pyramid_request).run(MultiDict({"user": user.userid}))
+
+        assert result.annotation_ids == [annotation_2.id, annotation_1.id]
+        assert result.total == 2
+        assert templates.counts == {"compile": 1}
+
+    def test_it_returns_replies_separately_with_a_compiled_query(
+        self, pyramid_request, Annotation, templates
+    ):
+        annotation = Annotation(shared=True)
+        reply = Annotation(references=[annotation.id], shared=True)
+
+        result = search.Search(pyramid_request, separate_replies=True).run(
+            MultiDict({"uri": annotation.target_uri})
+        )
+
+        assert result.annotation_ids == [annotation.id]
+        assert result.reply_ids == [reply.id]
+        assert templates.counts == {"compile": 1}
+
+    def test_it_returns_a_cursor_with_a_compiled_query(
+        self, factories, pyramid_request, Annotation, templates
+    ):
+        user = factories.User()
+        now = datetime.datetime.now()
+        annotations = [
+            Annotation(userid=user.userid, updated=now, shared=True) for _ in range(3)
+        ]
+        expected = sorted(annotations, key=lambda a: a.id, reverse=True)
+
+        first = search.Search(pyramid_request).run(
+            MultiDict({"user": user.userid, "limit": 2})
+        )
+        second = search.Search(pyramid_request).run(
+            MultiDict({"user": user.userid, "limit": 2, "cursor": first.cursor})
+        )
+
+        assert first.annotation_ids + second.annotation_ids == [a.id for a in expected]
+        # Searches with cursors are built through the modifiers.
+        assert templates.counts == {"compile": 1, "fallback": 1}
+
+    def test_it_doesnt_use_the_templates_for_other_searches(
+        self, pyramid_request, Annotation, templates
+    ):
+        annotation = Annotation(shared=True, tags=["foo"])
+
+        result = search.Search(pyramid_request).run(MultiDict({"tag": "foo"}))
+
+        assert result.annotation_ids == [annotation.id]
+        assert templates.counts == {"fallback": 1}
+
+    def test_it_doesnt_use_the_templates_with_added_modifiers(
+        self, pyramid_request, Annotation, templates
+    ):
+        Annotation(shared=True)
+        s = search.Search(pyramid_request)
+        s.append_modifier(search.TopLevelAnnotationsFilter())
+
+        s.run(MultiDict({}))
+
+        assert templates.counts == {}
+
+    def test_it_doesnt_use_the_templates_without_the_feature(
+        self, pyramid_request, Annotation, templates
+    ):
+        pyramid_request.feature.flags["search_query_templates"] = False
+        Annotation(shared=True)
+
+        search.Search(pyramid_request).run(MultiDict({}))
+
+        assert templates.counts == {}
+
+    @pytest.fixture
+    def templates(self, pyramid_request):
+        templates = QueryTemplates()
+        pyramid_request.registry[QUERY_TEMPLATES_KEY] = templates
+        return templates
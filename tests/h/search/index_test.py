@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 import datetime
 
+import dateutil.tz
 import elasticsearch
 import elasticsearch_dsl
 import logging
@@ -472,6 +473,93 @@ class TestBatchIndexer(object):
             )
             notify.assert_has_calls([mock.call(event)])
 
+    def test_it_indexes_the_annotations_in_windows(
+        self, batch_indexer, factories, get_indexed_ann
+    ):
+        dt = datetime.datetime
+        in_window = [
+            factories.Annotation(updated=dt(2018, 1, 1)),
+            factories.Annotation(updated=dt(2018, 1, 31)),
+            factories.Annotation(updated=dt(2019, 1, 1)),
+        ]
+        not_in_window = factories.Annotation(updated=dt(2018, 3, 1))
+        windows = [
+            h.search.index.Window(dt(2018, 1, 1), dt(2018, 2, 1)),
+            h.search.index.Window(dt(2019, 1, 1), None),
+        ]
+
+        batch_indexer.index(windows=windows)
+
+        for ann in in_window:
+            assert get_indexed_ann(ann.id) is not None
+        with pytest.raises(elasticsearch.exceptions.NotFoundError):
+            get_indexed_ann(not_in_window.id)
+
+    def test_sync_indexes_the_annotations_updated_since_the_date(
+        self, batch_indexer, factories, get_indexed_ann
+    ):
+        dt = datetime.datetime
+        updated = factories.Annotation(updated=dt(2018, 1, 2))
+        deleted = factories.Annotation(updated=dt(2018, 1, 3), deleted=True)
+        not_updated = factories.Annotation(updated=dt(2017, 12, 31))
+
+        batch_indexer.sync(dt(2018, 1, 1))
+
+        assert get_indexed_ann(updated.id)["id"] == updated.id
+        assert get_indexed_ann(deleted.id) == {"deleted": True}
+        with pytest.raises(elasticsearch.exceptions.NotFoundError):
+            get_indexed_ann(not_updated.id)
+
+    def test_sync_marks_indexed_annotations_as_deleted(
+        self, batch_indexer, factories, get_indexed_ann
+    ):
+        annotation = factories.Annotation(updated=datetime.datetime(2018, 1, 2))
+        batch_indexer.index()
+        annotation.deleted = True
+
+        batch_indexer.sync(datetime.datetime(2018, 1, 1))
+
+        assert get_indexed_ann(annotation.id) == {"deleted": True}
+
+    def test_sync_converts_aware_dates_to_utc(
+        self, batch_indexer, factories, get_indexed_ann
+    ):
+        annotation = factories.Annotation(updated=datetime.datetime(2018, 1, 1, 12))
+
+        # 13:00 in UTC+2 is 11:00 UTC, before the annotation was updated.
+        batch_indexer.sync(
+            datetime.datetime(2018, 1, 1, 13, tzinfo=dateutil.tz.tzoffset(None, 7200))
+        )
+
+        assert get_indexed_ann(annotation.id)["id"] == annotation.id
+
+    def test_index_annotations_indexes_the_given_annotations(
+        self, batch_indexer, db_session, factories, get_indexed_ann
+    ):
+        annotation = factories.Annotation()
+        deleted = factories.Annotation(deleted=True)
+        not_given = factories.Annotation()
+        db_session.flush()
+
+        batch_indexer.index_annotations([annotation, deleted])
+
+        assert get_indexed_ann(annotation.id)["id"] == annotation.id
+        assert get_indexed_ann(deleted.id) == {"deleted": True}
+        with pytest.raises(elasticsearch.exceptions.NotFoundError):
+            get_indexed_ann(not_given.id)
+
+    def test_delete_marks_the_annotations_as_deleted(
+        self, batch_indexer, factories, get_indexed_ann
+    ):
+        annotations = factories.Annotation.create_batch(2)
+        batch_indexer.index()
+
+        errored = batch_indexer.delete([a.id for a in annotations])
+
+        assert errored == set()
+        for annotation in annotations:
+            assert get_indexed_ann(annotation.id) == {"deleted": True}
+
     def test_it_logs_indexing_status(self, caplog, batch_indexer, factories):
         num_annotations = 10
         window_size = 3
@@ -545,6 +633,60 @@ class TestBatchIndexer(object):
         assert errored == expected_errored_ids
 
 
+class TestAnnotationWindows(object):
+    def test_the_windows_cover_all_the_annotations(self, db_session, factories):
+        dt = datetime.datetime
+        annotations = [
+            factories.Annotation(updated=dt(2018, 1, day)) for day in range(1, 6)
+        ]
+        factories.Annotation(updated=dt(2017, 1, 1), deleted=True)
+        db_session.flush()
+
+        windows = h.search.index.annotation_windows(db_session, windowsize=2)
+
+        assert windows == [
+            (annotations[0].updated, annotations[2].updated),
+            (annotations[2].updated, annotations[4].updated),
+            (annotations[4].updated, None),
+        ]
+
+    def test_the_windows_can_start_at_a_date(self, db_session, factories):
+        dt = datetime.datetime
+        annotations = [
+            factories.Annotation(updated=dt(2018, 1, day)) for day in range(1, 6)
+        ]
+        db_session.flush()
+
+        windows = h.search.index.annotation_windows(
+            db_session, windowsize=2, since=dt(2018, 1, 3)
+        )
+
+        assert windows == [
+            (annotations[2].updated, annotations[4].updated),
+            (annotations[4].updated, None),
+        ]
+
+    def test_there_are_no_windows_without_annotations(self, db_session):
+        assert h.search.index.annotation_windows(db_session) == []
+
+
+class TestFetchAnnotations(object):
+    def test_it_returns_the_annotations_with_the_ids(self, db_session, factories):
+        annotations = factories.Annotation.create_batch(2)
+        deleted = factories.Annotation(deleted=True)
+        factories.Annotation()
+        db_session.flush()
+
+        fetched = h.search.index.fetch_annotations(
+            db_session, [annotations[0].id, annotations[1].id, deleted.id]
+        )
+
+        assert set(fetched) == set(annotations + [deleted])
+
+    def test_it_returns_nothing_without_ids(self, db_session):
+        assert h.search.index.fetch_annotations(db_session, []) == []
+
+
 class SearchResponseWithIDs(Matcher):
     """
     Matches an elasticsearch_dsl response with the given annotation ids.
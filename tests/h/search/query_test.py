@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import base64
 import datetime
+import re
 import elasticsearch_dsl
 import pytest
 import webob
 
+from h.models.group import ReadableBy
 from h.search import Search, index, query
 
 MISSING = object()
@@ -256,6 +259,131 @@ class TestSorter(object):
 
         assert result.annotation_ids == ann_ids
 
+    def test_it_pages_through_annotations_with_cursors(self, search, Annotation):
+        dt = datetime.datetime
+        # Some of the annotations have the same updated date, so their order
+        # depends on the tiebreaker.
+        ann_ids = [
+            Annotation(id="1", updated=dt(2018, 1, 1)).id,
+            Annotation(id="3", updated=dt(2017, 1, 1)).id,
+            Annotation(id="2", updated=dt(2017, 1, 1)).id,
+            Annotation(id="4", updated=dt(2016, 1, 1)).id,
+            Annotation(id="5", updated=dt(2017, 1, 1)).id,
+        ]
+        search.append_modifier(query.Limiter())
+
+        pages = []
+        params = webob.multidict.MultiDict({"limit": 2})
+        while True:
+            result = search.run(params)
+            if not result.annotation_ids:
+                break
+            pages.append(result.annotation_ids)
+            params = webob.multidict.MultiDict({"limit": 2, "cursor": result.cursor})
+
+        assert pages == [
+            [ann_ids[0], ann_ids[4]],
+            [ann_ids[1], ann_ids[2]],
+            [ann_ids[3]],
+        ]
+
+    def test_cursor_overrides_the_sort_order_and_offset(self, es_dsl_search):
+        sorter = query.Sorter()
+        cursor = query.encode_cursor("created", "asc", [1514764800000, "abc"])
+        params = webob.multidict.MultiDict(
+            {"cursor": cursor, "sort": "updated", "order": "desc", "offset": 20}
+        )
+
+        q = sorter(es_dsl_search, params).to_dict()
+
+        assert q["sort"] == [
+            {"created": {"order": "asc", "unmapped_type": "boolean"}},
+            {"id": {"order": "asc"}},
+        ]
+        assert q["search_after"] == [1514764800000, "abc"]
+        assert "offset" not in params
+
+    def test_it_ignores_invalid_cursors(self, es_dsl_search):
+        sorter = query.Sorter()
+        params = webob.multidict.MultiDict({"cursor": "invalid", "order": "asc"})
+
+        q = sorter(es_dsl_search, params).to_dict()
+
+        assert q["sort"] == [
+            {"updated": {"order": "asc", "unmapped_type": "boolean"}},
+            {"id": {"order": "asc"}},
+        ]
+        assert "search_after" not in q
+
+    def test_it_doesnt_break_ties_after_search_after(self, es_dsl_search):
+        sorter = query.Sorter()
+        params = webob.multidict.MultiDict({"search_after": "2018"})
+
+        q = sorter(es_dsl_search, params).to_dict()
+
+        assert q["sort"] == [{"updated": {"order": "desc", "unmapped_type": "boolean"}}]
+
+    def test_it_doesnt_break_ties_by_id_twice(self, es_dsl_search):
+        sorter = query.Sorter()
+        params = webob.multidict.MultiDict({"sort": "id"})
+
+        q = sorter(es_dsl_search, params).to_dict()
+
+        assert q["sort"] == [{"id": {"order": "desc", "unmapped_type": "boolean"}}]
+
+    @pytest.mark.parametrize(
+        "params,expected",
+        [
+            ({}, ("updated", "desc")),
+            ({"sort": "user", "order": "asc"}, ("user_raw", "asc")),
+            ({"cursor": query.encode_cursor("id", "asc", ["a"])}, ("id", "asc")),
+            ({"search_after": "2018"}, None),
+        ],
+    )
+    def test_cursor_sort(self, params, expected):
+        params = webob.multidict.MultiDict(params)
+        original = params.copy()
+
+        assert query.Sorter.cursor_sort(params) == expected
+        assert params == original
+
+
+class TestCursors(object):
+    @pytest.mark.parametrize(
+        "values", [[1514764800000, "abc123"], ["acct:foo@example.com", "abc"], [1.5]]
+    )
+    def test_decode_cursor_returns_what_was_encoded(self, values):
+        cursor = query.encode_cursor("updated", "asc", values)
+
+        assert query.decode_cursor(cursor) == ("updated", "asc", values)
+
+    def test_cursors_are_url_safe(self):
+        cursor = query.encode_cursor("updated", "desc", ["\xff\xfe???>>>"])
+
+        assert re.match("^[A-Za-z0-9_-]+$", cursor)
+
+    @pytest.mark.parametrize(
+        "cursor",
+        [
+            None,
+            "",
+            "!!!",
+            "bm90IGpzb24",  # Not JSON.
+            query.encode_cursor(1, "desc", [1]),
+            query.encode_cursor("updated", "sideways", [1]),
+            query.encode_cursor("updated", "desc", []),
+            query.encode_cursor("updated", "desc", [1, 2, 3]),
+            query.encode_cursor("updated", "desc", [None]),
+        ],
+    )
+    def test_decode_cursor_returns_None_if_the_cursor_is_invalid(self, cursor):
+        assert query.decode_cursor(cursor) is None
+
+    def test_decode_cursor_returns_None_if_the_cursor_isnt_a_list(self):
+        cursor = base64.urlsafe_b64encode(b'{"sort": "updated"}').decode("ascii")
+
+        assert query.decode_cursor(cursor) is None
+
 
 class TestTopLevelAnnotationsFilter(object):
     def test_it_filters_out_replies_but_leaves_annotations_in(self, Annotation, search):
@@ -395,6 +523,63 @@ class TestGroupAuthFilter(object):
 
     @pytest.fixture
     def search(self, search, pyramid_request):
+        pyramid_request.feature.flags["search_group_readable_by_world"] = False
+        search.append_modifier(query.GroupAuthFilter(pyramid_request))
+        return search
+
+
+class TestGroupAuthFilterWithReadableByWorldField(object):
+    def test_returns_annotations_in_world_readable_groups(
+        self, search, Annotation, group_service
+    ):
+        expected_ids = [
+            Annotation(groupid="group1").id,
+            Annotation(groupid="group2").id,
+        ]
+
+        result = search.run(webob.multidict.MultiDict({}))
+
+        group_service.groupids_readable_by.assert_not_called()
+        assert sorted(result.annotation_ids) == sorted(expected_ids)
+
+    def test_does_not_return_annotations_if_group_not_readable_by_user(
+        self, search, Annotation, members_only_group
+    ):
+        Annotation(groupid="group1")
+
+        result = search.run(webob.multidict.MultiDict({}))
+
+        assert not result.annotation_ids
+
+    def test_returns_annotations_in_the_users_members_only_groups(
+        self, search, Annotation, group_service, members_only_group
+    ):
+        group_service.groupids_readable_by_members.return_value = ["group1"]
+        Annotation(groupid="group2")
+        expected_ids = [Annotation(groupid="group1").id]
+
+        result = search.run(webob.multidict.MultiDict({}))
+
+        assert sorted(result.annotation_ids) == sorted(expected_ids)
+
+    def test_it_fetches_the_requests_users_groups(
+        self, search, group_service, pyramid_request
+    ):
+        search.run(webob.multidict.MultiDict({}))
+
+        group_service.groupids_readable_by_members.assert_called_once_with(
+            pyramid_request.user
+        )
+
+    @pytest.fixture
+    def members_only_group(self, groupfinder_service, factories):
+        group = factories.Group.build(readable_by=ReadableBy.members)
+        groupfinder_service.find.return_value = group
+        return group
+
+    @pytest.fixture
+    def search(self, search, pyramid_request):
+        pyramid_request.feature.flags["search_group_readable_by_world"] = True
         search.append_modifier(query.GroupAuthFilter(pyramid_request))
         return search
 
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import elasticsearch_dsl
+import mock
+import pytest
+from webob.multidict import MultiDict
+
+from h.search import core, query, templates
+from h.search.templates import QueryTemplates
+
+
+class TestQueryTemplates(object):
+    @pytest.mark.parametrize(
+        "params",
+        [
+            [("uri", "http://example.com/")],
+            [("uri", "http://example.com/"), ("group", "abc123"), ("limit", "200")],
+            [("url", "http://example.com/"), ("uri", "https://example.org/")],
+            [("user", "acct:Bob@example.com"), ("sort", "created"), ("order", "asc")],
+            [("user", "acct:bob@example.com"), ("user", "acct:jo@example.com")],
+            [("group", "abc123"), ("offset", "40"), ("sort", "user")],
+            [],
+        ],
+    )
+    def test_body_is_the_body_the_modifiers_build(
+        self, templates_, pyramid_request, params
+    ):
+        body = templates_.body(
+            pyramid_request, MultiDict(params), core.default_modifiers
+        )
+
+        assert body == built_body(pyramid_request, MultiDict(params))
+
+    def test_body_is_the_body_the_modifiers_build_for_a_user(
+        self, templates_, pyramid_request, authenticated_user, group_service
+    ):
+        group_service.groupids_readable_by_members.return_value = ["private"]
+        group_service.groupids_created_by.return_value = ["created"]
+        params = [("uri", "http://example.com/"), ("group", "private")]
+
+        body = templates_.body(
+            pyramid_request, MultiDict(params), core.default_modifiers
+        )
+
+        assert body == built_body(pyramid_request, MultiDict(params))
+
+    def test_body_is_the_body_the_modifiers_build_without_the_readable_field(
+        self, templates_, pyramid_request, authenticated_user, group_service
+    ):
+        pyramid_request.feature.flags["search_group_readable_by_world"] = False
+        group_service.groupids_created_by.return_value = []
+        params = [("user", authenticated_user.userid)]
+
+        body = templates_.body(
+            pyramid_request, MultiDict(params), core.default_modifiers
+        )
+
+        assert body == built_body(pyramid_request, MultiDict(params))
+
+    def test_body_is_the_body_the_modifiers_build_for_top_level_annotations(
+        self, templates_, pyramid_request
+    ):
+        params = [("uri", "http://example.com/")]
+
+        body = templates_.body(
+            pyramid_request,
+            MultiDict(params),
+            core.default_modifiers,
+            top_level_only=True,
+        )
+
+        assert body == built_body(pyramid_request, MultiDict(params), True)
+
+    def test_body_substitutes_the_parameters_into_the_compiled_template(
+        self, templates_, pyramid_request
+    ):
+        templates_.body(
+            pyramid_request,
+            MultiDict({"user": "acct:a@example.com"}),
+            core.default_modifiers,
+        )
+
+        body = templates_.body(
+            pyramid_request,
+            MultiDict({"user": "acct:b@example.com", "offset": "20"}),
+            core.default_modifiers,
+        )
+
+        assert body == built_body(
+            pyramid_request, MultiDict({"user": "acct:b@example.com", "offset": "20"})
+        )
+        assert templates_.counts == {"compile": 1, "hit": 1}
+
+    def test_body_doesnt_modify_the_params(self, templates_, pyramid_request):
+        params = MultiDict({"uri": "http://example.com/", "limit": "10"})
+
+        templates_.body(pyramid_request, params, core.default_modifiers)
+
+        assert params == MultiDict({"uri": "http://example.com/", "limit": "10"})
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            [("any", "foo")],
+            [("tag", "foo")],
+            [("wildcard_uri", "http://example.com/*")],
+            [("search_after", "2018-01-01")],
+            [("group", "abc"), ("group", "def")],
+            [("order", "sideways")],
+        ],
+    )
+    def test_body_returns_None_for_other_shapes_of_search(
+        self, templates_, pyramid_request, params
+    ):
+        body = templates_.body(
+            pyramid_request, MultiDict(params), core.default_modifiers
+        )
+
+        assert body is None
+        assert templates_.counts == {"fallback": 1}
+
+    def test_body_reports_to_statsd(self, templates_, pyramid_request):
+        stats = mock.Mock(spec_set=["incr"])
+        params = MultiDict({"group": "abc123"})
+
+        templates_.body(pyramid_request, params, core.default_modifiers, stats=stats)
+        templates_.body(pyramid_request, params, core.default_modifiers, stats=stats)
+        templates_.body(
+            pyramid_request,
+            MultiDict({"any": "foo"}),
+            core.default_modifiers,
+            stats=stats,
+        )
+
+        assert stats.incr.call_args_list == [
+            mock.call("search.query.template.compile"),
+            mock.call("search.query.template.hit"),
+            mock.call("search.query.template.fallback"),
+        ]
+
+    def test_it_discards_the_templates_when_full(self, pyramid_request):
+        templates_ = QueryTemplates(maxsize=1)
+
+        templates_.body(
+            pyramid_request, MultiDict({"group": "a"}), core.default_modifiers
+        )
+        templates_.body(
+            pyramid_request, MultiDict({"user": "b"}), core.default_modifiers
+        )
+        templates_.body(
+            pyramid_request, MultiDict({"group": "c"}), core.default_modifiers
+        )
+
+        assert templates_.counts == {"compile": 3}
+
+    @pytest.fixture
+    def templates_(self):
+        return QueryTemplates()
+
+    @pytest.fixture
+    def authenticated_user(self, factories, pyramid_config, pyramid_request):
+        user = factories.User()
+        pyramid_config.testing_securitypolicy(user.userid)
+        pyramid_request.user = user
+        return user
+
+
+class TestGetTemplates(object):
+    def test_it_returns_the_registrys_templates(self, pyramid_request):
+        templates_ = QueryTemplates()
+        pyramid_request.registry[templates.QUERY_TEMPLATES_KEY] = templates_
+
+        assert templates.get_templates(pyramid_request) is templates_
+
+    def test_it_returns_None_if_there_are_none(self, pyramid_request):
+        assert templates.get_templates(pyramid_request) is None
+
+
+def built_body(request, params, top_level_only=False):
+    """Return the body of a search built through the modifiers."""
+    modifiers = core.default_modifiers(request)
+    if top_level_only:
+        modifiers.insert(0, query.TopLevelAnnotationsFilter())
+
+    search = elasticsearch_dsl.Search().source(False)
+    for modifier in modifiers:
+        search = modifier(search, params)
+    return search.to_dict()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from webob.multidict import MultiDict
+
+from h.services.annotation_export import AnnotationExportService
+from h.services.annotation_export import annotation_export_factory
+
+
+@pytest.mark.usefixtures("search", "presentation_factory")
+class TestAnnotationExportService(object):
+    def test_it_scans_the_search(self, svc, search, pyramid_request):
+        params = MultiDict({"group": "abc123"})
+
+        list(svc.export(params))
+
+        search.assert_called_once_with(pyramid_request, stats=pyramid_request.stats)
+        search.return_value.scan.assert_called_once_with(params, size=2)
+
+    def test_it_presents_the_annotations_a_window_at_a_time(
+        self, svc, presentation_svc
+    ):
+        result = list(svc.export(MultiDict()))
+
+        assert presentation_svc.present_all.call_args_list == [
+            mock.call(["id-1", "id-2"]),
+            mock.call(["id-3", "id-4"]),
+            mock.call(["id-5"]),
+        ]
+        assert result == ["presented-id-{}".format(i) for i in range(1, 6)]
+
+    def test_it_uses_a_new_presentation_service_for_each_window(
+        self, svc, pyramid_request, presentation_factory
+    ):
+        list(svc.export(MultiDict()))
+
+        assert (
+            presentation_factory.call_args_list
+            == [mock.call(None, pyramid_request)] * 3
+        )
+
+    def test_it_doesnt_search_until_the_export_is_iterated(self, svc, search):
+        svc.export(MultiDict())
+
+        assert not search.called
+
+    def test_it_presents_nothing_if_nothing_matches(
+        self, svc, search, presentation_svc
+    ):
+        search.return_value.scan.return_value = iter([])
+
+        assert list(svc.export(MultiDict())) == []
+        assert not presentation_svc.present_all.called
+
+    @pytest.fixture
+    def svc(self, pyramid_request):
+        pyramid_request.stats = mock.Mock()
+        return AnnotationExportService(pyramid_request, window_size=2)
+
+    @pytest.fixture
+    def search(self, patch):
+        search = patch("h.services.annotation_export.Search")
+        search.return_value.scan.return_value = iter(
+            ["id-{}".format(i) for i in range(1, 6)]
+        )
+        return search
+
+    @pytest.fixture
+    def presentation_svc(self):
+        presentation_svc = mock.Mock(spec_set=["present_all"])
+        presentation_svc.present_all.side_effect = lambda ids: [
+            "presented-" + id_ for id_ in ids
+        ]
+        return presentation_svc
+
+    @pytest.fixture
+    def presentation_factory(self, patch, presentation_svc):
+        return patch(
+            "h.services.annotation_export.annotation_json_presentation_service_factory",
+            return_value=presentation_svc,
+        )
+
+
+class TestAnnotationExportFactory(object):
+    def test_it_returns_service(self, pyramid_request):
+        svc = annotation_export_factory(None, pyramid_request)
+
+        assert isinstance(svc, AnnotationExportService)
+        assert svc.request == pyramid_request
@@ -19,12 +19,10 @@ class TestAnnotationStatsService(object):
 
         search.assert_called_with(pyramid_request, stats=pyramid_request.stats)
 
-    def test_total_user_annotation_count_calls_run_with_userid_and_limit(
-        self, svc, search
-    ):
+    def test_total_user_annotation_count_calls_count_with_userid(self, svc, search):
         svc.total_user_annotation_count("userid")
 
-        search.return_value.run.assert_called_with({"limit": 0, "user": "userid"})
+        search.return_value.count.assert_called_with({"user": "userid"})
 
     def test_toal_user_annotation_count_attaches_correct_modifiers(
         self, svc, search, limiter, deleted_filter, user_filter
@@ -43,7 +41,7 @@ class TestAnnotationStatsService(object):
         )
 
     def test_total_user_annotation_count_returns_total(self, svc, search):
-        search.return_value.run.return_value.total = 3
+        search.return_value.count.return_value = 3
 
         anns = svc.total_user_annotation_count("userid")
 
@@ -56,10 +54,10 @@ class TestAnnotationStatsService(object):
 
         search.assert_called_with(pyramid_request, stats=pyramid_request.stats)
 
-    def test_user_annotation_count_calls_run_with_userid_and_limit(self, svc, search):
+    def test_user_annotation_count_calls_count_with_userid(self, svc, search):
         svc.user_annotation_count("userid")
 
-        search.return_value.run.assert_called_with({"limit": 0, "user": "userid"})
+        search.return_value.count.assert_called_with({"user": "userid"})
 
     def test_user_annotation_count_excludes_replies(
         self, svc, search, top_level_annotation_filter
@@ -71,7 +69,7 @@ class TestAnnotationStatsService(object):
         )
 
     def test_user_annotation_count_returns_total(self, svc, search):
-        search.return_value.run.return_value.total = 3
+        search.return_value.count.return_value = 3
 
         anns = svc.user_annotation_count("userid")
 
@@ -84,10 +82,10 @@ class TestAnnotationStatsService(object):
 
         search.assert_called_with(pyramid_request, stats=pyramid_request.stats)
 
-    def test_group_annotation_count_calls_run_with_groupid_and_limit(self, svc, search):
+    def test_group_annotation_count_calls_count_with_groupid(self, svc, search):
         svc.group_annotation_count("groupid")
 
-        search.return_value.run.assert_called_with({"limit": 0, "group": "groupid"})
+        search.return_value.count.assert_called_with({"group": "groupid"})
 
     def test_group_annotation_count_excludes_replies(
         self, svc, search, top_level_annotation_filter
@@ -99,7 +97,7 @@ class TestAnnotationStatsService(object):
         )
 
     def test_group_annotation_count_returns_total(self, svc, search):
-        search.return_value.run.return_value.total = 3
+        search.return_value.count.return_value = 3
 
         anns = svc.group_annotation_count("groupid")
 
@@ -7,6 +7,8 @@ import pytest
 
 from h.models import Group, User, GroupScope
 from h.models.group import JoinableBy, ReadableBy, WriteableBy
+from h.services.group import GROUPIDS_CACHE_KEY
+from h.services.group import GroupidsCache
 from h.services.group_create import GroupCreateService
 from h.services.group_create import group_create_factory
 from h.services.user import UserService
@@ -106,6 +108,15 @@ class TestCreatePrivateGroup(object):
 
         publish.assert_called_once_with("group-join", group.pubid, creator.userid)
 
+    def test_it_invalidates_the_creators_groupids(
+        self, svc, creator, groupids_cache, db_session
+    ):
+        svc.create_private_group("Anteater fans", creator.userid)
+
+        groupids_cache.invalidate.assert_called_once_with(
+            [creator.userid], session=db_session
+        )
+
 
 class TestCreateOpenGroup(object):
     def test_it_returns_group_model(self, creator, svc, origins):
@@ -195,6 +206,13 @@ class TestCreateOpenGroup(object):
 
         publish.assert_not_called()
 
+    def test_it_invalidates_everyones_groupids(
+        self, svc, creator, origins, groupids_cache, db_session
+    ):
+        svc.create_open_group("Anteater fans", creator.userid, origins=origins)
+
+        groupids_cache.invalidate.assert_called_once_with(None, session=db_session)
+
     def test_it_sets_scopes(self, svc, matchers, creator):
         origins = ["https://biopub.org", "http://example.com", "https://wikipedia.com"]
 
@@ -401,6 +419,14 @@ class TestGroupCreateFactory(object):
             }
         )
 
+    def test_provides_the_groupids_cache(self, pyramid_request):
+        cache = GroupidsCache()
+        pyramid_request.registry[GROUPIDS_CACHE_KEY] = cache
+
+        svc = group_create_factory(None, pyramid_request)
+
+        assert svc.groupids_cache == cache
+
 
 @pytest.fixture
 def usr_svc(pyramid_request, db_session):
@@ -424,8 +450,15 @@ def publish():
 
 
 @pytest.fixture
-def svc(db_session, usr_svc, publish):
-    return GroupCreateService(db_session, usr_svc, publish=publish)
+def groupids_cache():
+    return mock.create_autospec(GroupidsCache, instance=True, spec_set=True)
+
+
+@pytest.fixture
+def svc(db_session, usr_svc, publish, groupids_cache):
+    return GroupCreateService(
+        db_session, usr_svc, publish=publish, groupids_cache=groupids_cache
+    )
 
 
 @pytest.fixture
@@ -6,6 +6,8 @@ import mock
 import pytest
 
 from h.models import User, GroupScope
+from h.services.group import GROUPIDS_CACHE_KEY
+from h.services.group import GroupidsCache
 from h.services.group_members import GroupMembersService
 from h.services.group_members import group_members_factory
 from h.services.user import UserService
@@ -36,6 +38,18 @@ class TestMemberJoin(object):
 
         publish.assert_called_once_with("group-join", group.pubid, user.userid)
 
+    def test_it_invalidates_the_users_groupids(
+        self, group_members_service, factories, groupids_cache, db_session
+    ):
+        group = factories.Group()
+        user = factories.User()
+
+        group_members_service.member_join(group, user.userid)
+
+        groupids_cache.invalidate.assert_called_once_with(
+            [user.userid], session=db_session
+        )
+
 
 class TestMemberLeave(object):
     def test_it_removes_user_from_group(
@@ -68,6 +82,19 @@ class TestMemberLeave(object):
 
         publish.assert_called_once_with("group-leave", group.pubid, new_member.userid)
 
+    def test_it_invalidates_the_users_groupids(
+        self, group_members_service, factories, groupids_cache, db_session
+    ):
+        group = factories.Group()
+        new_member = factories.User()
+        group.members.append(new_member)
+
+        group_members_service.member_leave(group, new_member.userid)
+
+        groupids_cache.invalidate.assert_called_once_with(
+            [new_member.userid], session=db_session
+        )
+
 
 class TestAddMembers(object):
     def test_it_adds_users_in_userids(self, factories, group_members_service):
@@ -200,6 +227,14 @@ class TestFactory(object):
             }
         )
 
+    def test_provides_the_groupids_cache(self, pyramid_request):
+        cache = GroupidsCache()
+        pyramid_request.registry[GROUPIDS_CACHE_KEY] = cache
+
+        group_members_service = group_members_factory(None, pyramid_request)
+
+        assert group_members_service.groupids_cache == cache
+
 
 @pytest.fixture
 def usr_group_members_service(pyramid_request, db_session):
@@ -223,8 +258,20 @@ def publish():
 
 
 @pytest.fixture
-def group_members_service(db_session, usr_group_members_service, publish):
-    return GroupMembersService(db_session, usr_group_members_service, publish=publish)
+def groupids_cache():
+    return mock.create_autospec(GroupidsCache, instance=True, spec_set=True)
+
+
+@pytest.fixture
+def group_members_service(
+    db_session, usr_group_members_service, publish, groupids_cache
+):
+    return GroupMembersService(
+        db_session,
+        usr_group_members_service,
+        publish=publish,
+        groupids_cache=groupids_cache,
+    )
 
 
 @pytest.fixture
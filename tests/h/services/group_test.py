@@ -7,6 +7,8 @@ import pytest
 
 from h.models import User, Group, GroupScope
 from h.models.group import ReadableBy
+from h.services.group import GROUPIDS_CACHE_KEY
+from h.services.group import GroupidsCache
 from h.services.group import GroupService
 from h.services.group import groups_factory
 from h.services.user import UserService
@@ -103,6 +105,36 @@ class TestGroupServiceGroupIds(object):
 
         assert group.pubid in svc.groupids_readable_by(user)
 
+    def test_readable_by_members_includes_memberships(self, svc, db_session, factories):
+        user = factories.User()
+        group = factories.Group(readable_by=ReadableBy.members)
+        group.members.append(user)
+        db_session.flush()
+
+        assert svc.groupids_readable_by_members(user) == [group.pubid]
+
+    def test_readable_by_members_excludes_world_readable_groups(
+        self, svc, db_session, factories
+    ):
+        user = factories.User()
+        group = factories.Group(readable_by=ReadableBy.world)
+        group.members.append(user)
+        db_session.flush()
+
+        assert svc.groupids_readable_by_members(user) == []
+
+    def test_readable_by_members_excludes_other_groups(
+        self, svc, db_session, factories
+    ):
+        user = factories.User()
+        factories.Group(readable_by=ReadableBy.members)
+        db_session.flush()
+
+        assert svc.groupids_readable_by_members(user) == []
+
+    def test_readable_by_members_returns_empty_list_for_missing_user(self, svc):
+        assert svc.groupids_readable_by_members(None) == []
+
     def test_created_by_includes_created_groups(self, svc, factories):
         user = factories.User()
         group = factories.Group(creator=user)
@@ -122,6 +154,215 @@ class TestGroupServiceGroupIds(object):
         assert svc.groupids_created_by(None) == []
 
 
+class TestGroupServiceGroupIdsCache(object):
+    def test_readable_by_caches_the_groupids(self, cached_svc, db_session, factories):
+        user = factories.User()
+        group = factories.Group(readable_by=ReadableBy.members)
+        db_session.flush()
+        cached_svc.groupids_readable_by(user)
+
+        group.members.append(user)
+        db_session.flush()
+
+        assert group.pubid not in cached_svc.groupids_readable_by(user)
+
+    def test_readable_by_caches_the_groupids_of_each_user(
+        self, cached_svc, db_session, factories
+    ):
+        user = factories.User()
+        group = factories.Group(readable_by=ReadableBy.members)
+        group.members.append(user)
+        db_session.flush()
+        cached_svc.groupids_readable_by(None)
+
+        assert group.pubid in cached_svc.groupids_readable_by(user)
+
+    def test_readable_by_refetches_invalidated_groupids(
+        self, cached_svc, db_session, factories
+    ):
+        user = factories.User()
+        group = factories.Group(readable_by=ReadableBy.members)
+        db_session.flush()
+        cached_svc.groupids_readable_by(user)
+
+        group.members.append(user)
+        db_session.flush()
+        cached_svc.groupids_cache.invalidate([user.userid])
+
+        assert group.pubid in cached_svc.groupids_readable_by(user)
+
+    def test_readable_by_members_caches_the_groupids(
+        self, cached_svc, db_session, factories
+    ):
+        user = factories.User()
+        group = factories.Group(readable_by=ReadableBy.members)
+        db_session.flush()
+        cached_svc.groupids_readable_by_members(user)
+
+        group.members.append(user)
+        db_session.flush()
+
+        assert cached_svc.groupids_readable_by_members(user) == []
+
+    def test_created_by_caches_the_groupids(self, cached_svc, factories):
+        user = factories.User()
+        cached_svc.groupids_created_by(user)
+
+        factories.Group(creator=user)
+
+        assert cached_svc.groupids_created_by(user) == []
+
+    def test_created_by_returns_empty_list_for_missing_user(self, cached_svc):
+        assert cached_svc.groupids_created_by(None) == []
+
+
+class TestGroupidsCache(object):
+    def test_get_fetches_the_groupids(self, cache, fetch):
+        assert cache.get("readable", "acct:a@example.com", fetch) == ["abc", "def"]
+
+    def test_get_returns_cached_groupids(self, cache, fetch):
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        groupids = cache.get("readable", "acct:a@example.com", fetch)
+
+        assert groupids == ["abc", "def"]
+        assert fetch.call_count == 1
+
+    @pytest.mark.parametrize(
+        "kind,userid", [("created", "acct:a@example.com"), ("readable", None)]
+    )
+    def test_get_caches_each_kind_and_user(self, cache, fetch, kind, userid):
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        cache.get(kind, userid, fetch)
+
+        assert fetch.call_count == 2
+
+    def test_get_refetches_expired_groupids(self, cache, fetch, time):
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        time.time.return_value += 60
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        assert fetch.call_count == 2
+
+    def test_get_doesnt_cache_if_ttl_is_zero(self, fetch):
+        cache = GroupidsCache(ttl=0)
+
+        cache.get("readable", "acct:a@example.com", fetch)
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        assert fetch.call_count == 2
+
+    def test_get_forgets_expired_groupids_when_full(self, fetch, time):
+        cache = GroupidsCache(ttl=60, maxsize=2)
+        cache.get("readable", "acct:a@example.com", fetch)
+        time.time.return_value += 30
+        cache.get("readable", "acct:b@example.com", fetch)
+        time.time.return_value += 30
+
+        cache.get("readable", "acct:c@example.com", fetch)
+        cache.get("readable", "acct:b@example.com", fetch)
+
+        assert fetch.call_count == 3
+
+    def test_get_starts_afresh_when_full(self, fetch):
+        cache = GroupidsCache(ttl=60, maxsize=2)
+        cache.get("readable", "acct:a@example.com", fetch)
+        cache.get("readable", "acct:b@example.com", fetch)
+
+        cache.get("readable", "acct:c@example.com", fetch)
+        cache.get("readable", "acct:c@example.com", fetch)
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        assert fetch.call_count == 4
+
+    def test_invalidate_forgets_the_users_groupids(self, cache, fetch):
+        cache.get("readable", "acct:a@example.com", fetch)
+        cache.get("created", "acct:a@example.com", fetch)
+        cache.get("readable", "acct:b@example.com", fetch)
+
+        cache.invalidate(["acct:a@example.com"])
+        cache.get("readable", "acct:a@example.com", fetch)
+        cache.get("created", "acct:a@example.com", fetch)
+        cache.get("readable", "acct:b@example.com", fetch)
+
+        assert fetch.call_count == 5
+
+    def test_invalidate_forgets_everyones_groupids(self, cache, fetch):
+        cache.get("readable", "acct:a@example.com", fetch)
+        cache.get("readable", None, fetch)
+
+        cache.invalidate()
+        cache.get("readable", "acct:a@example.com", fetch)
+        cache.get("readable", None, fetch)
+
+        assert fetch.call_count == 4
+
+    def test_invalidate_forgets_the_groupids_again_after_the_transaction(
+        self, cache, fetch, db_session
+    ):
+        cache.invalidate(["acct:a@example.com"], session=db_session)
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        transaction = mock.Mock()
+        transaction.parent = None
+        db_session.dispatch.after_transaction_end(db_session, transaction)
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        assert fetch.call_count == 2
+
+    def test_invalidate_forgets_everyones_groupids_again_after_the_transaction(
+        self, cache, fetch, db_session
+    ):
+        cache.invalidate(["acct:a@example.com"], session=db_session)
+        cache.invalidate(session=db_session)
+        cache.get("readable", "acct:b@example.com", fetch)
+
+        transaction = mock.Mock()
+        transaction.parent = None
+        db_session.dispatch.after_transaction_end(db_session, transaction)
+        cache.get("readable", "acct:b@example.com", fetch)
+
+        assert fetch.call_count == 2
+
+    def test_invalidate_listens_to_the_session_once(self, cache, db_session):
+        with mock.patch("h.services.group.on_transaction_end") as on_transaction_end:
+            cache.invalidate(["acct:a@example.com"], session=db_session)
+            cache.invalidate(["acct:b@example.com"], session=db_session)
+            cache.invalidate(session=db_session)
+
+        on_transaction_end.assert_called_once_with(db_session)
+
+    def test_invalidate_only_forgets_the_groupids_once_after_the_transaction(
+        self, cache, fetch, db_session
+    ):
+        cache.invalidate(["acct:a@example.com"], session=db_session)
+        transaction = mock.Mock()
+        transaction.parent = None
+        db_session.dispatch.after_transaction_end(db_session, transaction)
+
+        cache.get("readable", "acct:a@example.com", fetch)
+        db_session.dispatch.after_transaction_end(db_session, transaction)
+        cache.get("readable", "acct:a@example.com", fetch)
+
+        assert fetch.call_count == 1
+
+    @pytest.fixture
+    def cache(self):
+        return GroupidsCache(ttl=60)
+
+    @pytest.fixture
+    def fetch(self):
+        return mock.Mock(spec_set=[], return_value=["abc", "def"])
+
+    @pytest.fixture
+    def time(self, patch):
+        time = patch("h.services.group.time")
+        time.time.return_value = 1000.0
+        return time
+
+
 @pytest.mark.usefixtures("user_service")
 class TestGroupsFactory(object):
     def test_returns_groups_service(self, pyramid_request):
@@ -141,6 +382,14 @@ class TestGroupsFactory(object):
 
         user_service.fetch.assert_called_once_with("foo")
 
+    def test_provides_the_groupids_cache(self, pyramid_request):
+        cache = GroupidsCache()
+        pyramid_request.registry[GROUPIDS_CACHE_KEY] = cache
+
+        svc = groups_factory(None, pyramid_request)
+
+        assert svc.groupids_cache == cache
+
 
 @pytest.fixture
 def usr_svc(pyramid_request, db_session):
@@ -158,6 +407,11 @@ def svc(db_session, usr_svc):
     return GroupService(db_session, usr_svc)
 
 
+@pytest.fixture
+def cached_svc(db_session, usr_svc):
+    return GroupService(db_session, usr_svc, groupids_cache=GroupidsCache())
+
+
 @pytest.fixture
 def user_service(pyramid_config):
     service = mock.create_autospec(UserService, spec_set=True, instance=True)
@@ -4,10 +4,14 @@ from __future__ import unicode_literals
 
 import pytest
 import mock
+import transaction
 
 from sqlalchemy.exc import SQLAlchemyError
 
+from h.models.group import ReadableBy
 from h.services.exceptions import ConflictError, ValidationError
+from h.services.group import GROUPIDS_CACHE_KEY
+from h.services.group import GroupidsCache
 from h.services.group_update import GroupUpdateService
 from h.services.group_update import group_update_factory
 
@@ -72,12 +76,81 @@ class TestGroupUpdate(object):
         fake_session = mock.Mock()
         fake_session.flush.side_effect = SQLAlchemyError("foo")
 
-        update_svc = GroupUpdateService(session=fake_session)
+        update_svc = GroupUpdateService(
+            session=fake_session, transaction_manager=transaction.TransactionManager()
+        )
         group = factories.Group(authority_provided_id="foo", authority="foo.com")
 
         with pytest.raises(SQLAlchemyError):
             update_svc.update(group, name="fingers")
 
+    def test_it_reindexes_the_groups_annotations_if_readable_by_changes(
+        self, factories, svc, reindex_group_annotations, transaction_manager
+    ):
+        group = factories.Group(readable_by=ReadableBy.members)
+
+        svc.update(group, readable_by=ReadableBy.world)
+        transaction_manager.commit()
+
+        reindex_group_annotations.delay.assert_called_once_with(group.pubid)
+
+    def test_it_doesnt_reindex_the_groups_annotations_before_the_commit(
+        self, factories, svc, reindex_group_annotations
+    ):
+        group = factories.Group(readable_by=ReadableBy.members)
+
+        svc.update(group, readable_by=ReadableBy.world)
+
+        reindex_group_annotations.delay.assert_not_called()
+
+    def test_it_doesnt_reindex_the_groups_annotations_if_the_commit_fails(
+        self, factories, svc, reindex_group_annotations, transaction_manager
+    ):
+        group = factories.Group(readable_by=ReadableBy.members)
+
+        svc.update(group, readable_by=ReadableBy.world)
+        for hook, args, kwargs in transaction_manager.get().getAfterCommitHooks():
+            hook(False, *args, **kwargs)
+
+        reindex_group_annotations.delay.assert_not_called()
+
+    def test_it_doesnt_reindex_the_groups_annotations_if_readable_by_is_unchanged(
+        self, factories, svc, reindex_group_annotations, transaction_manager
+    ):
+        group = factories.Group(readable_by=ReadableBy.world)
+
+        svc.update(group, name="whatnot", readable_by=ReadableBy.world)
+        transaction_manager.commit()
+
+        reindex_group_annotations.delay.assert_not_called()
+
+    def test_it_invalidates_everyones_groupids_if_readable_by_changes(
+        self, factories, svc, groupids_cache, db_session
+    ):
+        group = factories.Group()
+
+        svc.update(group, readable_by=ReadableBy.world)
+
+        groupids_cache.invalidate.assert_called_once_with(session=db_session)
+
+    def test_it_invalidates_everyones_groupids_if_creator_changes(
+        self, factories, svc, groupids_cache, db_session
+    ):
+        group = factories.Group()
+
+        svc.update(group, creator=factories.User())
+
+        groupids_cache.invalidate.assert_called_once_with(session=db_session)
+
+    def test_it_doesnt_invalidate_groupids_for_other_changes(
+        self, factories, svc, groupids_cache
+    ):
+        group = factories.Group()
+
+        svc.update(group, name="whatnot")
+
+        groupids_cache.invalidate.assert_not_called()
+
 
 class TestFactory(object):
     def test_returns_group_update_service(self, pyramid_request):
@@ -85,7 +158,41 @@ class TestFactory(object):
 
         assert isinstance(group_update_service, GroupUpdateService)
 
+    def test_provides_the_requests_transaction_manager(self, pyramid_request):
+        pyramid_request.tm = transaction.TransactionManager()
+
+        group_update_service = group_update_factory(None, pyramid_request)
+
+        assert group_update_service.transaction_manager == pyramid_request.tm
+
+    def test_provides_the_groupids_cache(self, pyramid_request):
+        cache = GroupidsCache()
+        pyramid_request.registry[GROUPIDS_CACHE_KEY] = cache
+
+        group_update_service = group_update_factory(None, pyramid_request)
+
+        assert group_update_service.groupids_cache == cache
+
+
+@pytest.fixture
+def groupids_cache():
+    return mock.create_autospec(GroupidsCache, instance=True, spec_set=True)
+
+
+@pytest.fixture(autouse=True)
+def reindex_group_annotations(patch):
+    return patch("h.services.group_update.reindex_group_annotations")
+
+
+@pytest.fixture
+def transaction_manager():
+    return transaction.TransactionManager()
+
 
 @pytest.fixture
-def svc(db_session):
-    return GroupUpdateService(session=db_session)
+def svc(db_session, transaction_manager, groupids_cache):
+    return GroupUpdateService(
+        session=db_session,
+        transaction_manager=transaction_manager,
+        groupids_cache=groupids_cache,
+    )
@@ -33,6 +33,34 @@ class TestNipsaService(object):
 
         assert not svc.is_flagged("acct:not_in_the_db@example.com")
 
+    def test_flagged_userids_returns_the_flagged_subset(self, db_session):
+        svc = NipsaService(db_session)
+
+        flagged = svc.flagged_userids(
+            [
+                "acct:renata@example.com",
+                "acct:dominic@example.com",
+                "acct:not_in_the_db@example.com",
+            ]
+        )
+
+        assert flagged == set(["acct:renata@example.com"])
+
+    def test_flagged_userids_returns_empty_set_for_no_userids(self, db_session):
+        svc = NipsaService(db_session)
+
+        assert svc.flagged_userids([]) == set()
+
+    def test_flagged_userids_uses_the_cache_if_populated(self, db_session, users):
+        svc = NipsaService(db_session)
+
+        svc.fetch_all_flagged_userids()
+        users["dominic"].nipsa = True  # Make sure result below comes from cache.
+
+        assert svc.flagged_userids(
+            ["acct:renata@example.com", "acct:dominic@example.com"]
+        ) == set(["acct:renata@example.com"])
+
     def test_flag_sets_nipsa_true(self, db_session, users):
         svc = NipsaService(db_session)
 
@@ -99,6 +99,25 @@ class TestExpandURI(object):
             "http://bar.com/",
         ]
 
+    def test_expand_uri_caches_the_document_uris(self, db_session):
+        document = Document(
+            document_uris=[
+                DocumentURI(uri="http://foo.com/", claimant="http://bar.com"),
+                DocumentURI(uri="http://bar.com/", claimant="http://bar.com"),
+            ]
+        )
+        db_session.add(document)
+        db_session.flush()
+        storage.expand_uri(db_session, "http://foo.com/")
+
+        db_session.delete(document.document_uris[1])
+        db_session.flush()
+
+        assert storage.expand_uri(db_session, "http://foo.com/") == [
+            "http://foo.com/",
+            "http://bar.com/",
+        ]
+
 
 @pytest.mark.usefixtures("models", "group_service", "update_document_metadata")
 class TestCreateAnnotation(object):
@@ -2,7 +2,7 @@ from __future__ import unicode_literals
 
 import pytest
 
-from h.streamer.filter import FilterHandler
+from h.streamer.filter import FilterHandler, NormalizedTarget, SubscriptionIndex
 
 
 class TestFilterHandler(object):
@@ -65,3 +65,231 @@ class TestFilterHandler(object):
 
         ann = {"id": "abc", "uri": "https://example.com", "references": ["456"]}
         assert handler.match(ann) is False
+
+    def test_it_matches_tags_case_insensitively(self):
+        handler = FilterHandler(
+            self.query({"field": "/tags", "operator": "one_of", "value": "Foo"})
+        )
+
+        assert handler.match({"tags": ["bar", "FOO"]}) is True
+        assert handler.match({"tags": ["bar"]}) is False
+
+    def test_one_of_with_a_string_term_does_a_substring_match(self):
+        handler = FilterHandler(
+            self.query({"field": "/id", "operator": "one_of", "value": "abc123"})
+        )
+
+        assert handler.match({"id": "abc"}) is True
+        assert handler.match({"id": "xyz"}) is False
+
+    def test_it_does_not_match_missing_fields(self):
+        handler = FilterHandler(
+            self.query({"field": "/user", "operator": "equals", "value": "acct:a@b"})
+        )
+
+        assert handler.match({"id": "abc"}) is False
+
+    def test_it_matches_everything_without_clauses(self):
+        assert FilterHandler(self.query()).match({"id": "abc"}) is True
+
+    def test_it_accepts_a_normalized_target(self):
+        handler = FilterHandler(
+            self.query(
+                {"field": "/uri", "operator": "one_of", "value": ["http://a.com"]}
+            )
+        )
+
+        assert handler.match(NormalizedTarget({"uri": "https://a.com/"})) is True
+
+    def test_it_normalizes_filter_terms_only_once(self, normalize_uri):
+        handler = FilterHandler(
+            self.query(
+                {"field": "/uri", "operator": "one_of", "value": ["http://a.com"]}
+            )
+        )
+        normalize_uri.reset_mock()
+
+        handler.match({"uri": "http://a.com"})
+        handler.match({"uri": "http://a.com"})
+
+        # Only the annotation's URI is normalized when matching.
+        assert normalize_uri.call_count == 2
+
+    def test_index_keys_returns_normalized_terms(self):
+        handler = FilterHandler(
+            self.query(
+                {
+                    "field": "/uri",
+                    "operator": "one_of",
+                    "value": ["https://example.com", "http://example.org/?"],
+                },
+                {"field": "/references", "operator": "one_of", "value": ["AbC"]},
+            )
+        )
+
+        assert sorted(handler.index_keys()) == [
+            ("/references", "abc"),
+            ("/uri", "httpx://example.com"),
+            ("/uri", "httpx://example.org"),
+        ]
+
+    @pytest.mark.parametrize(
+        "clause",
+        [
+            # Scalar `one_of` terms do a substring match against scalar fields.
+            {"field": "/id", "operator": "one_of", "value": "123"},
+            {"field": "/id", "operator": "one_of", "value": []},
+            {"field": "/id", "operator": "equals", "value": {"foo": "bar"}},
+        ],
+    )
+    def test_index_keys_returns_None_for_unindexable_clauses(self, clause):
+        handler = FilterHandler(
+            self.query({"field": "/id", "operator": "equals", "value": "1"}, clause)
+        )
+
+        assert handler.index_keys() is None
+
+    def test_index_keys_returns_None_without_clauses(self):
+        assert FilterHandler(self.query()).index_keys() is None
+
+    def query(self, *clauses):
+        return {"match_policy": "include_any", "actions": {}, "clauses": list(clauses)}
+
+    @pytest.fixture
+    def normalize_uri(self, patch):
+        normalize_uri = patch("h.streamer.filter.normalize_uri")
+        normalize_uri.side_effect = lambda uri: uri
+        return normalize_uri
+
+
+class TestNormalizedTarget(object):
+    def test_get_returns_normalized_value(self):
+        target = NormalizedTarget({"uri": "http://example.com/", "tags": ["FoO"]})
+
+        assert target.get("/uri") == "httpx://example.com"
+        assert target.get("/tags") == ["foo"]
+
+    def test_get_returns_None_for_missing_fields(self):
+        assert NormalizedTarget({}).get("/uri") is None
+
+    def test_get_normalizes_each_field_once(self, patch):
+        normalize_term = patch("h.streamer.filter.normalize_term")
+        target = NormalizedTarget({"uri": "http://example.com/"})
+
+        target.get("/uri")
+        target.get("/uri")
+
+        normalize_term.assert_called_once_with("/uri", "http://example.com/")
+
+
+class TestSubscriptionIndex(object):
+    def test_candidates_includes_sockets_filtering_on_matching_uri(self, index):
+        socket = self.socket_filtering_on("/uri", ["https://example.com"])
+        index.update(socket)
+
+        assert index.candidates({"uri": "http://example.com/"}) == {socket}
+
+    def test_candidates_excludes_sockets_filtering_on_other_uris(self, index):
+        index.update(self.socket_filtering_on("/uri", ["https://example.com"]))
+
+        assert index.candidates({"uri": "https://example.org"}) == set()
+
+    def test_candidates_matches_items_of_list_fields(self, index):
+        socket = self.socket_filtering_on("/references", ["123"])
+        index.update(socket)
+
+        assert index.candidates({"references": ["456", "123"]}) == {socket}
+
+    def test_candidates_always_includes_unindexable_sockets(self, index):
+        socket = FakeSocket(FilterHandler({"clauses": []}))
+        index.update(socket)
+
+        assert index.candidates({"uri": "https://example.org"}) == {socket}
+
+    def test_candidates_includes_field_subscribers_for_unhashable_items(self, index):
+        socket = self.socket_filtering_on("/target", ["foo"])
+        index.update(socket)
+
+        assert index.candidates({"target": [{"source": "bar"}]}) == {socket}
+
+    def test_update_ignores_sockets_without_filters(self, index):
+        index.update(FakeSocket(None))
+
+        assert len(index) == 0
+
+    def test_update_replaces_previous_keys(self, index):
+        socket = self.socket_filtering_on("/uri", ["https://example.com"])
+        index.update(socket)
+        socket.filter = FilterHandler(
+            TestFilterHandler().query(
+                {"field": "/uri", "operator": "one_of", "value": ["https://foo.com"]}
+            )
+        )
+
+        index.update(socket)
+
+        assert index.candidates({"uri": "https://example.com"}) == set()
+        assert index.candidates({"uri": "https://foo.com"}) == {socket}
+
+    def test_remove(self, index):
+        socket = self.socket_filtering_on("/uri", ["https://example.com"])
+        index.update(socket)
+
+        index.remove(socket)
+
+        assert index.candidates({"uri": "https://example.com"}) == set()
+        assert len(index) == 0
+
+    def test_remove_ignores_unknown_sockets(self, index):
+        index.remove(FakeSocket(None))
+
+    def test_uris_returns_the_uris_filtered_on(self, index):
+        index.update(self.socket_filtering_on("/uri", ["https://example.com"]))
+        index.update(self.socket_filtering_on("/uri", ["https://example.org"]))
+
+        assert index.uris() == {"httpx://example.com", "httpx://example.org"}
+
+    def test_uris_returns_None_if_a_filter_uses_other_fields(self, index):
+        index.update(self.socket_filtering_on("/uri", ["https://example.com"]))
+        index.update(self.socket_filtering_on("/references", ["123"]))
+
+        assert index.uris() is None
+
+    def test_uris_returns_None_if_a_filter_cant_be_indexed(self, index):
+        index.update(FakeSocket(FilterHandler({"clauses": []})))
+
+        assert index.uris() is None
+
+    def test_uris_forgets_removed_sockets(self, index):
+        socket = self.socket_filtering_on("/references", ["123"])
+        index.update(socket)
+
+        index.remove(socket)
+
+        assert index.uris() == set()
+
+    def test_version_changes_when_the_index_changes(self, index):
+        socket = self.socket_filtering_on("/uri", ["https://example.com"])
+        versions = [index.version]
+
+        index.update(socket)
+        versions.append(index.version)
+        index.remove(socket)
+        versions.append(index.version)
+
+        assert len(set(versions)) == 3
+
+    def socket_filtering_on(self, field, value):
+        query = TestFilterHandler().query(
+            {"field": field, "operator": "one_of", "value": value}
+        )
+        return FakeSocket(FilterHandler(query))
+
+    @pytest.fixture
+    def index(self):
+        return SubscriptionIndex()
+
+
+class FakeSocket(object):
+    def __init__(self, filter_):
+        self.filter = filter_
@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import json
+
 import mock
 import pytest
 from gevent.queue import Queue
 from pyramid import security
 from pyramid import registry
+from pyramid.registry import Registry
 
+from h import realtime
+from h.db.types import InvalidUUID
 from h.streamer import messages
+from h.streamer import websocket
+from h.streamer.filter import NormalizedTarget
 
 
 class FakeSocket(object):
@@ -31,6 +38,9 @@ class FakeSocket(object):
     def send_json(self, payload):
         self.send_json_payloads.append(payload)
 
+    def send_broadcast(self, broadcast, key=None):
+        self.send_json_payloads.append(json.loads(broadcast.data))
+
 
 @pytest.mark.usefixtures("fake_sentry", "fake_stats")
 class TestProcessMessages(object):
@@ -50,6 +60,7 @@ class TestProcessMessages(object):
             handler=mock.ANY,
             sentry_client=fake_sentry.get_client.return_value,
             statsd_client=mock.ANY,
+            bindings=None,
         )
 
     def test_creates_statsd_client(self, fake_stats, fake_consumer, queue):
@@ -68,6 +79,7 @@ class TestProcessMessages(object):
             handler=mock.ANY,
             sentry_client=mock.ANY,
             statsd_client=fake_stats.get_client.return_value,
+            bindings=None,
         )
 
     def test_passes_routing_key_to_consumer(self, fake_consumer, queue):
@@ -79,6 +91,7 @@ class TestProcessMessages(object):
             handler=mock.ANY,
             sentry_client=mock.ANY,
             statsd_client=mock.ANY,
+            bindings=None,
         )
 
     def test_initializes_new_connection(self, fake_realtime, fake_consumer, queue):
@@ -96,6 +109,7 @@ class TestProcessMessages(object):
             handler=mock.ANY,
             sentry_client=mock.ANY,
             statsd_client=mock.ANY,
+            bindings=None,
         )
 
     def test_runs_consumer(self, fake_consumer, queue):
@@ -104,6 +118,25 @@ class TestProcessMessages(object):
         consumer = fake_consumer.return_value
         consumer.run.assert_called_once_with()
 
+    def test_binds_the_annotation_consumer_to_subscribed_shards(
+        self, fake_consumer, queue
+    ):
+        settings = {"h.realtime_shards": 8}
+
+        messages.process_messages(settings, "annotation", queue, raise_error=False)
+
+        bindings = fake_consumer.call_args[1]["bindings"]
+        assert isinstance(bindings, messages.ShardBindings)
+        assert bindings.shards == 8
+        assert bindings.subscriptions is websocket.WebSocket.subscriptions
+
+    def test_doesnt_shard_other_consumers(self, fake_consumer, queue):
+        settings = {"h.realtime_shards": 8}
+
+        messages.process_messages(settings, "user", queue, raise_error=False)
+
+        assert fake_consumer.call_args[1]["bindings"] is None
+
     def test_message_handler_puts_message_on_queue(self, fake_consumer, queue):
         messages.process_messages({}, "foobar", queue, raise_error=False)
         message_handler = fake_consumer.call_args[1]["handler"]
@@ -134,80 +167,120 @@ class TestProcessMessages(object):
         return Queue()
 
 
+class TestShardBindings(object):
+    def test_returns_the_shards_of_the_subscribed_uris(self, subscriptions):
+        subscriptions.uris.return_value = {"httpx://example.com"}
+        bindings = messages.ShardBindings(8, subscriptions)
+
+        assert bindings() == {realtime.annotation_routing_key("httpx://example.com", 8)}
+
+    def test_returns_all_shards_if_any_filter_is_unrestricted(self, subscriptions):
+        subscriptions.uris.return_value = None
+        bindings = messages.ShardBindings(3, subscriptions)
+
+        assert bindings() == {"annotation.0", "annotation.1", "annotation.2"}
+
+    def test_reuses_the_routing_keys_until_the_subscriptions_change(
+        self, subscriptions
+    ):
+        subscriptions.uris.return_value = {"httpx://example.com"}
+        bindings = messages.ShardBindings(8, subscriptions)
+        bindings()
+        bindings()
+        assert subscriptions.uris.call_count == 1
+
+        subscriptions.version += 1
+        bindings()
+        assert subscriptions.uris.call_count == 2
+
+    @pytest.fixture
+    def subscriptions(self):
+        return mock.Mock(spec_set=["uris", "version"], version=0)
+
+
 class TestHandleMessage(object):
-    def test_calls_handler_with_list_of_sockets(self, websocket):
+    def test_calls_handler_with_registry_and_session(self):
         handler = mock.Mock(return_value=None)
         session = mock.sentinel.db_session
-        settings = mock.sentinel.settings
+        registry = mock.sentinel.registry
         message = messages.Message(topic="foo", payload={"foo": "bar"})
-        websocket.instances = [FakeSocket("a"), FakeSocket("b")]
 
         messages.handle_message(
-            message, settings, session, topic_handlers={"foo": handler}
+            message, registry, session, topic_handlers={"foo": handler}
         )
 
-        handler.assert_called_once_with(
-            message.payload, list(websocket.instances), settings, session
-        )
+        handler.assert_called_once_with(message.payload, registry, session)
 
-    @pytest.fixture
-    def websocket(self, patch):
-        return patch("h.streamer.websocket.WebSocket")
+    def test_raises_for_unknown_topic(self):
+        message = messages.Message(topic="bar", payload={"foo": "bar"})
+
+        with pytest.raises(RuntimeError):
+            messages.handle_message(
+                message, mock.sentinel.registry, None, topic_handlers={}
+            )
 
 
 @pytest.mark.usefixtures(
-    "fetch_annotation", "groupfinder_service", "links_service", "nipsa_service"
+    "fetch_ordered_annotations", "groupfinder_service", "links_service", "nipsa_service"
 )
 class TestHandleAnnotationEvent(object):
-    def test_it_fetches_the_annotation(self, fetch_annotation, presenter_asdict):
-        message = {
-            "annotation_id": "panda",
-            "action": "update",
-            "src_client_id": "pigeon",
-        }
+    def test_it_fetches_the_annotation(
+        self, registry, subscriptions, fetch_ordered_annotations, presenter_asdict
+    ):
+        message = {"annotation_id": "_", "action": "update", "src_client_id": "pigeon"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
-        fetch_annotation.assert_called_once_with(session, "panda")
+        fetch_ordered_annotations.assert_called_once_with(
+            session, ["_"], query_processor=mock.ANY
+        )
 
-    def test_it_skips_notification_when_fetch_failed(self, fetch_annotation):
+    def test_it_skips_notification_when_fetch_failed(
+        self, registry, subscriptions, fetch_ordered_annotations
+    ):
         """
         When a create/update and a delete event happens in quick succession
         we could fail to load the annotation, even though the event action is
         update/create. This tests that in that case we silently abort and don't
         sent a notification to the client.
         """
-        message = {
-            "annotation_id": "panda",
-            "action": "update",
-            "src_client_id": "pigeon",
-        }
+        message = {"annotation_id": "_", "action": "update", "src_client_id": "pigeon"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
-        fetch_annotation.return_value = None
+        fetch_ordered_annotations.return_value = []
+
+        subscriptions.candidates.return_value = {socket}
 
-        result = messages.handle_annotation_event(message, [socket], settings, session)
+        result = messages.handle_annotation_event(message, registry, session)
 
         assert result is None
+        assert socket.send_json_payloads == []
 
-    def test_it_initializes_groupfinder_service(self, groupfinder_service):
+    def test_it_initializes_groupfinder_service(
+        self, registry, subscriptions, groupfinder_service, presenter_asdict
+    ):
         message = {"action": "_", "annotation_id": "_", "src_client_id": "_"}
         session = mock.sentinel.db_session
         socket = FakeSocket("giraffe")
-        settings = {"h.authority": "example.org"}
+        registry.settings["h.authority"] = "example.org"
+        presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         groupfinder_service.assert_called_once_with(session, "example.org")
 
     def test_it_serializes_the_annotation(
         self,
-        fetch_annotation,
+        registry,
+        subscriptions,
+        annotation,
         links_service,
         groupfinder_service,
         annotation_resource,
@@ -216,17 +289,17 @@ class TestHandleAnnotationEvent(object):
         message = {"action": "_", "annotation_id": "_", "src_client_id": "_"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenters.AnnotationJSONPresenter.return_value.asdict.return_value = (
             self.serialized_annotation()
         )
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
+        links_service.assert_called_once_with("http://streamer", registry)
         annotation_resource.assert_called_once_with(
-            fetch_annotation.return_value,
-            groupfinder_service.return_value,
-            links_service.return_value,
+            annotation, groupfinder_service.return_value, links_service.return_value
         )
 
         presenters.AnnotationJSONPresenter.assert_called_once_with(
@@ -234,124 +307,211 @@ class TestHandleAnnotationEvent(object):
         )
         assert presenters.AnnotationJSONPresenter.return_value.asdict.called
 
-    def test_notification_format(self, presenter_asdict):
+    def test_it_finds_sockets_for_the_serialized_annotation(
+        self, registry, subscriptions, presenter_asdict
+    ):
+        message = {"action": "_", "annotation_id": "_", "src_client_id": "_"}
+        presenter_asdict.return_value = self.serialized_annotation()
+        subscriptions.candidates.return_value = set()
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        target = subscriptions.candidates.call_args[0][0]
+        assert isinstance(target, NormalizedTarget)
+        assert target.target == self.serialized_annotation()
+
+    def test_notification_format(
+        self, registry, subscriptions, presenter_asdict, replay
+    ):
         """Check the format of the returned notification in the happy case."""
-        message = {
-            "annotation_id": "panda",
-            "action": "update",
-            "src_client_id": "pigeon",
-        }
+        message = {"annotation_id": "_", "action": "update", "src_client_id": "pigeon"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads[0] == {
             "payload": [self.serialized_annotation()],
             "type": "annotation-notification",
-            "options": {"action": "update"},
+            "options": {"action": "update", "seq": 1, "stream": replay.stream},
         }
 
-    def test_notification_format_delete(self, fetch_annotation, presenter_asdict):
+    def test_notification_format_delete(
+        self, registry, subscriptions, annotation, presenter_asdict, replay
+    ):
         """Check the format of the returned notification for deletes."""
         message = {"annotation_id": "_", "action": "delete", "src_client_id": "pigeon"}
-        annotation = fetch_annotation.return_value
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads[0] == {
             "payload": [{"id": annotation.id}],
             "type": "annotation-notification",
-            "options": {"action": "delete"},
+            "options": {"action": "delete", "seq": 1, "stream": replay.stream},
         }
 
-    def test_no_send_for_sender_socket(self, presenter_asdict):
+    def test_no_send_for_sender_socket(self, registry, subscriptions, presenter_asdict):
         """Should return None if the socket's client_id matches the message's."""
         message = {"src_client_id": "pigeon", "annotation_id": "_", "action": "_"}
         socket = FakeSocket("pigeon")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads == []
 
-    def test_no_send_if_no_socket_filter(self, presenter_asdict):
+    def test_no_send_if_no_socket_filter(
+        self, registry, subscriptions, presenter_asdict
+    ):
         """Should return None if the socket has no filter."""
         message = {"src_client_id": "_", "annotation_id": "_", "action": "_"}
         socket = FakeSocket("giraffe")
         socket.filter = None
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads == []
 
-    def test_no_send_if_action_is_read(self, presenter_asdict):
+    def test_sends_the_same_encoded_notification_to_every_socket(
+        self, registry, subscriptions, presenter_asdict
+    ):
+        message = {"action": "update", "src_client_id": "_", "annotation_id": "_"}
+        sockets = [mock.Mock(client_id=None, effective_principals=[security.Everyone])]
+        sockets.append(
+            mock.Mock(client_id=None, effective_principals=[security.Everyone])
+        )
+        presenter_asdict.return_value = self.serialized_annotation()
+        subscriptions.candidates.return_value = sockets
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        broadcast = sockets[0].send_broadcast.call_args[0][0]
+        assert json.loads(broadcast.data)["type"] == "annotation-notification"
+        sockets[1].send_broadcast.assert_called_once_with(broadcast, key="_")
+        assert presenter_asdict.call_count == 1
+
+    def test_notifications_are_numbered_in_sequence(
+        self, registry, subscriptions, presenter_asdict
+    ):
+        message = {"action": "update", "src_client_id": "_", "annotation_id": "_"}
+        socket = FakeSocket("giraffe")
+        presenter_asdict.return_value = self.serialized_annotation()
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        seqs = [p["options"]["seq"] for p in socket.send_json_payloads]
+        assert seqs == [1, 2]
+
+    def test_it_keeps_notifications_for_replay(
+        self, registry, subscriptions, presenter_asdict, replay
+    ):
+        message = {"action": "update", "src_client_id": "_", "annotation_id": "_"}
+        presenter_asdict.return_value = self.serialized_annotation()
+        subscriptions.candidates.return_value = set()
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        (entry,) = replay.since(0)
+        assert entry.seq == 1
+        assert entry.key == "_"
+        assert json.loads(entry.broadcast.data)["options"]["seq"] == 1
+
+    def test_replayed_notifications_are_checked_against_the_socket(
+        self, registry, subscriptions, presenter_asdict, replay
+    ):
+        message = {"action": "update", "src_client_id": "pigeon", "annotation_id": "_"}
+        presenter_asdict.return_value = self.serialized_annotation()
+        subscriptions.candidates.return_value = set()
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        (entry,) = replay.since(0)
+        assert entry.recipient(FakeSocket("giraffe"))
+        assert not entry.recipient(FakeSocket("pigeon"))
+
+    def test_no_send_if_action_is_read(self, registry, subscriptions, presenter_asdict):
         """Should return None if the message action is 'read'."""
         message = {"action": "read", "src_client_id": "_", "annotation_id": "_"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads == []
 
-    def test_no_send_if_filter_does_not_match(self, presenter_asdict):
+    def test_no_send_if_filter_does_not_match(
+        self, registry, subscriptions, presenter_asdict
+    ):
         """Should return None if the socket filter doesn't match the message."""
         message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
         socket = FakeSocket("giraffe")
         socket.filter.match.return_value = False
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads == []
 
-    def test_no_send_if_annotation_nipsad(self, nipsa_service, presenter_asdict):
+    def test_no_send_if_annotation_nipsad(
+        self, registry, subscriptions, annotation, nipsa_service, presenter_asdict
+    ):
         """Should return None if the annotation is from a NIPSA'd user."""
         message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
-        nipsa_service.return_value.is_flagged.return_value = True
+        nipsa_service.return_value.flagged_userids.return_value = {annotation.userid}
+
+        subscriptions.candidates.return_value = {socket}
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads == []
 
     def test_sends_nipsad_annotations_to_owners(
-        self, fetch_annotation, nipsa_service, presenter_asdict
+        self, registry, subscriptions, annotation, nipsa_service, presenter_asdict
     ):
         """NIPSA'd users should see their own annotations."""
         message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
-        fetch_annotation.return_value.userid = "fred"
+        annotation.userid = "fred"
         socket = FakeSocket("giraffe")
         socket.authenticated_userid = "fred"
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
-        nipsa_service.return_value.is_flagged.return_value = True
+        nipsa_service.return_value.flagged_userids.return_value = {annotation.userid}
+
+        subscriptions.candidates.return_value = {socket}
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, registry, session)
 
         assert len(socket.send_json_payloads) == 1
 
-    def test_sends_if_annotation_public(self, presenter_asdict):
+    def test_sends_if_annotation_public(
+        self, registry, subscriptions, presenter_asdict
+    ):
         """
         Everyone should see annotations which are public.
 
@@ -364,44 +524,156 @@ class TestHandleAnnotationEvent(object):
         message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
         socket = FakeSocket("giraffe")
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert len(socket.send_json_payloads) == 1
 
-    def test_no_send_if_not_in_group(self, presenter_asdict):
+    def test_no_send_if_not_in_group(
+        self, registry, subscriptions, presenter_asdict, principals
+    ):
         """Users shouldn't see annotations in groups they aren't members of."""
         message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
         socket = FakeSocket("giraffe")
         socket.authenticated_userid = "fred"
+        principals.add(socket)
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation(
             {"permissions": {"read": ["group:private-group"]}}
         )
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert socket.send_json_payloads == []
 
-    def test_sends_if_in_group(self, presenter_asdict):
+    def test_sends_if_in_group(
+        self, registry, subscriptions, presenter_asdict, principals
+    ):
         """Users should see annotations in groups they are members of."""
         message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
         socket = FakeSocket("giraffe")
         socket.authenticated_userid = "fred"
         socket.effective_principals.append("group:private-group")
+        principals.add(socket)
         session = mock.sentinel.db_session
-        settings = {"foo": "bar"}
         presenter_asdict.return_value = self.serialized_annotation(
             {"permissions": {"read": ["group:private-group"]}}
         )
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_event(message, registry, session)
 
         assert len(socket.send_json_payloads) == 1
 
+    def test_sends_to_users_with_access_to_private_annotations(
+        self, registry, subscriptions, presenter_asdict, principals
+    ):
+        message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
+        fred, bob = FakeSocket("fred"), FakeSocket("bob")
+        fred.authenticated_userid = "acct:fred@example.com"
+        fred.effective_principals.append("acct:fred@example.com")
+        for socket in (fred, bob):
+            principals.add(socket)
+        presenter_asdict.return_value = self.serialized_annotation(
+            {"permissions": {"read": ["acct:fred@example.com"]}}
+        )
+
+        subscriptions.candidates.return_value = {fred, bob}
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        assert len(fred.send_json_payloads) == 1
+        assert bob.send_json_payloads == []
+
+    def test_replayed_notifications_are_checked_for_authorization(
+        self, registry, subscriptions, presenter_asdict, replay
+    ):
+        message = {"action": "_", "src_client_id": "_", "annotation_id": "_"}
+        presenter_asdict.return_value = self.serialized_annotation(
+            {"permissions": {"read": ["group:private-group"]}}
+        )
+        subscriptions.candidates.return_value = set()
+        member, other = FakeSocket("member"), FakeSocket("other")
+        member.effective_principals.append("group:private-group")
+
+        messages.handle_annotation_event(message, registry, mock.sentinel.db_session)
+
+        (entry,) = replay.since(0)
+        assert entry.recipient(member)
+        assert not entry.recipient(other)
+
+    def test_it_fetches_a_batch_of_annotations_at_once(
+        self, registry, subscriptions, fetch_ordered_annotations, presenter_asdict
+    ):
+        events = [
+            {"action": "create", "src_client_id": "_", "annotation_id": id_}
+            for id_ in ("_", "missing")
+        ]
+        session = mock.sentinel.db_session
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        messages.handle_annotation_events(events, registry, session)
+
+        fetch_ordered_annotations.assert_called_once_with(
+            session, ["_", "missing"], query_processor=mock.ANY
+        )
+
+    def test_it_fetches_annotations_one_at_a_time_if_an_id_is_invalid(
+        self,
+        registry,
+        subscriptions,
+        annotation,
+        fetch_ordered_annotations,
+        presenter_asdict,
+        patch,
+    ):
+        fetch_annotation = patch("h.streamer.messages.storage.fetch_annotation")
+        fetch_annotation.side_effect = [annotation, None]
+        fetch_ordered_annotations.side_effect = InvalidUUID("bogus")
+        events = [
+            {"action": "create", "src_client_id": "_", "annotation_id": id_}
+            for id_ in ("_", "bogus")
+        ]
+        socket = FakeSocket("giraffe")
+        session = mock.sentinel.db_session
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_events(events, registry, session)
+
+        assert fetch_annotation.call_args_list == [
+            mock.call(session, "_"),
+            mock.call(session, "bogus"),
+        ]
+        assert len(socket.send_json_payloads) == 1
+
+    def test_it_looks_up_nipsa_status_for_the_batch_at_once(
+        self, registry, subscriptions, annotation, nipsa_service, presenter_asdict
+    ):
+        events = [
+            {"action": "create", "src_client_id": "_", "annotation_id": "_"},
+            {"action": "update", "src_client_id": "_", "annotation_id": "_"},
+        ]
+        socket = FakeSocket("giraffe")
+        session = mock.sentinel.db_session
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        subscriptions.candidates.return_value = {socket}
+
+        messages.handle_annotation_events(events, registry, session)
+
+        nipsa_service.return_value.flagged_userids.assert_called_once_with(
+            {annotation.userid}
+        )
+        assert len(socket.send_json_payloads) == 2
+
     def serialized_annotation(self, data=None):
         if data is None:
             data = {}
@@ -412,9 +684,41 @@ class TestHandleAnnotationEvent(object):
         return serialized
 
     @pytest.fixture
-    def fetch_annotation(self, factories, patch):
-        fetch = patch("h.streamer.messages.storage.fetch_annotation")
-        fetch.return_value = factories.Annotation()
+    def registry(self):
+        registry = Registry("streamer_test")
+        registry.settings = {"h.app_url": "http://streamer"}
+        return registry
+
+    @pytest.fixture
+    def subscriptions(self, patch):
+        return patch("h.streamer.messages.websocket.WebSocket.subscriptions")
+
+    @pytest.fixture(autouse=True)
+    def principals(self, request):
+        patcher = mock.patch.object(
+            websocket.WebSocket, "principals", websocket.PrincipalIndex()
+        )
+        principals = patcher.start()
+        request.addfinalizer(patcher.stop)
+        return principals
+
+    @pytest.fixture(autouse=True)
+    def replay(self, request):
+        patcher = mock.patch.object(
+            websocket.WebSocket, "replay", websocket.ReplayBuffer()
+        )
+        replay = patcher.start()
+        request.addfinalizer(patcher.stop)
+        return replay
+
+    @pytest.fixture
+    def annotation(self, factories):
+        return factories.Annotation.build(id="_")
+
+    @pytest.fixture
+    def fetch_ordered_annotations(self, annotation, patch):
+        fetch = patch("h.streamer.messages.storage.fetch_ordered_annotations")
+        fetch.return_value = [annotation]
         return fetch
 
     @pytest.fixture
@@ -436,7 +740,7 @@ class TestHandleAnnotationEvent(object):
     @pytest.fixture
     def nipsa_service(self, patch):
         service = patch("h.streamer.messages.NipsaService")
-        service.return_value.is_flagged.return_value = False
+        service.return_value.flagged_userids.return_value = set()
         return service
 
     @pytest.fixture
@@ -445,7 +749,7 @@ class TestHandleAnnotationEvent(object):
 
 
 class TestHandleUserEvent(object):
-    def test_sends_session_change_when_joining_or_leaving_group(self):
+    def test_sends_session_change_when_joining_or_leaving_group(self, principals):
         session_model = mock.Mock()
         message = {
             "type": "group-join",
@@ -453,10 +757,9 @@ class TestHandleUserEvent(object):
             "group": "groupid",
             "session_model": session_model,
         }
-        socket = FakeSocket("clientid")
-        socket.authenticated_userid = "amy"
+        socket = self.socket_for("amy", principals)
 
-        messages.handle_user_event(message, [socket], None, None)
+        messages.handle_user_event(message, None, None)
 
         assert socket.send_json_payloads[0] == {
             "type": "session-change",
@@ -464,12 +767,62 @@ class TestHandleUserEvent(object):
             "model": session_model,
         }
 
-    def test_no_send_when_socket_is_not_event_users(self):
+    def test_no_send_when_socket_is_not_event_users(self, principals):
         """Don't send session-change events if the event user is not the socket user."""
         message = {"type": "group-join", "userid": "amy", "group": "groupid"}
-        socket = FakeSocket("clientid")
-        socket.authenticated_userid = "bob"
+        socket = self.socket_for("bob", principals)
 
-        messages.handle_user_event(message, [socket], None, None)
+        messages.handle_user_event(message, None, None)
 
         assert socket.send_json_payloads == []
+
+    def test_gives_the_socket_the_group_principal_on_joining(self, principals):
+        session_model = mock.Mock()
+        message = {
+            "type": "group-join",
+            "userid": "amy",
+            "group": "groupid",
+            "session_model": session_model,
+        }
+        socket = self.socket_for("amy", principals)
+
+        messages.handle_user_event(message, None, None)
+
+        socket.add_principal.assert_called_once_with("group:groupid")
+        assert socket.send_json_payloads == [
+            {"type": "session-change", "action": "group-join", "model": session_model}
+        ]
+
+    def test_takes_the_group_principal_away_on_leaving(self, principals):
+        session_model = mock.Mock()
+        message = {
+            "type": "group-leave",
+            "userid": "amy",
+            "group": "groupid",
+            "session_model": session_model,
+        }
+        socket = self.socket_for("amy", principals)
+
+        messages.handle_user_event(message, None, None)
+
+        socket.remove_principal.assert_called_once_with("group:groupid")
+        assert socket.send_json_payloads == [
+            {"type": "session-change", "action": "group-leave", "model": session_model}
+        ]
+
+    def socket_for(self, userid, principals):
+        socket = FakeSocket("clientid")
+        socket.authenticated_userid = userid
+        socket.add_principal = mock.Mock()
+        socket.remove_principal = mock.Mock()
+        principals.add(socket)
+        return socket
+
+    @pytest.fixture
+    def principals(self, request):
+        patcher = mock.patch.object(
+            websocket.WebSocket, "principals", websocket.PrincipalIndex()
+        )
+        principals = patcher.start()
+        request.addfinalizer(patcher.stop)
+        return principals
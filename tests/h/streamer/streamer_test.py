@@ -1,35 +1,38 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import gevent
 import mock
 from mock import call
 import pytest
+from gevent.queue import Queue
+from pyramid.registry import Registry
 
 from h.streamer import messages
 from h.streamer import streamer
 from h.streamer import websocket
 
 
-def test_process_work_queue_sends_realtime_messages_to_messages_handle_message(session):
+def test_process_work_queue_sends_realtime_messages_to_messages_handle_message(
+    registry, session
+):
     message = messages.Message(topic="foo", payload="bar")
-    queue = [message]
-    settings = {"foo": "bar"}
+    queue = work_queue(message)
 
-    streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     messages.handle_message.assert_called_once_with(
-        message, settings, session, topic_handlers=mock.ANY
+        message, registry, session, topic_handlers=mock.ANY
     )
 
 
 def test_process_work_queue_uses_appropriate_topic_handlers_for_realtime_messages(
-    session
+    registry, session
 ):
     message = messages.Message(topic="user", payload="bar")
-    queue = [message]
-    settings = {"foo": "bar"}
+    queue = work_queue(message)
 
-    streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     topic_handlers = {
         "annotation": messages.handle_annotation_event,
@@ -37,73 +40,119 @@ def test_process_work_queue_uses_appropriate_topic_handlers_for_realtime_message
     }
 
     messages.handle_message.assert_called_once_with(
-        mock.ANY, settings, session, topic_handlers=topic_handlers
+        mock.ANY, registry, session, topic_handlers=topic_handlers
     )
 
 
 def test_process_work_queue_sends_websocket_messages_to_websocket_handle_message(
-    session
+    registry, session
 ):
     message = websocket.Message(socket=mock.sentinel.SOCKET, payload="bar")
-    queue = [message]
+    queue = work_queue(message)
 
-    streamer.process_work_queue({}, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     websocket.handle_message.assert_called_once_with(message, session)
 
 
-def test_process_work_queue_commits_after_each_message(session):
+def test_process_work_queue_commits_after_each_message(registry, session):
     message1 = websocket.Message(socket=mock.sentinel.SOCKET, payload="bar")
     message2 = messages.Message(topic="user", payload="bar")
-    queue = [message1, message2]
+    queue = work_queue(message1, message2)
 
-    streamer.process_work_queue({}, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     assert session.commit.call_count == 2
 
 
-def test_process_work_queue_rolls_back_on_handler_exception(session):
+def test_process_work_queue_rolls_back_on_handler_exception(registry, session):
     message = messages.Message(topic="foo", payload="bar")
-    queue = [message]
+    queue = work_queue(message)
 
     messages.handle_message.side_effect = RuntimeError("explosion")
 
-    streamer.process_work_queue({}, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     session.commit.assert_not_called()
     session.rollback.assert_called_once_with()
 
 
-def test_process_work_queue_rolls_back_on_unknown_message_type(session):
+def test_process_work_queue_rolls_back_on_unknown_message_type(registry, session):
     message = "something that is not a message"
-    queue = [message]
+    queue = work_queue(message)
 
-    streamer.process_work_queue({}, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     session.commit.assert_not_called()
     session.rollback.assert_called_once_with()
 
 
-def test_process_work_queue_calls_close_after_commit(session):
+def test_process_work_queue_calls_close_after_commit(registry, session):
     message = messages.Message(topic="annotation", payload="bar")
-    queue = [message]
+    queue = work_queue(message)
 
-    streamer.process_work_queue({}, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     assert session.method_calls[-2:] == [call.commit(), call.close()]
 
 
-def test_process_work_queue_calls_close_after_rollback(session):
+def test_process_work_queue_calls_close_after_rollback(registry, session):
     message = messages.Message(topic="foo", payload="bar")
-    queue = [message]
+    queue = work_queue(message)
 
     messages.handle_message.side_effect = RuntimeError("explosion")
 
-    streamer.process_work_queue({}, queue, session_factory=lambda _: session)
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
 
     assert session.method_calls[-2:] == [call.rollback(), call.close()]
 
 
+def test_process_work_queue_handles_annotation_events_in_batches(registry, session):
+    queue = work_queue(
+        messages.Message(topic="annotation", payload="foo"),
+        messages.Message(topic="annotation", payload="bar"),
+    )
+
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
+
+    messages.handle_annotation_events.assert_called_once_with(
+        ["foo", "bar"], registry, session
+    )
+    assert session.commit.call_count == 1
+
+
+def test_process_work_queue_rolls_back_on_annotation_batch_exception(registry, session):
+    queue = work_queue(messages.Message(topic="annotation", payload="foo"))
+
+    messages.handle_annotation_events.side_effect = RuntimeError("explosion")
+
+    streamer.process_work_queue(registry, queue, session_factory=lambda _: session)
+
+    session.commit.assert_not_called()
+    session.rollback.assert_called_once_with()
+
+
+def work_queue(*items):
+    """Return a queue of `items` which ends iteration when they're consumed."""
+    queue = Queue()
+    for item in items:
+        queue.put(item)
+    queue.put(StopIteration)
+    return queue
+
+
+@pytest.fixture
+def registry():
+    registry = Registry("streamer_test")
+    registry.settings = {"foo": "bar"}
+    return registry
+
+
+@pytest.fixture
+def stats(patch):
+    return patch("h.streamer.streamer.stats")
+
+
 @pytest.fixture
 def session():
     return mock.Mock(spec_set=["close", "commit", "execute", "rollback"])
@@ -117,3 +166,195 @@ def websocket_handle_message(patch):
 @pytest.fixture(autouse=True)
 def messages_handle_message(patch):
     return patch("h.streamer.messages.handle_message")
+
+
+@pytest.fixture(autouse=True)
+def messages_handle_annotation_events(patch):
+    return patch("h.streamer.messages.handle_annotation_events")
+
+
+def test_process_work_queue_reports_consumer_busy_time(registry, session, stats):
+    queue = work_queue(messages.Message(topic="foo", payload="bar"))
+
+    streamer.process_work_queue(
+        registry, queue, session_factory=lambda _: session, consumer_id=3
+    )
+
+    pipeline = stats.get_client.return_value.pipeline.return_value
+    pipeline.timing.assert_called_once_with(
+        "streamer.consumer.3.busy", pipeline.timer.return_value.ms
+    )
+
+
+class TestDistributeWork(object):
+    def test_it_sends_messages_from_the_same_socket_to_the_same_consumer(self):
+        socket = mock.sentinel.socket
+        queue = [websocket.Message(socket=socket, payload={"n": n}) for n in range(10)]
+        consumer_queues = [Queue() for _ in range(4)]
+
+        streamer.distribute_work(queue, consumer_queues)
+
+        received = [list(q.queue) for q in consumer_queues if q.qsize()]
+        assert received == [queue]
+
+    def test_it_spreads_messages_between_consumers(self):
+        queue = [
+            messages.Message(topic="annotation", payload={"annotation_id": str(n)})
+            for n in range(100)
+        ]
+        consumer_queues = [Queue() for _ in range(4)]
+
+        streamer.distribute_work(queue, consumer_queues)
+
+        assert all(q.qsize() for q in consumer_queues)
+        assert sum(q.qsize() for q in consumer_queues) == 100
+
+    def test_it_drops_messages_for_consumers_which_are_behind(self, send_stats, log):
+        queue = [
+            messages.Message(topic="annotation", payload={"annotation_id": "abc"})
+            for _ in range(5)
+        ]
+        consumer_queues = [Queue(maxsize=2)]
+
+        streamer.distribute_work(queue, consumer_queues)
+
+        assert list(consumer_queues[0].queue) == queue[:2]
+        assert send_stats == {"streamer.consumer.0.dropped": 3}
+        assert log.warning.call_count == 3
+
+    def test_it_waits_for_room_in_a_consumers_queue(self):
+        queue = [
+            messages.Message(topic="annotation", payload={"annotation_id": "abc"})
+            for _ in range(2)
+        ]
+        consumer_queue = Queue(maxsize=1)
+        gevent.spawn_later(0.01, consumer_queue.get)
+
+        streamer.distribute_work(queue, [consumer_queue])
+
+        assert list(consumer_queue.queue) == queue[1:]
+
+    @pytest.mark.usefixtures("log")
+    def test_it_never_drops_websocket_messages(self, send_stats):
+        socket = mock.sentinel.socket
+        queue = [websocket.Message(socket=socket, payload={"n": n}) for n in range(2)]
+        consumer_queue = Queue(maxsize=1)
+        gevent.spawn_later(0.2, consumer_queue.get)
+
+        streamer.distribute_work(queue, [consumer_queue])
+
+        assert list(consumer_queue.queue) == queue[1:]
+        assert not send_stats
+
+    @pytest.mark.usefixtures("send_stats", "log")
+    def test_a_full_consumer_queue_doesnt_hold_up_the_others_for_long(self, patch):
+        patch("h.streamer.streamer.partition_key", side_effect=lambda msg: msg.payload)
+        queue = [
+            messages.Message(topic="annotation", payload=0),
+            messages.Message(topic="annotation", payload=0),
+            messages.Message(topic="annotation", payload=1),
+        ]
+        consumer_queues = [Queue(maxsize=1) for _ in range(2)]
+
+        streamer.distribute_work(queue, consumer_queues)
+
+        assert list(consumer_queues[0].queue) == [queue[0]]
+        assert list(consumer_queues[1].queue) == [queue[2]]
+
+    @pytest.fixture
+    def log(self, patch):
+        return patch("h.streamer.streamer.log")
+
+    @pytest.fixture
+    def send_stats(self, request):
+        patcher = mock.patch.dict("h.streamer.websocket.SEND_STATS", clear=True)
+        patcher.start()
+        request.addfinalizer(patcher.stop)
+        return websocket.SEND_STATS
+
+
+class TestBatchAnnotationMessages(object):
+    def test_it_batches_consecutive_annotation_messages(self):
+        annotation_messages = [
+            messages.Message(topic="annotation", payload={"n": n}) for n in range(3)
+        ]
+        user_message = messages.Message(topic="user", payload={})
+        socket_message = websocket.Message(socket=mock.sentinel.socket, payload={})
+        queue = work_queue(
+            annotation_messages[0],
+            annotation_messages[1],
+            user_message,
+            annotation_messages[2],
+            socket_message,
+        )
+
+        batches = list(streamer.batch_annotation_messages(queue))
+
+        assert batches == [
+            annotation_messages[:2],
+            user_message,
+            annotation_messages[2:],
+            socket_message,
+        ]
+
+    def test_it_limits_the_size_of_batches(self):
+        annotation_messages = [
+            messages.Message(topic="annotation", payload={"n": n}) for n in range(5)
+        ]
+        queue = work_queue(*annotation_messages)
+
+        batches = list(streamer.batch_annotation_messages(queue, max_size=2))
+
+        assert batches == [
+            annotation_messages[:2],
+            annotation_messages[2:4],
+            annotation_messages[4:],
+        ]
+
+    def test_it_stops_waiting_for_a_batch_after_max_wait(self):
+        message = messages.Message(topic="annotation", payload={})
+        queue = Queue()
+        queue.put(message)
+
+        batches = streamer.batch_annotation_messages(queue, max_wait=0.01)
+
+        assert next(batches) == [message]
+
+
+class TestPartitionKey(object):
+    def test_websocket_messages_are_keyed_on_the_socket(self):
+        socket = mock.sentinel.socket
+        msg = websocket.Message(socket=socket, payload={})
+
+        assert streamer.partition_key(msg) == id(socket)
+
+    def test_annotation_messages_are_keyed_on_the_annotation(self):
+        msg = messages.Message(topic="annotation", payload={"annotation_id": "abc"})
+
+        assert streamer.partition_key(msg) == "abc"
+
+    def test_user_messages_are_keyed_on_the_user(self):
+        msg = messages.Message(topic="user", payload={"userid": "acct:a@b.com"})
+
+        assert streamer.partition_key(msg) == "acct:a@b.com"
+
+    def test_other_messages_have_no_key(self):
+        assert streamer.partition_key("something else") is None
+
+
+class TestReportSendStats(object):
+    def test_it_reports_and_resets_the_send_stats(self, send_stats):
+        send_stats["streamer.send_queue.dropped"] = 3
+        client = mock.Mock(spec_set=["incr"])
+
+        streamer.report_send_stats(client)
+
+        client.incr.assert_called_once_with("streamer.send_queue.dropped", 3)
+        assert not send_stats
+
+    @pytest.fixture
+    def send_stats(self, request):
+        patcher = mock.patch.dict("h.streamer.websocket.SEND_STATS", clear=True)
+        patcher.start()
+        request.addfinalizer(patcher.stop)
+        return websocket.SEND_STATS
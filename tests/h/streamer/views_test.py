@@ -5,6 +5,7 @@ import pytest
 
 from h.streamer import views
 from h.streamer import streamer
+from h.websocket import DEFAULT_DEFLATE_MEM_LEVEL
 
 
 def test_websocket_view_adds_auth_state_to_environ(pyramid_config, pyramid_request):
@@ -36,6 +37,34 @@ def test_websocket_view_adds_work_queue_to_environ(pyramid_request):
     assert env["h.ws.streamer_work_queue"] == streamer.WORK_QUEUE
 
 
+def test_websocket_view_does_not_offer_deflate_by_default(pyramid_request, app):
+    pyramid_request.get_response = lambda _: None
+
+    views.websocket_view(pyramid_request)
+
+    assert app.call_args[1]["deflate"] is None
+
+
+def test_websocket_view_offers_deflate_if_enabled(pyramid_request, app):
+    pyramid_request.registry.settings.update(
+        {"h.websocket_deflate": "true", "h.websocket_deflate_window_bits": "10"}
+    )
+    pyramid_request.get_response = lambda _: None
+
+    views.websocket_view(pyramid_request)
+
+    assert app.call_args[1]["deflate"] == {
+        "window_bits": 10,
+        "mem_level": DEFAULT_DEFLATE_MEM_LEVEL,
+        "no_context_takeover": False,
+    }
+
+
+@pytest.fixture
+def app(patch):
+    return patch("h.streamer.views.WebSocketWSGIApplication")
+
+
 @pytest.fixture
 def pyramid_request(pyramid_request):
     return pyramid_request
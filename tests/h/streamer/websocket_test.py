@@ -2,14 +2,19 @@
 
 from __future__ import unicode_literals
 from collections import namedtuple
+import zlib
 
+import gevent
 import mock
 import pytest
 from gevent.queue import Queue
 from jsonschema import ValidationError
 from pyramid import security
+from pyramid.registry import Registry
+from ws4py.messaging import PingControlMessage, PongControlMessage
 
 from h.streamer import websocket
+from h.websocket import DEFLATE_TRAILER, PerMessageDeflate
 
 
 FakeMessage = namedtuple("FakeMessage", ["data"])
@@ -86,6 +91,42 @@ class TestWebSocket(object):
         # A second closure (however unusual) should not raise
         client1.closed(1000)
 
+    def test_removes_self_from_subscriptions_when_closed(
+        self, fake_environ, subscriptions
+    ):
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        client.closed(1000)
+
+        subscriptions.remove.assert_called_once_with(client)
+
+    def test_indexes_self_by_principals(self, client, principals):
+        assert principals.readers(["group:__world__"]) == {client}
+        assert principals.user_sockets("janet") == {client}
+
+    def test_removes_self_from_principal_index_when_closed(self, client, principals):
+        client.closed(1000)
+
+        assert principals.readers(["group:__world__"]) == set()
+        assert principals.user_sockets("janet") == set()
+
+    def test_add_principal(self, client, principals):
+        client.add_principal("group:abc123")
+
+        assert "group:abc123" in client.effective_principals
+        assert principals.readers(["group:abc123"]) == {client}
+
+    def test_remove_principal(self, client, principals):
+        client.remove_principal("group:__world__")
+
+        assert "group:__world__" not in client.effective_principals
+        assert principals.readers(["group:__world__"]) == set()
+
+    def test_principals_are_not_shared_with_the_environ(self, client, fake_environ):
+        client.add_principal("group:abc123")
+
+        assert "group:abc123" not in fake_environ["h.ws.effective_principals"]
+
     def test_enqueues_incoming_messages(self, client, queue):
         """Valid messages are pushed onto the queue."""
         message = FakeMessage('{"foo":"bar"}')
@@ -141,28 +182,204 @@ class TestWebSocket(object):
             "group:__world__",
         ]
 
-    def test_socket_sets_registry_from_environ(self, client):
-        assert client.registry == mock.sentinel.registry
+    def test_socket_sets_registry_from_environ(self, client, registry):
+        assert client.registry == registry
 
-    def test_socket_send_json(self, client, fake_socket_send):
+    def test_socket_send_json(self, client, fake_write_frame):
         payload = {"foo": "bar"}
 
         client.send_json(payload)
+        gevent.sleep(0)
+
+        fake_write_frame.assert_called_once_with(
+            client, websocket.build_frame('{"foo": "bar"}')
+        )
+
+    def test_socket_send_broadcast(self, client, fake_write_frame):
+        client.send_broadcast(websocket.Broadcast(b'{"foo": "bar"}'))
+        gevent.sleep(0)
+
+        fake_write_frame.assert_called_once_with(
+            client, websocket.build_frame(b'{"foo": "bar"}')
+        )
+
+    def test_socket_sends_messages_in_order(self, client, fake_write_frame):
+        client.send_broadcast(websocket.Broadcast(b"1"))
+        client.send_json(2)
+        client.send_broadcast(websocket.Broadcast(b"3"))
+        gevent.sleep(0)
+
+        assert fake_write_frame.call_args_list == [
+            mock.call(client, websocket.build_frame(b"1")),
+            mock.call(client, websocket.build_frame("2")),
+            mock.call(client, websocket.build_frame(b"3")),
+        ]
+
+    def test_socket_drops_oldest_message_when_send_queue_full(
+        self, client, registry, fake_write_frame, send_stats
+    ):
+        for n in range(5):
+            client.send_broadcast(websocket.Broadcast(str(n).encode()))
+        gevent.sleep(0)
+
+        assert fake_write_frame.call_args_list == [
+            mock.call(client, websocket.build_frame(b"2")),
+            mock.call(client, websocket.build_frame(b"3")),
+            mock.call(client, websocket.build_frame(b"4")),
+        ]
+        assert send_stats["streamer.send_queue.dropped"] == 2
+
+    def test_socket_coalesces_messages_about_the_same_thing_when_send_queue_full(
+        self, fake_environ, registry, fake_write_frame, send_stats
+    ):
+        registry.settings["h.streamer_slow_consumer_policy"] = "coalesce"
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        client.send_broadcast(websocket.Broadcast(b"a1"), key="a")
+        client.send_broadcast(websocket.Broadcast(b"b1"), key="b")
+        client.send_broadcast(websocket.Broadcast(b"c1"), key="c")
+        client.send_broadcast(websocket.Broadcast(b"b2"), key="b")
+        client.send_broadcast(websocket.Broadcast(b"d1"), key="d")
+        gevent.sleep(0)
+
+        assert fake_write_frame.call_args_list == [
+            mock.call(client, websocket.build_frame(b"c1")),
+            mock.call(client, websocket.build_frame(b"b2")),
+            mock.call(client, websocket.build_frame(b"d1")),
+        ]
+        assert send_stats["streamer.send_queue.dropped"] == 2
+
+    def test_socket_disconnects_slow_consumers_when_send_queue_full(
+        self, fake_environ, registry, fake_write_frame, fake_socket_close, send_stats
+    ):
+        registry.settings["h.streamer_slow_consumer_policy"] = "disconnect"
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        for n in range(5):
+            client.send_broadcast(websocket.Broadcast(str(n).encode()))
+        gevent.sleep(0)
+
+        assert not fake_write_frame.called
+        fake_socket_close.assert_called_once_with(
+            client, websocket.SLOW_CONSUMER_CLOSE_CODE, "client too slow"
+        )
+        assert send_stats["streamer.send_queue.slow_consumer_disconnected"] == 1
+
+    def test_socket_compresses_messages_if_deflate_negotiated(
+        self, deflate_client, fake_write_frame
+    ):
+        deflate_client.send(b'{"foo": "bar"}')
+        gevent.sleep(0)
+
+        data = fake_write_frame.call_args[0][1]
+        # A final, compressed (RSV1), unmasked text frame with a short payload.
+        assert bytearray(data)[:2] == bytearray([0xC1, len(data) - 2])
+        inflated = zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+            data[2:] + DEFLATE_TRAILER
+        )
+        assert inflated == b'{"foo": "bar"}'
+
+    def test_socket_sends_compressed_messages_in_order(
+        self, deflate_client, fake_write_frame
+    ):
+        deflate_client.send("1")
+        deflate_client.send_json(2)
+        deflate_client.send("3")
+        gevent.sleep(0)
+
+        inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        inflated = [
+            inflate.decompress(c[0][1][2:] + DEFLATE_TRAILER)
+            for c in fake_write_frame.call_args_list
+        ]
+        assert inflated == [b"1", b"2", b"3"]
+
+    def test_socket_compresses_binary_messages_as_binary(
+        self, deflate_client, fake_write_frame
+    ):
+        deflate_client.send(b"\x00\x01", binary=True)
+        gevent.sleep(0)
+
+        data = fake_write_frame.call_args[0][1]
+        # A final, compressed (RSV1), binary frame.
+        assert bytearray(data)[0] == 0xC2
+
+    @pytest.mark.parametrize(
+        "message,frame",
+        [
+            (PingControlMessage("beep"), b"\x89\x04beep"),
+            (PongControlMessage("beep"), b"\x8a\x04beep"),
+        ],
+    )
+    def test_socket_doesnt_compress_control_messages(
+        self, deflate_client, fake_socket_write, message, frame
+    ):
+        deflate_client.send(message)
+
+        # An uncompressed frame, without RSV1.
+        fake_socket_write.assert_called_once_with(deflate_client, frame)
+
+    def test_socket_doesnt_compress_its_close_frame(self, deflate_client):
+        deflate_client.close(1000, "bye")
+
+        data = deflate_client.sock.sendall.call_args[0][0]
+        # A final, uncompressed close frame with the code and reason.
+        assert data == b"\x88\x05\x03\xe8bye"
+
+    def test_socket_doesnt_write_frames_in_the_middle_of_others(self, client):
+        client._write_lock.acquire()
+
+        writer = gevent.spawn(client._write, b"pong")
+        gevent.sleep(0)
+        assert not client.sock.sendall.called
+
+        client._write_lock.release()
+        writer.join()
+        client.sock.sendall.assert_called_once_with(b"pong")
+
+    def test_socket_writes_frames_through_partial_writes(self, client):
+        frame = websocket.build_frame(b"x" * 1000)
+        client.sock.send.side_effect = [100, 400, len(frame) - 500]
+
+        client._write_frame(frame)
 
-        fake_socket_send.assert_called_once_with(client, '{"foo": "bar"}')
+        written = [c[0][0].tobytes() for c in client.sock.send.call_args_list]
+        assert written == [frame, frame[100:], frame[500:]]
+
+    def test_socket_stops_sending_when_closed(self, client, fake_write_frame):
+        client.send_broadcast(websocket.Broadcast(b"1"))
+        client.closed(1000)
+        gevent.sleep(0)
+
+        assert not fake_write_frame.called
+
+    def test_socket_send_broadcast_skips_when_terminated(
+        self, client, fake_write_frame, fake_socket_terminated
+    ):
+        fake_socket_terminated.return_value = True
+
+        client.send_broadcast(websocket.Broadcast(b'{"foo": "bar"}'))
+
+        assert not fake_write_frame.called
 
     def test_socket_send_json_skips_when_terminated(
-        self, client, fake_socket_send, fake_socket_terminated
+        self, client, fake_write_frame, fake_socket_terminated
     ):
         fake_socket_terminated.return_value = True
 
         client.send_json({"foo": "bar"})
 
-        assert not fake_socket_send.called
+        assert not fake_write_frame.called
 
     @pytest.fixture
     def client(self, fake_environ):
-        sock = mock.Mock(spec_set=["sendall"])
+        sock = mock.Mock(spec_set=["send", "sendall"])
+        return websocket.WebSocket(sock, environ=fake_environ)
+
+    @pytest.fixture
+    def deflate_client(self, fake_environ):
+        fake_environ["h.ws.deflate"] = PerMessageDeflate()
+        sock = mock.Mock(spec_set=["send", "sendall"])
         return websocket.WebSocket(sock, environ=fake_environ)
 
     @pytest.fixture
@@ -170,7 +387,20 @@ class TestWebSocket(object):
         return Queue()
 
     @pytest.fixture
-    def fake_environ(self, queue):
+    def registry(self):
+        registry = Registry("websocket_test")
+        registry.settings = {"h.streamer_send_queue_size": 3}
+        return registry
+
+    @pytest.fixture
+    def send_stats(self, request):
+        patcher = mock.patch.dict("h.streamer.websocket.SEND_STATS", clear=True)
+        patcher.start()
+        request.addfinalizer(patcher.stop)
+        return websocket.SEND_STATS
+
+    @pytest.fixture
+    def fake_environ(self, queue, registry):
         return {
             "h.ws.authenticated_userid": "janet",
             "h.ws.effective_principals": [
@@ -178,23 +408,209 @@ class TestWebSocket(object):
                 security.Authenticated,
                 "group:__world__",
             ],
-            "h.ws.registry": mock.sentinel.registry,
+            "h.ws.registry": registry,
             "h.ws.streamer_work_queue": queue,
         }
 
+    @pytest.fixture
+    def subscriptions(self, patch):
+        return patch("h.streamer.websocket.WebSocket.subscriptions")
+
+    @pytest.fixture(autouse=True)
+    def principals(self, request):
+        patcher = mock.patch.object(
+            websocket.WebSocket, "principals", websocket.PrincipalIndex()
+        )
+        principals = patcher.start()
+        request.addfinalizer(patcher.stop)
+        return principals
+
     @pytest.fixture
     def fake_socket_close(self, patch):
         return patch("h.streamer.websocket.WebSocket.close")
 
     @pytest.fixture
-    def fake_socket_send(self, patch):
-        return patch("h.streamer.websocket.WebSocket.send")
+    def fake_write_frame(self, patch):
+        return patch("h.streamer.websocket.WebSocket._write_frame")
+
+    @pytest.fixture
+    def fake_socket_write(self, patch):
+        return patch("h.streamer.websocket.WebSocket._write")
 
     @pytest.fixture
     def fake_socket_terminated(self, patch):
         return patch("h.streamer.websocket.WebSocket.terminated")
 
 
+class TestBroadcast(object):
+    def test_it_builds_the_frame_once(self, build_frame):
+        broadcast = websocket.Broadcast('{"foo": "bar"}')
+
+        frames = [broadcast.frame(), broadcast.frame()]
+
+        build_frame.assert_called_once_with(b'{"foo": "bar"}', None, binary=False)
+        assert frames == [build_frame.return_value] * 2
+
+    def test_it_shares_compressed_frames_without_context_takeover(self, build_frame):
+        broadcast = websocket.Broadcast(b"{}")
+        deflates = [PerMessageDeflate(no_context_takeover=True) for _ in range(2)]
+
+        for deflate in deflates:
+            broadcast.frame(deflate)
+
+        build_frame.assert_called_once_with(b"{}", deflates[0], binary=False)
+
+    def test_it_compresses_frames_per_socket_with_context_takeover(self, build_frame):
+        broadcast = websocket.Broadcast(b"{}")
+        deflates = [PerMessageDeflate() for _ in range(2)]
+
+        for deflate in deflates:
+            broadcast.frame(deflate)
+
+        assert build_frame.call_args_list == [
+            mock.call(b"{}", deflates[0], binary=False),
+            mock.call(b"{}", deflates[1], binary=False),
+        ]
+
+    @pytest.fixture
+    def build_frame(self, patch):
+        return patch("h.streamer.websocket.build_frame")
+
+
+class TestPrincipalIndex(object):
+    def test_readers_returns_sockets_with_any_of_the_principals(self, index):
+        alice = self.socket(index, "acct:alice@example.com", ["group:abc"])
+        bob = self.socket(index, "acct:bob@example.com", ["group:def"])
+        self.socket(index, "acct:carol@example.com", ["group:ghi"])
+
+        assert index.readers(["group:abc", "acct:bob@example.com"]) == {alice, bob}
+
+    def test_readers_returns_None_for_everyone(self, index):
+        self.socket(index, None, [])
+
+        assert index.readers([security.Everyone, "group:abc"]) is None
+
+    def test_readers_returns_nothing_for_unknown_principals(self, index):
+        assert index.readers(["group:abc"]) == set()
+
+    def test_user_sockets(self, index):
+        socket = self.socket(index, "acct:alice@example.com", [])
+        self.socket(index, "acct:bob@example.com", [])
+
+        assert index.user_sockets("acct:alice@example.com") == {socket}
+
+    def test_user_sockets_ignores_anonymous_sockets(self, index):
+        self.socket(index, None, [])
+
+        assert index.user_sockets(None) == set()
+
+    def test_remove(self, index):
+        socket = self.socket(index, "acct:alice@example.com", ["group:abc"])
+
+        index.remove(socket)
+
+        assert index.readers(["group:abc"]) == set()
+        assert index.user_sockets("acct:alice@example.com") == set()
+
+    def test_add_and_remove_principal(self, index):
+        socket = self.socket(index, None, [])
+
+        index.add_principal(socket, "group:abc")
+        assert index.readers(["group:abc"]) == {socket}
+
+        index.remove_principal(socket, "group:abc")
+        assert index.readers(["group:abc"]) == set()
+
+    def socket(self, index, userid, principals):
+        principals = [security.Everyone] + principals
+        if userid is not None:
+            principals += [security.Authenticated, userid]
+        socket = mock.Mock(
+            spec_set=["authenticated_userid", "effective_principals"],
+            authenticated_userid=userid,
+            effective_principals=principals,
+        )
+        index.add(socket)
+        return socket
+
+    @pytest.fixture
+    def index(self):
+        return websocket.PrincipalIndex()
+
+
+class TestReplayBuffer(object):
+    def test_numbers_notifications_in_sequence(self):
+        replay = websocket.ReplayBuffer()
+
+        assert [replay.next_seq() for _ in range(3)] == [1, 2, 3]
+        assert replay.last_seq == 3
+
+    def test_since_returns_later_notifications(self):
+        replay = self.replay_with(5)
+
+        assert [e.seq for e in replay.since(2)] == [3, 4, 5]
+
+    def test_since_returns_nothing_if_up_to_date(self):
+        replay = self.replay_with(5)
+
+        assert replay.since(5) == []
+
+    def test_since_stops_at_until(self):
+        replay = self.replay_with(5)
+
+        assert [e.seq for e in replay.since(1, until=3)] == [2, 3]
+
+    def test_since_returns_None_if_notifications_were_discarded(self):
+        replay = self.replay_with(5, size=3)
+
+        assert replay.since(1) is None
+        assert [e.seq for e in replay.since(2)] == [3, 4, 5]
+
+    def test_since_returns_None_for_unknown_sequence_numbers(self):
+        replay = self.replay_with(5)
+
+        assert replay.since(6) is None
+
+    def test_since_ignores_gaps_in_the_sequence(self):
+        replay = websocket.ReplayBuffer(size=2)
+        replay.next_seq()
+        seq = replay.next_seq()
+        replay.append(seq, mock.sentinel.broadcast, None, mock.sentinel.recipient)
+
+        assert [e.seq for e in replay.since(0)] == [2]
+
+    def test_keeps_nothing_if_size_is_zero(self):
+        replay = self.replay_with(2, size=0)
+
+        assert replay.since(2) == []
+        assert replay.since(1) is None
+
+    def test_streams_are_distinct(self):
+        assert websocket.ReplayBuffer().stream != websocket.ReplayBuffer().stream
+
+    def replay_with(self, count, size=10):
+        replay = websocket.ReplayBuffer(size=size)
+        for _ in range(count):
+            seq = replay.next_seq()
+            replay.append(seq, mock.sentinel.broadcast, None, mock.sentinel.recipient)
+        return replay
+
+
+class TestBuildFrame(object):
+    def test_it_builds_a_text_frame(self):
+        assert websocket.build_frame('{"foo": "bar"}') == b'\x81\x0e{"foo": "bar"}'
+
+    def test_it_builds_a_compressed_text_frame(self):
+        frame = websocket.build_frame(b"{}", PerMessageDeflate())
+
+        # A final, compressed (RSV1), unmasked text frame with a short payload.
+        assert bytearray(frame)[:2] == bytearray([0xC1, len(frame) - 2])
+        inflated = zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+            frame[2:] + DEFLATE_TRAILER
+        )
+        assert inflated == b"{}"
+
+
 @pytest.mark.usefixtures("handlers")
 class TestHandleMessage(object):
     def test_uses_unknown_handler_for_missing_type(self, unknown_handler):
@@ -295,6 +711,43 @@ class TestHandleFilterMessage(object):
 
         assert socket.filter is not None
 
+    def test_indexes_socket_by_filter(self, socket, subscriptions):
+        message = websocket.Message(
+            socket=socket,
+            payload={
+                "filter": {
+                    "actions": {},
+                    "match_policy": "include_any",
+                    "clauses": [
+                        {
+                            "field": "/uri",
+                            "operator": "equals",
+                            "value": "http://example.com",
+                        }
+                    ],
+                }
+            },
+        )
+
+        websocket.handle_filter_message(message)
+
+        subscriptions.update.assert_called_once_with(socket)
+
+    def test_records_the_sequence_number_when_first_subscribing(self, socket, replay):
+        replay.last_seq = 7
+        message = websocket.Message(
+            socket=socket,
+            payload={
+                "filter": {"actions": {}, "match_policy": "include_any", "clauses": []}
+            },
+        )
+
+        websocket.handle_filter_message(message)
+        replay.last_seq = 9
+        websocket.handle_filter_message(message)
+
+        assert socket.subscribed_seq == 7
+
     @mock.patch("h.streamer.websocket.storage.expand_uri")
     def test_expands_uris_in_uri_filter_with_session(self, expand_uri, socket):
         expand_uri.return_value = [
@@ -384,6 +837,135 @@ class TestHandleFilterMessage(object):
         socket.filter = None
         return socket
 
+    @pytest.fixture(autouse=True)
+    def subscriptions(self, patch):
+        return patch("h.streamer.websocket.WebSocket.subscriptions")
+
+    @pytest.fixture
+    def replay(self, request):
+        patcher = mock.patch.object(
+            websocket.WebSocket, "replay", websocket.ReplayBuffer()
+        )
+        replay = patcher.start()
+        request.addfinalizer(patcher.stop)
+        return replay
+
+
+class TestHandleReplayMessage(object):
+    def test_sends_the_missed_notifications(self, socket, replay):
+        message = self.replay_message(socket, replay.stream, 1)
+
+        websocket.handle_replay_message(message)
+
+        socket.send_broadcast.assert_has_calls(
+            [
+                mock.call(mock.sentinel.broadcast_2, key="id_2"),
+                mock.call(mock.sentinel.broadcast_3, key="id_3"),
+            ]
+        )
+
+    def test_skips_notifications_sent_since_subscribing(self, socket, replay):
+        socket.subscribed_seq = 2
+        message = self.replay_message(socket, replay.stream, 1)
+
+        websocket.handle_replay_message(message)
+
+        socket.send_broadcast.assert_called_once_with(
+            mock.sentinel.broadcast_2, key="id_2"
+        )
+
+    def test_skips_notifications_for_other_recipients(self, socket, replay):
+        message = self.replay_message(socket, replay.stream, 0)
+
+        websocket.handle_replay_message(message)
+
+        keys = [c[1]["key"] for c in socket.send_broadcast.call_args_list]
+        assert "id_1" not in keys
+
+    def test_does_not_replay_twice(self, socket, replay):
+        message = self.replay_message(socket, replay.stream, 1)
+
+        websocket.handle_replay_message(message)
+        websocket.handle_replay_message(message)
+
+        assert socket.send_broadcast.call_count == 2
+
+    def test_replies_when_done(self, socket, replay):
+        message = self.replay_message(socket, replay.stream, 1)
+
+        with mock.patch.object(websocket.Message, "reply") as mock_reply:
+            websocket.handle_replay_message(message)
+
+        mock_reply.assert_called_once_with({"type": "replay", "stream": replay.stream})
+
+    @pytest.mark.parametrize("seq", [None, "1", True])
+    def test_invalid_seq_error(self, matchers, socket, replay, seq):
+        message = self.replay_message(socket, replay.stream, seq)
+
+        with mock.patch.object(websocket.Message, "reply") as mock_reply:
+            websocket.handle_replay_message(message)
+
+        mock_reply.assert_called_once_with(
+            matchers.MappingContaining("error"), ok=False
+        )
+        assert not socket.send_broadcast.called
+
+    def test_unavailable_for_other_streams(self, socket, replay):
+        message = self.replay_message(socket, "otherstream", 1)
+
+        self.assert_unavailable(message)
+        assert not socket.send_broadcast.called
+
+    def test_unavailable_if_notifications_discarded(self, socket, replay):
+        for _ in range(5):
+            self.add(replay, lambda socket: True)
+        message = self.replay_message(socket, replay.stream, 1)
+
+        self.assert_unavailable(message)
+        assert not socket.send_broadcast.called
+
+    def test_unavailable_without_a_filter(self, socket, replay):
+        socket.filter = None
+        message = self.replay_message(socket, replay.stream, 1)
+
+        self.assert_unavailable(message)
+
+    def assert_unavailable(self, message):
+        with mock.patch.object(websocket.Message, "reply") as mock_reply:
+            websocket.handle_replay_message(message)
+
+        reply = mock_reply.call_args[0][0]
+        assert reply["error"]["type"] == "replay_unavailable"
+        assert mock_reply.call_args[1] == {"ok": False}
+
+    def replay_message(self, socket, stream, seq):
+        return websocket.Message(
+            socket=socket, payload={"type": "replay", "stream": stream, "seq": seq}
+        )
+
+    def add(self, replay, recipient):
+        seq = replay.next_seq()
+        broadcast = getattr(mock.sentinel, "broadcast_{}".format(seq))
+        replay.append(seq, broadcast, "id_{}".format(seq), recipient)
+
+    @pytest.fixture
+    def socket(self):
+        socket = mock.Mock(spec_set=["filter", "subscribed_seq", "send_broadcast"])
+        socket.subscribed_seq = None
+        return socket
+
+    @pytest.fixture
+    def replay(self, socket, request):
+        replay = websocket.ReplayBuffer(size=3)
+        self.add(replay, lambda s: s is not socket)
+        self.add(replay, lambda s: s is socket)
+        self.add(replay, lambda s: s is socket)
+
+        patcher = mock.patch.object(websocket.WebSocket, "replay", replay)
+        patcher.start()
+        request.addfinalizer(patcher.stop)
+        return replay
+
 
 class TestHandlePingMessage(object):
     def test_pong(self):
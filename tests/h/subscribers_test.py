@@ -83,13 +83,16 @@ class TestPublishAnnotationEvent:
                 "action": event.action,
                 "annotation_id": event.annotation_id,
                 "src_client_id": "client_id",
-            }
+            },
+            target_uri_normalized="httpx://example.com",
         )
 
     @pytest.fixture
     def event(self, pyramid_request):
         pyramid_request.realtime = mock.Mock()
-        event = AnnotationEvent(pyramid_request, "test_annotation_id", "create")
+        event = AnnotationEvent(
+            pyramid_request, "test_annotation_id", "create", "httpx://example.com"
+        )
         return event
 
 
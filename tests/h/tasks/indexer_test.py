@@ -2,6 +2,8 @@
 
 from __future__ import unicode_literals
 
+import datetime
+
 import mock
 import pytest
 
@@ -78,12 +80,12 @@ class TestAddAnnotation(object):
             target_index="hypothesis-xyz123",
         )
 
-    def test_it_indexes_thread_root(self, fetch_annotation, reply, delay):
+    def test_it_indexes_thread_root(self, fetch_annotation, reply, reindex_thread_root):
         fetch_annotation.return_value = reply
 
         indexer.add_annotation("test-annotation-id")
 
-        delay.assert_called_once_with("root-id")
+        reindex_thread_root.assert_called_once_with("root-id")
 
     @pytest.fixture
     def index(self, patch):
@@ -106,8 +108,81 @@ class TestAddAnnotation(object):
         )
 
     @pytest.fixture
-    def delay(self, patch):
-        return patch("h.tasks.indexer.add_annotation.delay")
+    def reindex_thread_root(self, patch):
+        return patch("h.tasks.indexer.reindex_thread_root")
+
+
+@pytest.mark.usefixtures("celery", "pending_thread_roots")
+class TestReindexThreadRoot(object):
+    def test_it_schedules_a_reindex_of_the_root(self, apply_async, time):
+        scheduled = indexer.reindex_thread_root("root-id")
+
+        assert scheduled
+        apply_async.assert_called_once_with(("root-id",), countdown=2)
+
+    def test_it_coalesces_reindexes_of_the_same_root(self, apply_async, time):
+        indexer.reindex_thread_root("root-id")
+        time.time.return_value = 101.9
+
+        scheduled = indexer.reindex_thread_root("root-id")
+
+        assert not scheduled
+        assert apply_async.call_count == 1
+
+    def test_it_doesnt_coalesce_reindexes_of_other_roots(self, apply_async, time):
+        indexer.reindex_thread_root("root-id")
+
+        indexer.reindex_thread_root("other-root-id")
+
+        assert apply_async.call_args_list == [
+            mock.call(("root-id",), countdown=2),
+            mock.call(("other-root-id",), countdown=2),
+        ]
+
+    def test_it_schedules_another_reindex_once_the_pending_one_is_due(
+        self, apply_async, time
+    ):
+        indexer.reindex_thread_root("root-id")
+        time.time.return_value = 102
+
+        scheduled = indexer.reindex_thread_root("root-id")
+
+        assert scheduled
+        assert apply_async.call_count == 2
+
+    def test_it_forgets_the_reindexes_which_have_run(
+        self, apply_async, time, pending_thread_roots
+    ):
+        indexer.reindex_thread_root("root-id")
+        time.time.return_value = 102
+
+        indexer.reindex_thread_root("other-root-id")
+
+        assert list(pending_thread_roots) == ["other-root-id"]
+
+    def test_it_reports_to_statsd(self, apply_async, time, pyramid_request):
+        indexer.reindex_thread_root("root-id")
+        indexer.reindex_thread_root("root-id")
+
+        assert pyramid_request.stats.incr.call_args_list == [
+            mock.call("indexer.thread_root.scheduled"),
+            mock.call("indexer.thread_root.coalesced"),
+        ]
+
+    @pytest.fixture
+    def apply_async(self, patch):
+        return patch("h.tasks.indexer.add_annotation.apply_async")
+
+    @pytest.fixture
+    def time(self, patch):
+        time = patch("h.tasks.indexer.time")
+        time.time.return_value = 100
+        return time
+
+    @pytest.fixture
+    def pending_thread_roots(self):
+        with mock.patch.dict(indexer._pending_thread_roots, clear=True):
+            yield indexer._pending_thread_roots
 
 
 @pytest.mark.usefixtures("celery", "delete", "settings_service")
@@ -185,6 +260,108 @@ class TestReindexUserAnnotations(object):
         }
 
 
+@pytest.mark.usefixtures("celery")
+class TestReindexGroupAnnotations(object):
+    def test_it_creates_batch_indexer(self, batch_indexer, annotation_ids, celery):
+        groupid = list(annotation_ids.keys())[0]
+
+        indexer.reindex_group_annotations(groupid)
+
+        batch_indexer.assert_any_call(
+            celery.request.db, celery.request.es, celery.request
+        )
+
+    def test_it_reindexes_groups_annotations(self, batch_indexer, annotation_ids):
+        groupid = list(annotation_ids.keys())[0]
+
+        indexer.reindex_group_annotations(groupid)
+
+        args, _ = batch_indexer.return_value.index.call_args
+        actual = args[0]
+        expected = annotation_ids[groupid]
+        assert sorted(expected) == sorted(actual)
+
+    def test_it_loads_the_ids_a_page_at_a_time(
+        self, batch_indexer, annotation_ids, monkeypatch
+    ):
+        monkeypatch.setattr(indexer, "GROUP_REINDEX_PAGE_SIZE", 2)
+        groupid = list(annotation_ids.keys())[0]
+
+        indexer.reindex_group_annotations(groupid)
+
+        pages = [args[0] for args, _ in batch_indexer.return_value.index.call_args_list]
+        assert [len(page) for page in pages] == [2, 1]
+        assert sorted(pages[0] + pages[1]) == sorted(annotation_ids[groupid])
+
+    def test_it_logs_the_errored_ids(self, batch_indexer, annotation_ids, log):
+        batch_indexer.return_value.index.return_value = {"errored_id"}
+        groupid = list(annotation_ids.keys())[0]
+
+        indexer.reindex_group_annotations(groupid)
+
+        log.warning.assert_called_once_with(
+            "Failed to re-index annotations into ES6 %s", {"errored_id"}
+        )
+
+    @pytest.fixture
+    def batch_indexer(self, patch):
+        return patch("h.tasks.indexer.BatchIndexer")
+
+    @pytest.fixture
+    def log(self, patch):
+        return patch("h.tasks.indexer.log")
+
+    @pytest.fixture
+    def annotation_ids(self, factories):
+        groupid1 = "group1"
+        groupid2 = "group2"
+
+        return {
+            groupid1: [
+                a.id for a in factories.Annotation.create_batch(3, groupid=groupid1)
+            ],
+            groupid2: [
+                a.id for a in factories.Annotation.create_batch(2, groupid=groupid2)
+            ],
+        }
+
+
+@pytest.mark.usefixtures("celery", "settings_service")
+class TestSyncAnnotations(object):
+    def test_it_syncs_the_annotations_updated_since_the_date(
+        self, batch_indexer, celery
+    ):
+        indexer.sync_annotations("2018-08-27T11:02:15")
+
+        batch_indexer.assert_called_once_with(
+            celery.request.db, celery.request.es, celery.request
+        )
+        batch_indexer.return_value.sync.assert_called_once_with(
+            datetime.datetime(2018, 8, 27, 11, 2, 15)
+        )
+
+    def test_during_reindex_syncs_the_new_index(
+        self, batch_indexer, celery, settings_service
+    ):
+        settings_service.put("reindex.new_index", "hypothesis-xyz123")
+
+        indexer.sync_annotations("2018-08-27T11:02:15")
+
+        batch_indexer.assert_any_call(
+            celery.request.db,
+            celery.request.es,
+            celery.request,
+            target_index="hypothesis-xyz123",
+        )
+        assert batch_indexer.return_value.sync.call_count == 2
+
+    @pytest.fixture
+    def batch_indexer(self, patch):
+        batch_indexer = patch("h.tasks.indexer.BatchIndexer")
+        batch_indexer.return_value.sync.return_value = set()
+        return batch_indexer
+
+
 @pytest.fixture
 def celery(patch, pyramid_request):
     cel = patch("h.tasks.indexer.celery")
@@ -195,6 +372,7 @@ def celery(patch, pyramid_request):
 @pytest.fixture
 def pyramid_request(pyramid_request):
     pyramid_request.es = mock.Mock()
+    pyramid_request.stats = mock.Mock(spec_set=["incr"])
     return pyramid_request
 
 
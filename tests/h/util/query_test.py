@@ -9,7 +9,7 @@ import pytest
 import sqlalchemy as sa
 
 from h._compat import text_type
-from h.util.query import column_windows
+from h.util.query import column_window, column_window_bounds, column_windows
 
 
 meta = sa.MetaData()
@@ -76,6 +76,23 @@ class TestColumnWindows(object):
 
         assert window_query_results(db_session, windows, filter_) == expected
 
+    def test_window_bounds_give_the_same_windows(self, db_session):
+        testdata = [{"name": text_type(l), "enabled": True} for l in ASCII_LOWERCASE]
+        db_session.execute(test_cw.insert().values(testdata))
+
+        bounds = column_window_bounds(db_session, test_cw.c.name, windowsize=10)
+        windows = [column_window(test_cw.c.name, start, end) for start, end in bounds]
+
+        assert bounds == [("a", "k"), ("k", "u"), ("u", None)]
+        assert window_query_results(db_session, windows) == [
+            "abcdefghij",
+            "klmnopqrst",
+            "uvwxyz",
+        ]
+
+    def test_window_bounds_are_empty_if_there_are_no_rows(self, db_session):
+        assert column_window_bounds(db_session, test_cw.c.name) == []
+
 
 def window_query_results(session, windows, filter_=None):
     """
@@ -67,7 +67,21 @@ class TestSearchController(object):
 
         controller.search()
 
-        paginate.assert_called_once_with(pyramid_request, mock.ANY, page_size=100)
+        paginate.assert_called_once_with(
+            pyramid_request, mock.ANY, page_size=100, cursor=mock.ANY
+        )
+
+    def test_search_passes_the_cursor_to_the_next_page_to_pagination(
+        self, controller, pyramid_request, paginate, query
+    ):
+        controller.search()
+
+        paginate.assert_called_once_with(
+            pyramid_request,
+            mock.ANY,
+            page_size=mock.ANY,
+            cursor=query.execute.return_value.cursor,
+        )
 
     def test_search_generates_tag_links(self, controller):
         result = controller.search()
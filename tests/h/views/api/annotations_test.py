@@ -19,7 +19,10 @@ class TestSearch(object):
 
         search = search_lib.Search.return_value
         search_lib.Search.assert_called_with(
-            pyramid_request, separate_replies=False, stats=pyramid_request.stats
+            pyramid_request,
+            separate_replies=False,
+            stats=pyramid_request.stats,
+            paginate_replies=False,
         )
 
         expected_params = MultiDict(
@@ -45,6 +48,17 @@ class TestSearch(object):
 
         assert views.search(pyramid_request) == expected
 
+    def test_it_returns_the_cursor_to_the_next_page(
+        self, pyramid_request, search_run, presentation_service
+    ):
+        search_run.return_value = SearchResult(
+            2, ["row-1", "row-2"], [], {}, cursor="abc"
+        )
+
+        result = views.search(pyramid_request)
+
+        assert result["cursor"] == "abc"
+
     def test_it_presents_replies(
         self, pyramid_request, search_run, presentation_service
     ):
@@ -55,6 +69,23 @@ class TestSearch(object):
 
         presentation_service.present_all.assert_called_with(["reply-1", "reply-2"])
 
+    def test_it_fetches_all_the_pages_of_replies_if_asked_to(
+        self, pyramid_request, search_lib
+    ):
+        pyramid_request.params = NestedMultiDict(
+            MultiDict({"_separate_replies": "1", "_paginate_replies": "1"})
+        )
+
+        views.search(pyramid_request)
+
+        _, kwargs = search_lib.Search.call_args
+        assert kwargs["separate_replies"] is True
+        assert kwargs["paginate_replies"] is True
+        expected_params = MultiDict(
+            [("sort", "updated"), ("limit", 20), ("order", "desc"), ("offset", 0)]
+        )
+        search_lib.Search.return_value.run.assert_called_once_with(expected_params)
+
     def test_it_returns_replies(
         self, pyramid_request, search_run, presentation_service
     ):
@@ -78,6 +109,63 @@ class TestSearch(object):
         return search_lib.Search.return_value.run
 
 
+class TestSearchExport(object):
+    def test_it_exports_the_annotations_matching_the_search(
+        self, pyramid_request, export_service
+    ):
+        pyramid_request.params = NestedMultiDict(
+            MultiDict(
+                {"group": "abc123", "_separate_replies": "1", "_paginate_replies": "1"}
+            )
+        )
+
+        views.search_export(pyramid_request)
+
+        expected_params = MultiDict(
+            [
+                ("group", "abc123"),
+                ("sort", "updated"),
+                ("limit", 20),
+                ("order", "desc"),
+                ("offset", 0),
+            ]
+        )
+        export_service.export.assert_called_once_with(expected_params)
+
+    def test_it_raises_if_the_params_are_invalid(self, pyramid_request):
+        pyramid_request.params = NestedMultiDict(MultiDict({"sort": "sideways"}))
+
+        with pytest.raises(ValidationError):
+            views.search_export(pyramid_request)
+
+    def test_it_streams_newline_delimited_json(self, pyramid_request, export_service):
+        export_service.export.return_value = iter([{"id": "foo"}, {"id": "bar"}])
+
+        response = views.search_export(pyramid_request)
+
+        assert response.content_type == "application/x-ndjson"
+        assert list(response.app_iter) == [b'{"id": "foo"}\n', b'{"id": "bar"}\n']
+
+    def test_it_closes_the_db_session_after_streaming(
+        self, pyramid_request, export_service
+    ):
+        pyramid_request.db = mock.Mock(spec_set=["close"])
+        export_service.export.return_value = iter([{"id": "foo"}])
+
+        response = views.search_export(pyramid_request)
+
+        assert not pyramid_request.db.close.called
+        list(response.app_iter)
+        pyramid_request.db.close.assert_called_once_with()
+
+    @pytest.fixture
+    def export_service(self, pyramid_config):
+        svc = mock.Mock(spec_set=["export"])
+        svc.export.return_value = iter([])
+        pyramid_config.register_service(svc, name="annotation_export")
+        return svc
+
+
 @pytest.mark.usefixtures(
     "AnnotationEvent",
     "create_schema",
@@ -147,7 +235,7 @@ class TestCreate(object):
         annotation = storage.create_annotation.return_value
 
         AnnotationEvent.assert_called_once_with(
-            pyramid_request, annotation.id, "create"
+            pyramid_request, annotation.id, "create", annotation.target_uri_normalized
         )
         pyramid_request.notify_after_commit.assert_called_once_with(
             AnnotationEvent.return_value
@@ -318,8 +406,9 @@ class TestUpdate(object):
 
         views.update(context, pyramid_request)
 
+        annotation = storage.update_annotation.return_value
         AnnotationEvent.assert_called_once_with(
-            pyramid_request, storage.update_annotation.return_value.id, "update"
+            pyramid_request, annotation.id, "update", annotation.target_uri_normalized
         )
 
     def test_it_fires_the_AnnotationEvent(self, AnnotationEvent, pyramid_request):
@@ -401,7 +490,10 @@ class TestDelete(object):
         views.delete(context, pyramid_request)
 
         AnnotationEvent.assert_called_once_with(
-            pyramid_request, context.annotation.id, "delete"
+            pyramid_request,
+            context.annotation.id,
+            "delete",
+            context.annotation.target_uri_normalized,
         )
         pyramid_request.notify_after_commit.assert_called_once_with(event)
 
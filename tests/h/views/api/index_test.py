@@ -18,6 +18,7 @@ class TestIndex(object):
         pyramid_request.registry.api_links = config.registry.api_links
 
         pyramid_config.add_route("api.search", "/dummy/search")
+        pyramid_config.add_route("api.search_export", "/dummy/search/export")
         pyramid_config.add_route("api.annotations", "/dummy/annotations")
         pyramid_config.add_route("api.annotation", "/dummy/annotations/:id")
         pyramid_config.add_route("api.links", "/dummy/links")
@@ -36,3 +37,5 @@ class TestIndex(object):
         assert links["annotation"]["update"]["url"] == (host + "/dummy/annotations/:id")
         assert links["search"]["method"] == "GET"
         assert links["search"]["url"] == host + "/dummy/search"
+        assert links["search_export"]["method"] == "GET"
+        assert links["search_export"]["url"] == host + "/dummy/search/export"
@@ -23,7 +23,10 @@ class TestCreate(object):
         views.create(resource, pyramid_request)
 
         events.AnnotationEvent.assert_called_once_with(
-            pyramid_request, resource.annotation.id, "update"
+            pyramid_request,
+            resource.annotation.id,
+            "update",
+            resource.annotation.target_uri_normalized,
         )
 
         pyramid_request.notify_after_commit.assert_called_once_with(
@@ -48,7 +51,10 @@ class TestDelete(object):
         views.delete(resource, pyramid_request)
 
         events.AnnotationEvent.assert_called_once_with(
-            pyramid_request, resource.annotation.id, "update"
+            pyramid_request,
+            resource.annotation.id,
+            "update",
+            resource.annotation.target_uri_normalized,
         )
 
         pyramid_request.notify_after_commit.assert_called_once_with(
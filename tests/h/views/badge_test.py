@@ -16,25 +16,23 @@ badge_fixtures = pytest.mark.usefixtures("models", "search_lib")
 
 @badge_fixtures
 def test_badge_returns_number_from_search(
-    models, pyramid_request, search_run, mark_uri_as_annotated
+    models, pyramid_request, search_count, mark_uri_as_annotated
 ):
     mark_uri_as_annotated("http://example.com")
 
     pyramid_request.params["uri"] = "http://example.com"
     models.Blocklist.is_blocked.return_value = False
-    search_run.return_value = mock.Mock(total=29)
+    search_count.return_value = 29
 
     result = badge(pyramid_request)
 
-    search_run.assert_called_once_with(
-        MultiDict({"uri": "http://example.com", "limit": 0})
-    )
+    search_count.assert_called_once_with(MultiDict({"uri": "http://example.com"}))
     assert result == {"total": 29}
 
 
 @badge_fixtures
 def test_badge_does_not_search_if_uri_never_annotated(
-    models, pyramid_request, search_run
+    models, pyramid_request, search_count
 ):
     pyramid_request.params["uri"] = "http://example.com"
     models.Blocklist.is_blocked.return_value = False
@@ -43,25 +41,25 @@ def test_badge_does_not_search_if_uri_never_annotated(
 
     assert result == {"total": 0}
     models.Blocklist.is_blocked.assert_not_called()
-    search_run.assert_not_called()
+    search_count.assert_not_called()
 
 
 @badge_fixtures
 def test_badge_returns_0_if_blocked(
-    models, pyramid_request, search_run, mark_uri_as_annotated
+    models, pyramid_request, search_count, mark_uri_as_annotated
 ):
     mark_uri_as_annotated("http://blocked-domain.com")
 
     pyramid_request.params["uri"] = "http://blocked-domain.com"
     models.Blocklist.is_blocked.return_value = True
-    search_run.return_value = {"total": 29}
+    search_count.return_value = 29
 
     result = badge(pyramid_request)
 
     models.Blocklist.is_blocked.assert_called_with(
         mock.ANY, "http://blocked-domain.com"
     )
-    assert not search_run.called
+    assert not search_count.called
     assert result == {"total": 0}
 
 
@@ -82,8 +80,8 @@ def search_lib(patch):
 
 
 @pytest.fixture
-def search_run(search_lib):
-    return search_lib.Search.return_value.run
+def search_count(search_lib):
+    return search_lib.Search.return_value.count
 
 
 @pytest.fixture
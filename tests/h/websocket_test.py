@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import zlib
+
+import mock
+import pytest
+from ws4py.exc import FrameTooLargeException
+from ws4py.framing import Frame, OPCODE_CONTINUATION, OPCODE_PING, OPCODE_TEXT
+from ws4py.streaming import Stream
+
+from h import websocket
+
+
+class TestPerMessageDeflate(object):
+    @pytest.mark.parametrize(
+        "header", [None, "", "x-webkit-deflate-frame", "permessage-deflate; foo=1"]
+    )
+    def test_negotiate_returns_none_without_an_acceptable_offer(self, header):
+        assert websocket.PerMessageDeflate.negotiate(header) is None
+
+    def test_negotiate_accepts_an_offer(self):
+        deflate = websocket.PerMessageDeflate.negotiate(
+            "permessage-deflate; client_max_window_bits", window_bits=11, mem_level=4
+        )
+
+        assert deflate.window_bits == 11
+        assert deflate.mem_level == 4
+        assert not deflate.no_context_takeover
+        assert deflate.response_header == (
+            "permessage-deflate; client_no_context_takeover"
+        )
+
+    def test_negotiate_accepts_the_first_acceptable_offer(self):
+        deflate = websocket.PerMessageDeflate.negotiate(
+            "permessage-deflate; server_max_window_bits=8, "
+            "permessage-deflate; server_max_window_bits=10"
+        )
+
+        assert deflate.window_bits == 10
+        assert deflate.response_header == (
+            "permessage-deflate; client_no_context_takeover; server_max_window_bits=10"
+        )
+
+    def test_negotiate_honours_server_no_context_takeover(self):
+        deflate = websocket.PerMessageDeflate.negotiate(
+            "permessage-deflate; server_no_context_takeover"
+        )
+
+        assert deflate.no_context_takeover
+        assert deflate.response_header == (
+            "permessage-deflate; client_no_context_takeover; server_no_context_takeover"
+        )
+
+    @pytest.mark.parametrize(
+        "header",
+        [
+            "permessage-deflate; server_max_window_bits=16",
+            "permessage-deflate; server_max_window_bits=foo",
+            "permessage-deflate; server_no_context_takeover; server_no_context_takeover",
+        ],
+    )
+    def test_negotiate_rejects_invalid_offers(self, header):
+        assert websocket.PerMessageDeflate.negotiate(header) is None
+
+    @pytest.mark.parametrize("no_context_takeover", [True, False])
+    def test_compress_produces_a_permessage_deflate_payload(self, no_context_takeover):
+        deflate = websocket.PerMessageDeflate(no_context_takeover=no_context_takeover)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        for message in [b'{"type": "a"}', b'{"type": "b"}']:
+            compressed = deflate.compress(message)
+
+            assert not compressed.endswith(websocket.DEFLATE_TRAILER)
+            assert (
+                decompressor.decompress(compressed + websocket.DEFLATE_TRAILER)
+                == message
+            )
+
+    def test_memory_usage_is_bounded_by_the_deflate_parameters(self):
+        deflate = websocket.PerMessageDeflate(window_bits=12, mem_level=5)
+        assert deflate.memory_usage == 0
+
+        deflate.compress(b"foo")
+
+        assert deflate.memory_usage == (1 << 14) + (1 << 14)
+
+    def test_memory_is_not_kept_without_context_takeover(self):
+        deflate = websocket.PerMessageDeflate(no_context_takeover=True)
+
+        deflate.compress(b"foo")
+
+        assert deflate.memory_usage == 0
+
+    def test_decompress_rejects_oversized_messages(self, patch):
+        patch("h.websocket.MAX_INFLATED_MESSAGE_SIZE", new=10, autospec=None)
+        deflate = websocket.PerMessageDeflate()
+
+        with pytest.raises(FrameTooLargeException):
+            deflate.decompress(compress(b"x" * 100), start=True, end=True)
+
+
+class TestDeflateFrame(object):
+    def test_it_inflates_compressed_messages(self, stream):
+        data = frame(OPCODE_TEXT, compress(b'{"type": "ping"}'), rsv1=1)
+
+        with websocket.parsing_with(websocket.PerMessageDeflate()):
+            stream.parser.send(data)
+
+        assert stream.has_message
+        assert stream.message.data == b'{"type": "ping"}'
+
+    def test_it_inflates_fragmented_compressed_messages(self, stream):
+        compressed = compress(b'{"type": "whoami"}')
+
+        with websocket.parsing_with(websocket.PerMessageDeflate()):
+            stream.parser.send(frame(OPCODE_TEXT, compressed[:5], rsv1=1, fin=0))
+            stream.parser.send(frame(OPCODE_PING, b""))
+            stream.parser.send(frame(OPCODE_CONTINUATION, compressed[5:]))
+
+        assert stream.has_message
+        assert stream.message.data == b'{"type": "whoami"}'
+
+    def test_it_leaves_uncompressed_messages_alone(self, stream):
+        with websocket.parsing_with(websocket.PerMessageDeflate()):
+            stream.parser.send(frame(OPCODE_TEXT, b'{"type": "ping"}'))
+
+        assert stream.message.data == b'{"type": "ping"}'
+
+    def test_it_rejects_compressed_messages_if_not_negotiated(self, stream):
+        stream.parser.send(frame(OPCODE_TEXT, compress(b"{}"), rsv1=1))
+
+        assert stream.errors
+        assert stream.errors[0].code == 1002
+
+    def test_it_rejects_compressed_control_frames(self, stream):
+        with websocket.parsing_with(websocket.PerMessageDeflate()):
+            stream.parser.send(frame(OPCODE_PING, compress(b""), rsv1=1))
+
+        assert stream.errors
+        assert stream.errors[0].code == 1002
+
+    @pytest.fixture
+    def stream(self):
+        return Stream()
+
+
+class TestWebSocketWSGIApplication(object):
+    def test_it_negotiates_permessage_deflate(self, environ, start_response):
+        app = websocket.WebSocketWSGIApplication(
+            deflate={"window_bits": 10}, handler_cls=mock.Mock()
+        )
+
+        app(environ, start_response)
+
+        deflate = environ["h.ws.deflate"]
+        assert deflate.window_bits == 10
+        headers = start_response.call_args[0][1]
+        assert ("Sec-WebSocket-Extensions", deflate.response_header) in headers
+
+    def test_it_does_not_negotiate_if_disabled(self, environ, start_response):
+        app = websocket.WebSocketWSGIApplication(handler_cls=mock.Mock())
+
+        app(environ, start_response)
+
+        assert environ["h.ws.deflate"] is None
+        headers = start_response.call_args[0][1]
+        assert "Sec-WebSocket-Extensions" not in dict(headers)
+
+    @pytest.fixture
+    def environ(self):
+        return {
+            "REQUEST_METHOD": "GET",
+            "HTTP_UPGRADE": "websocket",
+            "HTTP_CONNECTION": "Upgrade",
+            "HTTP_SEC_WEBSOCKET_KEY": "dGhlIHNhbXBsZSBub25jZQ==",
+            "HTTP_SEC_WEBSOCKET_VERSION": "13",
+            "HTTP_SEC_WEBSOCKET_EXTENSIONS": "permessage-deflate",
+            "ws4py.socket": mock.sentinel.socket,
+        }
+
+    @pytest.fixture
+    def start_response(self):
+        return mock.Mock(spec_set=[])
+
+
+def compress(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressed[: -len(websocket.DEFLATE_TRAILER)]
+
+
+def frame(opcode, body, rsv1=0, fin=1):
+    """Return the bytes of a masked frame, as sent by a client."""
+    return Frame(
+        opcode=opcode, body=body, masking_key=b"abcd", fin=fin, rsv1=rsv1
+    ).build()